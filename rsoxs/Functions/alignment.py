@@ -9,7 +9,7 @@ from functools import partial
 import bluesky.plan_stubs as bps
 from ophyd import Device
 
-from ..redis_config import rsoxs_config  # bec, db
+from ..redis_config import rsoxs_config, rsoxs_bar_cache  # bec, db
 from ..configuration_setup.configuration_load_save import sync_rsoxs_config_to_nbs_manipulator
 
 from nbs_bl.hw import (
@@ -84,18 +84,14 @@ def get_sample_id_and_index(sample_id_or_index):
     
     if isinstance(sample_id_or_index, int): ## Sample index was inputted
         try: 
-            sample_id = rsoxs_config["bar"][sample_id_or_index]["sample_id"]
+            sample_id = rsoxs_bar_cache.get()[sample_id_or_index]["sample_id"]
             sample_index = sample_id_or_index
         except: raise ValueError("Sample number" + str(sample_id_or_index) + "not found.")
     elif isinstance(sample_id_or_index, str): ## Sample name was inputted
-        sample_found = False
-        for index, sample in enumerate(rsoxs_config["bar"]):
-            if sample["sample_id"] == sample_id_or_index:
-                sample_index = index
-                sample_id = sample_id_or_index
-                sample_found = True
-                break
-        if sample_found == False: raise ValueError("Sample ID" + str(sample_id_or_index) + "not found.")
+        ## Looked up in sample_lookup_index instead of going through the bar
+        sample_index = sample_lookup_index.sample_index(rsoxs_bar_cache.get(), sample_id_or_index)
+        sample_id = sample_id_or_index
+        if sample_index is None: raise ValueError("Sample ID" + str(sample_id_or_index) + "not found.")
     
     return sample_id, int(sample_index)
 
@@ -133,7 +129,7 @@ def rotate_now(
         ## Identify the current sample and get its metadata
         sample_id_current = RE.md["sample_id"] ## TODO: would like a better way to do this
         sample_id, sample_index = get_sample_id_and_index(sample_id_current)
-        sample_dictionary_old = copy.deepcopy(rsoxs_config["bar"][sample_index])
+        sample_dictionary_old = copy.deepcopy(rsoxs_bar_cache.get()[sample_index])
         ## Set new angle
         sample_dictionary_new = copy.deepcopy(sample_dictionary_old)
         sample_dictionary_new["angle"] = theta
@@ -141,9 +137,11 @@ def rotate_now(
         print("Rotating to angle: " + str(theta))
         if dryrun == True: return
         ## Rotate to angle, update rsoxs_config
+        ## The rotated position comes from bar_geometry_cache, and the sample is only written (and the manipulator synced) if its position or angle changed
         rotate_sample(sample_dictionary_new, force)
-        rsoxs_config["bar"][sample_index] = sample_dictionary_new
-        sync_rsoxs_config_to_nbs_manipulator()
+        if sample_dictionary_new != sample_dictionary_old:
+            rsoxs_config["bar"][sample_index] = sample_dictionary_new
+            sync_rsoxs_config_to_nbs_manipulator()
 
         ## Load the sample with new metadata
         yield from load_samp(sample_index)
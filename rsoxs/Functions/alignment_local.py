@@ -12,8 +12,21 @@ import datetime
 import bluesky.plan_stubs as bps
 from ophyd import Device
 from bluesky.preprocessors import finalize_decorator
-from ..redis_config import rsoxs_config #bec, db 
+from ..redis_config import rsoxs_config, rsoxs_bar_cache #bec, db 
 from ..configuration_setup.configuration_load_save import sync_rsoxs_config_to_nbs_manipulator
+from ..configuration_setup.configuration_index import ConfigurationIndex, configurationIndex_Fields
+from ..alignment.bar_geometry import (
+    rotatedx,
+    rotatedz,
+    af_rotation,
+    zoffset,
+    rotation_angles,
+    apply_position,
+    bar_geometry_cache,
+    angle_value,
+)
+from ..alignment.bar_stitching import barImage_Extent_Default, stitch_tiles, build_pyramid, show_pyramid, save_bar_images, load_bar_images
+from ..alignment.bar_locator import locate_samples, barLocator_Parameters_Default, barLocator_Skipped_Names
 from nbs_bl.hw import(
     sam_viewer,   
     SampleViewer_cam
@@ -24,10 +37,19 @@ from ..HW.slackbot import rsoxs_bot
 from nbs_bl.printing import boxed_text, colored
 
 
+## Positions of samples by sample_id, sample_name, bar spot, project, and proposal in the rsoxs_bar_cache snapshot, updated when the snapshot changes
+sample_lookup_index = ConfigurationIndex()
+
+
 def sample_by_value_match(key, string, bar=None):
     if bar == None:
-        bar = rsoxs_config['bar']
-    results = [d for (index, d) in enumerate(bar) if d[key].find(string) >= 0]
+        bar = rsoxs_bar_cache.get() ## Read-only snapshot, only read from Redis again after the bar changes
+    ## Exact matches come from the index, and only a part of a value needs to scan the bar
+    results = []
+    if key in configurationIndex_Fields:
+        results = [bar[index] for index in sample_lookup_index.sample_positions(bar, key, string)]
+    if len(results) == 0 and key != "spot":
+        results = [d for (index, d) in enumerate(bar) if d[key].find(string) >= 0]
     if len(results) == 1:
         return results[0]
     elif len(results) < 1:
@@ -41,9 +63,23 @@ def sample_by_value_match(key, string, bar=None):
 def sample_by_name( name, bar=None):
     return sample_by_value_match("sample_name", name, bar=bar)
 
+def check_sample_lookup_index(bar=None):
+    """
+    Checks sample_lookup_index against the bar.  Prints and returns the differences (none if it is consistent).
+    """
+    if bar == None:
+        bar = rsoxs_bar_cache.get()
+    sample_lookup_index.update(bar) ## Brings the index up to date first, as any lookup would
+    problems = sample_lookup_index.check(bar)
+    for problem in problems:
+        print(problem)
+    if len(problems) == 0:
+        print("Sample lookup index is consistent with the bar")
+    return problems
+
 def list_samples(bar=None):
     if bar == None:
-        bar = rsoxs_config['bar']
+        bar = rsoxs_bar_cache.get()
     text = "  i  Sample Name"
     for index, sample in enumerate(bar):
         text += "\n {} {}".format(index, sample["sample_name"])
@@ -63,78 +99,25 @@ def list_samples(bar=None):
 
 def sanatize_angle(samp, force=False):
     # translates a requested angle (something in sample['angle']) into an actual angle depending on the kind of sample
-    if type(samp["angle"]) == int or type(samp["angle"]) == float:
-        goodnumber = True  # make the number fall in the necessary range
-    else:
-        goodnumber = False  # make all transmission 90 degrees from the back, and all grading 20 deg
-    if force and -155 < samp["angle"] < 195:
-        samp["bar_loc"]["th"] = samp["angle"]
-        return
-    if samp["grazing"]:
-        # the sample is intended for grazing incidence, so angles should be interpreted to mean
-        # 0 - parallel with the face of the sample
-        # 90 - normal to the sample
-        # 110 - 20 degrees from normal in one direction
-        # 70 - 20 degrees from normal in the other direction
-        # valid input angles are 0 - 180
-        if samp["front"]:
-            # sample is on the front of the bar, so valid outputs are between -90 and 90
-            if goodnumber:
-                samp["bar_loc"]["th"] = float(90 - np.mod(samp["angle"] + 3600, 180))
-            else:
-                samp["bar_loc"]["th"] = 70  # default grazing incidence samples to 20 degrees incidence angle
-                samp["angle"] = 70
-                # front grazing sample angle is interpreted as grazing angle
-        else:
-            if goodnumber:
-                angle = float(np.mod(435 - np.mod(-samp["angle"] + 3600, 180), 360) - 165)
-                if angle < -155:
-                    angle = float(np.mod(435 - np.mod(samp["angle"] + 3600, 180), 360) - 165)
-                samp["bar_loc"]["th"] = angle
-            else:
-                samp["bar_loc"]["th"] = 110
-                samp["angle"] = 110
-            # back grazing sample angle is interpreted as grazing angle but subtracted from 180
-    else:
-        if samp["front"]:
-            if goodnumber:
-                samp["bar_loc"]["th"] = float(np.mod(345 - np.mod(90 + samp["angle"] + 3600, 180) + 90, 360) - 165)
-                if samp["bar_loc"]["x0"] > 6 and np.abs(samp["angle"]) > 30:
-                    # transmission from the left side of the bar at a incident angle more than 20 degrees,
-                    # flip sample around to come from the other side - this can take a minute or two
-                    samp["bar_loc"]["th"] = float(
-                        np.mod(345 - np.mod(90 - samp["angle"] + 3600, 180) + 90, 360) - 165
-                    )
-                if samp["bar_loc"]["th"] >= 195:
-                    samp["bar_loc"]["th"] = 180
-                if samp["bar_loc"]["th"] <= -155:
-                    samp["bar_loc"]["th"] = -150
-            else:
-                samp["bar_loc"]["th"] = 0
-                samp["angle"] = 0
-        else:
-            if goodnumber:
-                samp["bar_loc"]["th"] = float(np.mod(90 + samp["angle"] + 3600, 180) - 90)
-                if samp["bar_loc"]["x0"] < -5 and np.abs(samp["angle"]) > 30: #TODO figure out the geometry constraints for the back of the bar transmission
-                    # transmission from the right side of the bar at a incident angle more than 20 degrees,
-                    # flip to come from the left side
-                    samp["bar_loc"]["th"] = float(np.mod(90 - samp["angle"] + 3600, 180) - 90.0)
-            else:
-                samp["bar_loc"]["th"] = 0
-                samp["angle"] = 0
-
-    if samp["bar_loc"]["th"] >= 195:
-        samp["bar_loc"]["th"] = 195.0
-    if samp["bar_loc"]["th"] <= -155:
-        samp["bar_loc"]["th"] = -155.0
+    # the rules for each kind of sample are in bar_geometry.rotation_angles, which does the same for many samples at once
+    theta, angle = rotation_angles(
+        angle_value(samp["angle"]), samp["grazing"], samp["front"], samp["bar_loc"].get("x0", 0), force=force
+    )
+    if not np.isfinite(angle_value(samp["angle"])):
+        samp["angle"] = float(angle)  # angles that are not numbers are replaced by the default for the kind of sample
+    samp["bar_loc"]["th"] = float(theta)
     
 
 
 def samp_dict_from_id_or_num(num_or_id):
     if isinstance(num_or_id,str):
-        sam_dict = [d for (index, d) in enumerate(rsoxs_config['bar']) if d['sample_id'].find(num_or_id) >= 0]
-        if len(sam_dict) > 0:
-            sam_dict =  sam_dict[0]
+        ## Search the cached snapshot but return the sample from rsoxs_config so that changes to it are written back
+        bar = rsoxs_bar_cache.get()
+        indices = sample_lookup_index.sample_positions(bar, "sample_id", num_or_id)
+        if len(indices) == 0: ## Part of a sample_id
+            indices = [index for (index, d) in enumerate(bar) if d['sample_id'].find(num_or_id) >= 0]
+        if len(indices) > 0:
+            sam_dict = rsoxs_config['bar'][indices[0]]
         else:
             raise ValueError(f'sample named {num_or_id} not found')
     else:
@@ -190,20 +173,24 @@ def default_sample(name,
     }
 from bluesky.callbacks.mpl_plotting import QtAwareCallback
 class BarPlotter(QtAwareCallback):
-    def __init__(self, *args, front=None, bar=None, path=None,**kwargs):
+    def __init__(self, *args, front=None, bar=None, path=None, automatic=False, **kwargs):
         self.path = path
         self.front = front
         self.bar = bar
+        self.automatic = automatic
         super().__init__(*args, **kwargs)
 
     def stop(self, doc):
         imageuid = doc['run_start']
         images = list(db[imageuid].data("Sample Imager Detector Area Camera_image"))
-        image = stitch_sample(images, 25, -6)  # this will start the interactive pointing of samples
-        if self.path is not None:
+        ## A path ending in .h5 keeps the pictures and pyramid, so locate_samples_from_image can show the bar again from it
+        store = self.path if self.path is not None and self.path.endswith((".h5", ".hdf5")) else None
+        image = stitch_sample(images, 25, -6, store=store)  # this will start the interactive pointing of samples
+        if self.path is not None and store is None:
             im = Image.fromarray(image)
             im.save(self.path)
-        update_bar(loc_Q, self.front, inbar=self.bar)
+        sample_ids = propose_bar_locations(image, self.front, bar=self.bar) if self.automatic else None
+        update_bar(loc_Q, self.front, inbar=self.bar, sample_ids=sample_ids)
 
 import bluesky.preprocessors as bpp
 def image_bar( path=None, front=True, bar=None):
@@ -250,11 +237,12 @@ def image_bar( path=None, front=True, bar=None):
     ## TODO: possibly make a separate RunEngine for taking pictures.  Also update to make it data security compliant.  Possibly run through Jupyter notebook after feeding in spreadsheet and image rather than pointing to db.
     
 
-def locate_samples_from_image( impath, front=True, bar=None):
+def locate_samples_from_image( impath, front=True, bar=None, automatic=False):
     if bar == None:
         bar = rsoxs_config['bar']
     # if the image was just taken itself, before a bar was compiled, then this can be run to just load that image
     # and then interactively place the elements of bar
+    # with automatic, samples found on the image are placed first and only the rest need to be clicked
     global loc_Q
     # user needs to define the 'bar' in their namespace
     loc_Q = queue.Queue(1)
@@ -264,15 +252,49 @@ def locate_samples_from_image( impath, front=True, bar=None):
         )  # this starts the sample pointing
     else:
         image = stitch_sample(False, False, False, from_image=impath, flip_file=False)
+    sample_ids = propose_bar_locations(image, front, bar=bar) if automatic else None
     # stitch samples will be sending signals, update bar will catch those signals and assign the positions to the bar
-    update_bar(loc_Q, front,inbar=bar)
+    update_bar(loc_Q, front,inbar=bar, sample_ids=sample_ids)
     sync_rsoxs_config_to_nbs_manipulator()
 
 
-def update_bar(loc_Q, front, inbar=None):
+def propose_bar_locations(image, front=True, bar=None, confidence_minimum=None, extent=barImage_Extent_Default):
+    """
+    Finds the samples on the bar image and places the ones it is confident about, the same as clicking on them would.
+
+    Returns the sample_ids that still need to be clicked (samples below confidence_minimum, and the fiducials and diode), to give update_bar.
+    """
+    if bar == None:
+        bar = rsoxs_config['bar']
+    if confidence_minimum is None:
+        confidence_minimum = barLocator_Parameters_Default["confidence_minimum"]
+    samples = [sample for sample in bar if sample["front"] == front]
+    proposals = locate_samples(image, samples, extent=extent)
+    sample_ids = list(barLocator_Skipped_Names)
+    number_placed = 0
+    for sample, proposal in zip(samples, proposals):
+        if sample["sample_name"] in barLocator_Skipped_Names:
+            continue
+        if proposal["confidence"] < confidence_minimum:
+            print(f'{sample["sample_name"]} (spot {sample["bar_loc"]["spot"]}): confidence {proposal["confidence"]:.2f}, needs to be clicked')
+            sample_ids.append(sample["sample_id"])
+            continue
+        sample["location"] = proposal["location"]
+        sample["bar_loc"]["ximg"] = proposal["ximg"]
+        sample["bar_loc"]["yimg"] = proposal["yimg"]
+        sample["bar_loc"]["th0"] = float(0) if front else float(180)
+        number_placed += 1
+        if "sample_image_axes" in globals():
+            annotateImage(sample_image_axes, proposal["location"], f'{sample["sample_name"]} ({proposal["confidence"]:.2f})')
+    print(f"Placed {number_placed} samples from the image, labeled with their confidence on the plot.  A higher confidence_minimum leaves more of them to click.")
+    return sample_ids
+
+
+def update_bar(loc_Q, front, inbar=None, sample_ids=None):
     
     """
     updated with whether we are pointing at the front or the back of the bar
+    with sample_ids (from propose_bar_locations), only those samples are asked for
     """
     if inbar == None:
         inbar = rsoxs_config['bar']
@@ -336,8 +358,8 @@ def update_bar(loc_Q, front, inbar=None):
         while True:
             #        for sample in bar:
             sample = gbar[samplenum]
-            if sample["front"] != front:  # skip if we are not on the right side of the sample bar
-                # (only locate samples that we can see in this image!)
+            if sample["front"] != front or (sample_ids is not None and sample["sample_id"] not in sample_ids):  # skip if we are not on the right side of the sample bar
+                # (only locate samples that we can see in this image!), or the sample was already placed from the image
                 samplenum += 1
                 if samplenum >= len(gbar):
                     print("done")
@@ -408,32 +430,39 @@ def annotateImage(axes, item, name):
     plt.draw()
 
 
-def stitch_sample(images, step_size, y_off, from_image=None, flip_file=False):
+def stitch_sample(images, step_size, y_off, from_image=None, flip_file=False, positions=None, blend=False, store=None):
+    """
+    Stitches the image_bar pictures (or loads a saved image of the bar) and shows it to point at samples.
+
+    The bar image is allocated once from the picture positions (step_size apart unless positions are given) and the pictures are copied into it,
+    with overlaps blended if blend.  It is shown from a pyramid of smaller copies, so panning and zooming stay fast.
+    With store, the pictures and pyramid are saved to that HDF5 file, which can be given as from_image later to show the bar again.
+    """
     global sample_image_axes
 
-    if isinstance(from_image, str):
+    if isinstance(from_image, str) and from_image.endswith((".h5", ".hdf5")):
+        pyramid = load_bar_images(from_image)["pyramid"]
+        if flip_file:
+            pyramid = [np.flipud(level) for level in pyramid]
+        result = pyramid[0]
+    elif isinstance(from_image, str):
         im_frame = Image.open(from_image)
         result = np.array(im_frame)
         if flip_file:
             result = np.flipud(result)
+        pyramid = build_pyramid(result)
     else:
-        pixel_step = int(step_size * (1760) / 25)
-        pixel_overlap = 2464 - pixel_step
-        result = images[0][0]
-        i = 0
-        for imageb in images[1:]:
-            image = imageb[0]
-            i += 1
-            if y_off > 0:
-                result = np.concatenate((image[(y_off * i) :, :], result[:-(y_off), pixel_overlap:]), axis=1)
-            elif y_off < 0:
-                result = np.concatenate((image[: (y_off * i), :], result[-(y_off):, pixel_overlap:]), axis=1)
-            else:
-                result = np.concatenate((image[:, :], result[:, pixel_overlap:]), axis=1)
+        tiles = [imageb[0] for imageb in images]
+        if positions is None:
+            positions = step_size * np.arange(len(tiles))
+        result = stitch_tiles(tiles, positions, step_size, y_off, blend=blend)
+        pyramid = build_pyramid(result)
+        if store is not None:
+            save_bar_images(store, tiles, positions, step_size, y_off, blend, pyramid=pyramid)
         # result = np.flipud(result)
 
     fig, ax = plt.subplots()
-    ax.imshow(result, extent=[-210, 25, -14.5, 14.5])
+    show_pyramid(ax, pyramid, extent=barImage_Extent_Default)
     sample_image_axes = ax
     fig.canvas.mpl_connect("button_press_event", plot_click)
     fig.canvas.mpl_connect("key_press_event", plot_key_press)
@@ -583,6 +612,7 @@ def correct_bar(fiduciallist, include_back, training_wheels=True, bar = None):
     run_y = af2y - af1y  # (distance between the fiducial markers) (above are the total delta over this run,
     # in between this will be scaled
 
+    samples_corrected = []
     for samp in bar:
         xpos = samp["bar_loc"]["ximg"]  # x position from the image
         ypos = samp["bar_loc"]["yimg"]  # y position from the image
@@ -625,97 +655,25 @@ def correct_bar(fiduciallist, include_back, training_wheels=True, bar = None):
             af2y=af2y,
         )
         samp["bar_loc"]["zoff"] = float(zoff)
-
-        # now we can rotate the sample to the desired position (in the 'angle' metadata)
-        # moving z is dangerous = best to keep it at 0 by default
-        rotate_sample(samp)  # this will take the positions found above and the desired incident angle and
+        samples_corrected.append(samp)
+
+    # now we can rotate the samples to the desired positions (in the 'angle' metadata), all at once
+    # moving z is dangerous = best to keep it at 0 by default
+    bar_geometry_cache.invalidate()  # positions from the previous correction are no longer right
+    positions = bar_geometry_cache.get_positions(samples_corrected, [samp["angle"] for samp in samples_corrected])
+    for samp, position in zip(samples_corrected, positions):
+        apply_position(samp, position)  # this will take the positions found above and the desired incident angle and
         # rotate the location of the sample accordingly
     rsoxs_config['bar'] = bar #event_model.sanitize_doc() #rsoxs_config['bar'] = orjson.dumps(bar)
     sync_rsoxs_config_to_nbs_manipulator()
     
-def zoffset(af1zoff, af2zoff, y, front=True, height=0.25, af1y=-186.3, af2y=4):
-    """
-    Using the z offset of the fiducial positions from the center of rotation,
-    project the z offset of the surface of a given sample at some y position between
-    the fiducials.
-    """
-
-    m = (af2zoff - af1zoff) / (af2y - af1y)  # slope of bar
-    z0 = af1zoff + m * (y - af1y)
-
-    # offset the line by the front/back offset + height
-    if front:
-        #return z0 - 2.5 - height # 
-        return z0 + 4.5 - height # fixed Nov 2023 with new rotation stage
-    else:
-        return z0 + height
-    # return the offset intersect
-
-
-def rotatedx(x0, theta, zoff, xoff=1.88, thoff=0):
-    """
-    given the x position at 0 rotation (from the image of the sample bar)
-    and a rotation angle, the offset of rotation in z and x (as well as a potential theta offset)
-    find the correct x position to move to at a different rotation angle
-    """
-    return (
-        xoff + (x0 - xoff) * np.cos((theta - thoff) * np.pi / 180) - zoff * np.sin((theta - thoff) * np.pi / 180)
-    )
-
-
-def rotatedz(x0, theta, zoff, xoff=1.88, thoff=0):
-    """
-    given the x position at 0 rotation (from the image of the sample bar)
-    and a rotation angle, the offset of rotation in z and x axes (as well as a potential theta offset)
-    find the correct z position to move to to keep a particular sample at the same intersection point with X-rays
-    """
-    return (
-        zoff + (x0 - xoff) * np.sin((theta - thoff) * np.pi / 180) - zoff * np.cos((theta - thoff) * np.pi / 180)
-    )
-
-
-def af_rotation(xfm90, xf0, xf90, xf180):
-    """
-    takes the fiducial centers measured in the x direction at -90, 0, 90, and 180 degrees
-    and returns the offset in x and z from the center of rotation, as well as the
-    unrotated x positon of the fiducial marker.
-
-    the x offset is not expected to vary between loads, and has been measured to be 1.88,
-    while the z offset is as the bar flexes in this direction, and will be used to
-    map the surface locations of other samples between the fiducials
-
-    """
-
-    x0 = xf0
-    xoff = (xf180 + x0) / 2
-    zoff = (xfm90 - xf90) / 2
-    return (x0, zoff, xoff)
-
-
-
 def rotate_sample(samp, force=False):
     """
     rotate a sample position to the requested theta position
     the requested sample position is set in the angle metadata (sample['angle'])
+    positions come from bar_geometry_cache, so rotating to an angle that was already worked out is a lookup
     """
-    sanatize_angle(samp, force)  # makes sure the requested angle is translated into a real angle for acquisition
-    theta_new = samp["bar_loc"]["th"]
-    x0 = samp["bar_loc"]["x0"]
-    y0 = samp["bar_loc"]["y0"]
-    xoff = samp["bar_loc"]["xoff"]
-    zoff = samp["bar_loc"]["zoff"]
-
-    newx = rotatedx(x0, theta_new, zoff, xoff=xoff)
-    for motor in samp["location"]:
-        if motor["motor"] == "x":
-            motor["position"] = newx
-        if motor["motor"] == "th":
-            motor["position"] = theta_new
-        if motor["motor"] == "y":
-            motor["position"] = y0
-    # in future, updating y (if the rotation axis is not perfectly along y
-    # and z (to keep the sample-detector distance constant) as needed would be good as well
-    # newz = rotatedz(newx, th, zoff, af1xoff)
+    apply_position(samp, bar_geometry_cache.get_position(samp, samp["angle"], force))
 
 
 def sample_recenter_sample(samp):
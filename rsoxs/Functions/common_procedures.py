@@ -1,4 +1,5 @@
 from matplotlib import pyplot as plt
+import os
 import numpy as np
 import bluesky.plans as bp
 import bluesky.plan_stubs as bps
@@ -45,6 +46,7 @@ from ..HW.energy import (
 )
 from ..configuration_setup.configurations_instrument import load_configuration
 from .alignment import load_samp
+from ..plans.epu_lookup_tables import EPUTableBuilder, epuTable_Parameters_Default
 from ..HW.detectors import set_exposure
 # from ..startup import bec
 from nbs_bl.printing import run_report
@@ -67,13 +69,22 @@ def buildeputable(
     mode="L",
     grat="1200",
     name="test",
+    path=None,
+    parameters=epuTable_Parameters_Default,
 ):
+    """
+    Finds the EPU gap at the harmonic peak for energies from start to stop (not including stop) and builds a lookup table from them.
+
+    Each peak is appended to path (by default the same EPUdata csv as before) as soon as it is found, so a table can be resumed by running again with the same name.
+    After the first two energies, the gap search is centered on the gap predicted from the peaks so far for this mode and phase,
+    and is only as wide as the prediction is uncertain (see epu_lookup_tables.EPUTableBuilder.search_window), instead of the fixed
+    500 * widfract below to 2500 * widfract above the previous peak.  If the peak is found at the edge of a narrow window, the fixed window is swept again
+    before the peak is recorded.  At the end, the lookup table is saved next to path with "_LUT" added to the name.
+    """
     ens = np.arange(start, stop, step)
-    gaps = []
-    gapsbs = []
-    ensout = []
-    heights = []
-    heightsbs = []
+    if path is None:
+        path = "/nsls2/data/sst/legacy/RSoXS/EPUdata_2023Nov_" + name + ".csv"
+    table = EPUTableBuilder(path, parameters=parameters, mode=mode, phase=phase)
     #izero_mesh.kind = "hinted"
     #Beamstop_SAXS.kind = "hinted"
     mono_en.kind = "hinted"
@@ -108,57 +119,44 @@ def buildeputable(
     count = 0
     peaklist = []
     flip=False
+    gap_swept = 0
     for energy in ens:
         #yield from bps.mv(epu_gap, max(14000, startinggap - 500 * widfract))
         #yield from bps.mv(shutter_enable, 0)
         #yield from bps.mv(shutter_control, 1)
+        gap_low, gap_high = table.search_window(energy, mode, phase, startinggap, widfract)
+        ## Alternate directions so the gap does not have to go back to the same side before every sweep
         if not flip:
-            startgap = min(99500, max(14000, startinggap - 500 * widfract))
-            endgap = min(100000, max(15000, startinggap + 2500 * widfract))
+            startgap, endgap = gap_low, gap_high
             flip = True
         else:
-            endgap = min(99500, max(14000, startinggap - 500 * widfract))
-            startgap = min(100000, max(15000, startinggap + 2500 * widfract))
+            startgap, endgap = gap_high, gap_low
             flip = False
+        gap_swept += gap_high - gap_low
         
         yield from bps.mv(mono_en, energy,en.scanlock, False,epu_gap,startgap)
-        
-        ## Below is Eliot's old fly_max
-        yield from fly_max(
-            [izero_mesh, beamstop_waxs],
-            [
-                "RSoXS Au Mesh Current",
-                "WAXS Beamstop",
-            ],
-            epu_gap,
-            startgap,
-            endgap,
-            [200],
-            10,
-            True,
-            True,
-            peaklist,
-            end_on_max=False
-        )
+        yield from _sweep_epu_gap(startgap, endgap, peaklist)
+
+        ## A wrong prediction can leave the peak outside the window, and fly_max then gives the edge of the window
+        gap_peak = peaklist[-1]["RSoXS Au Mesh Current"]["en_epugap"]
+        if table.peak_at_edge(gap_peak, gap_low, gap_high, energy, mode, phase):
+            gap_low, gap_high = table.default_window(startinggap, widfract)
+            print("Peak at " + str(round(gap_peak)) + " um is at the edge of the predicted window, sweeping " + str(round(gap_low)) + " to " + str(round(gap_high)) + " um")
+            startgap, endgap = (gap_low, gap_high) if abs(gap_low - gap_peak) < abs(gap_high - gap_peak) else (gap_high, gap_low)
+            gap_swept += gap_high - gap_low
+            yield from bps.mv(epu_gap, startgap)
+            yield from _sweep_epu_gap(startgap, endgap, peaklist)
 
         startinggap = peaklist[-1]["RSoXS Au Mesh Current"]["en_epugap"]
-        gapbs = peaklist[-1]["WAXS Beamstop"]["en_epugap"]
-        height = peaklist[-1]["RSoXS Au Mesh Current"]["RSoXS Au Mesh Current"]
-        heightbs = peaklist[-1]["WAXS Beamstop"]["WAXS Beamstop"]
-        gaps.append(startinggap)
-        gapsbs.append(gapbs)
-        heights.append(height)
-        heightsbs.append(heightbs)
-        ensout.append(mono_en.position)
-        data = {
-            "Energies": ensout,
-            "EPUGaps": gaps,
-            "PeakCurrent": heights,
-            "EPUGapsBS": gapsbs,
-            "PeakCurrentBS": heightsbs,
-        }
-        dataframe = pd.DataFrame(data=data)
-        dataframe.to_csv("/nsls2/data/sst/legacy/RSoXS/EPUdata_2023Nov_" + name + ".csv")
+        table.append(
+            energy=mono_en.position,
+            gap=startinggap,
+            mode=mode,
+            phase=phase,
+            height=peaklist[-1]["RSoXS Au Mesh Current"]["RSoXS Au Mesh Current"],
+            gap_beamstop=peaklist[-1]["WAXS Beamstop"]["en_epugap"],
+            height_beamstop=peaklist[-1]["WAXS Beamstop"]["WAXS Beamstop"],
+        )
         count += 1
         if count > 20:
             count = 0
@@ -171,9 +169,34 @@ def buildeputable(
     plt.close()
     plt.close()
     print(peaklist)
+    print("Swept " + str(round(gap_swept)) + " um of gap in total, instead of " + str(round(len(ens) * 3000 * widfract)) + " um with fixed windows.")
+    if len(table.model(mode, phase)) >= 2:
+        path_lookup_table = os.path.splitext(path)[0] + "_LUT.csv"
+        table.save_lookup_table(path_lookup_table, mode, phase)
+        print("Saved lookup table: " + path_lookup_table)
     # print(ens,gaps)
 
 
+def _sweep_epu_gap(startgap, endgap, peaklist):
+    ## Below is Eliot's old fly_max
+    yield from fly_max(
+        [izero_mesh, beamstop_waxs],
+        [
+            "RSoXS Au Mesh Current",
+            "WAXS Beamstop",
+        ],
+        epu_gap,
+        startgap,
+        endgap,
+        [200],
+        10,
+        True,
+        True,
+        peaklist,
+        end_on_max=False
+    )
+
+
 def do_some_eputables_2023_en():
 
     yield from load_configuration("WAXSNEXAFS")
@@ -31,6 +31,7 @@ from nbs_bl.hw import (
     #Det_S,
 )
 from ..startup import sd  # bec, db
+from .monitor_streams import read_monitor_streams, align_monitor_streams, find_monitor_maxima
 
 
 ## TODO: Not sure why this is redefined identically as the function in flystream_wrapper.py, but end goal is to move to Jamie's function.
@@ -288,29 +289,11 @@ def ramp_plan_with_multiple_monitors(
         yield from ramp_plan
 
 
-def process_monitor_scan(db, uid, time_offsets=None):
-    if time_offsets == None:
-        time_offsets = {}
-    hdr = db.v2[uid]
-    df = pd.DataFrame()
-    for stream_name in hdr:
-        if "monitor" not in stream_name:
-            print(stream_name)
-            continue
-        column_name = stream_name.replace("_monitor", "")
-        newdf = pd.DataFrame(
-            {
-                "time": hdr[stream_name]["timestamps"][column_name].read(),
-                column_name: hdr[stream_name]["data"][column_name].read(),
-            }
-        ).set_index("time")
-        newdf.index += time_offsets.get(stream_name, 0.0)
-        df = pd.concat((df, newdf))
-    # df = df[~df.index.duplicated(keep='first')].sort_index().interpolate(method='index').ffill().bfill()
-
-    df = df.groupby("time").mean().sort_index().interpolate(method="index").ffill().bfill()
-
-    return df
+def process_monitor_scan(db, uid, time_offsets=None, reference=None, windows=None):
+    ## All monitor streams on one time base.  See monitor_streams.align_monitor_streams for reference and windows.
+    streams = read_monitor_streams(db.v2[uid], time_offsets)
+    aligned = align_monitor_streams(streams, reference=reference, windows=windows)
+    return pd.DataFrame(aligned).set_index("time")
 
 
 def fly_plan(motor, *scan_params, exposure_time=0.5, flyer_list=[], md=None):
@@ -350,15 +333,9 @@ def find_optimum_motor_pos(
     signal_names=["RSoXS Au Mesh Current", "SAXS Beamstop"],
     time_offsets=None,
 ):
-    df = process_monitor_scan(db, uid, time_offsets)
-    max_signal_dict = {}
-    for monitor in signal_names:
-        idx = df[monitor].idxmax()
-        max_signal_dict[monitor] = {}
-        max_signal_dict[monitor]["time"] = idx
-        max_signal_dict[monitor][motor_name] = df[motor_name][idx]
-        max_signal_dict[monitor][monitor] = df[monitor][idx]
-    return max_signal_dict
+    ## Only the motor and the signals are read, and each signal's maximum is found among its own readings, instead of lining up every stream first
+    streams = read_monitor_streams(db.v2[uid], time_offsets, names=[motor_name] + list(signal_names))
+    return find_monitor_maxima(streams, motor_name, signal_names)
 
 
 
@@ -0,0 +1,162 @@
+## Lines up monitor streams from a fly scan (each signal with its own timestamps) with numpy instead of concatenating DataFrames.
+## Used by fly_alignment.process_monitor_scan and fly_alignment.find_optimum_motor_pos.  Only needs numpy and pandas, so it can be tested without the beamline.
+
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def read_monitor_streams(header, time_offsets=None, names=None):
+    """
+    Reads the monitor streams of a run into {column name: (timestamps, values)}, with time_offsets (by stream name) added to the timestamps.
+    Column names are the stream names without "_monitor", same as process_monitor_scan.  With names, only those columns are read.
+    """
+    time_offsets = time_offsets or {}
+    streams = {}
+    for stream_name in header:
+        if "monitor" not in stream_name:
+            print(stream_name)
+            continue
+        column_name = stream_name.replace("_monitor", "")
+        if names is not None and column_name not in names:
+            continue
+        timestamps = np.asarray(header[stream_name]["timestamps"][column_name].read(), dtype=float) + time_offsets.get(stream_name, 0.0)
+        streams[column_name] = (timestamps, np.asarray(header[stream_name]["data"][column_name].read(), dtype=float))
+    return streams
+
+
+def align_monitor_streams(streams, reference=None, windows=None):
+    """
+    Puts all streams on one time base.
+
+    Parameters
+    ----------
+    streams : dict
+        {name: (timestamps, values)}
+    reference : str, optional
+        Name of the stream whose timestamps are used, e.g., the motor readback.  By default, all timestamps of all streams, same as the old process_monitor_scan.
+    windows : list of (float, float), optional
+        Only keep times within these (start, end) windows, e.g., from maximum_windows
+
+    Returns
+    -------
+    dict with "time" and each stream's values at those times.  Values are interpolated linearly in time and held at the first and last readings outside
+    their range (same as interpolate(method="index").ffill().bfill()).  Readings with the same timestamp are averaged.
+    """
+    streams = {name: _average_duplicate_times(*stream) for name, stream in streams.items()}
+    if reference is None:
+        times = np.unique(np.concatenate([timestamps for timestamps, _ in streams.values()]))
+    else:
+        times = streams[reference][0]
+    if windows is not None:
+        keep = np.zeros(len(times), dtype=bool)
+        for start, end in windows:
+            keep[np.searchsorted(times, start, side="left") : np.searchsorted(times, end, side="right")] = True
+        times = times[keep]
+    aligned = {"time": times}
+    for name, (timestamps, values) in streams.items():
+        aligned[name] = values if name == reference and windows is None else np.interp(times, timestamps, values)
+    return aligned
+
+
+def maximum_windows(streams, signal_names, half_width=1.0, invert=False):
+    """
+    Returns (start, end) time windows of half_width seconds around the largest reading of each signal, so that only those parts of the scan need to be lined up.
+    """
+    windows = []
+    for signal_name in signal_names:
+        timestamps, values = streams[signal_name]
+        index = int(np.argmin(values) if invert else np.argmax(values))
+        windows.append((timestamps[index] - half_width, timestamps[index] + half_width))
+    return windows
+
+
+def find_monitor_maxima(streams, motor_name, signal_names, invert=False):
+    """
+    Finds the motor position at the largest reading of each signal, in the same format as fly_alignment.find_optimum_motor_pos.
+
+    The largest reading of a signal is found among its own readings (interpolating it to other timestamps cannot make it larger),
+    then the motor position is interpolated to that time.  Nothing else is lined up, so this takes milliseconds even for long streams.
+    """
+    streams = {name: _average_duplicate_times(*streams[name]) for name in [motor_name] + list(signal_names)}
+    times_motor, positions_motor = streams[motor_name]
+    max_signal_dict = {}
+    for signal_name in signal_names:
+        timestamps, values = streams[signal_name]
+        index = int(np.argmin(values) if invert else np.argmax(values))
+        max_signal_dict[signal_name] = {
+            "time": float(timestamps[index]),
+            motor_name: float(np.interp(timestamps[index], times_motor, positions_motor)),
+            signal_name: float(values[index]),
+        }
+    return max_signal_dict
+
+
+def _average_duplicate_times(timestamps, values):
+    timestamps = np.asarray(timestamps, dtype=float)
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, values = timestamps[order], values[order]
+    if len(timestamps) < 2 or np.all(np.diff(timestamps) > 0):
+        return timestamps, values
+    times_unique, index, counts = np.unique(timestamps, return_inverse=True, return_counts=True)
+    return times_unique, np.bincount(index, weights=values) / counts
+
+
+def _align_monitor_streams_pandas(streams):
+    ## The old process_monitor_scan, kept to compare against in benchmark_monitor_alignment
+    df = pd.DataFrame()
+    for name, (timestamps, values) in streams.items():
+        newdf = pd.DataFrame({"time": timestamps, name: values}).set_index("time")
+        df = pd.concat((df, newdf))
+    return df.groupby("time").mean().sort_index().interpolate(method="index").ffill().bfill()
+
+
+def _make_benchmark_streams(number_samples=100000, seed=0):
+    ## Motor moving at constant speed, with a few signals at different rates and phases
+    random = np.random.default_rng(seed)
+    duration = number_samples / 1000
+    streams = {}
+    times_motor = np.sort(random.uniform(0, duration, number_samples))
+    streams["RSoXS Sample Up-Down"] = (times_motor, -2 + 4 * times_motor / duration)
+    for name, rate in (("RSoXS Au Mesh Current", 1.0), ("SAXS Beamstop", 0.7)):
+        times = np.sort(random.uniform(0, duration, int(number_samples * rate)))
+        position = -2 + 4 * times / duration
+        streams[name] = (times, np.exp(-((position - 0.3) / 0.2) ** 2) + 0.01 * random.standard_normal(len(times)))
+    return streams
+
+
+def benchmark_monitor_alignment(number_samples=100000, repeats=5):
+    """
+    Compares the old DataFrame alignment with align_monitor_streams and find_monitor_maxima on streams of number_samples readings.
+    """
+    streams = _make_benchmark_streams(number_samples)
+    motor_name = "RSoXS Sample Up-Down"
+    signal_names = ["RSoXS Au Mesh Current", "SAXS Beamstop"]
+
+    def timed(function):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = function()
+        return (time.perf_counter() - start) / repeats, result
+
+    def maxima_pandas():
+        df = _align_monitor_streams_pandas(streams)
+        return {name: df[motor_name][df[name].idxmax()] for name in signal_names}
+
+    time_pandas, positions_pandas = timed(maxima_pandas)
+    time_aligned, _ = timed(lambda: align_monitor_streams(streams))
+    time_reference, _ = timed(lambda: align_monitor_streams(streams, reference=motor_name))
+    time_windows, _ = timed(lambda: align_monitor_streams(streams, reference=motor_name, windows=maximum_windows(streams, signal_names, 0.1)))
+    time_maxima, maxima = timed(lambda: find_monitor_maxima(streams, motor_name, signal_names))
+
+    print(str(number_samples) + " readings per stream                       time (ms)")
+    print(f"DataFrame concat, groupby, interpolate     {time_pandas * 1e3:10.2f}")
+    print(f"align on all timestamps                    {time_aligned * 1e3:10.2f}")
+    print(f"align on motor timestamps                  {time_reference * 1e3:10.2f}")
+    print(f"align on motor timestamps, windows only    {time_windows * 1e3:10.2f}")
+    print(f"find_monitor_maxima                        {time_maxima * 1e3:10.2f}")
+    for name in signal_names:
+        print(f"{name}: motor at maximum {positions_pandas[name]:.5f} (DataFrame), {maxima[name][motor_name]:.5f} (numpy)")
+    return {"pandas": time_pandas, "aligned": time_aligned, "reference": time_reference, "windows": time_windows, "maxima": time_maxima}
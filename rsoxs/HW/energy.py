@@ -287,3 +287,19 @@ SR:C07-ID:G1A{SST1:1}FlyMove-Speed-RB # readback speed
 SR:C07-ID:G1A{SST1:1}FlyMove-Mtr.MOVN # moving
 '''
 
+
+
+epu_fly_prefix = "SR:C07-ID:G1A{SST1:1}"
+epu_fly_lut_energy = EpicsSignal(epu_fly_prefix + "FlyLUT-Energy-RB", write_pv=epu_fly_prefix + "FlyLUT-Energy-SP", name="EPU Fly LUT Energy")
+epu_fly_lut_gap = EpicsSignal(epu_fly_prefix + "FlyLUT-Gap-RB", write_pv=epu_fly_prefix + "FlyLUT-Gap-SP", name="EPU Fly LUT Gap")
+epu_fly_calculate_spline = EpicsSignal(epu_fly_prefix + "CalculateSpline.PROC", name="EPU Fly Calculate Spline")
+
+
+def set_epu_lookup_table(lookup_table):
+    """
+    Programs the energy and gap arrays that the EPU follows during energy fly scans (e.g., from energy_fly.make_epu_lookup_table),
+    then has the EPU calculate a new spline from them.
+    """
+    yield from bps.abs_set(epu_fly_lut_energy, list(lookup_table["energy"]), wait=True)
+    yield from bps.abs_set(epu_fly_lut_gap, list(lookup_table["gap"]), wait=True)
+    yield from bps.abs_set(epu_fly_calculate_spline, 1, wait=True)
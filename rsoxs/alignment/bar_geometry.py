@@ -0,0 +1,375 @@
+## Rotated sample positions for the whole bar at once.  Positions for every sample and requested angle are worked out in one numpy call and cached,
+## so rotate_now, the queue scheduler, and the time estimates look them up instead of rotating one sample at a time.
+## The cache is cleared when correct_bar changes the fiducial corrections.  Does not import any hardware, so it can be tested without the beamline.
+
+import time
+
+import numpy as np
+
+
+def rotatedx(x0, theta, zoff, xoff=1.88, thoff=0):
+    """
+    given the x position at 0 rotation (from the image of the sample bar)
+    and a rotation angle, the offset of rotation in z and x (as well as a potential theta offset)
+    find the correct x position to move to at a different rotation angle
+    """
+    return (
+        xoff + (x0 - xoff) * np.cos((theta - thoff) * np.pi / 180) - zoff * np.sin((theta - thoff) * np.pi / 180)
+    )
+
+
+def rotatedz(x0, theta, zoff, xoff=1.88, thoff=0):
+    """
+    given the x position at 0 rotation (from the image of the sample bar)
+    and a rotation angle, the offset of rotation in z and x axes (as well as a potential theta offset)
+    find the correct z position to move to to keep a particular sample at the same intersection point with X-rays
+    """
+    return (
+        zoff + (x0 - xoff) * np.sin((theta - thoff) * np.pi / 180) - zoff * np.cos((theta - thoff) * np.pi / 180)
+    )
+
+
+def af_rotation(xfm90, xf0, xf90, xf180):
+    """
+    takes the fiducial centers measured in the x direction at -90, 0, 90, and 180 degrees
+    and returns the offset in x and z from the center of rotation, as well as the
+    unrotated x positon of the fiducial marker.
+
+    the x offset is not expected to vary between loads, and has been measured to be 1.88,
+    while the z offset is as the bar flexes in this direction, and will be used to
+    map the surface locations of other samples between the fiducials
+
+    """
+
+    x0 = xf0
+    xoff = (xf180 + x0) / 2
+    zoff = (xfm90 - xf90) / 2
+    return (x0, zoff, xoff)
+
+
+def zoffset(af1zoff, af2zoff, y, front=True, height=0.25, af1y=-186.3, af2y=4):
+    """
+    Using the z offset of the fiducial positions from the center of rotation,
+    project the z offset of the surface of a given sample at some y position between
+    the fiducials.  y, front, and height can be arrays for many samples at once.
+    """
+
+    m = (af2zoff - af1zoff) / (af2y - af1y)  # slope of bar
+    z0 = af1zoff + m * (y - af1y)
+
+    # offset the line by the front/back offset + height
+    #return z0 - 2.5 - height for the front before Nov 2023
+    if np.ndim(front) == 0:
+        return z0 + 4.5 - height if front else z0 + height  # fixed Nov 2023 with new rotation stage
+    return np.where(front, z0 + 4.5 - height, z0 + height)
+    # return the offset intersect
+
+
+def rotation_angles(angle, grazing, front, x0, force=False):
+    """
+    Translates requested angles (sample["angle"]) into theta positions, for many samples and angles at once.  Same rules as sanatize_angle.
+
+    Parameters
+    ----------
+    angle : array-like
+        Requested angles.  NaN for angles that are not numbers, which get the default angle for the kind of sample.
+    grazing, front : array-like of bool
+    x0 : array-like
+        Unrotated x position of each sample (bar_loc["x0"]), which decides which side transmission samples are rotated from
+    force : bool
+        Use the requested angle as it is, if it is between -155 and 195
+
+    Returns
+    -------
+    theta, angle : numpy.ndarray
+        Theta positions, and the requested angles with the defaults filled in
+    """
+    angle, grazing, front, x0 = np.broadcast_arrays(
+        np.asarray(angle, dtype=float), np.asarray(grazing, dtype=bool), np.asarray(front, dtype=bool), np.asarray(x0, dtype=float)
+    )
+    good = np.isfinite(angle)
+    a = np.where(good, angle, 0.0)
+    transmission = ~grazing
+    with np.errstate(invalid="ignore"):
+        ## grazing incidence, front: 0 is parallel to the face of the sample, 90 is normal to it
+        theta_grazing_front = 90 - np.mod(a + 3600, 180)
+        ## grazing incidence, back: grazing angle subtracted from 180
+        theta_grazing_back = np.mod(435 - np.mod(-a + 3600, 180), 360) - 165
+        theta_grazing_back = np.where(theta_grazing_back < -155, np.mod(435 - np.mod(a + 3600, 180), 360) - 165, theta_grazing_back)
+        ## transmission, front: coming from the left side of the bar at more than 30 degrees, flip to come from the other side
+        theta_transmission_front = np.where(
+            (x0 > 6) & (np.abs(a) > 30),
+            np.mod(345 - np.mod(90 - a + 3600, 180) + 90, 360) - 165,
+            np.mod(345 - np.mod(90 + a + 3600, 180) + 90, 360) - 165,
+        )
+        theta_transmission_front = np.where(theta_transmission_front >= 195, 180, theta_transmission_front)
+        theta_transmission_front = np.where(theta_transmission_front <= -155, -150, theta_transmission_front)
+        ## transmission, back: coming from the right side at more than 30 degrees, flip to come from the left side
+        theta_transmission_back = np.where(
+            (x0 < -5) & (np.abs(a) > 30), np.mod(90 - a + 3600, 180) - 90.0, np.mod(90 + a + 3600, 180) - 90
+        )
+
+    theta = np.select(
+        [grazing & front, grazing & ~front, transmission & front],
+        [theta_grazing_front, theta_grazing_back, theta_transmission_front],
+        theta_transmission_back,
+    )
+    ## Angles that are not numbers default to 20 degrees incidence for grazing samples and normal incidence for transmission samples
+    default = np.select([grazing & front, grazing & ~front], [70.0, 110.0], 0.0)
+    theta = np.where(good, theta, default)
+    angle = np.where(good, angle, default)
+    theta = np.clip(theta, -155.0, 195.0)
+    if force:
+        theta = np.where(good & (angle > -155) & (angle < 195), angle, theta)
+    return theta, angle
+
+
+def angle_value(angle):
+    ## NaN for angles that are not numbers ("Do not rotate", None, etc.)
+    if isinstance(angle, (int, float, np.number)) and not isinstance(angle, (bool, np.bool_)):
+        return float(angle)
+    return np.nan
+
+
+def _location_value(sample, motor_name):
+    for motor in sample.get("location") or []:
+        if motor["motor"] == motor_name:
+            return motor["position"]
+    return None
+
+
+def _geometry_inputs(sample):
+    ## Everything a rotated position depends on, or None if the sample has not been corrected from the bar image yet
+    bar_loc = sample.get("bar_loc") or {}
+    try:
+        return (
+            float(bar_loc["x0"]), float(bar_loc["y0"]), float(bar_loc["xoff"]), float(bar_loc["zoff"]),
+            bool(sample["grazing"]), bool(sample["front"]), _location_value(sample, "z"),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def rotate_positions(samples, angles, force=False):
+    """
+    Positions of samples at angles, in one vectorized calculation.
+
+    Parameters
+    ----------
+    samples : list of dict
+        Samples from the bar, with bar_loc x0, y0, xoff, and zoff from correct_bar
+    angles : list
+        Requested angle for each sample (same length as samples)
+    force : bool
+        See rotation_angles
+
+    Returns
+    -------
+    list of dict with "x", "y", "z", "th", and "angle" (the requested angle with defaults filled in), or None for samples without a corrected position.
+    z is the z in the sample's location, which rotations do not move (moving z is dangerous, so it is kept at 0 by default).
+    """
+    inputs = [_geometry_inputs(sample) for sample in samples]
+    valid = [index for index, value in enumerate(inputs) if value is not None]
+    positions = [None] * len(samples)
+    if not valid:
+        return positions
+    columns = list(zip(*[inputs[index] for index in valid]))
+    x0, y0, xoff, zoff = (np.array(column, dtype=float) for column in columns[:4])
+    grazing, front = (np.array(column, dtype=bool) for column in columns[4:6])
+    z = columns[6]
+    angle = np.array([angle_value(angles[index]) for index in valid])
+    theta, angle = rotation_angles(angle, grazing, front, x0, force=force)
+    x = rotatedx(x0, theta, zoff, xoff=xoff)
+    for position_index, index in enumerate(valid):
+        positions[index] = {
+            "x": float(x[position_index]),
+            "y": float(y0[position_index]),
+            "z": z[position_index],
+            "th": float(theta[position_index]),
+            "angle": angles[index] if np.isfinite(angle_value(angles[index])) else float(angle[position_index]),
+        }
+    return positions
+
+
+def apply_position(sample, position):
+    """
+    Sets the x, y, and th of sample["location"] to a position from rotate_positions, and records the angle, same as rotate_sample.
+    """
+    sample["bar_loc"]["th"] = position["th"]
+    sample["angle"] = position["angle"]
+    for motor in sample["location"]:
+        if motor["motor"] == "x":
+            motor["position"] = position["x"]
+        if motor["motor"] == "th":
+            motor["position"] = position["th"]
+        if motor["motor"] == "y":
+            motor["position"] = position["y"]
+    # in future, updating y (if the rotation axis is not perfectly along y
+    # and z (to keep the sample-detector distance constant) as needed would be good as well
+    # newz = rotatedz(newx, th, zoff, af1xoff)
+
+
+class BarGeometryCache:
+    """
+    Rotated positions by (sample_id, angle, force, version).
+
+    version counts the fiducial corrections.  invalidate (called by correct_bar) starts a new version, so positions from the old corrections are not used.
+    Each cached position also remembers the bar_loc values it came from, so edits to one sample (e.g., jog_samp_zoff) are picked up without invalidating.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.positions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.version += 1
+        self.positions = {}
+
+    def get_positions(self, samples, angles, force=False):
+        """
+        Returns the positions of samples at angles (one angle per sample, like rotate_positions).  Positions not in the cache are calculated together.
+        """
+        positions = [None] * len(samples)
+        missing = []
+        inputs_by_sample = {}  ## The same sample is usually asked for at several angles
+        for index, (sample, angle) in enumerate(zip(samples, angles)):
+            key = (sample.get("sample_id"), _angle_key(angle), bool(force), self.version)
+            if id(sample) not in inputs_by_sample:
+                inputs_by_sample[id(sample)] = _geometry_inputs(sample)
+            inputs = inputs_by_sample[id(sample)]
+            cached = self.positions.get(key)
+            if cached is not None and cached[0] == inputs:
+                positions[index] = cached[1]
+                self.hits += 1
+            else:
+                missing.append((index, key, inputs))
+        if missing:
+            self.misses += len(missing)
+            calculated = rotate_positions([samples[index] for index, _, _ in missing], [angles[index] for index, _, _ in missing], force=force)
+            for (index, key, inputs), position in zip(missing, calculated):
+                positions[index] = position
+                if position is not None:
+                    self.positions[key] = (inputs, position)
+        ## Copies, so that changing a returned position does not change the cache
+        return [dict(position) if position is not None else None for position in positions]
+
+    def get_position(self, sample, angle, force=False):
+        position = self.get_positions([sample], [angle], force=force)[0]
+        if position is None:
+            raise KeyError(
+                f'the sample {sample.get("sample_name")} does not have a corrected position (bar_loc x0, y0, xoff, zoff) yet, have you imaged the bar and run correct_bar?'
+            )
+        return position
+
+    def get_bar_positions(self, bar, angles, force=False):
+        """
+        Positions of every sample on the bar at every angle in angles.  Returns {sample_id: {angle: position}}.
+        """
+        samples = [sample for sample in bar for _ in angles]
+        angles_all = [angle for _ in bar for angle in angles]
+        positions = self.get_positions(samples, angles_all, force=force)
+        result = {}
+        for sample, angle, position in zip(samples, angles_all, positions):
+            result.setdefault(sample["sample_id"], {})[_angle_key(angle)] = position
+        return result
+
+
+def _angle_key(angle):
+    if isinstance(angle, (int, float)) and not isinstance(angle, bool):
+        return float(angle)
+    value = angle_value(angle)
+    return value if np.isfinite(value) else str(angle)
+
+
+def make_sample_position_function(bar, cache=None, queue=None):
+    """
+    Returns position_function(acquisition) -> (position at the start, position at the end) for queue_scheduler.get_acquisition_states, from the cache.
+
+    The start is the sample at its first angle in sample_angles and the end is at its last angle.
+    Acquisitions with "Do not rotate" stay at the sample's location.  Unknown samples or positions give (None, None).
+    With queue, the positions of all its acquisitions are calculated up front in one call.
+    """
+    cache = bar_geometry_cache if cache is None else cache
+    samples_by_id = {sample["sample_id"]: sample for sample in bar}
+
+    def angles_of(acquisition):
+        angles = acquisition.get("sample_angles")
+        if not isinstance(angles, (list, tuple)) or len(angles) == 0:
+            angles = [0]
+        return angles
+
+    if queue is not None:
+        pairs = [
+            (samples_by_id[acquisition.get("sample_id")], angle)
+            for acquisition in queue
+            if acquisition.get("sample_id") in samples_by_id
+            for angle in angles_of(acquisition)
+            if angle != "Do not rotate"
+        ]
+        if pairs:
+            cache.get_positions([sample for sample, _ in pairs], [angle for _, angle in pairs])
+
+    def position_function(acquisition):
+        sample = samples_by_id.get(acquisition.get("sample_id"))
+        if sample is None:
+            return None, None
+        angles = angles_of(acquisition)
+        if angles[0] == "Do not rotate":
+            location = {motor: _location_value(sample, motor) for motor in ("x", "y", "th")}
+            return location, location
+        start, end = cache.get_positions([sample, sample], [angles[0], angles[-1]])
+        return start, end
+
+    return position_function
+
+
+def benchmark_bar_geometry(number_samples=200, number_angles=10, repeats=5):
+    """
+    Compares rotating one sample and one angle at a time (as rotate_sample did) with rotate_positions and with cached lookups.
+    """
+    random = np.random.default_rng(0)
+    bar = [
+        {
+            "sample_id": "sample" + str(index),
+            "sample_name": "sample" + str(index),
+            "grazing": bool(random.random() < 0.3),
+            "front": bool(random.random() < 0.7),
+            "angle": 0,
+            "location": [{"motor": motor, "position": 0.0, "order": 0} for motor in ("x", "y", "z", "th")],
+            "bar_loc": {"x0": random.uniform(-10, 10), "y0": random.uniform(-190, 0), "xoff": 1.88, "zoff": random.uniform(-1, 1)},
+        }
+        for index in range(number_samples)
+    ]
+    angles = list(np.linspace(-60, 60, number_angles))
+
+    def one_at_a_time():
+        positions = []
+        for sample in bar:
+            for angle in angles:
+                positions.append(rotate_positions([sample], [angle])[0])
+        return positions
+
+    def timed(function):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = function()
+        return (time.perf_counter() - start) / repeats, result
+
+    cache = BarGeometryCache()
+    time_loop, positions_loop = timed(one_at_a_time)
+    time_vectorized, positions_vectorized = timed(lambda: rotate_positions([sample for sample in bar for _ in angles], [angle for _ in bar for angle in angles]))
+    cache.get_bar_positions(bar, angles)
+    time_cached, _ = timed(lambda: cache.get_bar_positions(bar, angles))
+    assert all(abs(a["x"] - b["x"]) < 1e-9 and a["th"] == b["th"] for a, b in zip(positions_loop, positions_vectorized))
+
+    print(f"{number_samples} samples x {number_angles} angles                time (ms)")
+    print(f"one sample and angle at a time       {time_loop * 1e3:10.2f}")
+    print(f"rotate_positions                     {time_vectorized * 1e3:10.2f}")
+    print(f"BarGeometryCache, all cached         {time_cached * 1e3:10.2f}")
+    return {"loop": time_loop, "vectorized": time_vectorized, "cached": time_cached}
+
+
+## Shared by rotate_now, rotate_sample, correct_bar, and the queue time estimates
+bar_geometry_cache = BarGeometryCache()
@@ -2,34 +2,43 @@ import numpy as np
 from matplotlib import pyplot as plt
 from PIL import Image
 
+from .bar_stitching import barImage_Extent_Default, stitch_tiles, build_pyramid, show_pyramid, save_bar_images, load_bar_images
+
 
 ## Just copied from Eliot's code for now
-def stitch_sample(images, step_size, y_off, from_image=None, flip_file=False):
+def stitch_sample(images, step_size, y_off, from_image=None, flip_file=False, positions=None, blend=False, store=None):
+    """
+    Stitches the image_bar pictures (or loads a saved image of the bar) and shows it to point at samples.
+
+    The bar image is allocated once from the picture positions (step_size apart unless positions are given) and the pictures are copied into it,
+    with overlaps blended if blend.  It is shown from a pyramid of smaller copies, so panning and zooming stay fast.
+    With store, the pictures and pyramid are saved to that HDF5 file, which can be given as from_image later to show the bar again.
+    """
     global sample_image_axes
 
-    if isinstance(from_image, str):
+    if isinstance(from_image, str) and from_image.endswith((".h5", ".hdf5")):
+        pyramid = load_bar_images(from_image)["pyramid"]
+        if flip_file:
+            pyramid = [np.flipud(level) for level in pyramid]
+        result = pyramid[0]
+    elif isinstance(from_image, str):
         im_frame = Image.open(from_image)
         result = np.array(im_frame)
         if flip_file:
             result = np.flipud(result)
+        pyramid = build_pyramid(result)
     else:
-        pixel_step = int(step_size * (1760) / 25)
-        pixel_overlap = 2464 - pixel_step
-        result = images[0][0]
-        i = 0
-        for imageb in images[1:]:
-            image = imageb[0]
-            i += 1
-            if y_off > 0:
-                result = np.concatenate((image[(y_off * i) :, :], result[:-(y_off), pixel_overlap:]), axis=1)
-            elif y_off < 0:
-                result = np.concatenate((image[: (y_off * i), :], result[-(y_off):, pixel_overlap:]), axis=1)
-            else:
-                result = np.concatenate((image[:, :], result[:, pixel_overlap:]), axis=1)
+        tiles = [imageb[0] for imageb in images]
+        if positions is None:
+            positions = step_size * np.arange(len(tiles))
+        result = stitch_tiles(tiles, positions, step_size, y_off, blend=blend)
+        pyramid = build_pyramid(result)
+        if store is not None:
+            save_bar_images(store, tiles, positions, step_size, y_off, blend, pyramid=pyramid)
         # result = np.flipud(result)
 
     fig, ax = plt.subplots()
-    ax.imshow(result, extent=[-210, 25, -14.5, 14.5])
+    show_pyramid(ax, pyramid, extent=barImage_Extent_Default)
     sample_image_axes = ax
     #fig.canvas.mpl_connect("button_press_event", plot_click) ## For now, want to keep simple and not do clicking here.
     #fig.canvas.mpl_connect("key_press_event", plot_key_press)
@@ -0,0 +1,355 @@
+## Proposes sample locations on the stitched bar image, so that update_bar only needs clicks for the samples it is not sure about.
+## Samples are found as regions that differ from the bar around them (thresholding and connected components), and the regions are matched to
+## the samples of the bar by fitting the known layout (positions from an earlier image, or the bar spots) to them.
+## Each proposal has a confidence from 0 to 1 and the location entries a click at the same place would give.
+## Only needs numpy, so it can be tested without the beamline.
+
+import re
+
+import numpy as np
+
+from .bar_stitching import barImage_Extent_Default, barStitch_Parameters_Default, build_pyramid
+
+
+barLocator_Parameters_Default = {
+    "analysis_width": 4096,  ## pixels.  Regions are found on the pyramid level of the bar image that is at most this wide.
+    "threshold_sigmas": 5,  ## Pixels further than this many noise standard deviations from the bar around them are sample
+    "opening": 0.25,  ## mm.  Specks smaller than this are removed from the thresholded image.
+    "size_minimum": 1.0,  ## mm, side of the smallest square sample
+    "size_maximum": 20.0,  ## mm, side of the largest square sample
+    "match_distance": 3.0,  ## mm.  Regions further than this from where the layout puts a sample are not matched to it.
+    "match_sigma": 0.75,  ## mm.  A region this far from where the layout puts the sample lowers the confidence to 0.6.
+    "spot_directions": [-1, 1],  ## Sign of the image x per spot letter (A at the top) and of the image y per spot number (increasing to the right)
+    "iterations": 10,  ## Rounds of matching regions to samples and fitting the layout
+    "confidence_minimum": 0.7,  ## Samples below this are left for the user to click
+}
+
+## Fiducials and the diode that update_bar adds to the bar.  They are not matched to regions, so they are always clicked.
+barLocator_Skipped_Names = ["AF1_front", "AF2_front", "diode", "AF1_back", "AF2_back"]
+
+
+def locate_samples(image, samples, extent=barImage_Extent_Default, parameters=barLocator_Parameters_Default):
+    """
+    Proposes the location of each sample on a stitched bar image.
+
+    Parameters
+    ----------
+    image : numpy array
+        Bar image from stitch_sample, (rows, columns) or (rows, columns, colors)
+    samples : list of dict
+        Samples of the bar that are on the side of the bar in the image
+    extent : list
+        [left, right, bottom, top] in mm, same as the extent the image is shown with, so positions are the same as clicks give
+    parameters : dict
+
+    Returns
+    -------
+    list of dict, one per sample in the same order, with
+        "sample_id", "sample_name"
+        "confidence": 0 to 1.  0 if no region was matched to the sample.
+        "location": location entries as plot_click makes them, or None
+        "ximg", "yimg": image position in mm (None if not matched)
+        "bounds": {"x": (low, high), "y": (low, high)} in mm, the edges of the sample region, or None
+    """
+    regions = find_sample_regions(image, extent, parameters)
+    samples_matched = [sample for sample in samples if sample.get("sample_name") not in barLocator_Skipped_Names]
+    template = layout_template(samples_matched)
+    matches = match_layout(regions, template, parameters)
+    proposals_by_id = {}
+    for indexSample, sample in enumerate(samples_matched):
+        indexRegion, distance, distance_other = matches[indexSample]
+        proposal = _empty_proposal(sample)
+        if indexRegion is not None:
+            region = regions[indexRegion]
+            sigma = parameters["match_sigma"]
+            confidence_match = np.exp(-0.5 * (distance / sigma) ** 2)
+            ## Another region nearly as close could be the sample instead
+            confidence_unique = 1 - np.exp(-0.5 * ((distance_other - distance) / sigma) ** 2)
+            confidence = confidence_match * confidence_unique * region["contrast_score"] * region["shape_score"]
+            proposal.update(
+                confidence=float(confidence),
+                location=image_location(region["x"], region["y"]),
+                ximg=region["x"],
+                yimg=region["y"],
+                bounds=region["bounds"],
+            )
+        proposals_by_id[id(sample)] = proposal
+    return [proposals_by_id.get(id(sample)) or _empty_proposal(sample) for sample in samples]
+
+
+def image_location(x, y):
+    ## Location entries for image position (x, y) in mm, the same as plot_click makes from a click there
+    return [
+        {"motor": "x", "position": float(x), "order": 0},
+        {"motor": "y", "position": float(y), "order": 0},
+        {"motor": "z", "position": 0.0, "order": 0},
+        {"motor": "th", "position": 180.0, "order": 0},
+    ]
+
+
+def pixel_to_image_position(row, column, shape, extent=barImage_Extent_Default):
+    ## (x, y) in mm of a pixel, the same as event.ydata and event.xdata of a click on the image shown with imshow(extent=extent)
+    left, right, bottom, top = extent
+    return top - (row + 0.5) * (top - bottom) / shape[0], left + (column + 0.5) * (right - left) / shape[1]
+
+
+def find_sample_regions(image, extent=barImage_Extent_Default, parameters=barLocator_Parameters_Default):
+    """
+    Finds regions of the bar image that may be samples.
+
+    Each row of the bar is mostly bare bar, so the median of the row is taken as the bar there.  Pixels that differ from it by more than
+    threshold_sigmas times the noise are thresholded into connected regions, and regions outside the size limits are dropped.
+
+    Returns
+    -------
+    list of dict with
+        "x", "y": center in mm, "bounds": {"x": (low, high), "y": (low, high)} in mm, "area": mm^2
+        "contrast_score": 0.5 to 1 from how far the region stands out of the noise, "shape_score": 0 to 1 from how much of its bounding box it fills
+    """
+    ## Only the pyramid levels down to the first one narrow enough are made
+    halvings = max(int(np.ceil(np.log2(image.shape[1] / parameters["analysis_width"]))), 0)
+    pyramid = build_pyramid(image, dict(barStitch_Parameters_Default, pyramid_minimum=max(min(image.shape[:2]) >> halvings, 1)))
+    level = pyramid[min(halvings, len(pyramid) - 1)]
+    gray = level.astype(float).mean(axis=2) if level.ndim == 3 else level.astype(float)
+    difference = np.abs(gray - np.median(gray, axis=1, keepdims=True))
+    noise = 1.4826 * np.median(difference)
+    threshold = parameters["threshold_sigmas"] * max(noise, 1e-12)
+    height_mm = abs(extent[3] - extent[2]) / gray.shape[0]
+    width_mm = abs(extent[1] - extent[0]) / gray.shape[1]
+    size_opening = max(int(round(parameters["opening"] / max(height_mm, width_mm))), 1)
+    mask = _opening(difference > threshold, size_opening)
+
+    regions = []
+    for component in label_components(mask, difference):
+        area = component["area"] * height_mm * width_mm
+        if not parameters["size_minimum"] ** 2 <= area <= parameters["size_maximum"] ** 2:
+            continue
+        (row_low, row_high), (column_low, column_high) = component["rows"], component["columns"]
+        x, y = pixel_to_image_position(component["row"], component["column"], gray.shape, extent)
+        x_low, y_low = pixel_to_image_position(row_high + 0.5, column_low - 0.5, gray.shape, extent)
+        x_high, y_high = pixel_to_image_position(row_low - 0.5, column_high + 0.5, gray.shape, extent)
+        fill = component["area"] / ((row_high - row_low + 1) * (column_high - column_low + 1))
+        regions.append(
+            {
+                "x": float(x),
+                "y": float(y),
+                "bounds": {"x": (float(min(x_low, x_high)), float(max(x_low, x_high))), "y": (float(min(y_low, y_high)), float(max(y_low, y_high)))},
+                "area": float(area),
+                "contrast_score": float(min(1.0, component["mean"] / threshold / 2)),
+                "shape_score": float(min(1.0, fill / 0.8)),
+            }
+        )
+    return regions
+
+
+def label_components(mask, values=None):
+    """
+    Finds the 4-connected regions of a boolean image from its runs of True pixels along rows, which is fast without scipy.
+
+    Returns
+    -------
+    list of dict with "area" (pixels), "row", "column" (center), "rows", "columns" (first and last), and "mean" of values over the region
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    changes = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(changes == 1)
+    _, run_ends = np.nonzero(changes == -1)  ## One past the last pixel of the run
+    number_runs = len(run_rows)
+    if number_runs == 0:
+        return []
+
+    ## Join runs in neighboring rows that share columns
+    parents = list(range(number_runs))
+
+    def root(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    row_firsts = np.searchsorted(run_rows, np.arange(mask.shape[0] + 1))
+    for row in range(1, mask.shape[0]):
+        above, above_end = row_firsts[row - 1], row_firsts[row]
+        current, current_end = row_firsts[row], row_firsts[row + 1]
+        while above < above_end and current < current_end:
+            if run_starts[above] < run_ends[current] and run_starts[current] < run_ends[above]:
+                root_above, root_current = root(above), root(current)
+                if root_above != root_current:
+                    parents[root_current] = root_above
+            if run_ends[above] < run_ends[current]:
+                above += 1
+            else:
+                current += 1
+    labels = np.array([root(index) for index in range(number_runs)])
+    labels = np.unique(labels, return_inverse=True)[1]
+
+    lengths = (run_ends - run_starts).astype(float)
+    areas = np.bincount(labels, weights=lengths)
+    rows = np.bincount(labels, weights=run_rows * lengths) / areas
+    columns = np.bincount(labels, weights=(run_starts + run_ends - 1) / 2 * lengths) / areas
+    if values is not None:
+        sums = np.zeros((mask.shape[0], mask.shape[1] + 1))
+        np.cumsum(values, axis=1, out=sums[:, 1:])
+        means = np.bincount(labels, weights=sums[run_rows, run_ends] - sums[run_rows, run_starts]) / areas
+    row_firsts, row_lasts = np.full(len(areas), mask.shape[0]), np.zeros(len(areas), dtype=int)
+    column_firsts, column_lasts = np.full(len(areas), mask.shape[1]), np.zeros(len(areas), dtype=int)
+    np.minimum.at(row_firsts, labels, run_rows)
+    np.maximum.at(row_lasts, labels, run_rows)
+    np.minimum.at(column_firsts, labels, run_starts)
+    np.maximum.at(column_lasts, labels, run_ends - 1)
+    return [
+        {
+            "area": int(areas[label]),
+            "row": float(rows[label]),
+            "column": float(columns[label]),
+            "rows": (int(row_firsts[label]), int(row_lasts[label])),
+            "columns": (int(column_firsts[label]), int(column_lasts[label])),
+            "mean": float(means[label]) if values is not None else np.nan,
+        }
+        for label in range(len(areas))
+    ]
+
+
+def layout_template(samples):
+    """
+    Returns where the layout puts each sample, as {"positions": (number of samples, 2) array of (x, y) or NaN, "kind": kind}.
+
+    "image": ximg and yimg from an earlier image of the bar, in mm.  Only a shift is fit.
+    "spot": bar spots such as "12B", as (row letter, number).  A scale and shift are fit along and across the bar.
+    "order": the order of the samples along the bar.  A scale and shift are fit along the bar.
+    """
+    positions_image = np.array([[_number((sample.get("bar_loc") or {}).get(key)) for key in ("ximg", "yimg")] for sample in samples], dtype=float).reshape(-1, 2)
+    if len(samples) and np.isfinite(positions_image).all(axis=1).sum() >= max(2, len(samples) // 2):
+        return {"positions": positions_image, "kind": "image"}
+    spots = [re.fullmatch(r"\s*(\d+)\s*([A-Za-z]?)\s*", str((sample.get("bar_loc") or {}).get("spot", sample.get("bar_spot", "")))) for sample in samples]
+    if len(samples) and all(spots) and len({spot.group(1) for spot in spots}) > 1:
+        positions_spot = [[ord(spot.group(2).upper()) - ord("A") if spot.group(2) else 0, int(spot.group(1))] for spot in spots]
+        return {"positions": np.array(positions_spot, dtype=float), "kind": "spot"}
+    return {"positions": np.column_stack((np.zeros(len(samples)), np.arange(len(samples), dtype=float))), "kind": "order"}
+
+
+def match_layout(regions, template, parameters=barLocator_Parameters_Default):
+    """
+    Fits the layout to the regions and matches them to samples.
+
+    Regions and samples are matched nearest first, the layout is fit again to the matches, and this is repeated.
+    A layout of spots or order is the same mirrored, so which way it runs comes from spot_directions.
+
+    Returns
+    -------
+    list of (region index or None, distance, distance to the next nearest region) in mm, one per sample
+    """
+    template_positions = template["positions"]
+    if len(regions) == 0 or len(template_positions) == 0:
+        return [(None, np.inf, np.inf)] * len(template_positions)
+    region_positions = np.array([[region["x"], region["y"]] for region in regions])
+    known = np.isfinite(template_positions).all(axis=1)
+
+    transform = _initial_transform(template_positions[known], region_positions, template["kind"], parameters)
+    for iteration in range(parameters["iterations"]):
+        predicted = template_positions * transform[:, 0] + transform[:, 1]
+        ## The first guess of the spot spacing is rough, so every sample is matched to start with
+        gate = np.inf if iteration == 0 and template["kind"] != "image" else parameters["match_distance"]
+        pairs = _match_nearest(predicted, region_positions, gate)
+        transform_new = _fit_transform(template_positions, region_positions, pairs, template["kind"], transform)
+        if np.allclose(transform_new, transform):
+            break
+        transform = transform_new
+    predicted = template_positions * transform[:, 0] + transform[:, 1]
+    pairs = _match_nearest(predicted, region_positions, parameters["match_distance"])
+
+    matches = []
+    for indexSample in range(len(template_positions)):
+        if indexSample not in pairs:
+            matches.append((None, np.inf, np.inf))
+            continue
+        indexRegion, distance = pairs[indexSample]
+        distances = np.hypot(*(region_positions - predicted[indexSample]).T)
+        distances[indexRegion] = np.inf
+        matches.append((indexRegion, float(distance), float(distances.min())))
+    return matches
+
+
+def _empty_proposal(sample):
+    return {"sample_id": sample.get("sample_id"), "sample_name": sample.get("sample_name"), "confidence": 0.0, "location": None, "ximg": None, "yimg": None, "bounds": None}
+
+
+def _initial_transform(template_positions, region_positions, kind, parameters):
+    ## [[scale, shift] for x, [scale, shift] for y] that puts the template over the regions
+    if kind == "image":
+        return np.array([[1.0, _shift_1d(template_positions[:, axis], region_positions[:, axis])] for axis in (0, 1)])
+    transform = np.zeros((2, 2))
+    for axis in (0, 1):
+        low, high = np.min(template_positions[:, axis]), np.max(template_positions[:, axis])
+        region_low, region_high = np.percentile(region_positions[:, axis], [0, 100])
+        scale = (region_high - region_low) / (high - low) if high > low else 0.0
+        scale *= parameters["spot_directions"][axis]
+        transform[axis] = [scale, (region_low + region_high) / 2 - scale * (low + high) / 2]
+    return transform
+
+
+def _shift_1d(template_values, region_values):
+    ## Shift that lines up the most template positions with regions, from a histogram of the differences between all of them in 1 mm bins
+    differences = (region_values[None, :] - template_values[:, None]).ravel()
+    histogram, edges = np.histogram(differences, bins=max(int(np.ptp(differences)), 1))
+    center = (edges[np.argmax(histogram)] + edges[np.argmax(histogram) + 1]) / 2
+    close = differences[np.abs(differences - center) <= 1]
+    return float(np.median(close)) if len(close) else float(center)
+
+
+def _match_nearest(predicted, region_positions, gate):
+    ## {sample index: (region index, distance)}, closest pairs first, each region and sample used once
+    distances = np.hypot(predicted[:, None, 0] - region_positions[None, :, 0], predicted[:, None, 1] - region_positions[None, :, 1])
+    distances[~np.isfinite(distances)] = np.inf
+    pairs = {}
+    regions_used = set()
+    for flat in np.argsort(distances, axis=None):
+        indexSample, indexRegion = divmod(int(flat), distances.shape[1])
+        if not distances[indexSample, indexRegion] <= min(gate, np.finfo(float).max):
+            break
+        if indexSample in pairs or indexRegion in regions_used:
+            continue
+        pairs[indexSample] = (indexRegion, float(distances[indexSample, indexRegion]))
+        regions_used.add(indexRegion)
+    return pairs
+
+
+def _fit_transform(template_positions, region_positions, pairs, kind, transform):
+    ## Least squares scale and shift on each axis from the matched pairs.  The image layout is only shifted, and an axis with one template value keeps its scale.
+    if not pairs:
+        return transform
+    samples, regions = zip(*((indexSample, indexRegion) for indexSample, (indexRegion, _) in pairs.items()))
+    transform_new = transform.copy()
+    for axis in (0, 1):
+        template_values = template_positions[list(samples), axis]
+        region_values = region_positions[list(regions), axis]
+        if kind == "image" or np.ptp(template_values) == 0 or len(template_values) < 3:
+            transform_new[axis, 1] = np.median(region_values - transform[axis, 0] * template_values)
+        else:
+            transform_new[axis] = np.polyfit(template_values, region_values, 1)
+    return transform_new
+
+
+def _opening(mask, size):
+    ## Erosion then dilation with a size x size square, from sums over an integral image
+    if size <= 1:
+        return mask
+    eroded = _box_sum(mask, size) == size * size
+    return _box_sum(eroded, size, shift=size - 1 - size // 2) > 0
+
+
+def _box_sum(mask, size, shift=None):
+    ## Number of True pixels in the size x size square around each pixel (starting shift pixels up and left)
+    shift = size // 2 if shift is None else shift
+    integral = np.zeros((mask.shape[0] + size, mask.shape[1] + size), dtype=np.int64)
+    integral[shift + 1 : shift + 1 + mask.shape[0], shift + 1 : shift + 1 + mask.shape[1]] = mask
+    integral = integral.cumsum(axis=0).cumsum(axis=1)
+    return integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
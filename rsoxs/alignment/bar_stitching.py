@@ -0,0 +1,250 @@
+## Stitches the sample imager pictures from image_bar into one image of the bar.
+## The size of the bar image is worked out from the imager positions first, so it is allocated once and each picture is copied into its place,
+## instead of concatenating onto a growing image for every picture.  A pyramid of 2x smaller copies is kept for fast panning and zooming,
+## and the pictures and pyramid can be saved to a chunked HDF5 file so the bar can be shown again without taking new pictures.
+## Only needs numpy (h5py to save and load), so it can be tested without the beamline.
+
+import time
+
+import numpy as np
+
+
+barStitch_Parameters_Default = {
+    "pixels_per_mm": 1760 / 25,  ## Sample imager, same as stitch_sample has always used
+    "pyramid_minimum": 256,  ## pixels.  The pyramid stops at the level whose shorter side would be smaller than this.
+    "display_width": 2048,  ## pixels.  The pyramid level shown is the smallest that has at least this many pixels across the visible part of the bar.
+    "chunk": 256,  ## pixels, chunk size of the images in the HDF5 file
+    "compression": "gzip",
+}
+
+## [left, right, bottom, top] in mm that stitch_sample shows the bar image with.  Clicked positions (and so ximg and yimg) are in these coordinates.
+barImage_Extent_Default = [-210, 25, -14.5, 14.5]
+
+
+def tile_offsets(positions, tile_shape, step_size=25, y_off=0, parameters=barStitch_Parameters_Default):
+    """
+    Works out where each picture goes in the bar image.
+
+    Pictures at larger positions go further left, step_size * pixels_per_mm pixels per step_size, same as stitch_sample.
+    Each picture is also shifted y_off pixels up or down per step_size, and the bar image is cropped to the rows all pictures cover.
+
+    Parameters
+    ----------
+    positions : array-like
+        Sample imager position (mm) of each picture, in the order they were taken
+    tile_shape : tuple
+        Shape of one picture
+    step_size : float
+        mm per step of the image_bar scan
+    y_off : int
+        pixels each picture is shifted vertically from the one before
+    parameters : dict
+
+    Returns
+    -------
+    rows : numpy array of int
+        First row of each picture that is in the bar image
+    columns : numpy array of int
+        Column of the bar image where each picture starts
+    shape : tuple
+        Shape of the bar image
+    """
+    positions = np.asarray(positions, dtype=float)
+    height, width = tile_shape[:2]
+    steps = (positions - positions[0]) / step_size
+    pixel_step = int(step_size * parameters["pixels_per_mm"])
+    columns = np.rint((steps.max() - steps) * pixel_step).astype(int)
+    shifts = np.rint(-y_off * steps).astype(int)
+    top = shifts.max()
+    rows = top - shifts
+    height_bar = height + shifts.min() - top
+    if height_bar <= 0:
+        raise ValueError("The pictures do not have any rows in common with y_off " + str(y_off))
+    return rows, columns, (int(height_bar), int(columns.max() + width)) + tuple(tile_shape[2:])
+
+
+def stitch_tiles(tiles, positions=None, step_size=25, y_off=0, blend=False, parameters=barStitch_Parameters_Default):
+    """
+    Stitches pictures into one image of the bar.
+
+    Without blend, a later picture covers the earlier ones where they overlap, which gives the same image as the old np.concatenate stitching.
+    With blend, overlaps fade linearly from one picture to the next, which hides differences in brightness between pictures.
+
+    Parameters
+    ----------
+    tiles : list of numpy arrays
+        Pictures, (rows, columns) or (rows, columns, colors), all the same shape
+    positions : array-like, optional
+        Sample imager position of each picture.  By default, the pictures are step_size apart.
+    step_size, y_off : see tile_offsets
+    blend : bool
+    parameters : dict
+
+    Returns
+    -------
+    numpy array, the same type as the pictures
+    """
+    if positions is None:
+        positions = step_size * np.arange(len(tiles))
+    tile_shape = np.shape(tiles[0])
+    rows, columns, shape = tile_offsets(positions, tile_shape, step_size, y_off, parameters)
+    height, width = shape[0], tile_shape[1]
+    image = np.zeros(shape, dtype=np.asarray(tiles[0]).dtype)
+    if blend:
+        ## Weight of each column of a picture, largest in the middle, and the sum of the weights placed so far in each column of the bar image
+        weights_tile = np.minimum(np.arange(1, width + 1), np.arange(width, 0, -1)).astype(np.float32)
+        weights_bar = np.zeros(shape[1], dtype=np.float32)
+    for tile, row, column in zip(tiles, rows, columns):
+        tile = np.asarray(tile)[row : row + height]
+        if not blend:
+            image[:, column : column + width] = tile
+            continue
+        ## Running weighted average, so only the columns that overlap pictures already placed need floating point
+        fraction = weights_tile / (weights_bar[column : column + width] + weights_tile)
+        overlapping = np.flatnonzero(fraction < 1)
+        if len(overlapping) == 0:
+            image[:, column : column + width] = tile
+        else:
+            low, high = overlapping[0], overlapping[-1] + 1
+            image[:, column : column + low] = tile[:, :low]
+            image[:, column + high : column + width] = tile[:, high:]
+            overlap = slice(column + low, column + high)
+            fraction_overlap = fraction[low:high].reshape((1, -1) + (1,) * (tile.ndim - 2))
+            mixed = image[:, overlap] + fraction_overlap * (tile[:, low:high] - image[:, overlap].astype(np.float32))
+            image[:, overlap] = np.rint(mixed) if np.issubdtype(image.dtype, np.integer) else mixed
+        weights_bar[column : column + width] += weights_tile
+    return image
+
+
+def build_pyramid(image, parameters=barStitch_Parameters_Default):
+    """
+    Returns [image, image 2x smaller, 4x smaller, ...], each level the average of 2 x 2 pixels of the one before (an odd last row or column is dropped).
+    """
+    pyramid = [image]
+    while min(pyramid[-1].shape[:2]) // 2 >= parameters["pyramid_minimum"]:
+        level = pyramid[-1]
+        height, width = level.shape[0] // 2, level.shape[1] // 2
+        ## Sums of pairs of rows, then of pairs of columns, in a wider type than the image, which is much faster than a mean over a reshaped array
+        if np.issubdtype(image.dtype, np.integer):
+            accumulator = np.uint16 if image.dtype == np.uint8 else np.int64
+        else:
+            accumulator = np.float64
+        rows = np.add(level[0 : 2 * height : 2], level[1 : 2 * height : 2], dtype=accumulator)
+        total = np.add(rows[:, 0 : 2 * width : 2], rows[:, 1 : 2 * width : 2])
+        pyramid.append((total / 4 if accumulator is np.float64 else (total + 2) // 4).astype(image.dtype))
+    return pyramid
+
+
+def pyramid_level(pyramid, fraction_visible=1.0, parameters=barStitch_Parameters_Default):
+    ## Index of the smallest level that still has display_width pixels across the visible fraction of the bar
+    for index in range(len(pyramid) - 1, -1, -1):
+        if pyramid[index].shape[1] * fraction_visible >= parameters["display_width"]:
+            return index
+    return 0
+
+
+def show_pyramid(ax, pyramid, extent, parameters=barStitch_Parameters_Default):
+    """
+    Shows the bar image on matplotlib axes at a pyramid level that suits the zoom, and switches levels when the axes are zoomed or panned.
+    Data coordinates come from extent, so clicks give the same positions at any level.
+    """
+    level = pyramid_level(pyramid, 1.0, parameters)
+    artist = ax.imshow(pyramid[level], extent=extent)
+    width_full = abs(extent[1] - extent[0])
+
+    def zoomed(ax):
+        nonlocal level
+        left, right = ax.get_xlim()
+        level_new = pyramid_level(pyramid, min(abs(right - left) / width_full, 1.0), parameters)
+        if level_new != level:
+            level = level_new
+            artist.set_data(pyramid[level])
+
+    ax.callbacks.connect("xlim_changed", zoomed)
+    return artist
+
+
+def save_bar_images(path, tiles, positions, step_size=25, y_off=0, blend=False, pyramid=None, parameters=barStitch_Parameters_Default):
+    """
+    Saves the pictures, their positions, and the pyramid (made from the pictures if not given) to an HDF5 file, in chunks so a part can be read on its own.
+    Returns the pyramid.
+    """
+    import h5py
+
+    tiles = np.asarray(tiles)
+    if pyramid is None:
+        pyramid = build_pyramid(stitch_tiles(tiles, positions, step_size, y_off, blend, parameters), parameters)
+    chunk = parameters["chunk"]
+    with h5py.File(path, "w") as file:
+        file.attrs.update(step_size=step_size, y_off=y_off, blend=blend, pixels_per_mm=parameters["pixels_per_mm"], date=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        file.create_dataset("positions", data=np.asarray(positions, dtype=float))
+        file.create_dataset(
+            "tiles", data=tiles, chunks=(1, min(chunk, tiles.shape[1]), min(chunk, tiles.shape[2])) + tiles.shape[3:], compression=parameters["compression"]
+        )
+        for index, level in enumerate(pyramid):
+            file.create_dataset(
+                "pyramid/" + str(index),
+                data=level,
+                chunks=(min(chunk, level.shape[0]), min(chunk, level.shape[1])) + level.shape[2:],
+                compression=parameters["compression"],
+            )
+    return pyramid
+
+
+def load_bar_images(path, tiles=False):
+    """
+    Reads a file written by save_bar_images.  Returns a dict with "pyramid" (list of arrays), "positions", the stitching settings, and "tiles" if asked for.
+    """
+    import h5py
+
+    with h5py.File(path, "r") as file:
+        loaded = dict(file.attrs)
+        loaded["positions"] = file["positions"][()]
+        loaded["pyramid"] = [file["pyramid/" + str(index)][()] for index in range(len(file["pyramid"]))]
+        if tiles:
+            loaded["tiles"] = file["tiles"][()]
+    return loaded
+
+
+def _stitch_concatenate(tiles, step_size=25, y_off=0, parameters=barStitch_Parameters_Default):
+    ## The old stitch_sample loop, kept to compare against in benchmark_bar_stitching
+    pixel_step = int(step_size * parameters["pixels_per_mm"])
+    pixel_overlap = np.shape(tiles[0])[1] - pixel_step
+    result = tiles[0]
+    i = 0
+    for image in tiles[1:]:
+        i += 1
+        if y_off > 0:
+            result = np.concatenate((image[(y_off * i) :, :], result[:-(y_off), pixel_overlap:]), axis=1)
+        elif y_off < 0:
+            result = np.concatenate((image[: (y_off * i), :], result[-(y_off):, pixel_overlap:]), axis=1)
+        else:
+            result = np.concatenate((image[:, :], result[:, pixel_overlap:]), axis=1)
+    return result
+
+
+def benchmark_bar_stitching(number_tiles=9, tile_shape=(2056, 2464, 3), step_size=25, y_off=-6, repeats=3):
+    """
+    Compares the old np.concatenate stitching with stitch_tiles on pictures the size of the sample imager's, and times the pyramid.
+    """
+    random = np.random.default_rng(0)
+    tiles = [random.integers(0, 256, tile_shape, dtype=np.uint8) for _ in range(number_tiles)]
+
+    def timed(function):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = function()
+        return (time.perf_counter() - start) / repeats, result
+
+    time_concatenate, image_concatenate = timed(lambda: _stitch_concatenate(tiles, step_size, y_off))
+    time_stitch, image_stitch = timed(lambda: stitch_tiles(tiles, None, step_size, y_off))
+    time_blend, _ = timed(lambda: stitch_tiles(tiles, None, step_size, y_off, blend=True))
+    time_pyramid, pyramid = timed(lambda: build_pyramid(image_stitch))
+
+    print(f"{number_tiles} pictures of {tile_shape}, bar image {image_stitch.shape}          time (ms)")
+    print(f"np.concatenate onto the growing image        {time_concatenate * 1e3:10.1f}")
+    print(f"preallocated                                 {time_stitch * 1e3:10.1f}")
+    print(f"preallocated, blended overlaps               {time_blend * 1e3:10.1f}")
+    print(f"pyramid, {len(pyramid)} levels                            {time_pyramid * 1e3:10.1f}")
+    print("same image as np.concatenate: " + str(np.array_equal(image_concatenate, image_stitch)))
+    return {"concatenate": time_concatenate, "stitch": time_stitch, "blend": time_blend, "pyramid": time_pyramid}
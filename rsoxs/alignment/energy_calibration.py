@@ -33,6 +33,8 @@ def calibrate_pgm_offsets(
     mirror_rb_off = 0,
     search_ratio = 30,
     scan_time = 30,
+    fit = "gaussian",
+    tolerance = 0.0001, ## Grating degrees.  Slower passes are skipped once the fitted peak is known this well.
 ):
     # RE(tune_pgm(cs=[1.35,1.37,1.385,1.4,1.425,1.45],ms=[1,1,1,1,1],energy=291.65,pol=90,k=250))
     # RE(tune_pgm(cs=[1.55,1.6,1.65,1.7,1.75,1.8],ms=[1,1,1,1,1],energy=291.65,pol=90,k=1200))
@@ -70,7 +72,9 @@ def calibrate_pgm_offsets(
             range_ratio=search_ratio,
             open_shutter=True,
             rb_offset=grating_rb_off,
-            stream=False
+            stream=False,
+            fit=fit,
+            tolerance=tolerance,
         )
         grating_measured.append(peaklist[0][signal][grating.name] - grating_rb_off )
         mirror_measured.append(mirror2.read()[mirror2.name]["value"] - mirror_rb_off)
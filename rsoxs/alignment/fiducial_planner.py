@@ -0,0 +1,237 @@
+## Plans the fly scans of find_fiducials.  Search windows start from the last stored fiducial positions when there are recent ones,
+## and the scans at each fiducial are ordered to keep stage travel short.  Results are kept with timestamps so correct_bar can be run again from them.
+## Does not import any hardware, so it can be tested without the beamline.
+
+import datetime
+import itertools
+import time
+
+
+## Same order as the list find_fiducials gives correct_bar
+fiducial_Names = ["af2y", "af2xm90", "af2x0", "af2x90", "af2x180", "af1y", "af1xm90", "af1x0", "af1x90", "af1x180"]
+fiducial_Angles = {"xm90": -90, "x0": 0, "x90": 90, "x180": 180}
+
+## Where to look without stored results, same as the find_fiducials defaults.  x is for each angle, in the order of fiducial_Angles.
+fiducial_Starts_Default = {
+    "af2": {"y": 2, "x": [3.5, -1, -2.4, 1.5]},  ## af2 first because it is a safer location
+    "af1": {"y": -187.5, "x": [2.0, -0.9, -1.5, 0.8]},
+}
+
+fiducialPlanner_Parameters_Default = {
+    "range_y": 2,  ## mm, full width of the y search without stored results
+    "range_x": 3.5,  ## mm, full width of the x search without stored results
+    "prior_width_y": 0.3,  ## mm, half width of the y search around a stored result
+    "prior_width_x": 0.5,  ## mm, half width of the x search around a stored result
+    "prior_sigmas": 5,  ## The half width is at least this many times the uncertainty of the stored result
+    "age_maximum": 14 * 24 * 3600,  ## s.  Older results are not used to start from.
+    "edge_margin": 0.1,  ## Fraction of the window.  A peak this close to the edge of a narrow window may be outside it, so it is searched again over the full range.
+    "angles_y": [0],  ## deg, angles the y scans can be done at.  Add 180 if the fiducials can also be found from the back, so the y scan of the second fiducial does not need to rotate back.
+    "velocity": 0.2,  ## mm/s during the scans
+    "speeds": {"x": 1.0, "y": 2.0, "th": 10.0},  ## mm/s or deg/s, rough stage speeds between scans, for ordering the scans
+    "scan_fixed": 8,  ## s per scan to open the run, settle, and open the shutter
+    "history_maximum": 50,  ## Stored results kept
+    "config_key": "fiducials",  ## Key in rsoxs_config
+}
+
+
+def plan_fiducial_scans(starts=fiducial_Starts_Default, stored=None, position=None, parameters=fiducialPlanner_Parameters_Default):
+    """
+    Returns the scans for find_fiducials in the order they should be run.
+
+    Each fiducial starts with its y scan, since the x scans are done at the y that is found.  The angle of the y scan (from angles_y) and the order of
+    the x scans are chosen to take the least time moving between scans (rotation is usually the slowest), starting from position.
+
+    Parameters
+    ----------
+    starts : dict
+        {"af2": {"y": y, "x": [x at -90, 0, 90, 180]}, "af1": ...}, in the order the fiducials are scanned
+    stored : dict, optional
+        A stored result (FiducialStore.latest).  Its positions are the centers of narrower windows.
+    position : dict, optional
+        {"x", "y", "th"} where the stage is now
+    parameters : dict
+
+    Returns
+    -------
+    list of dict with
+        "name": name in fiducial_Names, "fiducial": "af1" or "af2", "motor": "x" or "y"
+        "start", "stop", "center": scan range in motor units
+        "move": {"x", "y", "th"} to go to before the scan.  For x scans, y is the expected fiducial y, to be replaced by the y that is found.
+        "warm": whether the window comes from a stored result
+    """
+    positions_stored = stored["positions"] if stored else {}
+    uncertainties_stored = (stored.get("uncertainties") or {}) if stored else {}
+    position = position or {}
+    current = {axis: position.get(axis) for axis in ("x", "y", "th")}
+    scans = []
+    for fiducial, start in starts.items():
+        scans_x = []
+        for (suffix, angle), x_start in zip(fiducial_Angles.items(), start["x"]):
+            scans_x.append(_make_scan(fiducial + suffix, fiducial, "x", x_start, positions_stored, uncertainties_stored, parameters))
+        scan_y = _make_scan(fiducial + "y", fiducial, "y", start["y"], positions_stored, uncertainties_stored, parameters)
+        for scan_x, angle in zip(scans_x, fiducial_Angles.values()):
+            scan_x["move"] = {"x": scan_x["start"], "y": scan_y["center"], "th": angle}
+
+        ## The y scan comes first, at whichever allowed angle, then the x scans in the order that moves the least
+        orders = []
+        for angle_y in parameters["angles_y"]:
+            scan_x_at_angle = scans_x[list(fiducial_Angles.values()).index(angle_y)]
+            scan_y_at_angle = dict(scan_y, move={"x": scan_x_at_angle["center"], "y": scan_y["start"], "th": angle_y})
+            orders.extend([scan_y_at_angle] + list(scans_order) for scans_order in itertools.permutations(scans_x))
+        order = min(orders, key=lambda scans_order: _travel_time(current, scans_order, parameters))
+        scans.extend(order)
+        current = dict(order[-1]["move"], x=order[-1]["center"])
+    return scans
+
+
+def estimate_fiducial_time(scans, position=None, parameters=fiducialPlanner_Parameters_Default):
+    ## Time (seconds) to run scans, including moving between them
+    position = position or {}
+    current = {axis: position.get(axis) for axis in ("x", "y", "th")}
+    return _travel_time(current, scans, parameters) + sum(
+        parameters["scan_fixed"] + abs(scan["stop"] - scan["start"]) / parameters["velocity"] for scan in scans
+    )
+
+
+def cold_scan(scan, starts=fiducial_Starts_Default, parameters=fiducialPlanner_Parameters_Default):
+    ## The same scan over the full range around the default start, for when a narrow window missed the fiducial
+    fiducial = scan["fiducial"]
+    if scan["motor"] == "y":
+        center = starts[fiducial]["y"]
+    else:
+        center = starts[fiducial]["x"][list(fiducial_Angles).index(scan["name"][len(fiducial) :])]
+    scan_new = _make_scan(scan["name"], fiducial, scan["motor"], center, {}, {}, parameters)
+    scan_new["move"] = dict(scan["move"], **{scan["motor"]: scan_new["start"]})
+    return scan_new
+
+
+def peak_at_edge(scan, peak_position, parameters=fiducialPlanner_Parameters_Default):
+    """
+    Returns True if peak_position is within edge_margin of the ends of a scan that started from a stored result, so the fiducial may be outside the window.
+    """
+    if not scan["warm"]:
+        return False
+    low, high = sorted((scan["start"], scan["stop"]))
+    margin = parameters["edge_margin"] * (high - low)
+    return not low + margin <= peak_position <= high - margin
+
+
+def fiducial_list(record):
+    ## Positions of a stored result in the order correct_bar takes
+    return [record["positions"][name] for name in fiducial_Names]
+
+
+class FiducialStore:
+    """
+    Fiducial results with timestamps, kept as a list under parameters["config_key"] in config (rsoxs_config, or any dict for testing), newest last.
+    """
+
+    def __init__(self, config, parameters=fiducialPlanner_Parameters_Default):
+        self.config = config
+        self.parameters = parameters
+
+    def records(self):
+        return list(self.config.get(self.parameters["config_key"], None) or [])
+
+    def latest(self, age_maximum=None, now=None):
+        """
+        Returns the newest result that has all fiducials and is younger than age_maximum (seconds, parameters["age_maximum"] by default), or None.
+        """
+        age_maximum = self.parameters["age_maximum"] if age_maximum is None else age_maximum
+        now = time.time() if now is None else now
+        for record in reversed(self.records()):
+            if now - record["time"] <= age_maximum and all(name in record["positions"] for name in fiducial_Names):
+                return record
+        return None
+
+    def add(self, positions, uncertainties=None, configuration=None, warm_start=False, now=None):
+        """
+        Stores a result.  positions is {name: position} for fiducial_Names, or a list in that order.
+        """
+        if not isinstance(positions, dict):
+            positions = dict(zip(fiducial_Names, positions))
+        now = time.time() if now is None else now
+        record = {
+            "time": float(now),
+            "date": datetime.datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            "positions": {name: float(value) for name, value in positions.items()},
+            "uncertainties": {name: float(value) for name, value in (uncertainties or {}).items() if value is not None},
+            "configuration": configuration,
+            "warm_start": bool(warm_start),
+        }
+        ## The whole list is written back, so that redis stores it
+        self.config[self.parameters["config_key"]] = (self.records() + [record])[-self.parameters["history_maximum"] :]
+        return record
+
+    def differences(self, record, previous=None):
+        """
+        Returns {name: change} of each fiducial position from previous (by default, the result stored before record).
+        """
+        if previous is None:
+            records = [stored for stored in self.records() if stored["time"] < record["time"]]
+            if not records:
+                return {}
+            previous = records[-1]
+        return {
+            name: record["positions"][name] - previous["positions"][name]
+            for name in fiducial_Names
+            if name in record["positions"] and name in previous["positions"]
+        }
+
+
+def compare_fiducial_plans(starts=fiducial_Starts_Default, prior_error=0.05, parameters=fiducialPlanner_Parameters_Default):
+    """
+    Prints the estimated time of find_fiducials without stored results, in the old fixed order, and started from stored results in the planned order.
+    The stored results are the starting positions moved by prior_error (mm).
+    """
+    position = {"x": 0, "y": 0, "th": 0}
+    stored = {"positions": {}, "uncertainties": {}}
+    for fiducial, start in starts.items():
+        stored["positions"][fiducial + "y"] = start["y"] + prior_error
+        for suffix, x_start in zip(fiducial_Angles, start["x"]):
+            stored["positions"][fiducial + suffix] = x_start + prior_error
+    ## The old order: y, then -90, 0, 90, 180 at each fiducial
+    scans_old = []
+    for fiducial, start in starts.items():
+        scans_fiducial = plan_fiducial_scans({fiducial: start}, None, position, dict(parameters, angles_y=[0]))
+        scans_old.append(scans_fiducial[0])
+        scans_old.extend(sorted(scans_fiducial[1:], key=lambda scan: scan["move"]["th"]))
+    time_old = estimate_fiducial_time(scans_old, position, parameters)
+    time_cold = estimate_fiducial_time(plan_fiducial_scans(starts, None, position, parameters), position, parameters)
+    time_warm = estimate_fiducial_time(plan_fiducial_scans(starts, stored, position, parameters), position, parameters)
+    print(f"fixed order, full ranges       {time_old:8.1f} s")
+    print(f"planned order, full ranges     {time_cold:8.1f} s")
+    print(f"planned order, stored results  {time_warm:8.1f} s ({time_warm / time_old:.0%})")
+    return {"old": time_old, "cold": time_cold, "warm": time_warm}
+
+
+def _make_scan(name, fiducial, motor, start_default, positions_stored, uncertainties_stored, parameters):
+    if name in positions_stored:
+        center = positions_stored[name]
+        half_width = max(parameters["prior_width_" + motor], parameters["prior_sigmas"] * uncertainties_stored.get(name, 0.0))
+        half_width = min(half_width, parameters["range_" + motor] / 2)
+        warm = True
+    else:
+        center = start_default
+        half_width = parameters["range_" + motor] / 2
+        warm = False
+    return {"name": name, "fiducial": fiducial, "motor": motor, "start": center - half_width, "stop": center + half_width, "center": center, "warm": warm}
+
+
+def _move_time(current, target, parameters):
+    ## Motors move together, so the slowest one sets the time.  Unknown current positions count as no move.
+    times = [
+        abs(target[axis] - current[axis]) / parameters["speeds"][axis]
+        for axis in ("x", "y", "th")
+        if current.get(axis) is not None and target.get(axis) is not None
+    ]
+    return max(times, default=0.0)
+
+
+def _travel_time(current, scans, parameters):
+    total = 0.0
+    for scan in scans:
+        total += _move_time(current, scan["move"], parameters)
+        ## rsoxs_fly_max ends at the peak
+        current = dict(scan["move"], **{scan["motor"]: scan["center"]})
+    return total
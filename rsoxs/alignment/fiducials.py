@@ -16,6 +16,16 @@ from ..Functions.alignment import (
     rsoxs_config, 
     correct_bar
     )
+from .fiducial_planner import (
+    fiducialPlanner_Parameters_Default,
+    FiducialStore,
+    plan_fiducial_scans,
+    estimate_fiducial_time,
+    cold_scan,
+    peak_at_edge,
+    fiducial_list,
+    fiducial_Names,
+)
 
 
 ## For now, mostly pasting Eliot's fly_find-fiducials, but updating the fly_max function that is used for testing purposes
@@ -25,7 +35,21 @@ def find_fiducials(
         y1=-187.5, 
         y2=2,
         configuration = "WAXSNEXAFS",
+        fit = "gaussian",
+        warm_start = True,
+        apply = True,
+        training_wheels = True,
+        parameters = fiducialPlanner_Parameters_Default,
         ):
+    """
+    Finds the x positions of both fiducials at -90, 0, 90, and 180 degrees and their y positions, stores them, and corrects the bar with them.
+
+    With warm_start, the search windows are centered on the last stored results (if they are recent enough) instead of covering the full ranges,
+    and a fiducial found at the edge of a narrow window is searched again over the full range.  The scans are run in the order that moves the stage the least
+    (see fiducial_planner.plan_fiducial_scans).  f2, f1, y1, and y2 are where to look without stored results.
+
+    Results are stored with timestamps in rsoxs_config (see correct_bar_from_fiducials).  With apply, correct_bar is run right away, without asking.
+    """
     
     ## TODO: make more robust and automated
     if configuration == "WAXSNEXAFS":
@@ -35,10 +59,16 @@ def find_fiducials(
         detector = dm7_photodiode
         detector_name = "DM7 photodiode"
 
-    thoffset = 0
-    angles = [-90 + thoffset, 0 + thoffset, 90 + thoffset, 180 + thoffset]
-    xrange = 3.5
-    startxss = [f2, f1]
+    motors = {"x": sam_X, "y": sam_Y}
+    starts = {"af2": {"y": y2, "x": list(f2)}, "af1": {"y": y1, "x": list(f1)}}  # af2 first because it is a safer location
+    store = FiducialStore(rsoxs_config, parameters)
+    stored = store.latest() if warm_start else None
+    if stored is not None:
+        print(f"Starting from the fiducials found {stored['date']}")
+    position = {"x": (yield from bps.rd(sam_X)), "y": (yield from bps.rd(sam_Y)), "th": (yield from bps.rd(sam_Th))}
+    scans = plan_fiducial_scans(starts, stored, position, parameters)
+    print(f"{len(scans)} fiducial scans, estimated {estimate_fiducial_time(scans, position, parameters):.0f} s")
+
     yield from bps.mv(shutter_enable, 0)
     yield from bps.mv(shutter_control, 0)
     ## January 2026 - No WAXS beamstop
@@ -47,47 +77,66 @@ def find_fiducials(
     yield from load_configuration(configuration)
     detector.kind = "hinted"
     # bec.enable_plots()
-    startys = [y2, y1]  # af2 first because it is a safer location
-    maxlocs = []
-    for startxs, starty in zip(startxss, startys):
-        yield from bps.mv(sam_Y, starty, sam_X, startxs[1], sam_Th, 0, sam_Z, 0)
-        peaklist = []
-        yield from rsoxs_fly_max(
-            [detector], #[beamstop_waxs],
-            sam_Y,
-            starty - 1,
-            starty + 1,
-            velocities=[0.2],
-            period = 0.5, ## Gives similar point density as Eliot's old fiducial scans.
-            open_shutter=True,
-            peaklist=peaklist,
-            stream=False,
-        )
-        maxlocs.append(peaklist[-1][detector_name][sam_Y.name]) #maxlocs.append(peaklist[-1]["WAXS Beamstop"][sam_Y.name])
-        yield from bps.mv(sam_Y, peaklist[-1][detector_name][sam_Y.name]) #yield from bps.mv(sam_Y, peaklist[-1]["WAXS Beamstop"][sam_Y.name])
-        for startx, angle in zip(startxs, angles):
-            yield from bps.mv(sam_X, startx, sam_Th, angle)
-            yield from bps.mv(shutter_control, 1)
-            peaklist = []
-            yield from rsoxs_fly_max(
-                [detector], #[beamstop_waxs],
-                sam_X,
-                startx - 0.5 * xrange,
-                startx + 0.5 * xrange,
-                velocities=[0.2],
-                period = 0.5,
-                open_shutter=True,
-                peaklist=peaklist,
-            )
-            maxlocs.append(peaklist[-1][detector_name][sam_X.name]) #maxlocs.append(peaklist[-1]["WAXS Beamstop"][sam_X.name])
-    
-    
+    positions = {}
+    uncertainties = {}
+    for scan in scans:
+        move = dict(scan["move"])
+        if scan["motor"] == "x":
+            move["y"] = positions[scan["fiducial"] + "y"]  ## x scans are done at the y that was found
+        peak = yield from _fly_fiducial(scan, move, motors, detector, detector_name, fit, parameters["velocity"])
+        if peak_at_edge(scan, peak[motors[scan["motor"]].name], parameters):
+            print(f"{scan['name']} found at the edge of the window around the stored result, searching the full range")
+            scan = cold_scan(scan, starts, parameters)
+            peak = yield from _fly_fiducial(scan, dict(move, **{scan["motor"]: scan["start"]}), motors, detector, detector_name, fit, parameters["velocity"])
+        positions[scan["name"]] = peak[motors[scan["motor"]].name]
+        uncertainties[scan["name"]] = peak.get("fit", {}).get("uncertainty")
+        if scan["motor"] == "y":
+            yield from bps.mv(sam_Y, positions[scan["name"]])
+
+    record = store.add(positions, uncertainties, configuration=configuration, warm_start=stored is not None)
+    maxlocs = fiducial_list(record)
     print(maxlocs)  # [af2y,af2xm90,af2x0,af2x90,af2x180,af1y,af1xm90,af1x0,af1x90,af1x180]
-    accept = input(f"Do you want to apply this correction (y,n)?")
-    if accept in ["y", "Y", "yes"]:
-        back = False
-        for samp in rsoxs_config["bar"]:
-            if samp["front"] == False:
-                back = True
-        correct_bar(maxlocs, include_back=back)
+    differences = store.differences(record)
+    if differences:
+        print("Change from the last fiducials: " + ", ".join(f"{name} {differences[name]:+.3f}" for name in fiducial_Names))
+    if apply:
+        correct_bar_from_fiducials(record, training_wheels=training_wheels)
     # bec.disable_plots()
+    return record
+
+
+def _fly_fiducial(scan, move, motors, detector, detector_name, fit, velocity):
+    ## One fly scan of a fiducial.  Returns the peak (the signal dict of rsoxs_fly_max for detector).
+    yield from bps.mv(sam_X, move["x"], sam_Y, move["y"], sam_Th, move["th"], sam_Z, 0)
+    if scan["motor"] == "x":
+        yield from bps.mv(shutter_control, 1)
+    peaklist = []
+    yield from rsoxs_fly_max(
+        [detector], #[beamstop_waxs],
+        motors[scan["motor"]],
+        scan["start"],
+        scan["stop"],
+        velocities=[velocity],
+        period = 0.5, ## Gives similar point density as Eliot's old fiducial scans.
+        open_shutter=True,
+        peaklist=peaklist,
+        fit=fit,
+        **({"stream": False} if scan["motor"] == "y" else {}),
+    )
+    return peaklist[-1][detector_name]
+
+
+def correct_bar_from_fiducials(record=None, training_wheels=True):
+    """
+    Runs correct_bar with stored fiducials (by default, the newest), e.g., after loading the bar again from a spreadsheet.
+    """
+    if record is None:
+        record = FiducialStore(rsoxs_config).latest(age_maximum=float("inf"))
+        if record is None:
+            raise ValueError("No stored fiducials.  Run find_fiducials first.")
+    back = False
+    for samp in rsoxs_config["bar"]:
+        if samp["front"] == False:
+            back = True
+    correct_bar(fiducial_list(record), include_back=back, training_wheels=training_wheels)
+    print(f"Corrected the bar with the fiducials found {record['date']}")
@@ -1,9 +1,11 @@
 from nbs_bl.plans.maximizers import fly_max
-from bluesky.preprocessors import finalize_wrapper
+from bluesky.preprocessors import finalize_wrapper, subs_wrapper
 import bluesky.plan_stubs as bps
 from nbs_bl.hw import shutter_control, shutter_enable, shutter_y
 import numpy as np
 
+from .peak_fitting import fit_peak
+
 
 def rsoxs_fly_max(
     detectors,
@@ -19,6 +21,8 @@ def rsoxs_fly_max(
     end_on_max=True,
     md=None,
     rb_offset=0,
+    fit=None,
+    tolerance=None,
     **kwargs,
 ):
     r"""
@@ -66,6 +70,11 @@ def rsoxs_fly_max(
         metadata
     time_offsets : dict, optional
         stream names time offsets dictionary in seconds
+    fit : str, optional
+        "centroid", "quadratic", "gaussian", or "lorentzian" to use the fitted peak position (see peak_fitting.fit_peak) instead of the largest reading.
+        The fit of each pass is in signal_dict[max_channel[0]]["fit"] and in the metadata of the next pass, and the next pass is centered on it.
+    tolerance : float, optional
+        With fit, stop before the remaining velocities once the uncertainty of the peak position is below tolerance (motor units)
     **kwargs : dict, optional
         additional arguments to pass to fly_scan
 
@@ -90,6 +99,9 @@ def rsoxs_fly_max(
         "plan_name": "fly_max",
         "hints": {},
     }
+    if fit is not None:
+        _md["plan_args"].update(fit=fit, tolerance=tolerance)
+        _md["peak_fits"] = []  ## Fits of the passes before this one
     _md.update(md or {})
     try:
         dimensions = [(motor.hints["fields"], "primary")]
@@ -117,23 +129,37 @@ def rsoxs_fly_max(
             #yield from bps.mv(shutter_y, 26) ## Shutter mechanism physically lets beam pass rather than the piezo portion
             yield from bps.mv(shutter_enable, 0)
             yield from bps.mv(shutter_control, 1)
-            
+        
+        readings = {motor_signal: [], max_channel[0]: []}
         signal_dict = yield from finalize_wrapper(
-            fly_max(
-                detectors,
-                motor,
-                start,
-                stop,
-                velocity,
-                md=_md,
-                max_channel=max_channel,
-                end_on_max=False,
-                **kwargs,
+            subs_wrapper(
+                fly_max(
+                    detectors,
+                    motor,
+                    start,
+                    stop,
+                    velocity,
+                    md=_md,
+                    max_channel=max_channel,
+                    end_on_max=False,
+                    **kwargs,
+                ),
+                _record_primary(readings),
             ),
             _cleanup(),
         )
         print(signal_dict)
         print(f"maximum signal of {max_channel[0]} found at {signal_dict[max_channel[0]][motor_signal]}")
+        if fit is not None and len(readings[motor_signal]) > 0:
+            peak_fit = fit_peak(readings[motor_signal], readings[max_channel[0]], method=fit, invert=kwargs.get("invert", False))
+            peak_fit["velocity"] = velocity
+            signal_dict[max_channel[0]]["fit"] = peak_fit
+            signal_dict[max_channel[0]][motor_signal] = peak_fit["position"]
+            _md = dict(_md, peak_fits=_md["peak_fits"] + [peak_fit])
+            print(f"{peak_fit['method']} peak of {max_channel[0]} at {peak_fit['position']} +/- {peak_fit['uncertainty']}")
+            if tolerance is not None and peak_fit["uncertainty"] < tolerance:
+                print(f"Peak position is within the tolerance of {tolerance}, skipping the remaining velocities")
+                break
         low_side = max((min_val, signal_dict[max_channel[0]][motor_signal] - (range / (2 * range_ratio))))
         high_side = min((max_val, signal_dict[max_channel[0]][motor_signal] + (range / (2 * range_ratio))))
         if snake:
@@ -149,3 +175,22 @@ def rsoxs_fly_max(
     # bec.disable_plots
     peaklist.append(signal_dict) ## PK: adding to match Eliot's code
     return signal_dict
+
+
+def _record_primary(readings):
+    ## Callback that keeps the readings of the primary stream for the keys in readings
+    descriptors_primary = set()
+
+    def callback(name, doc):
+        if name == "descriptor" and doc.get("name") == "primary":
+            descriptors_primary.add(doc["uid"])
+        elif name == "event" and doc["descriptor"] in descriptors_primary:
+            if all(key in doc["data"] for key in readings):
+                for key in readings:
+                    readings[key].append(doc["data"][key])
+        elif name == "event_page" and doc["descriptor"] in descriptors_primary:
+            if all(key in doc["data"] for key in readings):
+                for key in readings:
+                    readings[key].extend(doc["data"][key])
+
+    return callback
@@ -0,0 +1,193 @@
+## Peak position from a fly scan pass, more precise than the position of the largest reading.
+## Used by fly_alignment.rsoxs_fly_max.  Only needs numpy, so it can be tested without the beamline.
+
+import numpy as np
+
+
+peakFit_Methods = ["maximum", "centroid", "quadratic", "gaussian", "lorentzian"]
+
+peakFit_Parameters_Default = {
+    "fraction": 0.5,  ## Fits use the points around the maximum that are above this fraction of the peak height
+    "points_minimum": 5,  ## Fewer points than this around the maximum, and the fit uses the nearest points anyway
+    "baseline_percentile": 10,
+}
+
+
+def fit_peak(positions, values, method="gaussian", invert=False, parameters=peakFit_Parameters_Default):
+    """
+    Finds the position of a peak in a scan.
+
+    Parameters
+    ----------
+    positions, values : array-like
+        Motor positions and signal readings, in any order
+    method : str
+        "maximum": the position of the largest reading (what fly_max gives)
+        "centroid": average position weighted by the signal above the baseline
+        "quadratic": vertex of a parabola fit around the maximum
+        "gaussian": fit of a Gaussian (a parabola in the log of the signal above the baseline)
+        "lorentzian": fit of a Lorentzian (a parabola in 1 / the signal above the baseline)
+    invert : bool
+        Find a minimum (dip) instead of a maximum
+    parameters : dict
+
+    Returns
+    -------
+    dict with
+        "method": the method used.  Falls back to "maximum" if the fit does not describe a peak.
+        "position", "uncertainty": peak position and its standard uncertainty, in motor units
+        "height": peak height above the baseline (negative for a dip), "width": full width at half maximum, "baseline"
+        "position_maximum": position of the largest reading
+        "number_points": number of readings used
+    """
+    if method not in peakFit_Methods:
+        raise ValueError("Peak fit method must be one of " + str(peakFit_Methods))
+    positions = np.asarray(positions, dtype=float)
+    values = np.asarray(values, dtype=float)
+    valid = np.isfinite(positions) & np.isfinite(values)
+    order = np.argsort(positions[valid], kind="stable")
+    positions, values = positions[valid][order], values[valid][order]
+    if len(positions) == 0:
+        raise ValueError("No readings to fit")
+    sign = -1 if invert else 1
+    values = sign * values
+
+    baseline = np.percentile(values, parameters["baseline_percentile"])
+    signal = values - baseline
+    index_maximum = int(np.argmax(signal))
+    noise = _estimate_noise(values)
+    step = np.median(np.diff(positions)) if len(positions) > 1 else 0.0
+    ## Any reading within noise of the largest one could have been the largest
+    near_maximum = positions[signal >= signal[index_maximum] - 2 * noise]
+    result = {
+        "method": "maximum",
+        "position": float(positions[index_maximum]),
+        "uncertainty": float(max(abs(step) / np.sqrt(12), np.ptp(near_maximum) / 2)) if step else np.inf,
+        "height": float(sign * signal[index_maximum]),
+        "width": np.nan,
+        "baseline": float(sign * baseline),
+        "position_maximum": float(positions[index_maximum]),
+        "number_points": 1,
+    }
+    if method == "maximum" or signal[index_maximum] <= 0:
+        return result
+
+    region = _peak_region(signal, index_maximum, parameters)
+    x, y = positions[region], signal[region]
+    if len(x) < 3 or np.ptp(x) == 0:
+        return result
+
+    if method == "centroid":
+        weights = np.clip(y, 0, None)
+        position = float(np.sum(weights * x) / np.sum(weights))
+        uncertainty = noise * np.sqrt(np.sum((x - position) ** 2)) / np.sum(weights)
+        ## Which readings are in the region also depends on the noise, so add how much the centroid moves with the region
+        positions_regions = []
+        for fraction in (parameters["fraction"] - 0.1, parameters["fraction"] + 0.1):
+            region_other = _peak_region(signal, index_maximum, dict(parameters, fraction=fraction))
+            weights_other = np.clip(signal[region_other], 0, None)
+            positions_regions.append(np.sum(weights_other * positions[region_other]) / np.sum(weights_other))
+        uncertainty = np.sqrt(uncertainty**2 + np.var(positions_regions + [position]))
+        width = 2 * np.sqrt(2 * np.log(2) * np.sum(weights * (x - position) ** 2) / np.sum(weights))
+        fit = {"position": position, "uncertainty": uncertainty, "height": float(np.max(y)), "width": width}
+    elif method == "quadratic":
+        fit = _fit_parabola(x, y, np.full(len(y), 1 / max(noise, 1e-12) ** 2))
+        if fit is not None:
+            center, coefficients = fit.pop("center"), fit.pop("coefficients")
+            height = _evaluate_parabola(coefficients, center, fit.pop("center_x"), fit.pop("scale_x"))
+            fit.update(position=center, height=height, width=np.nan)
+    else:
+        positive = y > 0
+        x, y = x[positive], y[positive]
+        if len(x) < 3:
+            return result
+        if method == "gaussian":
+            ## ln(y) is a parabola.  The uncertainty of ln(y) is noise / y.
+            fit = _fit_parabola(x, np.log(y), (y / max(noise, 1e-12)) ** 2)
+            if fit is not None:
+                a = fit["coefficients"][0] / fit["scale_x"] ** 2
+                width_sigma = np.sqrt(-1 / (2 * a))
+                height = np.exp(_evaluate_parabola(fit["coefficients"], fit["center"], fit["center_x"], fit["scale_x"]))
+                fit = {"position": fit["center"], "uncertainty": fit["uncertainty"], "height": height, "width": 2 * np.sqrt(2 * np.log(2)) * width_sigma}
+        else:
+            ## 1 / y is an upward parabola.  The uncertainty of 1 / y is noise / y**2.
+            fit = _fit_parabola(x, -1 / y, (y**2 / max(noise, 1e-12)) ** 2)
+            if fit is not None:
+                a = fit["coefficients"][0] / fit["scale_x"] ** 2
+                height = -1 / _evaluate_parabola(fit["coefficients"], fit["center"], fit["center_x"], fit["scale_x"])
+                fit = {"position": fit["center"], "uncertainty": fit["uncertainty"], "height": height, "width": 2 * np.sqrt(1 / (-a * height))}
+    ## A fit whose peak is outside the readings it used does not describe this peak
+    if fit is None or not np.isfinite(fit["position"]) or not x[0] <= fit["position"] <= x[-1]:
+        return result
+    result.update(
+        method=method,
+        position=float(fit["position"]),
+        uncertainty=float(fit["uncertainty"]),
+        height=float(sign * fit["height"]),
+        width=float(fit["width"]),
+        number_points=int(len(x)),
+    )
+    return result
+
+
+def _estimate_noise(values):
+    ## Standard deviation of the noise from differences of neighboring readings, which mostly cancel the peak itself
+    if len(values) < 3:
+        return 0.0
+    differences = np.diff(values)
+    return float(1.4826 * np.median(np.abs(differences - np.median(differences))) / np.sqrt(2))
+
+
+def _peak_region(signal, index_maximum, parameters):
+    ## Contiguous readings around the maximum above fraction of its height, widened to points_minimum if there are too few
+    threshold = parameters["fraction"] * signal[index_maximum]
+    low = index_maximum
+    while low > 0 and signal[low - 1] >= threshold:
+        low -= 1
+    high = index_maximum
+    while high < len(signal) - 1 and signal[high + 1] >= threshold:
+        high += 1
+    while high - low + 1 < parameters["points_minimum"] and (low > 0 or high < len(signal) - 1):
+        if low > 0:
+            low -= 1
+        if high < len(signal) - 1 and high - low + 1 < parameters["points_minimum"]:
+            high += 1
+    return slice(low, high + 1)
+
+
+def _fit_parabola(x, y, weights):
+    ## Weighted least squares y = a x^2 + b x + c in scaled x.  Returns None unless the parabola opens downward.
+    center_x = x.mean()
+    scale_x = max(np.ptp(x) / 2, 1e-12)
+    xs = (x - center_x) / scale_x
+    matrix = np.vander(xs, 3)
+    weights = np.asarray(weights, dtype=float)
+    normal = matrix.T @ (weights[:, None] * matrix)
+    try:
+        covariance = np.linalg.inv(normal)
+    except np.linalg.LinAlgError:
+        return None
+    coefficients = covariance @ (matrix.T @ (weights * y))
+    a, b, _ = coefficients
+    if a >= 0:
+        return None
+
+    ## Scale the covariance by the reduced chi-squared, so the uncertainty also covers a peak shape that does not quite match
+    degrees_of_freedom = len(y) - 3
+    if degrees_of_freedom > 0:
+        chi_squared_reduced = np.sum(weights * (y - matrix @ coefficients) ** 2) / degrees_of_freedom
+        covariance = covariance * max(chi_squared_reduced, 1.0)
+    center_scaled = -b / (2 * a)
+    gradient = np.array([b / (2 * a**2), -1 / (2 * a), 0.0])
+    variance = max(float(gradient @ covariance @ gradient), 0.0)
+    return {
+        "center": float(center_x + scale_x * center_scaled),
+        "uncertainty": float(scale_x * np.sqrt(variance)),
+        "coefficients": coefficients,
+        "center_x": center_x,
+        "scale_x": scale_x,
+    }
+
+
+def _evaluate_parabola(coefficients, x, center_x, scale_x):
+    return float(np.polyval(coefficients, (x - center_x) / scale_x))
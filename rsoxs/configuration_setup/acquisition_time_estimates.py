@@ -0,0 +1,150 @@
+## Estimates how long acquisitions take, without moving anything.
+## Used by run_acquisitions_queue (printed before the queue starts, and per acquisition during a dry run) and can be called from a GUI to plan a queue.
+
+import datetime
+
+from ..plans.energy_grids import get_energy_grid
+from ..plans.energy_fly import estimate_fly_time, get_fly_speed
+from .queue_scheduler import get_acquisition_states, transition_cost
+
+
+## Estimated time (seconds) for the parts of an acquisition that are not exposures
+timeEstimateOverheads_Default = {
+    "scan_fixed": 5,  ## Opening a run, setting up detectors, etc., same as nbs-bl's gscan_estimate
+    "point_nexafs": 0.2,  ## Per energy point, same as add_to_plan_time_dict(nexafs, ...)
+    "point_rsoxs": 1.0,  ## Per energy point with the 2D detector, same as add_to_plan_time_dict(rsoxs, ...)
+    "point_spiral": 1.5,  ## Per spiral position: sample move and 2D detector readout
+    "exposure_count": 0.5,  ## Per exposure in a time scan
+    "exposure_count_2D": 1.0,  ## Per exposure in a time2D scan
+    "rotation": 20,  ## rotate_now, per angle
+    "polarization": 15,  ## Changing polarization within an acquisition
+}
+
+
+def estimate_acquisition_time(acquisition, overheads=timeEstimateOverheads_Default):
+    """
+    Returns the estimated time (seconds) to run one acquisition, not counting the time to move to it from the previous acquisition.
+    Works on sanitized acquisitions as well as rows straight from a spreadsheet, using the defaults for anything that is missing.
+    """
+    sample_angles = _listify(acquisition.get("sample_angles"), default=[0])
+    polarizations = _listify(acquisition.get("polarizations"), default=[0])
+    exposure_time = _number(acquisition.get("exposure_time"), default=1)
+    exposures_per_energy = _number(acquisition.get("exposures_per_energy"), default=1)
+    scan_type = acquisition.get("scan_type")
+
+    if scan_type in ("time", "time2D"):
+        overhead_exposure = overheads["exposure_count_2D" if scan_type == "time2D" else "exposure_count"]
+        time_scan = overheads["scan_fixed"] + exposures_per_energy * (exposure_time + overhead_exposure)
+    elif scan_type == "spiral":
+        step_size, width_x, width_y = _listify(acquisition.get("spiral_dimensions"), default=[0.3, 1.8, 1.8])
+        number_points = (round(width_x / step_size) + 1) * (round(width_y / step_size) + 1)  ## Same as spiral_scan
+        time_scan = overheads["scan_fixed"] + number_points * (exposures_per_energy * exposure_time + overheads["point_spiral"])
+    elif scan_type in ("nexafs", "rsoxs"):
+        number_points = count_energy_points(acquisition.get("energy_list_parameters"))
+        overhead_point = overheads["point_rsoxs" if scan_type == "rsoxs" else "point_nexafs"]
+        time_sweep = overheads["scan_fixed"] + number_points * (exposures_per_energy * exposure_time + overhead_point)
+        cycles = int(_number(acquisition.get("cycles"), default=0))
+        time_scan = time_sweep * (1 if cycles == 0 else 2 * cycles)  ## Each cycle is an ascending and a descending sweep
+    elif scan_type == "nexafs_fly":
+        try:
+            energy_grid = get_energy_grid(acquisition.get("energy_list_parameters"))
+            time_sweep = estimate_fly_time(energy_grid, get_fly_speed(energy_grid, exposures_per_energy * exposure_time))
+        except ValueError:
+            time_sweep = 0
+        cycles = int(_number(acquisition.get("cycles"), default=0))
+        time_scan = time_sweep * (1 if cycles == 0 else 2 * cycles)
+    else:
+        time_scan = 0
+
+    time_angles = 0 if sample_angles == ["Do not rotate"] else overheads["rotation"] * len(sample_angles)
+    time_polarizations = 0
+    if acquisition.get("configuration_instrument") != "NoBeam" and len(polarizations) > 1:
+        ## Polarizations are looped over for every angle, so the polarization changes at every step except the first
+        time_polarizations = overheads["polarization"] * (len(sample_angles) * len(polarizations) - 1)
+
+    return time_angles + time_polarizations + len(sample_angles) * len(polarizations) * time_scan
+
+
+def estimate_queue_time(queue, overheads=timeEstimateOverheads_Default, cost_function=None, state_initial=None, position_function=None):
+    """
+    Estimates the time for a queue of acquisitions, run in the order given.
+
+    The time between acquisitions (configuration, grating, polarization, energy, and sample changes) uses the same cost model as the queue scheduler.
+    With position_function (see queue_scheduler.get_acquisition_states), sample moves between acquisitions are estimated from the cached sample positions.
+
+    Returns
+    -------
+    dict with
+        "acquisitions": estimated time (seconds) of each acquisition, including the change from the previous acquisition
+        "transitions": part of the above spent changing the instrument between acquisitions
+        "total": estimated time (seconds) of the whole queue
+    """
+    if cost_function is None:
+        cost_function = transition_cost
+    times_acquisitions = []
+    times_transitions = []
+    state = state_initial or {}
+    for acquisition in queue:
+        stateStart, stateEnd = get_acquisition_states(acquisition, position_function=position_function)
+        time_transition = cost_function(state, stateStart)
+        times_transitions.append(time_transition)
+        times_acquisitions.append(time_transition + estimate_acquisition_time(acquisition, overheads=overheads))
+        state = stateEnd
+    return {"acquisitions": times_acquisitions, "transitions": times_transitions, "total": sum(times_acquisitions)}
+
+
+def estimate_configuration_time(configuration, sort_by=["priority"], overheads=timeEstimateOverheads_Default):
+    """
+    Estimates the time to run the acquisitions that are not finished yet in a configuration (e.g., a loaded spreadsheet), in the order run_acquisitions_queue would run them.
+    Intended for GUIs.  Returns the same dictionary as estimate_queue_time, plus the "queue" that was estimated.
+    """
+    from .configuration_load_save_sanitize import gatherAcquisitionsFromConfiguration, sortAcquisitionsQueue
+
+    queue = sortAcquisitionsQueue(gatherAcquisitionsFromConfiguration(configuration), sortBy=sort_by)
+    estimate = estimate_queue_time(queue, overheads=overheads)
+    estimate["queue"] = queue
+    return estimate
+
+
+def print_queue_time_estimate(estimate, time_start=None):
+    """
+    Prints the total estimated time of a queue and when it is expected to finish.
+    """
+    time_start = time_start or datetime.datetime.now()
+    time_finish = time_start + datetime.timedelta(seconds=estimate["total"])
+    print(
+        "Estimated queue time: " + format_duration(estimate["total"])
+        + " (" + format_duration(sum(estimate["transitions"])) + " changing the instrument between acquisitions).  "
+        + "Expected to finish around " + time_finish.strftime("%Y-%m-%d %H:%M")
+    )
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return str(hours) + " h " + str(minutes).zfill(2) + " min" if hours else str(minutes) + " min " + str(seconds).zfill(2) + " s"
+
+
+def count_energy_points(energy_parameters):
+    """
+    Returns the number of energies that nbs_energy_scan visits for energy_list_parameters (a name in energy_list_parameters, or a tuple of start, step, stop, step, stop...).
+    Parameters that cannot be scanned count as 0 points.
+    """
+    try:
+        return get_energy_grid(energy_parameters).number_points
+    except ValueError:
+        return 0
+
+
+def _listify(value, default):
+    if value is None or value == "":
+        return list(default)
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _number(value, default):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:  ## value != value for nan
+        return default
+    return value
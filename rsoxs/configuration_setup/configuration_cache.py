@@ -0,0 +1,128 @@
+## Cache of sanitized configurations loaded from spreadsheets, keyed by the content of the spreadsheet.
+## Reopening a spreadsheet that has not changed reads a JSON file instead of parsing and sanitizing the workbook again.
+## The key also includes the code that does the parsing and sanitizing and the configuration names that are allowed,
+## so cached results are not reused after either changes.
+
+import hashlib
+import json
+import os
+import uuid
+
+
+## Default location, can be changed with the RSOXS_SPREADSHEET_CACHE environment variable
+spreadsheetCache_Directory = os.environ.get(
+    "RSOXS_SPREADSHEET_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "rsoxs", "spreadsheets")
+)
+spreadsheetCache_MaximumFiles = 50
+
+## Modules whose contents determine the sanitized result of a spreadsheet
+_sanitizer_source_files = [
+    os.path.join(os.path.dirname(__file__), "configuration_load_save_sanitize.py"),
+    os.path.join(os.path.dirname(__file__), "configuration_schema.py"),
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "plans", "default_energy_parameters.py"),
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "plans", "energy_grids.py"),  ## configuration_schema checks energies with get_energy_grid
+]
+_sanitizer_hash = None
+
+
+def spreadsheet_cache_key(file_contents, configuration_names_allowed=()):
+    """
+    Returns the cache key for the bytes of a spreadsheet file.
+    configuration_names_allowed are the configuration_instrument values sanitization accepts, which change with add_configuration and remove_configuration.
+    """
+    global _sanitizer_hash
+    if _sanitizer_hash is None:
+        hash_sanitizer = hashlib.sha256()
+        for source_file in _sanitizer_source_files:
+            with open(source_file, "rb") as file:
+                hash_sanitizer.update(file.read())
+        _sanitizer_hash = hash_sanitizer.hexdigest()
+    names_allowed = repr(sorted(str(name) for name in configuration_names_allowed))
+    return hashlib.sha256(_sanitizer_hash.encode() + names_allowed.encode() + file_contents).hexdigest()
+
+
+def read_cached_configuration(key, cache_directory=None):
+    """
+    Returns the configuration cached under key, or None if there is no usable cache entry.
+    """
+    path = _cache_path(key, cache_directory)
+    try:
+        with open(path, "r") as file:
+            configuration = json.load(file, object_hook=_json_object_hook)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  ## Marks the entry as recently used so it is kept when old entries are removed
+    except OSError:
+        pass
+    return configuration
+
+
+def write_cached_configuration(key, configuration, cache_directory=None):
+    """
+    Stores a sanitized configuration under key.  Failing to write the cache does not stop the spreadsheet from loading.
+    """
+    path = _cache_path(key, cache_directory)
+    path_temporary = path + "." + uuid.uuid4().hex + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path_temporary, "w") as file:
+            json.dump(_tag_tuples(configuration), file, default=_json_default)
+        os.replace(path_temporary, path)  ## Another process never sees a partly written entry
+        _remove_old_entries(os.path.dirname(path))
+    except (OSError, TypeError, ValueError) as error:
+        print("Unable to cache sanitized spreadsheet: " + str(error))
+        if os.path.exists(path_temporary):
+            os.remove(path_temporary)
+
+
+def clear_spreadsheet_cache(cache_directory=None):
+    cache_directory = cache_directory or spreadsheetCache_Directory
+    if not os.path.isdir(cache_directory):
+        return
+    for fileName in os.listdir(cache_directory):
+        if fileName.endswith(".json"):
+            os.remove(os.path.join(cache_directory, fileName))
+
+
+def _cache_path(key, cache_directory):
+    return os.path.join(cache_directory or spreadsheetCache_Directory, key + ".json")
+
+
+def _remove_old_entries(cache_directory):
+    paths = [os.path.join(cache_directory, fileName) for fileName in os.listdir(cache_directory) if fileName.endswith(".json")]
+    if len(paths) <= spreadsheetCache_MaximumFiles:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[: len(paths) - spreadsheetCache_MaximumFiles]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+## JSON would turn tuples (e.g., energy_list_parameters) into lists, so they are stored tagged and come back as tuples
+def _tag_tuples(value):
+    if isinstance(value, tuple):
+        return {"__tuple__": [_tag_tuples(item) for item in value]}
+    if isinstance(value, list):
+        return [_tag_tuples(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _tag_tuples(item) for key, item in value.items()}
+    return value
+
+
+## uid_local values generated while sanitizing are uuid.UUID (ones from the spreadsheet are text).  They are not stored, and new ones are generated
+## every time the entry is read, the same as sanitizing the spreadsheet again would.
+def _json_default(value):
+    if isinstance(value, uuid.UUID):
+        return {"__uuid_generated__": True}
+    raise TypeError("Object of type " + type(value).__name__ + " cannot be cached")
+
+
+def _json_object_hook(dictionary):
+    if len(dictionary) == 1 and "__uuid_generated__" in dictionary:
+        return uuid.uuid4()
+    if len(dictionary) == 1 and "__tuple__" in dictionary:
+        return tuple(dictionary["__tuple__"])
+    return dictionary
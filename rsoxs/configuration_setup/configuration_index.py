@@ -0,0 +1,323 @@
+## Index of positions of samples and acquisitions within a configuration (the list stored in rsoxs_config["bar"]).
+## Used so that updating the status of one acquisition does not require copying and scanning the whole configuration,
+## and so that looking up samples by sample_id, sample_name, bar spot, project, or proposal does not scan the bar.
+
+import bisect
+import copy
+import time
+import uuid
+
+
+## Sample fields that can be looked up with sample_positions.  "spot" is bar_loc["spot"].
+configurationIndex_Fields = ["sample_id", "sample_name", "spot", "project_name", "proposal_id"]
+
+
+class ConfigurationIndex:
+    """
+    Positions of samples keyed by sample_id and positions of acquisitions keyed by (sample_id, uid_local),
+    plus the positions of samples with each sample_name, bar spot, project_name, and proposal_id.
+
+    Positions are checked against the configuration on every lookup, so the same index can be reused with fresh copies of rsoxs_config["bar"].
+    If a position is stale (e.g., samples were added or reordered), the index is updated from the configuration.
+    Updates only change the entries of samples whose lookup fields changed, unless most of the configuration changed.
+    If more than one sample has the same sample_id, the first one is used, same as the linear search it replaces.
+    """
+
+    def __init__(self, configuration=None):
+        self._clear()
+        self.rebuilds = 0
+        self.updates = 0
+        if configuration is not None:
+            self.rebuild(configuration)
+
+    def _clear(self):
+        self.samples = {}
+        self.acquisitions = {}
+        self.acquisition_counts = {}
+        self.positions = {field: {} for field in configurationIndex_Fields}  ## field: {value: sorted positions}
+        self.keys = []  ## Lookup fields and number of acquisitions of the sample at each position, to find what changed
+        self._acquisition_keys = {}  ## sample_id: keys in acquisitions, so that one sample's entries can be replaced
+        self._configuration_seen = None
+
+    def rebuild(self, configuration):
+        self._clear()
+        self.keys = [_sample_keys(sample) for sample in configuration]
+        for indexSample, keys in enumerate(self.keys):
+            self._add_positions(indexSample, keys)
+        for sample_id in self.positions["sample_id"]:
+            self._index_sample(configuration, sample_id)
+        self._configuration_seen = configuration
+        self.rebuilds += 1
+
+    def update(self, configuration):
+        """
+        Brings the index up to date with configuration, changing only the entries of samples that changed.
+        """
+        keys_new = [_sample_keys(sample) for sample in configuration]
+        number_common = min(len(keys_new), len(self.keys))
+        changed = [index for index in range(number_common) if keys_new[index] != self.keys[index]]
+        changed += list(range(number_common, max(len(keys_new), len(self.keys))))
+        if 2 * len(changed) > len(keys_new):
+            ## e.g., a sample inserted near the start moves every sample after it
+            self.rebuild(configuration)
+            return
+        sample_ids_changed = set()
+        for indexSample in changed:
+            if indexSample < len(self.keys):
+                self._remove_positions(indexSample, self.keys[indexSample])
+                sample_ids_changed.add(self.keys[indexSample][0])
+        self.keys = self.keys[: len(keys_new)] + keys_new[len(self.keys) :]
+        for indexSample in changed:
+            if indexSample < len(keys_new):
+                self.keys[indexSample] = keys_new[indexSample]
+                self._add_positions(indexSample, keys_new[indexSample])
+                sample_ids_changed.add(keys_new[indexSample][0])
+        for sample_id in sample_ids_changed:
+            self._index_sample(configuration, sample_id)
+        self._configuration_seen = configuration
+        self.updates += 1
+
+    def sample_positions(self, configuration, field, value):
+        """
+        Returns the positions of the samples in configuration whose field (one of configurationIndex_Fields) equals value, in order.
+
+        configuration is compared with the one seen last by identity, so pass the same list (e.g., the rsoxs_bar_cache snapshot) while it has not changed.
+        """
+        if configuration is not self._configuration_seen:
+            self.update(configuration)
+        positions = self.positions[field].get(value, [])
+        if any(index >= len(configuration) or _field_value(configuration[index], field) != value for index in positions):
+            self.update(configuration)  ## The list was changed in place
+            positions = self.positions[field].get(value, [])
+        return list(positions)
+
+    def sample_ids(self, configuration, field, value):
+        """
+        Returns the sample_ids of the samples whose field equals value, e.g., sample_ids(bar, "sample_name", "AF1_front").
+        """
+        return [configuration[index]["sample_id"] for index in self.sample_positions(configuration, field, value)]
+
+    def check(self, configuration):
+        """
+        Compares the index with one built from scratch from configuration.  Returns a list of the differences (empty if the index is consistent).
+        """
+        fresh = ConfigurationIndex(configuration)
+        problems = []
+        for name, mine, theirs in [("sample_id", self.samples, fresh.samples), ("acquisition", self.acquisitions, fresh.acquisitions)] + [
+            (field, self.positions[field], fresh.positions[field]) for field in configurationIndex_Fields
+        ]:
+            if mine != theirs:
+                keys_different = [key for key in set(mine) | set(theirs) if mine.get(key) != theirs.get(key)]
+                problems.append(name + " positions differ for " + str(keys_different[:10]))
+        return problems
+
+    def _add_positions(self, indexSample, keys):
+        for field, value in zip(configurationIndex_Fields, keys):
+            if value is not None:
+                bisect.insort(self.positions[field].setdefault(value, []), indexSample)
+
+    def _remove_positions(self, indexSample, keys):
+        for field, value in zip(configurationIndex_Fields, keys):
+            if value is not None:
+                positions = self.positions[field][value]
+                positions.remove(indexSample)
+                if not positions:
+                    del self.positions[field][value]
+
+    def _index_sample(self, configuration, sample_id):
+        ## Sample and acquisition positions of sample_id come from its first position
+        for key in self._acquisition_keys.pop(sample_id, []):
+            del self.acquisitions[key]
+        positions = self.positions["sample_id"].get(sample_id)
+        if not positions:
+            self.samples.pop(sample_id, None)
+            self.acquisition_counts.pop(sample_id, None)
+            return
+        sample = configuration[positions[0]]
+        self.samples[sample_id] = positions[0]
+        acquisitions = sample.get("acquisitions") or []
+        self.acquisition_counts[sample_id] = len(acquisitions)
+        keys = self._acquisition_keys[sample_id] = []
+        for indexAcquisition, acquisition in enumerate(acquisitions):
+            key = (sample_id, _uid_key(acquisition["uid_local"]))
+            if key not in self.acquisitions:
+                self.acquisitions[key] = indexAcquisition
+                keys.append(key)
+
+    def sample_index(self, configuration, sample_id):
+        """
+        Returns the position of the sample in configuration, or None if there is no sample with this sample_id.
+        """
+        indexSample = self.samples.get(sample_id)
+        if not self._sample_is_current(configuration, sample_id, indexSample):
+            self.update(configuration)
+            indexSample = self.samples.get(sample_id)
+        return indexSample
+
+    def acquisition_index(self, configuration, sample_id, uid_local):
+        """
+        Returns (sample position, acquisition position) in configuration.
+        The acquisition position is None if the sample does not have an acquisition with this uid_local yet.
+        """
+        indexSample = self.sample_index(configuration, sample_id)
+        if indexSample is None:
+            return None, None
+        key = (sample_id, _uid_key(uid_local))
+        indexAcquisition = self.acquisitions.get(key)
+        acquisitions = configuration[indexSample]["acquisitions"]
+        if indexAcquisition is not None:
+            if indexAcquisition < len(acquisitions) and _uid_key(acquisitions[indexAcquisition]["uid_local"]) == key[1]:
+                return indexSample, indexAcquisition
+        elif self.acquisition_counts.get(sample_id) == len(acquisitions):
+            return indexSample, None  ## Nothing was added since the index was built, so this is a new acquisition
+
+        self.rebuild(configuration)
+        indexSample = self.samples.get(sample_id)
+        return indexSample, self.acquisitions.get(key)
+
+    def add_acquisition(self, sample_id, uid_local, indexAcquisition):
+        """
+        Records an acquisition that was appended to a sample.
+        """
+        key = (sample_id, _uid_key(uid_local))
+        if key not in self.acquisitions:
+            self.acquisitions[key] = indexAcquisition
+            self._acquisition_keys.setdefault(sample_id, []).append(key)
+        self.acquisition_counts[sample_id] = indexAcquisition + 1
+
+    def _sample_is_current(self, configuration, sample_id, indexSample):
+        return (
+            indexSample is not None
+            and indexSample < len(configuration)
+            and configuration[indexSample]["sample_id"] == sample_id
+        )
+
+
+def _field_value(sample, field):
+    value = (sample.get("bar_loc") or {}).get("spot") if field == "spot" else sample.get(field)
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)  ## Lookup values have to be hashable
+
+
+def _sample_keys(sample):
+    return tuple(_field_value(sample, field) for field in configurationIndex_Fields) + (len(sample.get("acquisitions") or []),)
+
+
+def _uid_key(uid_local):
+    ## uid_local is a uuid.UUID when it is first generated but a string after it has been stored in Redis or a spreadsheet
+    return str(uid_local)
+
+
+def benchmark_acquisition_update(numbers_of_samples=(10, 100, 1000), acquisitions_per_sample=10, repeats=200):
+    """
+    Prints the time per acquisition status update for configurations of different sizes.
+    The indexed, in-place update should stay constant while the copy-and-scan update grows with the configuration.
+    """
+    from .configuration_load_save_sanitize import updateConfigurationWithAcquisition
+
+    print("samples  acquisitions  copy-and-scan (ms)  indexed (ms)")
+    for number_of_samples in numbers_of_samples:
+        configuration = _make_benchmark_configuration(number_of_samples, acquisitions_per_sample)
+        acquisition = dict(configuration[-1]["acquisitions"][-1], acquire_status="Started")
+
+        start = time.perf_counter()
+        for _ in range(max(1, repeats // number_of_samples)):
+            _update_by_copy_and_scan(configuration, acquisition)
+        time_scan = (time.perf_counter() - start) / max(1, repeats // number_of_samples)
+
+        index = ConfigurationIndex(configuration)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            updateConfigurationWithAcquisition(configuration, acquisition, index=index, in_place=True)
+        time_indexed = (time.perf_counter() - start) / repeats
+
+        print(
+            f"{number_of_samples:7d}  {number_of_samples * acquisitions_per_sample:12d}  "
+            f"{time_scan * 1e3:18.3f}  {time_indexed * 1e3:12.4f}"
+        )
+
+
+def benchmark_sample_lookup(number_of_samples=500, repeats=2000):
+    """
+    Prints the time per sample lookup by sample_id, sample_name, and bar spot with linear scans (as get_sample_id_and_index and sample_by_value_match did)
+    and with the index, and the time to bring the index up to date after one sample changes.
+    """
+    configuration = _make_benchmark_configuration(number_of_samples, 2)
+    for indexSample, sample in enumerate(configuration):
+        sample.update(project_name="project" + str(indexSample % 10), proposal_id=300000 + indexSample % 3)
+    sample_ids = [sample["sample_id"] for sample in configuration]
+    index = ConfigurationIndex(configuration)
+
+    def timed(function):
+        start = time.perf_counter()
+        for repeat in range(repeats):
+            function(sample_ids[(repeat * 7919) % number_of_samples])
+        return (time.perf_counter() - start) / repeats
+
+    times = {
+        "scan sample_id": timed(lambda sample_id: next(index for index, sample in enumerate(configuration) if sample["sample_id"] == sample_id)),
+        "scan sample_name": timed(lambda sample_id: [sample for sample in configuration if sample["sample_name"].find(sample_id) >= 0]),
+        "index sample_id": timed(lambda sample_id: index.sample_index(configuration, sample_id)),
+        "index sample_name": timed(lambda sample_id: index.sample_ids(configuration, "sample_name", sample_id)),
+        "index spot": timed(lambda sample_id: index.sample_positions(configuration, "spot", sample_id[len("sample") :])),
+    }
+    configuration_changed = copy.deepcopy(configuration)
+    configuration_changed[number_of_samples // 2]["sample_name"] = "renamed"
+    start = time.perf_counter()
+    index.update(configuration_changed)
+    times["update after one change"] = time.perf_counter() - start
+    start = time.perf_counter()
+    ConfigurationIndex(configuration_changed)
+    times["rebuild"] = time.perf_counter() - start
+    assert not index.check(configuration_changed)
+
+    print(f"{number_of_samples} samples                 time (us)")
+    for name, seconds in times.items():
+        print(f"{name:26s} {seconds * 1e6:10.2f}")
+    return times
+
+
+def _update_by_copy_and_scan(configuration, acquisition):
+    ## The update as it was done before the index, kept for comparison in the benchmark
+    configuration = copy.deepcopy(configuration)
+    acquisition = copy.deepcopy(acquisition)
+    for sample in copy.deepcopy(configuration):
+        if sample["sample_id"] == acquisition["sample_id"]:
+            break
+    for sample in configuration:
+        if sample["sample_id"] == acquisition["sample_id"]:
+            for indexAcquisition, acquisitionExisting in enumerate(sample["acquisitions"]):
+                if acquisitionExisting["uid_local"] == acquisition["uid_local"]:
+                    sample["acquisitions"][indexAcquisition] = acquisition
+                    break
+            break
+    return configuration
+
+
+def _make_benchmark_configuration(number_of_samples, acquisitions_per_sample):
+    configuration = []
+    for indexSample in range(number_of_samples):
+        sample_id = "sample" + str(indexSample)
+        configuration.append(
+            {
+                "sample_id": sample_id,
+                "sample_name": sample_id,
+                "location": [{"motor": motor, "position": 0.0, "order": 0} for motor in ("x", "y", "z", "th")],
+                "bar_loc": {"spot": str(indexSample)},
+                "acquisitions": [
+                    {
+                        "sample_id": sample_id,
+                        "configuration_instrument": "WAXSNEXAFS",
+                        "scan_type": "nexafs",
+                        "energy_list_parameters": "carbon_NEXAFS",
+                        "polarizations": [0, 90],
+                        "sample_angles": [0],
+                        "acquire_status": "Not begun",
+                        "uid_local": str(uuid.uuid4()),
+                    }
+                    for _ in range(acquisitions_per_sample)
+                ],
+            }
+        )
+    return configuration
@@ -9,6 +9,9 @@ import json
 import datetime
 import re, warnings, httpx
 import uuid
+import hashlib
+import threading
+import orjson
 
 
 from nbs_bl.devices.sampleholders import SampleHolderBase
@@ -18,24 +21,66 @@ from .configuration_load_save_sanitize import (
     load_configuration_spreadsheet_local, 
     save_configuration_spreadsheet_local,
     get_sample_dictionary_nbs_format_from_rsoxs_config,
+    get_sample_changes_nbs_format_from_rsoxs_config,
+    updateConfigurationWithAcquisition,
 )
-from ..redis_config import rsoxs_config
+from .configuration_index import ConfigurationIndex
+from ..redis_config import rsoxs_config, rsoxs_bar_cache
 
 
+## Kept for the whole session so that positions found for one acquisition update are reused for the next
+rsoxs_config_index = ConfigurationIndex()
 
-def sync_rsoxs_config_to_nbs_manipulator():
+## sample_id -> fingerprint of each sample as it was last sent to the manipulator, so that the next sync only sends what changed
+manipulator_sample_fingerprints = {}
+
+
+def sync_rsoxs_config_to_nbs_manipulator(full_resync=False):
     """
     Converts metadata from rsoxs_config["bar"] to format used by nbs-bl.
     Then updates maniuplator sample list.
     Intended to be run anywhere rsoxs_config["bar"] is updated.
     TODO: this function needs to be run manually anytime rsoxs_config["bar"] is updated manually.
-    """
 
-    samples_dictionary_nbs_format = get_sample_dictionary_nbs_format_from_rsoxs_config(configuration=copy.deepcopy(rsoxs_config["bar"]))
+    Only samples that were added, updated, or removed since the last sync are sent to the manipulator.
+    The whole sample list is reloaded if full_resync=True, if the manipulator's samples were changed elsewhere (e.g., nbs-bl's own sample loading), or if the incremental update fails.
+    """
+    global manipulator_sample_fingerprints
+
+    configuration = rsoxs_bar_cache.get()
+
+    if not full_resync and set(manipulator.samples.keys()) == set(manipulator_sample_fingerprints.keys()):
+        try:
+            samples_changed, sample_ids_removed, fingerprints = get_sample_changes_nbs_format_from_rsoxs_config(
+                configuration=configuration, fingerprints_previous=manipulator_sample_fingerprints
+            )
+            ## Updated samples are removed first so that they are added fresh, same as after clearing in a full reload
+            for sample_id in sample_ids_removed + [sample_id for sample_id in samples_changed if sample_id in manipulator_sample_fingerprints]:
+                manipulator.remove_sample(sample_id)
+            if len(samples_changed) > 0:
+                manipulator.load_sample_dict(samples_changed, clear=False)
+            manipulator_sample_fingerprints = fingerprints
+            return
+        except Exception as error:
+            print("Incremental sync to the manipulator failed (" + str(error) + ").  Reloading all samples.")
+
+    samples_dictionary_nbs_format, sample_ids_removed, manipulator_sample_fingerprints = get_sample_changes_nbs_format_from_rsoxs_config(
+        configuration=configuration, fingerprints_previous={}
+    )
     manipulator.load_sample_dict(samples_dictionary_nbs_format)
 
 
 
+def update_acquisition_in_rsoxs_config(acquisition):
+    """
+    Writes an updated acquisition (e.g., a new acquire_status) back into rsoxs_config["bar"].
+    Only the changed acquisition is modified; the rest of the configuration is not copied or searched.
+    """
+    configuration = rsoxs_config["bar"]
+    updateConfigurationWithAcquisition(configuration, acquisition, index=rsoxs_config_index, in_place=True)
+
+
+
 def load_sheet(file_path):
     """
     Loads spreadsheet and updates sample configuration in RSoXS control computer.
@@ -51,10 +96,62 @@ def load_sheet(file_path):
     
     return
 
-def save_sheet(file_path, file_label):
+def save_sheet(file_path, file_label, file_format="xlsx", background=False):
     ## Test comment + more comment
-    save_configuration_spreadsheet_local(configuration=rsoxs_config["bar"], file_path=file_path, file_label=file_label)
-    return
+    ## With background=True, the file is written in a background thread so that saving does not hold up the RE, and a Future with the saved paths is returned.
+    return save_configuration_spreadsheet_local(
+        configuration=rsoxs_bar_cache.get(), file_path=file_path, file_label=file_label, file_format=file_format, background=background
+    )
+
+
+## Autosave thread and the event used to stop it
+_autosave_thread = None
+_autosave_stop = threading.Event()
+
+
+def start_autosave(file_path, interval_seconds=300, file_format="jsonl", file_label="autosave"):
+    """
+    Saves rsoxs_config["bar"] every interval_seconds in a background thread, but only if it changed since the last autosave.
+    Always overwrites the same file, autosave_<file_label> in the folder file_path, so the latest configuration is there if Bluesky stops unexpectedly.
+    """
+    global _autosave_thread
+    stop_autosave()
+    _autosave_stop.clear()
+
+    def autosave():
+        version_saved = None
+        while not _autosave_stop.wait(interval_seconds):
+            try:
+                version_cache = rsoxs_bar_cache.version  ## Read before the bar, so a change made in between is saved next time
+                configuration = rsoxs_bar_cache.get()
+                version = _get_configuration_version(configuration, version_cache)
+                if version == version_saved:
+                    continue
+                save_configuration_spreadsheet_local(
+                    configuration=configuration, file_path=file_path, file_format=file_format, file_name="autosave_" + str(file_label)
+                )
+                version_saved = version
+            except Exception as error:
+                print("Autosave failed: " + str(error))
+
+    _autosave_thread = threading.Thread(target=autosave, name="rsoxs_autosave", daemon=True)
+    _autosave_thread.start()
+    print("Autosaving configuration every " + str(interval_seconds) + " s to " + os.path.join(str(file_path), "autosave_" + str(file_label)))
+
+
+def stop_autosave():
+    global _autosave_thread
+    if _autosave_thread is not None:
+        _autosave_stop.set()
+        _autosave_thread.join()
+        _autosave_thread = None
+
+
+def _get_configuration_version(configuration, version_cache):
+    ## The bar cache counts every change it is told about.  Without keyspace notifications, changes from other processes are only seen by comparing contents.
+    if rsoxs_bar_cache.notifications_enabled:
+        return version_cache
+    return hashlib.sha256(orjson.dumps(configuration, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)).hexdigest()
 
 
 
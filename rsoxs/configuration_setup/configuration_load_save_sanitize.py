@@ -2,6 +2,9 @@
 ## Test comment
 
 import os
+import io
+import contextlib
+import concurrent.futures
 import numpy as np
 import pandas as pd
 import ast
@@ -10,13 +13,19 @@ import json
 import datetime
 import re, warnings, httpx
 import uuid
+import orjson
 
 from ..plans.default_energy_parameters import energy_list_parameters
+from ..plans.energy_grids import get_energy_grid
+from .configuration_index import ConfigurationIndex
+from .configuration_registry import rsoxs_configuration_registry
+from .queue_scheduler import scheduleAcquisitionsQueue
+from .configuration_cache import spreadsheet_cache_key, read_cached_configuration, write_cached_configuration
 
 
 
 
-def load_configuration_spreadsheet_local(file_path):
+def load_configuration_spreadsheet_local(file_path, return_errors=False, use_cache=True, cache_directory=None):
     ## TODO: use natsort to get things in order of bar location
 
     ## The following are items that were present in Eliot's spreadsheet loader, but I might not keep going forward.
@@ -24,23 +33,89 @@ def load_configuration_spreadsheet_local(file_path):
     ## Also, Eliot has the top few rows with instructions, but I might leave that aside for now.
     ## Most probably getting rid of the Parameter/Index
 
-    ## Load list of samples and metadata, make a configuration dictionary, and sanitize
-    samplesDF = pd.read_excel(file_path, sheet_name="Samples")
-    samplesDF = sanitizeSpreadsheet(samplesDF)
-    configuration = samplesDF.to_dict(orient="records")
-    configuration = sanitizeSamples(configuration)
+    ## Imported here because the schema module builds on the parameter definitions further down in this module
+    from .configuration_schema import sanitize_configuration_columnar, error_report
+
+    ## The file is read from disk once.  If the same contents were already sanitized, the cached configuration is used instead of parsing the workbook.
+    files_contents = {}
+    for path in _get_configuration_file_paths(file_path):
+        with open(path, "rb") as file:
+            files_contents[path] = file.read()
+    cache_key = spreadsheet_cache_key(b"".join(files_contents.values()), configurationInstrument_Allowed)
+    if use_cache:
+        configuration = read_cached_configuration(cache_key, cache_directory=cache_directory)
+        if configuration is not None:
+            print("Spreadsheet unchanged since it was last loaded, using cached configuration.")
+            if return_errors:
+                return configuration, error_report([])
+            return configuration
+
+    ## Load list of samples and acquisitions from one pass over the workbook, then sanitize whole columns at once.
+    ## sanitizeSamples and sanitizeAcquisitions remain the row-by-row reference for configurations written directly in Bluesky.
+    sheets = _read_configuration_sheets(files_contents)
+    configuration, errors = sanitize_configuration_columnar(sheets["Samples"], sheets["Acquisitions"])
+
+    ## Only spreadsheets without problems are cached, so problems are reported every time the spreadsheet is loaded
+    if use_cache and len(errors) == 0:
+        write_cached_configuration(cache_key, configuration, cache_directory=cache_directory)
+
+    if return_errors:
+        return configuration, errors
+    if len(errors) > 0:
+        raise ValueError(
+            "Spreadsheet " + str(file_path) + " has " + str(len(errors)) + " problem(s):\n" + errors.to_string(index=False)
+        )
+
+    return configuration
 
-    ## Load list of acquisitions, make a dictionary, and sanitize
-    acquisitionsDF = pd.read_excel(file_path, sheet_name="Acquisitions")
-    acquisitionsDF = sanitizeSpreadsheet(acquisitionsDF)
-    acquisitionsDict = acquisitionsDF.to_dict(orient="records")
-    acquisitionsDict = sanitizeAcquisitions(acquisitionsDict, configuration)
 
-    ## Store acquisitions into its respective sample dictionary.  Consider making this a separate function so that dictionaries written directly in Bluesky can be fed into this function.
-    for indexAcquisition, acquisition in enumerate(acquisitionsDict):
-        configuration = updateConfigurationWithAcquisition(configuration, acquisition)
+def _get_configuration_file_paths(file_path):
+    ## Configurations saved as csv or parquet are a pair of files, and either one can be given
+    file_path = str(file_path)
+    for extension in [".csv", ".parquet"]:
+        for sheet_name in ["_Samples", "_Acquisitions"]:
+            if file_path.endswith(sheet_name + extension):
+                file_path_base = file_path[: -len(sheet_name + extension)]
+                return [file_path_base + "_Samples" + extension, file_path_base + "_Acquisitions" + extension]
+    return [file_path]
 
-    return configuration
+
+def _read_configuration_sheets(files_contents):
+    ## Empty text cells are missing values in every format, as xlsx, csv, and parquet already read them, so all formats load the same configuration
+    return {sheet_name: _empty_text_to_missing(df) for sheet_name, df in _read_configuration_sheets_raw(files_contents).items()}
+
+
+def _empty_text_to_missing(df):
+    for column in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].where(df[column].map(lambda value: not (isinstance(value, str) and value == "")).astype(bool), np.nan)
+    return df
+
+
+def _read_configuration_sheets_raw(files_contents):
+    paths = list(files_contents.keys())
+    if len(paths) == 2:
+        if paths[0].endswith(".csv"):
+            return {
+                sheet_name: pd.read_csv(io.BytesIO(file_contents))
+                for sheet_name, file_contents in zip(["Samples", "Acquisitions"], files_contents.values())
+            }
+        return {
+            sheet_name: pd.read_parquet(io.BytesIO(file_contents))
+            for sheet_name, file_contents in zip(["Samples", "Acquisitions"], files_contents.values())
+        }
+
+    file_contents = files_contents[paths[0]]
+    if paths[0].endswith(".jsonl"):
+        rows = {"Samples": [], "Acquisitions": []}
+        for line in file_contents.decode().splitlines():
+            if line.strip():
+                row = json.loads(line)
+                rows[row.pop("sheet")].append(row)
+        return {sheet_name: pd.DataFrame(rows_sheet) for sheet_name, rows_sheet in rows.items()}
+
+    ## pandas opens the workbook with openpyxl in read-only mode, and both sheets are parsed from the same open workbook
+    return pd.read_excel(io.BytesIO(file_contents), sheet_name=["Samples", "Acquisitions"], engine="openpyxl")
 
 
 def sanitizeSpreadsheet(df):
@@ -73,35 +148,9 @@ def sanitizeSpreadsheet(df):
             print(f"Error evaluating {val}: {e}")
             return val
 
-    # List of columns that should remain as strings
-    ## TODO: energy_list_parameters is sometimes a string or sometimes a list.  Figure out a way to handle that.
-    string_columns = [
-        "location",
-        "bar_loc",
-        "acq_history",
-        "acquire_status",
-        "sample_id",
-        "sample_name",
-        "sample_state",
-        "sample_set",
-        "project_name",
-        "project_desc",
-        "institution",
-        "configuration_instrument",
-        "scan_type",
-        "polarization_frame",
-        "group_name",
-        "uid_local",
-        "notes",
-        "proposal_id",
-        "bar_spot",
-        "notes",
-        "bar_name",
-    ]
-
     # Process each column
     for column in df.columns:
-        if column in string_columns:
+        if column in spreadsheetParameters_Strings:
             continue
 
         try:
@@ -118,6 +167,32 @@ def sanitizeSpreadsheet(df):
     return df
 
 
+## List of columns that should remain as strings
+## TODO: energy_list_parameters is sometimes a string or sometimes a list.  Figure out a way to handle that.
+spreadsheetParameters_Strings = [
+    "location",
+    "bar_loc",
+    "acq_history",
+    "acquire_status",
+    "sample_id",
+    "sample_name",
+    "sample_state",
+    "sample_set",
+    "project_name",
+    "project_desc",
+    "institution",
+    "configuration_instrument",
+    "scan_type",
+    "polarization_frame",
+    "group_name",
+    "uid_local",
+    "notes",
+    "proposal_id",
+    "bar_spot",
+    "bar_name",
+]
+
+
 ## TODO: For now, I am keeping Sample/Bar parameters exactly the same as how Eliot had them, but I would like to refactor these later on.
 sampleParameters_Empty = {
     "bar_name": None,  ## TODO: Would like to eliminate in the future
@@ -288,6 +363,9 @@ acquisitionParameters_Default = {
     "uid_local": None,  ## Intended so that I can store updates back into this same acquisition
     "notes": None,
 }
+## Names defined in configurations_instrument are added when it is imported
+configurationInstrument_Allowed = rsoxs_configuration_registry.names_allowed
+scanTypes_Allowed = ["time", "time2D", "spiral", "nexafs", "rsoxs", "nexafs_fly"]
 ## TODO: would like a cycles-like parameter where I can sleep up and down in energy.  Lucas would want that.
 ## TODO: maybe name the above as acquisitionParameters_Blank and then have a different acquisitionParameters_Default with the default values that I would liek to enter into the scan functions
 
@@ -318,19 +396,8 @@ def sanitizeAcquisition(acquisitionInput):
             acquisition[parameter] = acquisitionParameters_Default[parameter]
     
 
-    ## TODO: would like to find a way to automate configurations list
     parameterName = "configuration_instrument"
-    if acquisition[parameterName] not in ("NoBeam",
-                                        "WAXS_OpenBeamImages",
-                                        "WAXSNEXAFS",
-                                        "WAXS",
-                                        "WAXS_LowFlux",
-                                        "WAXSNEXAFS_Liquids",
-                                        "WAXS_Liquids",
-                                        "DM7NEXAFS",
-                                        "DM7NEXAFS_Liquids",
-                                        "DM7NEXAFS_Liquids_December2024",
-                                        ):
+    if acquisition[parameterName] not in configurationInstrument_Allowed:
         raise ValueError("Please enter valid " + str(parameterName))
 
     parameterName = "polarization_frame"
@@ -379,7 +446,7 @@ def sanitizeAcquisition(acquisitionInput):
         acquisition = sanitizeTimeScan(acquisition)
     elif acquisition[parameterName] == "spiral":
         acquisition = sanitizeSpirals(acquisition)
-    elif acquisition[parameterName] in ("nexafs", "rsoxs"):
+    elif acquisition[parameterName] in ("nexafs", "rsoxs", "nexafs_fly"):
         acquisition = sanitizeEnergyScan(acquisition)
     else: raise ValueError("Please enter valid " + str(parameterName))
 
@@ -437,6 +504,12 @@ def sanitizeEnergyScan(acquisitionInput):
     if isinstance(acquisition[parameterName], str):
         if acquisition[parameterName] not in list(energy_list_parameters.keys()):
             raise ValueError("Please enter valid energy plan.")
+    try:
+        energy_grid = get_energy_grid(acquisition[parameterName]) ## Checks inline parameters, e.g., for a missing stop or a step of 0
+    except ValueError as error:
+        raise ValueError("Please enter valid " + str(parameterName) + ".  " + str(error))
+    if acquisition["scan_type"] == "nexafs_fly" and energy_grid.number_points < 2:
+        raise ValueError("Please enter valid " + str(parameterName) + ".  Fly scans need a range of energies.")
 
     return acquisition
 
@@ -446,7 +519,16 @@ def sanitizeEnergyScan(acquisitionInput):
 ## One of the features of dry running in the old code was that it could indicate if something might fall out of a motor range.  But if that is documented and hard-coded and sanitized here, that might be better?
 
 
-def sortAcquisitionsQueue(acquisitions, sortBy=["priority"]):
+def sortAcquisitionsQueue(acquisitions, sortBy=["priority"], cost_function=None, position_function=None):
+    """
+    Returns the acquisitions that still need to be run, in the order to run them.
+
+    sortBy can include:
+    - "priority": lowest priority value first
+    - "transition_cost": within each priority, order acquisitions to reduce time spent changing configuration, grating, polarization, energy, and sample.
+      Acquisitions with the same group_name stay together.  cost_function can replace the default cost model (see queue_scheduler.transition_cost).
+      With position_function (see queue_scheduler.get_acquisition_states), sample moves and rotations also count.
+    """
     queue = []
     for indexAcquisition, acquisition in enumerate(copy.deepcopy(acquisitions)):
         ## Acquisitions that should not be added to queue
@@ -460,78 +542,210 @@ def sortAcquisitionsQueue(acquisitions, sortBy=["priority"]):
     for indexSortingCriterion, sortingCriterion in enumerate(sortBy):
         if sortingCriterion == "priority":
             queue = sorted(queue, key=lambda x: x["priority"])
+        if sortingCriterion == "transition_cost":
+            queue = sorted(queue, key=lambda x: x["priority"])
+            queue, report = scheduleAcquisitionsQueue(queue, cost_function=cost_function, position_function=position_function)
 
     return queue
 
 
-def updateConfigurationWithAcquisition(configurationInput, acquisitionInput):
-    configuration = copy.deepcopy(configurationInput)
-    acquisition = copy.deepcopy(acquisitionInput)
-    ## When I run scans, I will be updating the acquireStatus among other things.  I want to feed the updated acquisition dictionary back into the main configuration
+def updateConfigurationWithAcquisition(configurationInput, acquisitionInput, index=None, in_place=False):
+    """
+    Stores an acquisition into its sample in the configuration.
+    An existing acquisition with the same uid_local is replaced, otherwise the acquisition is appended to the sample's list.
 
-    for indexSample, sample in enumerate(copy.deepcopy(configuration)):
-        if sample["sample_id"] == acquisition["sample_id"]:
-            configurationUpdated = False
-            for indexAcquisitionExisting, acquisitionExisting in enumerate(
-                configuration[indexSample]["acquisitions"]
-            ):
-                ## If there already is an acquisition with the same uid_Local, update that acquisition
-                if acquisitionExisting["uid_local"] == acquisition["uid_local"]:
-                    configuration[indexSample]["acquisitions"][indexAcquisitionExisting] = acquisition
-                    configurationUpdated = True
-                    break
-            ## If this acquisition does not exist in the configuration, add it to the list
-            if not configurationUpdated:
-                configuration[indexSample]["acquisitions"].append(acquisition)
-            break
+    Parameters
+    ----------
+    configurationInput : list of dict
+        Configuration (list of samples) to update
+    acquisitionInput : dict
+        Acquisition to store
+    index : ConfigurationIndex, optional
+        Index of the configuration.  Reusing the same index across updates makes each update O(1).
+    in_place : bool
+        If True, only the changed acquisition is written into configurationInput.
+        If False, configurationInput is left unchanged and a copy is returned.  Only the list of samples, the updated sample, and its list of acquisitions are copied.
+
+    Returns
+    -------
+    list of dict
+        Updated configuration
+    """
+    ## When I run scans, I will be updating the acquireStatus among other things.  I want to feed the updated acquisition dictionary back into the main configuration
+    if index is None:
+        index = ConfigurationIndex()
+    acquisition = dict(acquisitionInput)  ## So that later changes to acquisitionInput do not leak into the configuration
+    indexSample, indexAcquisitionExisting = index.acquisition_index(
+        configurationInput, acquisition["sample_id"], acquisition["uid_local"]
+    )
+    if indexSample is None:
+        return configurationInput if in_place else list(configurationInput)
+
+    configuration = configurationInput
+    if not in_place:
+        configuration = list(configurationInput)
+        configuration[indexSample] = dict(configuration[indexSample])
+        configuration[indexSample]["acquisitions"] = list(configuration[indexSample]["acquisitions"])
+
+    ## If there already is an acquisition with the same uid_local, update that acquisition
+    if indexAcquisitionExisting is not None:
+        configuration[indexSample]["acquisitions"][indexAcquisitionExisting] = acquisition
+    ## If this acquisition does not exist in the configuration, add it to the list
+    else:
+        configuration[indexSample]["acquisitions"].append(acquisition)
+        index.add_acquisition(
+            acquisition["sample_id"], acquisition["uid_local"], len(configuration[indexSample]["acquisitions"]) - 1
+        )
 
     return configuration
 
 
-def save_configuration_spreadsheet_local(configuration, file_path, file_label=""):
+def save_configuration_spreadsheet_local(configuration, file_path, file_label="", file_format="xlsx", background=False, file_name=None):
+    """
+    Saves configuration to a spreadsheet (or another format that load_configuration_spreadsheet_local can read) in the folder file_path.
+
+    Parameters
+    ----------
+    configuration : list
+        Samples with their acquisitions, e.g., rsoxs_config["bar"].  A copy is taken before returning, so configuration can be changed right away.
+    file_path : str
+        Folder to save into
+    file_label : str
+        Added to the timestamped file name
+    file_format : str
+        "xlsx", "csv" (Samples and Acquisitions files), "parquet" (Samples and Acquisitions files, requires pyarrow), or "jsonl"
+    background : bool
+        If True, the file is written in a background thread so that the RE or GUI is not blocked, and a concurrent.futures.Future is returned.
+        Saves are written one at a time in the order they were requested.
+    file_name : str, optional
+        Name to save to instead of the timestamped name, without extension.  Used by autosave to keep overwriting the same file.
+
+    Returns
+    -------
+    List of paths written, or a Future of it if background=True.
+    Files are written to a temporary name and then renamed, so a file is never seen partly written.
+    """
 
     ## TODO: undecided if I want to sanitize anything here or just faithfully save what is in rsoxs_config and can let load_sheet deal with all sanitization
     ## I think probably erring on the side of less sanitization here is better so that users can save something and investivate what might be the issue.
 
+    if file_format not in saveFormats_Allowed:
+        raise ValueError("file_format should be one of " + str(saveFormats_Allowed))
+
+    ## Single copy taken here, also turns Redis-backed values into plain lists and dictionaries
+    configurationCopy = copy.deepcopy(list(configuration))
+
+    if file_name is None:
+        timeStamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        file_name = "out_" + str(timeStamp) + "_" + str(file_label)
+    file_path_base = os.path.join(file_path, file_name)
+
+    if background:
+        future = _get_save_executor().submit(_write_configuration_files, configurationCopy, file_path_base, file_format)
+        future.add_done_callback(_report_background_save)
+        return future
+    return _write_configuration_files(configurationCopy, file_path_base, file_format)
+
+
+saveFormats_Allowed = ["xlsx", "csv", "parquet", "jsonl"]
+_save_executor = None
+
+
+def _get_save_executor():
+    global _save_executor
+    if _save_executor is None:
+        _save_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rsoxs_save")
+    return _save_executor
+
+
+def _report_background_save(future):
+    ## Nobody may be waiting on the Future, so say whether the save worked
+    exception = future.exception()
+    if exception is not None:
+        print("Saving the configuration in the background failed: " + repr(exception))
+    else:
+        print("Saved configuration to: " + ", ".join(str(path) for path in future.result()))
+
+
+def _write_configuration_files(configuration, file_path_base, file_format):
+    try:
+        samples_ToExport_df, acquisitions_ToExport_df = _get_configuration_tables(configuration)
+
+        if file_format == "xlsx":
+            paths = [file_path_base + ".xlsx"]
+            with _atomic_path(paths[0]) as path_temporary:
+                with pd.ExcelWriter(path_temporary, engine="openpyxl") as writer:
+                    samples_ToExport_df.to_excel(writer, index=False, sheet_name="Samples")
+                    acquisitions_ToExport_df.to_excel(writer, index=False, sheet_name="Acquisitions")
+
+        elif file_format == "jsonl":
+            ## One line per row, tagged with the sheet it belongs to.  Values keep their JSON types instead of being written as text.
+            paths = [file_path_base + ".jsonl"]
+            with _atomic_path(paths[0]) as path_temporary:
+                with open(path_temporary, "w") as file:
+                    for sheet_name, df in [("Samples", samples_ToExport_df), ("Acquisitions", acquisitions_ToExport_df)]:
+                        for row in df.to_dict(orient="records"):
+                            file.write(json.dumps(dict(sheet=sheet_name, **row), default=str) + "\n")
+
+        else:
+            paths = []
+            for sheet_name, df in [("Samples", samples_ToExport_df), ("Acquisitions", acquisitions_ToExport_df)]:
+                paths.append(file_path_base + "_" + sheet_name + "." + file_format)
+                with _atomic_path(paths[-1]) as path_temporary:
+                    if file_format == "csv":
+                        df.to_csv(path_temporary, index=False)
+                    else:
+                        _stringify_object_columns(df).to_parquet(path_temporary, index=False)
+
+    except Exception as error:
+        print("Unable to save configuration to " + str(file_path_base) + ": " + str(error))
+        raise
+    return paths
+
+
+def _get_configuration_tables(configuration):
     ## Take acquisitions from the configuration and gather into a list of dictionaries to save as separate Acquisitions sheet
     ## If the parameters are not transferred to the template dictionary, they might show up in a different order in the spreadsheet.
-    ## Then delete ["acquisitions"] key from each sample
-    configurationCopy = copy.deepcopy(configuration)
-    acquisitions_ToExport = gatherAcquisitionsFromConfiguration(configurationCopy)
-    for indexSample, sample in enumerate(copy.deepcopy(configurationCopy)):
-        del configurationCopy[indexSample]["acquisitions"]
-
-    ## Organize sample parameters into the correct order
+    ## configuration is already a private copy, so values are not copied again
+    acquisitions_ToExport = []
     samples_ToExport = []
-    for indexSample, sample in enumerate(copy.deepcopy(configurationCopy)):
-        sample_ToExport = copy.deepcopy(sampleParameters_Empty)
-        ## Copy over core parameters
-        for indexParameter, parameter in enumerate(list(sampleParameters_Empty.keys())):
-            if sample.get(parameter, "Not present") == "Not present":
-                sample_ToExport[parameter] = None
-            else:
-                sample_ToExport[parameter] = sample[parameter]
-        ## Copy over extra parameters that users may have defined beyond my codebase
-        extraParameters = set(sample.keys()) - set(sampleParameters_Empty.keys())
-        for indexParameter, parameter in enumerate(extraParameters):
-            if sample.get(parameter, "Not present") == "Not present":
-                sample_ToExport[parameter] = None
-            else:
+    for sample in configuration:
+        for acquisition in sample.get("acquisitions", []):
+            acquisitions_ToExport.append({parameter: acquisition.get(parameter) for parameter in acquisitionParameters_Default})
+
+        ## Organize sample parameters into the correct order, then extra parameters that users may have defined beyond my codebase
+        sample_ToExport = {parameter: sample.get(parameter) for parameter in sampleParameters_Empty}
+        for parameter in sample:
+            if parameter not in sample_ToExport and parameter != "acquisitions":
                 sample_ToExport[parameter] = sample[parameter]
         samples_ToExport.append(sample_ToExport)
 
     ## TODO: for now, I am not including acq_history becuase I need to understand it better.  Anyways, my plans don't save acq_history so not needed urgently.
-
-    ## Export file
-    timeStamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    fileName = "out_" + str(timeStamp) + "_" + str(file_label) + ".xlsx"
-    acquisitions_ToExport_df = pd.DataFrame.from_dict(acquisitions_ToExport, orient="columns")
     samples_ToExport_df = pd.DataFrame.from_dict(samples_ToExport, orient="columns")
-
-    writer = pd.ExcelWriter(os.path.join(file_path, fileName))
-    samples_ToExport_df.to_excel(writer, index=False, sheet_name="Samples")
-    acquisitions_ToExport_df.to_excel(writer, index=False, sheet_name="Acquisitions")
-    writer.close()
+    acquisitions_ToExport_df = pd.DataFrame(acquisitions_ToExport, columns=list(acquisitionParameters_Default.keys()))
+    return samples_ToExport_df, acquisitions_ToExport_df
+
+
+@contextlib.contextmanager
+def _atomic_path(path):
+    ## Temporary file in the same folder so that the rename is atomic.  Extension is kept so that writers that check it still work.
+    directory, fileName = os.path.split(path)
+    path_temporary = os.path.join(directory, "." + fileName + "." + uuid.uuid4().hex + os.path.splitext(fileName)[1])
+    try:
+        yield path_temporary
+        os.replace(path_temporary, path)
+    finally:
+        if os.path.exists(path_temporary):
+            os.remove(path_temporary)
+
+
+def _stringify_object_columns(df):
+    ## Parquet columns need a single type, so mixed columns (e.g., energy_list_parameters) are written as text the same way Excel shows them
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = [None if value is None else value if isinstance(value, str) else str(value) for value in df[column]]
+    return df
 
 
 def gatherAcquisitionsFromConfiguration(configuration):
@@ -587,3 +801,59 @@ def get_sample_dictionary_nbs_format_from_rsoxs_config(configuration):
             bar_dict[sample_id] = sample_dict
     
     return bar_dict
+
+
+
+def get_sample_changes_nbs_format_from_rsoxs_config(configuration, fingerprints_previous):
+    """
+    Finds the samples that were added, updated, or removed since the last sync to nbs-bl's manipulator object.
+    Only samples that changed are converted to nbs-bl format.
+
+    Parameters
+    ----------
+    configuration : list
+        Samples in the format used in rsoxs_config.  Not modified.
+    fingerprints_previous : dict
+        sample_id -> fingerprint for every sample that is currently loaded in the manipulator, as returned by the previous call.
+
+    Returns
+    -------
+    samples_changed : dict
+        Added or updated samples in nbs-bl format, same as get_sample_dictionary_nbs_format_from_rsoxs_config
+    sample_ids_removed : list
+        Samples that should be removed from the manipulator, including samples that no longer have all 4 positions
+    fingerprints : dict
+        sample_id -> fingerprint for every sample that is loaded in the manipulator after the changes are applied
+    """
+
+    samples_current = {}
+    for sample in configuration:
+        ## If two samples have the same sample_id, the last one is used, same as in the full conversion
+        samples_current[sample["sample_id"]] = (_sample_fingerprint(sample), sample)
+
+    sample_ids_changed = [
+        sample_id for sample_id, (fingerprint, sample) in samples_current.items()
+        if fingerprints_previous.get(sample_id) != fingerprint
+    ]
+    samples_changed = get_sample_dictionary_nbs_format_from_rsoxs_config(
+        configuration=[copy.deepcopy(samples_current[sample_id][1]) for sample_id in sample_ids_changed]
+    )
+
+    sample_ids_removed = [sample_id for sample_id in fingerprints_previous if sample_id not in samples_current]
+    sample_ids_removed += [
+        sample_id for sample_id in sample_ids_changed
+        if sample_id in fingerprints_previous and sample_id not in samples_changed
+    ]
+
+    fingerprints = {
+        sample_id: fingerprint for sample_id, fingerprint in fingerprints_previous.items()
+        if sample_id in samples_current and sample_id not in sample_ids_changed
+    }
+    for sample_id in samples_changed:
+        fingerprints[sample_id] = samples_current[sample_id][0]
+
+    return samples_changed, sample_ids_removed, fingerprints
+
+
+def _sample_fingerprint(sample):
+    return orjson.dumps(sample, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
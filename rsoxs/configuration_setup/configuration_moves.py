@@ -0,0 +1,389 @@
+## Works out which motors actually need to move to load an instrument configuration.
+## Does not import any hardware, so the comparison can be used and tested without the beamline.  configurations_instrument.move_motors reads the motors and runs the moves.
+
+import concurrent.futures
+import math
+import time
+
+## Difference between the current position and the setpoint below which a motor is considered to be in position
+configurationTolerance_Default = 0.01
+
+## Estimated time (seconds) that a move takes even when the motors barely travel (starting the move, settling, status callbacks)
+## Used to report the time saved by skipping moves
+moveOverheads_Default = {
+    "order_group": 2.0,  ## Each bps.mv call waits for all of its motors to finish
+    "axis": 0.5,
+}
+
+
+def get_configuration_moves(configuration_setpoints, positions_current, tolerances=None, tolerance_default=configurationTolerance_Default):
+    """
+    Compares the setpoints of a configuration with the current motor positions and returns only the moves that are needed.
+
+    Parameters
+    ----------
+    configuration_setpoints : list of dict
+        {"motor": ..., "position": ..., "order": ...} entries, as stored in GLOBAL_CONFIGURATION_DICT
+    positions_current : dict
+        Current position of each motor, keyed by motor.  Motors that are missing or None (e.g., could not be read) are always moved.
+    tolerances : dict, optional
+        Tolerance for specific motors, keyed by motor.  Other motors use tolerance_default.
+    tolerance_default : float
+
+    Returns
+    -------
+    moves : list of (order, list of (motor, position))
+        Moves to make, one bps.mv per entry, in order.  Order groups with nothing to move are left out.
+    skipped : list of (order, motor, position)
+        Setpoints that were already within tolerance
+    """
+    tolerances = tolerances or {}
+    moves_ByOrder = {}
+    skipped = []
+    for setpoint in sorted(configuration_setpoints, key=lambda x: x["order"]):
+        motor, position, order = setpoint["motor"], setpoint["position"], int(setpoint["order"])
+        if is_in_position(positions_current.get(motor), position, tolerances.get(motor, tolerance_default)):
+            skipped.append((order, motor, position))
+        else:
+            moves_ByOrder.setdefault(order, []).append((motor, position))
+    moves = sorted(moves_ByOrder.items(), key=lambda x: x[0])
+    return moves, skipped
+
+
+def snapshot_positions(motors, read_function=None, max_workers=16):
+    """
+    Reads all motors at the same time, each in its own thread, instead of one after the other.
+
+    Parameters
+    ----------
+    motors : list
+        Motors to read.  Repeated motors are read once.
+    read_function : function, optional
+        read_function(motor) -> (position, timestamp).  Defaults to reading the motor with motor.read().
+    max_workers : int
+
+    Returns
+    -------
+    dict with
+        "positions": position of each motor, keyed by motor.  None for motors that could not be read.
+        "timestamps": timestamp of each reading, keyed by motor
+        "time": when the snapshot was started (time.time())
+        "duration": seconds taken to read all motors
+    """
+    read_function = read_function or read_motor
+    motors = list(dict.fromkeys(motors))
+    time_start = time.time()
+    time_counter = time.perf_counter()
+    readings = list(_get_snapshot_executor(max_workers).map(lambda motor: _read_or_none(read_function, motor), motors))
+    return {
+        "positions": {motor: reading[0] for motor, reading in zip(motors, readings)},
+        "timestamps": {motor: reading[1] for motor, reading in zip(motors, readings)},
+        "time": time_start,
+        "duration": time.perf_counter() - time_counter,
+    }
+
+
+def read_motor(motor):
+    ## Uses the reading of the motor itself (e.g., "Det_W", not "Det_W_user_setpoint"), or the first reading if there is no entry with the motor's name
+    try:
+        reading = motor.read()
+        entry = reading.get(getattr(motor, "name", None)) or next(iter(reading.values()))
+        return entry["value"], entry["timestamp"]
+    except Exception:
+        return motor.position, time.time()
+
+
+def compare_to_configurations(positions_current, configurations, tolerances=None, tolerance_default=configurationTolerance_Default):
+    """
+    Compares current positions with each configuration and returns them from nearest to farthest.
+
+    Parameters
+    ----------
+    positions_current : dict
+        Position of each motor, keyed by motor, e.g., snapshot_positions(...)["positions"]
+    configurations : dict
+        Setpoints of each configuration, keyed by configuration name
+    tolerances : dict, optional
+        Same as get_configuration_moves
+
+    Returns
+    -------
+    list of dict, one per configuration, with
+        "name"
+        "in_position": True if every motor is within tolerance
+        "motors_out_of_position": list of (motor, current position, setpoint)
+        "motors_unknown": motors that could not be read
+        "distance": root mean square of the differences from the setpoints, in units of each motor's tolerance.  0 when in position.
+    Configurations are sorted by number of motors out of position, then by distance.
+    """
+    tolerances = tolerances or {}
+    reports = []
+    for name, configuration_setpoints in configurations.items():
+        motors_outOfPosition = []
+        motors_unknown = []
+        distances = []
+        for setpoint in configuration_setpoints:
+            motor, position = setpoint["motor"], setpoint["position"]
+            position_current = positions_current.get(motor)
+            tolerance = tolerances.get(motor, tolerance_default)
+            if position_current is None:
+                motors_unknown.append(motor)
+                continue
+            if not is_in_position(position_current, position, tolerance):
+                motors_outOfPosition.append((motor, position_current, position))
+            try:
+                distances.append(max(abs(float(position_current) - float(position)) - tolerance, 0) / tolerance)
+            except (TypeError, ValueError):
+                distances.append(0 if position_current == position else 1)
+        reports.append({
+            "name": name,
+            "in_position": not motors_outOfPosition and not motors_unknown,
+            "motors_out_of_position": motors_outOfPosition,
+            "motors_unknown": motors_unknown,
+            "distance": math.sqrt(sum(distance**2 for distance in distances) / len(distances)) if distances else 0,
+        })
+    return sorted(reports, key=lambda report: (len(report["motors_out_of_position"]) + len(report["motors_unknown"]), report["distance"]))
+
+
+_snapshot_executor = None
+
+
+def _get_snapshot_executor(max_workers):
+    ## Kept between snapshots so that threads are not started for every acquisition
+    global _snapshot_executor
+    if _snapshot_executor is None or _snapshot_executor._max_workers != max_workers:
+        _snapshot_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="configuration_snapshot")
+    return _snapshot_executor
+
+
+def _read_or_none(read_function, motor):
+    try:
+        return read_function(motor)
+    except Exception:
+        return None, None
+
+
+def is_in_position(position_current, position_setpoint, tolerance):
+    if position_current is None or position_setpoint is None:
+        return False
+    try:
+        return abs(float(position_current) - float(position_setpoint)) <= tolerance
+    except (TypeError, ValueError):
+        return position_current == position_setpoint  ## e.g., positions that are names instead of numbers
+
+
+def estimate_time_saved(configuration_setpoints, moves, overheads=moveOverheads_Default):
+    """
+    Returns the estimated time (seconds) saved by making only the given moves instead of moving every motor in the configuration.
+    """
+    numberGroups_All = len(set(int(setpoint["order"]) for setpoint in configuration_setpoints))
+    numberAxes_Moved = sum(len(move_list) for order, move_list in moves)
+    return (
+        overheads["order_group"] * (numberGroups_All - len(moves))
+        + overheads["axis"] * (len(configuration_setpoints) - numberAxes_Moved)
+    )
+
+
+## Used for the estimated move times when a motor's velocity or current position is unknown
+moveVelocity_Default = 1.0  ## Motor units per second
+moveDuration_Unknown = 10.0  ## Seconds
+
+
+def plan_configuration_transition(
+    configuration_setpoints,
+    positions_current,
+    interlocks=(),
+    tolerances=None,
+    velocities=None,
+    device_function=None,
+    independent=(),
+    overheads=moveOverheads_Default,
+):
+    """
+    Plans the moves from the current motor positions to a configuration, running every move as early as its dependencies allow.
+
+    Motors that are already in position are not moved.  A move waits only for the moves it depends on:
+    - Moves listed in the setpoint's optional "after" entry (a list of motors in the same configuration)
+    - Interlocks, e.g., {"first": Det_W, "then": BeamStopW} to retract the detector before moving the beamstop.
+      An interlock only applies when both motors move, and can have a "when" function, when(targets) -> bool, where targets maps each moving motor to its target position.
+    - Moves with lower "order" values, same as moving one order group at a time.
+      Devices listed in independent (device_function(motor), by default motor.parent, or the motor itself if it has no parent) only keep the "order" of their own axes,
+      e.g., hexapod axes that cannot move together, and do not wait for, or hold up, other devices because of "order".
+
+    Parameters
+    ----------
+    configuration_setpoints : list of dict
+        {"motor": ..., "position": ..., "order": ..., "after": [...] (optional)} entries
+    positions_current : dict
+        Current position of each motor, keyed by motor.  Missing or None are always moved.
+    interlocks : list of dict
+    tolerances : dict, optional
+        Same as get_configuration_moves
+    velocities : dict, optional
+        Velocity of each motor, keyed by motor, used to estimate move times
+    device_function : function, optional
+    independent : list, optional
+        Devices (or motors) whose moves can run at the same time as moves of other devices with a different "order"
+    overheads : dict
+
+    Returns
+    -------
+    dict with
+        "moves": list of {"motor", "position", "order", "after", "start", "duration"}, sorted by the estimated start time.
+                 "after" is the list of indices in "moves" that have to finish first.
+        "critical_path": indices of the moves on the longest chain of dependencies
+        "time_critical_path": estimated time (seconds) of the planned moves
+        "time_in_order": estimated time (seconds) of the same moves, done one order group at a time
+        "skipped": setpoints already in position, same as get_configuration_moves
+    """
+    if device_function is None:
+        device_function = lambda motor: getattr(motor, "parent", None)
+    ## Compared by identity, since motors and devices are not always hashable
+    independent_ids = {id(device) for device in independent}
+    velocities = velocities or {}
+
+    moves_ByOrder, skipped = get_configuration_moves(configuration_setpoints, positions_current, tolerances=tolerances)
+    setpoints_ByMotor = {setpoint["motor"]: setpoint for setpoint in configuration_setpoints}
+    moves = []
+    for order, move_list in moves_ByOrder:
+        for motor, position in move_list:
+            moves.append({
+                "motor": motor,
+                "position": position,
+                "order": order,
+                "duration": _estimate_move_duration(positions_current.get(motor), position, velocities.get(motor), overheads),
+            })
+    targets = {move["motor"]: move["position"] for move in moves}
+    index_ByMotor = {move["motor"]: index for index, move in enumerate(moves)}
+
+    ## Dependencies, as sets of indices of moves that have to finish first
+    dependencies = [set() for move in moves]
+    for index, move in enumerate(moves):
+        for motor_before in setpoints_ByMotor[move["motor"]].get("after") or []:
+            if motor_before in index_ByMotor:
+                dependencies[index].add(index_ByMotor[motor_before])
+        device = _device_or_motor(device_function, move["motor"])
+        for indexOther, moveOther in enumerate(moves):
+            if moveOther["order"] < move["order"]:
+                deviceOther = _device_or_motor(device_function, moveOther["motor"])
+                if deviceOther is device or (id(device) not in independent_ids and id(deviceOther) not in independent_ids):
+                    dependencies[index].add(indexOther)
+    for interlock in interlocks:
+        if interlock["first"] in index_ByMotor and interlock["then"] in index_ByMotor:
+            if interlock.get("when") is None or interlock["when"](targets):
+                dependencies[index_ByMotor[interlock["then"]]].add(index_ByMotor[interlock["first"]])
+
+    ## Earliest start of each move, in an order where dependencies come first
+    order_topological = _sort_topological(dependencies, [move["motor"] for move in moves])
+    finish = [0] * len(moves)
+    previous_OnCriticalPath = [None] * len(moves)
+    for index in order_topological:
+        moves[index]["start"] = 0
+        for indexBefore in dependencies[index]:
+            if finish[indexBefore] > moves[index]["start"]:
+                moves[index]["start"] = finish[indexBefore]
+                previous_OnCriticalPath[index] = indexBefore
+        finish[index] = moves[index]["start"] + moves[index]["duration"]
+
+    ## Sort by start time and renumber the dependencies to match
+    order_start = sorted(range(len(moves)), key=lambda index: (moves[index]["start"], order_topological.index(index)))
+    index_New = {indexOld: indexNew for indexNew, indexOld in enumerate(order_start)}
+    plan_moves = []
+    for indexOld in order_start:
+        move = dict(moves[indexOld])
+        move["after"] = sorted(index_New[indexBefore] for indexBefore in dependencies[indexOld])
+        plan_moves.append(move)
+
+    critical_path = []
+    if moves:
+        index = max(range(len(moves)), key=lambda index: finish[index])
+        while index is not None:
+            critical_path.insert(0, index_New[index])
+            index = previous_OnCriticalPath[index]
+
+    time_in_order = sum(max(move["duration"] for move in moves if move["order"] == order) for order, move_list in moves_ByOrder)
+    return {
+        "moves": plan_moves,
+        "critical_path": critical_path,
+        "time_critical_path": max(finish) if moves else 0,
+        "time_in_order": time_in_order,
+        "skipped": skipped,
+    }
+
+
+class ConfigurationPlanner:
+    """
+    Keeps the transition plans between named configurations, so that going back and forth between configurations (e.g., WAXSNEXAFS and WAXS) is only planned once.
+
+    A cached plan is reused when the configuration has the same setpoints and the same motors need to move as when it was planned.
+    Otherwise, the transition is planned again.
+    """
+
+    def __init__(self, interlocks=(), tolerances=None, device_function=None, independent=()):
+        self.interlocks = interlocks
+        self.tolerances = tolerances
+        self.device_function = device_function
+        self.independent = independent
+        self._plans = {}
+        self.hits = 0
+        self.misses = 0
+
+    def plan(self, configuration_name_from, configuration_name_to, configuration_setpoints, positions_current, velocities=None):
+        moves, skipped = get_configuration_moves(configuration_setpoints, positions_current, tolerances=self.tolerances)
+        signature = (
+            tuple((id(setpoint["motor"]), repr(setpoint["position"]), setpoint["order"]) for setpoint in configuration_setpoints),
+            tuple((id(motor), order) for order, move_list in moves for motor, position in move_list),
+        )
+        key = (configuration_name_from, configuration_name_to)
+        if key in self._plans and self._plans[key][0] == signature:
+            self.hits += 1
+            return self._plans[key][1]
+        self.misses += 1
+        plan = plan_configuration_transition(
+            configuration_setpoints,
+            positions_current,
+            interlocks=self.interlocks,
+            tolerances=self.tolerances,
+            velocities=velocities,
+            device_function=self.device_function,
+            independent=self.independent,
+        )
+        self._plans[key] = (signature, plan)
+        return plan
+
+    def invalidate(self):
+        self._plans = {}
+
+    def stats(self):
+        return {"plans": len(self._plans), "hits": self.hits, "misses": self.misses}
+
+
+def _device_or_motor(device_function, motor):
+    device = device_function(motor)
+    return motor if device is None else device
+
+
+def _estimate_move_duration(position_current, position_target, velocity, overheads):
+    try:
+        distance = abs(float(position_target) - float(position_current))
+    except (TypeError, ValueError):
+        return moveDuration_Unknown
+    if not velocity or velocity <= 0:
+        velocity = moveVelocity_Default
+    return overheads["axis"] + distance / velocity
+
+
+def _sort_topological(dependencies, motors):
+    order = []
+    remaining = {index: set(indicesBefore) for index, indicesBefore in enumerate(dependencies)}
+    while remaining:
+        ready = sorted(index for index, indicesBefore in remaining.items() if not indicesBefore)
+        if not ready:
+            names = [str(getattr(motors[index], "name", motors[index])) for index in sorted(remaining)]
+            raise ValueError("Configuration move dependencies form a loop between: " + ", ".join(names))
+        for index in ready:
+            order.append(index)
+            del remaining[index]
+        for indicesBefore in remaining.values():
+            indicesBefore.difference_update(ready)
+    return order
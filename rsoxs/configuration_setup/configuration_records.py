@@ -0,0 +1,308 @@
+## Compact, read-only records for samples, acquisitions, and sample locations.
+## rsoxs_config["bar"] and spreadsheets keep using plain dictionaries.  Records are made from them (from_dict) and turned back into the same dictionaries (to_dict).
+##
+## Records are not changed in place.  replace() returns a new record that shares every value that did not change, so copying a record
+## (copy.copy, copy.deepcopy) just returns the same record.  Values inside a record (e.g., the polarizations list) must not be modified in place either.
+
+import copy
+import time
+import tracemalloc
+
+from .configuration_load_save_sanitize import (
+    acquisitionParameters_Default,
+    sampleParameters_Empty,
+    gatherAcquisitionsFromConfiguration,
+    sanitizeAcquisition,
+    sortAcquisitionsQueue,
+)
+
+
+class _Record:
+    """
+    Shared behavior of Acquisition and Sample.
+
+    Values can be read like a dictionary (record["scan_type"], record.get("notes")) or as attributes (record.scan_type).
+    Keys that are not one of the record's fields are kept in extra, so to_dict(from_dict(d)) == d.
+    validated is True once the record has been sanitized, and stays True through replace() of fields listed in _fields_NotValidated.
+    """
+
+    __slots__ = ("extra", "validated", "_missing")
+    _fields = ()
+    _fields_NotValidated = ()
+
+    def __init__(self, values, extra=None, validated=False, missing=frozenset()):
+        for field in self._fields:
+            object.__setattr__(self, field, values.get(field))
+        object.__setattr__(self, "extra", extra or {})
+        object.__setattr__(self, "validated", validated)
+        object.__setattr__(self, "_missing", frozenset(missing))
+
+    @classmethod
+    def from_dict(cls, dictionary, validated=False):
+        if isinstance(dictionary, cls):
+            return dictionary
+        return cls(
+            values={field: cls._convert_from_dict(field, dictionary[field]) for field in cls._fields if field in dictionary},
+            extra={key: value for key, value in dictionary.items() if key not in cls._fields},
+            validated=validated,
+            missing=[field for field in cls._fields if field not in dictionary],
+        )
+
+    def to_dict(self):
+        dictionary = {
+            field: self._convert_to_dict(field, getattr(self, field)) for field in self._fields if field not in self._missing
+        }
+        dictionary.update(self.extra)
+        return dictionary
+
+    def replace(self, **changes):
+        """
+        Returns a new record with changes applied.  Values that did not change are shared with this record.
+        """
+        values = {field: getattr(self, field) for field in self._fields}
+        extra = dict(self.extra)
+        missing = set(self._missing)
+        for key, value in changes.items():
+            if key in self._fields:
+                values[key] = self._convert_from_dict(key, value)
+                missing.discard(key)
+            else:
+                extra[key] = value
+        validated = self.validated and all(key in self._fields_NotValidated for key in changes)
+        return type(self)(values=values, extra=extra, validated=validated, missing=missing)
+
+    ## Read-only dictionary interface, so records can be used where dictionaries were used before
+    def __getitem__(self, key):
+        if key in self._fields and key not in self._missing:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return (key in self._fields and key not in self._missing) or key in self.extra
+
+    def keys(self):
+        return [field for field in self._fields if field not in self._missing] + list(self.extra.keys())
+
+    def __setattr__(self, name, value):
+        raise AttributeError(type(self).__name__ + " records are read-only, use replace()")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __eq__(self, other):
+        if isinstance(other, _Record):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + repr(self.to_dict()) + ")"
+
+    @classmethod
+    def _convert_from_dict(cls, field, value):
+        return value
+
+    @classmethod
+    def _convert_to_dict(cls, field, value):
+        return value
+
+
+class Acquisition(_Record):
+    _fields = tuple(acquisitionParameters_Default.keys())
+    _fields_NotValidated = ("acquire_status", "notes")  ## Status updates do not need the acquisition to be sanitized again
+    __slots__ = _fields
+
+
+class Location:
+    """
+    Sample location, the list of {"motor": ..., "position": ..., "order": ...} entries stored in sample["location"].
+
+    x, y, z, and th are available directly instead of searching the list.  Iterating gives the entries, same as the list.
+    """
+
+    __slots__ = ("entries", "x", "y", "z", "th")
+
+    def __init__(self, entries):
+        object.__setattr__(self, "entries", tuple(entries))
+        for motor in ("x", "y", "z", "th"):
+            object.__setattr__(self, motor, self.position(motor))
+
+    @classmethod
+    def from_list(cls, location):
+        return location if isinstance(location, cls) else cls(location)
+
+    def to_list(self):
+        return [dict(entry) for entry in self.entries]
+
+    def position(self, motor, default=None):
+        ## First entry for the motor, same as get_sample_dictionary_nbs_format_from_rsoxs_config
+        for entry in self.entries:
+            if entry.get("motor") == motor:
+                return entry.get("position")
+        return default
+
+    def replace(self, **positions):
+        """
+        Returns a new Location with new positions for the given motors, e.g., location.replace(x=1.5, th=90).
+        Motors that are not in the location yet are added at the end with order 0.
+        """
+        entries = []
+        motors_done = set()
+        for entry in self.entries:
+            motor = entry.get("motor")
+            if motor in positions and motor not in motors_done:
+                entry = dict(entry, position=positions[motor])
+                motors_done.add(motor)
+            entries.append(entry)
+        for motor, position in positions.items():
+            if motor not in motors_done:
+                entries.append({"motor": motor, "position": position, "order": 0})
+        return Location(entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Location records are read-only, use replace()")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __eq__(self, other):
+        if isinstance(other, Location):
+            return self.entries == other.entries
+        if isinstance(other, (list, tuple)):
+            return list(self.entries) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "Location(" + repr(self.to_list()) + ")"
+
+
+class Sample(_Record):
+    """
+    Sample with its acquisitions (a tuple of Acquisition records) and location (a Location record).
+    sample.x, sample.y, sample.z, and sample.th give the sample position.
+    """
+
+    _fields = tuple(sampleParameters_Empty.keys()) + ("acquisitions",)
+    __slots__ = _fields
+
+    @property
+    def x(self):
+        return self.location.x if isinstance(self.location, Location) else None
+
+    @property
+    def y(self):
+        return self.location.y if isinstance(self.location, Location) else None
+
+    @property
+    def z(self):
+        return self.location.z if isinstance(self.location, Location) else None
+
+    @property
+    def th(self):
+        return self.location.th if isinstance(self.location, Location) else None
+
+    @classmethod
+    def _convert_from_dict(cls, field, value):
+        if field == "location" and isinstance(value, (list, tuple)):
+            return Location.from_list(value)
+        if field == "acquisitions" and isinstance(value, (list, tuple)):
+            return tuple(Acquisition.from_dict(acquisition) for acquisition in value)
+        return value
+
+    @classmethod
+    def _convert_to_dict(cls, field, value):
+        if field == "location" and isinstance(value, Location):
+            return value.to_list()
+        if field == "acquisitions" and isinstance(value, tuple):
+            return [acquisition.to_dict() for acquisition in value]
+        return value
+
+
+def validate_acquisition(acquisition):
+    """
+    Returns a validated Acquisition record.  Acquisitions that were already validated are returned as they are, without sanitizing again.
+    Dictionaries and records that were changed since they were validated go through sanitizeAcquisition.
+    """
+    acquisition = Acquisition.from_dict(acquisition)
+    if acquisition.validated:
+        return acquisition
+    return Acquisition.from_dict(sanitizeAcquisition(acquisition.to_dict()), validated=True)
+
+
+def gather_acquisition_records(configuration):
+    """
+    Same acquisitions as gatherAcquisitionsFromConfiguration, as Acquisition records.
+    The configuration is not copied, so it should not be changed in place afterwards (e.g., use a copy of rsoxs_config["bar"]).
+    """
+    acquisitions = []
+    for sample in configuration:
+        for acquisition in sample["acquisitions"]:
+            values = {parameter: acquisition.get(parameter) for parameter in acquisitionParameters_Default}
+            acquisitions.append(Acquisition(values=values))
+    return acquisitions
+
+
+def benchmark_records(number_of_samples=100, acquisitions_per_sample=10, repeats=20):
+    """
+    Compares dictionaries and records for building the queue, for copying an acquisition, and for a status update during the queue.
+    """
+    from .configuration_index import _make_benchmark_configuration
+
+    configuration = _make_benchmark_configuration(number_of_samples, acquisitions_per_sample)
+    for sample in configuration:
+        for acquisition in sample["acquisitions"]:
+            acquisition.update({"polarization_frame": "lab", "exposure_time": 1, "exposures_per_energy": 1, "cycles": 0, "priority": 1})
+
+    def timed(function):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = function()
+        return (time.perf_counter() - start) / repeats, result
+
+    def memory(function):
+        tracemalloc.start()
+        result = function()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size, result
+
+    time_queue_dict, queue_dict = timed(lambda: sortAcquisitionsQueue(gatherAcquisitionsFromConfiguration(configuration)))
+    time_queue_record, queue_record = timed(lambda: sortAcquisitionsQueue(gather_acquisition_records(configuration)))
+    memory_dict = memory(lambda: sortAcquisitionsQueue(gatherAcquisitionsFromConfiguration(configuration)))[0]
+    memory_record = memory(lambda: sortAcquisitionsQueue(gather_acquisition_records(configuration)))[0]
+
+    acquisition_dict = queue_dict[0]
+    acquisition_record = validate_acquisition(queue_record[0])
+    time_step_dict = timed(lambda: dict(sanitizeAcquisition(acquisition_dict), acquire_status="Started"))[0]
+    time_step_record = timed(lambda: validate_acquisition(acquisition_record).replace(acquire_status="Started"))[0]
+    time_copy_dict = timed(lambda: copy.deepcopy(acquisition_dict))[0]
+    time_copy_record = timed(lambda: copy.deepcopy(acquisition_record))[0]
+
+    number_acquisitions = number_of_samples * acquisitions_per_sample
+    print(str(number_acquisitions) + " acquisitions               dictionaries     records")
+    print(f"gather and sort queue (ms)  {time_queue_dict * 1e3:12.2f}  {time_queue_record * 1e3:10.2f}")
+    print(f"queue memory (kB)           {memory_dict / 1e3:12.1f}  {memory_record / 1e3:10.1f}")
+    print(f"sanitize and update (us)    {time_step_dict * 1e6:12.1f}  {time_step_record * 1e6:10.1f}")
+    print(f"copy one acquisition (us)   {time_copy_dict * 1e6:12.1f}  {time_copy_record * 1e6:10.1f}")
@@ -0,0 +1,211 @@
+## Registry of instrument configurations, i.e., lists of {"motor": ..., "position": ..., "order": ...} setpoints, by name.
+## configurations_instrument defines the configurations here when it is imported.  Hybrid configurations (combinations of other configurations)
+## are only put together when they are first needed, and only configurations whose definitions changed are written to GLOBAL_CONFIGURATION_DICT.
+## Does not import any hardware, so the configuration names are available to the spreadsheet sanitization on any computer.
+
+import hashlib
+
+
+class ConfigurationRegistry:
+    """
+    Configurations by name.  Configurations are stored as tuples and returned as new lists, so changing a returned list does not change the registry.
+
+    Parameters
+    ----------
+    names_always_allowed : list of str
+        Names that are valid configuration_instrument values even if they are not defined in the registry (e.g., "NoBeam").
+        names_allowed starts with these and gets every name defined in the registry.
+    """
+
+    def __init__(self, names_always_allowed=()):
+        self._definitions = {}  ## name: ("setpoints", tuple of dict) or ("hybrid", recipe)
+        self._materialized = {}  ## name: tuple of dict
+        self._hashes = {}  ## name: content hash of the materialized configuration
+        self._definition_hashes = {}  ## name: hash of the definition, see definition_hash
+        self._published = {}  ## id(status_dict): {name: definition hash written}
+        self._names_always_allowed = list(names_always_allowed)
+        self.names_allowed = list(names_always_allowed)
+
+    def define(self, name, configuration_setpoints):
+        """
+        Defines (or replaces) a configuration from a list of setpoints.
+        """
+        self._set_definition(name, ("setpoints", tuple(dict(setpoint) for setpoint in configuration_setpoints)))
+
+    def define_hybrid(self, name, configurations_to_combine, configurations_to_overwrite=(), order_offsets=None):
+        """
+        Defines a configuration that combines other configurations, same as create_hybrid_configuration.
+
+        The setpoints of configurations_to_combine are put together with their orders raised by order_offsets (default 1 for each),
+        then setpoints of motors that are also in configurations_to_overwrite take their values from there.
+        Nothing is combined until the configuration is first needed (get, or publish when the stored copy is out of date), and it is combined again only after a component changes.
+        """
+        if order_offsets is None:
+            order_offsets = [1] * len(configurations_to_combine)
+        recipe = (tuple(configurations_to_combine), tuple(configurations_to_overwrite), tuple(order_offsets))
+        self._set_definition(name, ("hybrid", recipe))
+
+    def remove(self, name):
+        self._definitions.pop(name, None)
+        self._forget(name)
+        self._definition_hashes = {}
+        if name in self.names_allowed and name not in self._names_always_allowed:
+            self.names_allowed.remove(name)
+
+    def get(self, name):
+        """
+        Returns the setpoints of a configuration as a new list.  Raises KeyError if the name is not defined.
+        """
+        return [dict(setpoint) for setpoint in self._materialize(name, ())]
+
+    def content_hash(self, name):
+        self._materialize(name, ())
+        return self._hashes[name]
+
+    def definition_hash(self, name, names_inProgress=()):
+        """
+        Returns a hash of how a configuration is defined: its setpoints, or for a hybrid, its recipe and the definition hashes of its components.
+        Hybrids are not combined to work this out, so it is cheap enough to check every configuration when configurations_instrument is imported.
+        """
+        if name in self._definition_hashes:
+            return self._definition_hashes[name]
+        if name in names_inProgress:
+            raise ValueError("Configuration " + str(name) + " is combined from itself")
+        kind, definition = self._definitions[name]
+        if kind == "setpoints":
+            hash_definition = _hash_setpoints(definition)
+        else:
+            configurations_to_combine, configurations_to_overwrite, order_offsets = definition
+            hash_recipe = hashlib.sha256(repr(definition).encode())
+            for component in configurations_to_combine + configurations_to_overwrite:
+                hash_recipe.update(self.definition_hash(component, names_inProgress + (name,)).encode())
+            hash_definition = hash_recipe.hexdigest()
+        self._definition_hashes[name] = hash_definition
+        return hash_definition
+
+    def names(self):
+        return list(self._definitions.keys())
+
+    def publish(self, status_dict, names=None, hashes_dict=None):
+        """
+        Writes configurations to status_dict (e.g., GLOBAL_CONFIGURATION_DICT), skipping the ones that are already there with the same contents.
+        By default, every defined configuration is written, so that hybrids are listed (e.g., in the GUI) and stale copies from an earlier session are replaced.
+
+        hashes_dict (e.g., GLOBAL_CONFIGURATION_HASHES) keeps the definition hash of each configuration written to status_dict.
+        A configuration whose definition hash is already there is skipped without combining it, so hybrids are only combined on get,
+        or when their definition changed since they were last written.  Without hashes_dict, the stored setpoints are compared instead.
+        Returns the names that were written.
+        """
+        if names is None:
+            names = self.names()
+        published = self._published.setdefault(id(status_dict), {})
+        written = []
+        for name in names:
+            hash_definition = self.definition_hash(name)
+            if published.get(name) == hash_definition:
+                continue
+            if hashes_dict is not None and name in status_dict and hashes_dict.get(name) == hash_definition:
+                published[name] = hash_definition
+                continue
+            if not (name in status_dict and _hash_setpoints(status_dict[name]) == self.content_hash(name)):
+                status_dict[name] = self.get(name)
+                written.append(name)
+            if hashes_dict is not None:
+                hashes_dict[name] = hash_definition
+            published[name] = hash_definition
+        return written
+
+    ## Read-only mapping interface, so the registry can be used where the default_configurations dictionary was used
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self._definitions
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return len(self._definitions)
+
+    def keys(self):
+        return self.names()
+
+    def _set_definition(self, name, definition):
+        self._definitions[name] = definition
+        self._forget(name)
+        self._definition_hashes = {}  ## Hybrids that use this configuration get a new definition hash too
+        if name not in self.names_allowed:
+            self.names_allowed.append(name)  ## Changed in place, because the spreadsheet schema keeps a reference to the list
+
+    def _forget(self, name):
+        ## Configurations that were combined from this one have to be combined again
+        if not self._materialized:
+            return
+        names_stale = {name}
+        changed = True
+        while changed:
+            changed = False
+            for nameOther, (kind, recipe) in self._definitions.items():
+                if kind == "hybrid" and nameOther not in names_stale and names_stale.intersection(recipe[0] + recipe[1]):
+                    names_stale.add(nameOther)
+                    changed = True
+        for nameStale in names_stale:
+            self._materialized.pop(nameStale, None)
+            self._hashes.pop(nameStale, None)
+
+    def _materialize(self, name, names_inProgress):
+        if name in self._materialized:
+            return self._materialized[name]
+        if name in names_inProgress:
+            raise ValueError("Configuration " + str(name) + " is combined from itself")
+        kind, definition = self._definitions[name]
+        if kind == "setpoints":
+            configuration = definition
+        else:
+            configurations_to_combine, configurations_to_overwrite, order_offsets = definition
+            names_inProgress = names_inProgress + (name,)
+            configuration = []
+            for configuration_to_combine, order_offset in zip(configurations_to_combine, order_offsets):
+                for setpoint in self._materialize(configuration_to_combine, names_inProgress):
+                    configuration.append(dict(setpoint, order=int(setpoint["order"] + order_offset)))
+            for configuration_to_overwrite in configurations_to_overwrite:
+                devices_to_update = {setpoint["motor"]: setpoint for setpoint in self._materialize(configuration_to_overwrite, names_inProgress)}
+                for setpoint in configuration:
+                    if setpoint["motor"] in devices_to_update:
+                        setpoint.update(devices_to_update[setpoint["motor"]])
+            configuration = tuple(configuration)
+        self._materialized[name] = configuration
+        self._hashes[name] = _hash_setpoints(configuration)
+        return configuration
+
+
+def _hash_setpoints(configuration_setpoints):
+    ## Motors are identified by name, so the same configuration gives the same hash in every process
+    hash_configuration = hashlib.sha256()
+    for setpoint in configuration_setpoints:
+        entry = [_motor_key(setpoint.get("motor")), repr(setpoint.get("position")), repr(setpoint.get("order"))]
+        if setpoint.get("after"):
+            entry.append(repr([_motor_key(motor) for motor in setpoint["after"]]))
+        hash_configuration.update(repr(entry).encode())
+    return hash_configuration.hexdigest()
+
+
+def _motor_key(motor):
+    return getattr(motor, "name", None) or repr(motor)
+
+
+rsoxs_configuration_registry = ConfigurationRegistry(
+    names_always_allowed=[
+        "NoBeam",
+        "WAXS_OpenBeamImages",
+        "WAXSNEXAFS",
+        "WAXS",
+        "WAXS_LowFlux",
+        "WAXSNEXAFS_Liquids",
+        "WAXS_Liquids",
+        "DM7NEXAFS",
+        "DM7NEXAFS_Liquids",
+        "DM7NEXAFS_Liquids_December2024",
+    ]
+)
@@ -0,0 +1,404 @@
+## Declarative column schema for the Samples and Acquisitions sheets, and a columnar sanitization engine that applies it.
+## The row-by-row functions in configuration_load_save_sanitize stay the reference for configurations written directly in Bluesky.
+## For spreadsheets, the same rules are applied here to whole columns at once, and every problem is collected into a row-indexed error report instead of stopping at the first bad cell.
+
+import ast
+import json
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from ..plans.default_energy_parameters import energy_list_parameters
+from ..plans.energy_grids import get_energy_grid
+from .configuration_load_save_sanitize import (
+    acquisitionParameters_Default,
+    configurationInstrument_Allowed,
+    scanTypes_Allowed,
+    spreadsheetParameters_Strings,
+)
+
+
+## Each column entry can contain:
+## "type": "string", "bool", "int", "number", "list", "json", or "any"
+## "required": column must be present in the sheet
+## "default": value used when the column is missing (and for blank cells if "fill_none" is True, which is the default)
+## "minimum"/"maximum": inclusive numeric range
+## "allowed": list of allowed values
+## "cast": type that valid values are converted to, e.g., int for values that Excel stores as floats
+## "references": column in the Samples sheet that the value must be found in
+## "keywords": strings that are accepted for a "list" column and wrapped in a list, e.g., "Do not rotate"
+## "element_allowed"/"element_minimum"/"element_maximum": checks applied to every element of a "list" column
+## "strip": characters stripped from both ends of a "json" string before parsing
+samples_schema = {
+    "bar_name": {"type": "string", "required": True},
+    "sample_id": {"type": "string", "required": True},
+    "sample_name": {"type": "string", "required": True},
+    "project_name": {"type": "string", "required": True},
+    "institution": {"type": "string", "required": True},
+    "proposal_id": {"type": "int", "required": True, "minimum": 0},
+    "bar_spot": {"type": "string", "required": True},
+    "front": {"type": "bool", "required": True},
+    "grazing": {"type": "bool", "required": True},
+    "angle": {"type": "any", "required": True},  ## Invalid angles default to normal incidence instead of being rejected
+    "height": {"type": "number", "required": True, "minimum": 0},
+    "sample_priority": {"type": "int", "required": True, "minimum": 0},
+    "location": {"type": "json", "default": "[]"},
+    "bar_loc": {"type": "json", "default": "{}"},
+    "acq_history": {"type": "json", "default": "[]", "strip": '\\"'},
+    "notes": {"type": "any", "default": "", "fill_none": False},
+}
+
+acquisitions_schema = {
+    "sample_id": {"type": "any", "references": "sample_id"},
+    "configuration_instrument": {"type": "any", "allowed": configurationInstrument_Allowed},
+    "scan_type": {"type": "any", "allowed": scanTypes_Allowed},
+    "energy_list_parameters": {"type": "any"},  ## Depends on scan_type, see _sanitize_energy_columns
+    "polarization_frame": {"type": "any", "allowed": ["lab", "sample"]},
+    "polarizations": {"type": "list", "element_allowed": [-1], "element_minimum": 0, "element_maximum": 180},
+    "exposure_time": {"type": "number", "minimum": 0.001, "maximum": 10},
+    "exposures_per_energy": {"type": "number", "cast": int},
+    "cycles": {"type": "number", "minimum": 0, "cast": int},
+    "sample_angles": {"type": "list", "keywords": ["Do not rotate"]},
+    "spiral_dimensions": {"type": "any"},  ## Only used for spirals, see _sanitize_energy_columns
+    "group_name": {"type": "any"},
+    "priority": {"type": "number"},
+    "acquire_status": {"type": "any"},
+    "uid_local": {"type": "any"},
+    "notes": {"type": "any"},
+}
+for parameter, default in acquisitionParameters_Default.items():
+    acquisitions_schema[parameter]["default"] = default
+
+spiral_dimensions_default = [0.3, 1.8, 1.8]
+
+
+def sanitize_configuration_columnar(samplesDF, acquisitionsDF):
+    """
+    Sanitize the Samples and Acquisitions sheets column by column and assemble the configuration.
+
+    Parameters
+    ----------
+    samplesDF : pandas.DataFrame
+        Samples sheet as read from the spreadsheet
+    acquisitionsDF : pandas.DataFrame
+        Acquisitions sheet as read from the spreadsheet
+
+    Returns
+    -------
+    configuration : list of dict
+        Same list of samples (with acquisitions attached) that the row-by-row sanitization produces
+    errors : pandas.DataFrame
+        One line per problem with columns sheet, row, column, value, and message.
+        row is the 0-based row of the sheet's data (the header is not counted) and is None for problems with a whole column.
+    """
+    errors = []
+
+    samples = _sanitize_samples_columns(samplesDF, errors)
+    sample_ids = samplesDF["sample_id"] if "sample_id" in samplesDF.columns else pd.Series([], dtype=object)
+    acquisitions = _sanitize_acquisitions_columns(acquisitionsDF, sample_ids, errors)
+
+    ## Attach acquisitions to the first sample with a matching sample_id.
+    ## An acquisition with an existing uid_local replaces the earlier one, same as updateConfigurationWithAcquisition.
+    samples_by_id = {}
+    for sample in samples:
+        samples_by_id.setdefault(sample["sample_id"], (sample, {}))
+    for acquisition in acquisitions:
+        if acquisition["sample_id"] not in samples_by_id:
+            continue
+        sample, uid_positions = samples_by_id[acquisition["sample_id"]]
+        position = uid_positions.get(acquisition["uid_local"])
+        if position is None:
+            uid_positions[acquisition["uid_local"]] = len(sample["acquisitions"])
+            sample["acquisitions"].append(acquisition)
+        else:
+            sample["acquisitions"][position] = acquisition
+
+    return samples, error_report(errors)
+
+
+def error_report(errors):
+    """
+    Returns the list of problems collected during sanitization as a DataFrame sorted by sheet and row.
+    """
+    report = pd.DataFrame(errors, columns=["sheet", "row", "column", "value", "message"])
+    if len(report) > 0:
+        report = report.sort_values(["sheet", "row"], kind="stable", na_position="first").reset_index(drop=True)
+    return report
+
+
+def evaluate_literal_columns(df):
+    """
+    Columnar equivalent of sanitizeSpreadsheet.
+
+    Columns that should be numbers, lists, etc. but were read as strings are converted with ast.literal_eval.
+    Each distinct string is only evaluated once per column.
+    Blank cells are returned as None.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in spreadsheetParameters_Strings or pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_bool_dtype(df[column]):
+            continue  ## Numeric and boolean columns are already typed by the Excel reader.  Text columns can be object or str dtype (pandas >= 3).
+        values = df[column].to_numpy(dtype=object, copy=True)
+        is_string = _isinstance_mask(values, str)
+        if not is_string.any():
+            continue
+        parsed = {value: _literal_eval(value) for value in pd.unique(values[is_string])}
+        for index in np.flatnonzero(is_string):
+            values[index] = _fresh_copy(parsed[values[index]])
+        df[column] = values
+
+    ## Blank cells are loaded as nan by default.  Replace with None.
+    return df.astype(object).where(df.notna(), None)
+
+
+def _sanitize_samples_columns(samplesDF, errors):
+    sheet = "Samples"
+    df = evaluate_literal_columns(samplesDF)
+
+    ## Eliot: Get rid of the stupid unnamed columns thrown in by pandas
+    df = df.drop(columns=[column for column in df.columns if "named" in str(column).lower() or "Index" in str(column)])
+
+    _check_columns(df, samples_schema, sheet, errors)
+
+    ## If sample angles are invalid, default to normal incidence.
+    ## bar_loc["th"] keeps the angle as entered, same as sanitizeSamples.
+    angle_as_entered = df["angle"].to_numpy(dtype=object) if "angle" in df.columns else None
+    if angle_as_entered is not None and "grazing" in df.columns:
+        angles = _as_float(angle_as_entered)
+        grazing = df["grazing"].to_numpy(dtype=object) == True  ## Compared elementwise so that None counts as not grazing
+        invalid_grazing = grazing & ~((angles >= 20) & (angles <= 90))
+        invalid_transmission = ~grazing & ~((angles >= -14) & (angles <= 90))
+        if (invalid_grazing | invalid_transmission).any():
+            print(
+                "Invalid angle in Samples rows "
+                + str(list(df.index[invalid_grazing | invalid_transmission]))
+                + ".  Defaulting to normal incidence."
+            )
+        angles_sanitized = angle_as_entered.copy()
+        angles_sanitized[invalid_grazing] = 90
+        angles_sanitized[invalid_transmission] = 0
+        df["angle"] = angles_sanitized
+
+    samples = df.to_dict(orient="records")
+    bar_spots = df["bar_spot"].to_numpy(dtype=object) if "bar_spot" in df.columns else [None] * len(samples)
+    for index, sample in enumerate(samples):
+        if isinstance(sample["bar_loc"], dict):
+            sample["bar_loc"]["spot"] = bar_spots[index]
+            if angle_as_entered is not None:
+                sample["bar_loc"]["th"] = angle_as_entered[index]
+        sample["acquisitions"] = []
+    return samples
+
+
+def _sanitize_acquisitions_columns(acquisitionsDF, sample_ids, errors):
+    sheet = "Acquisitions"
+    df = evaluate_literal_columns(acquisitionsDF)
+
+    _check_columns(df, acquisitions_schema, sheet, errors, references={"sample_id": sample_ids})
+    _sanitize_energy_columns(df, sheet, errors)
+
+    ## Adding a local UID (not the same as Tiled's UID) so that each acquisition can be updated while it is running
+    uids = df["uid_local"].to_numpy(dtype=object)
+    for index in np.flatnonzero(pd.isna(uids)):
+        uids[index] = uuid.uuid4()
+    df["uid_local"] = uids
+
+    return df.to_dict(orient="records")
+
+
+def _check_columns(df, schema, sheet, errors, references=None):
+    """
+    Applies schema to df in place: adds missing columns with their defaults, fills blanks, checks types and values, and casts.
+    """
+    for column, rules in schema.items():
+        if column not in df.columns:
+            if rules.get("required", False):
+                errors.append(
+                    _error(sheet, None, column, None, column + " is a required parameter.  Please add " + column + " parameter with an appropriate value.")
+                )
+                continue
+            df[column] = [_fresh_copy(rules.get("default")) for _ in range(len(df))]
+
+        values = df[column].to_numpy(dtype=object, copy=True)
+        blank = pd.isna(values)
+        if rules.get("fill_none", True) and "default" in rules and blank.any():
+            for index in np.flatnonzero(blank):
+                values[index] = _fresh_copy(rules["default"])
+            blank = pd.isna(values)
+
+        kind = rules.get("type", "any")
+        if kind == "json":
+            values, invalid = _parse_json_column(values, rules.get("strip", ""))
+            _report(errors, sheet, df.index, column, values, invalid, column + " must be valid JSON.")
+        elif kind == "list":
+            values = _listify_column(values, rules.get("keywords", []))
+            invalid = ~_isinstance_mask(values, (list, tuple))
+            invalid |= _invalid_list_elements(values, rules) & ~invalid
+            _report(errors, sheet, df.index, column, values, invalid, "Please enter valid " + column)
+        elif kind != "any":
+            invalid = ~_type_mask(values, kind)
+            _report(errors, sheet, df.index, column, values, invalid, column + _type_messages[kind])
+            if kind in ("int", "number"):
+                numbers = _as_float(values)
+                out_of_range = np.zeros(len(values), dtype=bool)
+                if "minimum" in rules:
+                    out_of_range |= numbers < rules["minimum"]
+                if "maximum" in rules:
+                    out_of_range |= numbers > rules["maximum"]
+                _report(errors, sheet, df.index, column, values, out_of_range & ~invalid, column + _range_message(rules))
+                ## Excel stores integers as floats when a column has blank cells, so integral floats are cast back to int
+                cast = rules.get("cast", int if kind == "int" else None)
+                if cast is not None:
+                    for index in np.flatnonzero(~invalid & _isinstance_mask(values, (float, np.number))):
+                        values[index] = cast(values[index])
+
+        if "allowed" in rules:
+            invalid = ~pd.Series(values, dtype=object).isin(rules["allowed"]).to_numpy()
+            _report(errors, sheet, df.index, column, values, invalid, "Please enter valid " + column)
+        if "references" in rules:
+            invalid = ~pd.Series(values, dtype=object).isin(references[column]).to_numpy()
+            _report(errors, sheet, df.index, column, values, invalid, column + " was not found in Samples list")
+
+        df[column] = values
+
+
+def _sanitize_energy_columns(df, sheet, errors):
+    """
+    Checks energy_list_parameters and spiral_dimensions against scan_type, same as sanitizeTimeScan, sanitizeSpirals, and sanitizeEnergyScan.
+    """
+    scan_types = df["scan_type"].to_numpy(dtype=object)
+    energies = df["energy_list_parameters"].to_numpy(dtype=object, copy=True)
+    is_number = _type_mask(energies, "number")
+
+    single_energy = pd.Series(scan_types, dtype=object).isin(["time", "time2D", "spiral"]).to_numpy()
+    _report(errors, sheet, df.index, "energy_list_parameters", energies, single_energy & ~is_number, "energy_list_parameters must be a single number.")
+
+    energy_scan = pd.Series(scan_types, dtype=object).isin(["nexafs", "rsoxs", "nexafs_fly"]).to_numpy()
+    for index in np.flatnonzero(energy_scan & is_number):
+        energies[index] = (energies[index],)
+    is_string = _isinstance_mask(energies, str)
+    unknown_plan = energy_scan & is_string & ~pd.Series(energies, dtype=object).isin(list(energy_list_parameters.keys())).to_numpy()
+    _report(errors, sheet, df.index, "energy_list_parameters", energies, unknown_plan, "Please enter valid energy plan.")
+    for index in np.flatnonzero(energy_scan & ~is_string):
+        try:
+            energy_grid = get_energy_grid(energies[index])
+        except ValueError as error:
+            errors.append(_error(sheet, df.index[index], "energy_list_parameters", energies[index], str(error)))
+            continue
+        if scan_types[index] == "nexafs_fly" and energy_grid.number_points < 2:
+            errors.append(_error(sheet, df.index[index], "energy_list_parameters", energies[index], "Fly scans need a range of energies."))
+    df["energy_list_parameters"] = energies
+
+    spiral = scan_types == "spiral"
+    dimensions = df["spiral_dimensions"].to_numpy(dtype=object, copy=True)
+    for index in np.flatnonzero(spiral & pd.isna(dimensions)):
+        dimensions[index] = list(spiral_dimensions_default)
+    lengths = np.array([len(value) if isinstance(value, (list, tuple)) else -1 for value in dimensions])
+    _report(errors, sheet, df.index, "spiral_dimensions", dimensions, spiral & (lengths != 3), "spiral_dimensions must be a list with 3 elements.")
+    df["spiral_dimensions"] = dimensions
+
+
+_type_messages = {
+    "string": " must be a string",
+    "bool": " must be TRUE or FALSE",
+    "int": " must be a positive integer",
+    "number": " must be a number",
+}
+
+
+def _range_message(rules):
+    if "minimum" in rules and "maximum" in rules:
+        return " must be between " + str(rules["minimum"]) + " and " + str(rules["maximum"]) + "."
+    if "minimum" in rules:
+        return " must be " + str(rules["minimum"]) + " or larger."
+    return " must be " + str(rules.get("maximum")) + " or smaller."
+
+
+def _type_mask(values, kind):
+    if kind == "string":
+        return _isinstance_mask(values, str)
+    if kind == "bool":
+        return _isinstance_mask(values, (bool, np.bool_))
+    if kind == "int":
+        is_float = _isinstance_mask(values, (float, np.floating))
+        return _isinstance_mask(values, (int, np.integer)) | (is_float & (np.mod(_as_float(values), 1) == 0))
+    if kind == "number":
+        return _isinstance_mask(values, (int, float, np.number)) & ~pd.isna(values)
+    raise ValueError("Unknown column type " + str(kind))
+
+
+def _isinstance_mask(values, types):
+    return np.fromiter((isinstance(value, types) for value in values), dtype=bool, count=len(values))
+
+
+def _as_float(values):
+    """
+    Returns values as a float array with nan wherever the value is not a number.
+    """
+    return pd.to_numeric(pd.Series(values, dtype=object).where(_type_mask_number(values)), errors="coerce").to_numpy(dtype=float)
+
+
+def _type_mask_number(values):
+    return _isinstance_mask(values, (int, float, np.number)) & ~_isinstance_mask(values, (bool, np.bool_))
+
+
+def _listify_column(values, keywords):
+    values = values.copy()
+    for index, value in enumerate(values):
+        if isinstance(value, (int, float)) or value in keywords:
+            values[index] = [value]
+    return values
+
+
+def _invalid_list_elements(values, rules):
+    if not any(key in rules for key in ("element_allowed", "element_minimum", "element_maximum")):
+        return np.zeros(len(values), dtype=bool)
+    lists = pd.Series([value if isinstance(value, (list, tuple)) else [] for value in values], dtype=object)
+    elements = lists.explode().dropna()
+    numbers = pd.to_numeric(elements, errors="coerce")
+    valid = numbers.isin(rules.get("element_allowed", []))
+    in_range = numbers.notna()
+    if "element_minimum" in rules:
+        in_range &= numbers >= rules["element_minimum"]
+    if "element_maximum" in rules:
+        in_range &= numbers <= rules["element_maximum"]
+    invalid_rows = elements.index[~(valid | in_range).to_numpy()]
+    return np.isin(np.arange(len(values)), invalid_rows)
+
+
+def _parse_json_column(values, strip):
+    invalid = np.zeros(len(values), dtype=bool)
+    for index, value in enumerate(values):
+        if not isinstance(value, str):
+            continue  ## Already parsed, e.g., a configuration that was not read from a spreadsheet
+        try:
+            values[index] = json.loads(value.replace("'", '"').rstrip(strip).lstrip(strip))
+        except ValueError:
+            invalid[index] = True
+    return values, invalid
+
+
+def _literal_eval(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return value  ## If not a Python literal, return as is
+
+
+def _fresh_copy(value):
+    ## Parsed and default values are shared between rows, so lists and dictionaries are copied before being stored in a row
+    if isinstance(value, list):
+        return [_fresh_copy(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _fresh_copy(item) for key, item in value.items()}
+    return value
+
+
+def _report(errors, sheet, index, column, values, invalid, message):
+    for position in np.flatnonzero(invalid):
+        errors.append(_error(sheet, index[position], column, values[position], message))
+
+
+def _error(sheet, row, column, value, message):
+    return {"sheet": sheet, "row": row, "column": column, "value": value, "message": message}
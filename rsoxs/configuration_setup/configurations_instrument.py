@@ -1,5 +1,6 @@
 import numpy as np
 import copy
+import uuid
 
 # from ..startup import RE
 from nbs_bl.queueserver import GLOBAL_USER_STATUS
@@ -33,19 +34,65 @@ from nbs_bl.hw import (
 )
 
 from ..HW.energy import mono_en, grating_to_1200
+from .configuration_moves import (
+    get_configuration_moves,
+    estimate_time_saved,
+    snapshot_positions,
+    compare_to_configurations,
+    ConfigurationPlanner,
+)
+from .configuration_registry import rsoxs_configuration_registry
 
 GLOBAL_CONFIGURATION_DICT = GLOBAL_USER_STATUS.request_status_dict("RSoXS_Config")
+## Definition hash of each configuration in GLOBAL_CONFIGURATION_DICT, so that configurations that did not change are not combined again at import
+GLOBAL_CONFIGURATION_HASHES = GLOBAL_USER_STATUS.request_status_dict("RSoXS_Config_Hashes")
+
+## Motors that need a different tolerance than configurationTolerance_Default (0.01) to be considered in position when skip_in_position is used
+configurationTolerances = {
+    en: 0.05,
+    sam_Th: 0.05,
+    mir1.pitch: 0.001,
+    mir3.pitch: 0.001,
+    mir4.pitch: 0.001,
+}
+
+## Motors that have to finish moving before other motors start, used when moving with use_planner.
+## These apply on top of "order" and a setpoint's "after" entry, so they still protect the detectors when a configuration's order groups are not set up for it.
+position_CameraWAXS_Retracted_Maximum = -50 ## Camera positions below this are out of the beam path
+detectors_WAXS = [Det_W, BeamStopW]
+configurationInterlocks = [
+    ## Retract the camera before moving the beamstop, and get the beamstop in before the camera
+    {"first": Det_W, "then": BeamStopW, "when": lambda targets: targets[Det_W] < position_CameraWAXS_Retracted_Maximum},
+    {"first": BeamStopW, "then": Det_W, "when": lambda targets: targets[Det_W] >= position_CameraWAXS_Retracted_Maximum},
+    ## Protect detectors before moving samples
+    *[{"first": detector, "then": sample_motor} for detector in detectors_WAXS for sample_motor in [sam_X, sam_Y, sam_Z, sam_Th, TEMY, TEMZ]],
+    ## Beamstop in place before opening up the beam
+    *[
+        {"first": BeamStopW, "then": beam_motor}
+        for beam_motor in [
+            slits_foe.vcenter, slits_foe.vsize, slits_foe.hcenter, slits_foe.hsize,
+            shutter_y,
+            slitsc, slits1.vsize, slits1.hsize, slits2.vsize, slits2.hsize, slits3.vsize, slits3.hsize,
+        ]
+    ],
+]
+## Devices that only keep the "order" of their own axes, so they move at the same time as other devices.  Every other motor waits for all lower "order" values.
+## The mirror hexapods are not in any configuration with detectors or slits, and their axes still move one order at a time.
+configurationIndependent = [mir1, mir3, mir4]
+configuration_planner = ConfigurationPlanner(interlocks=configurationInterlocks, tolerances=configurationTolerances, independent=configurationIndependent)
 
 
 def load_configuration(
         configuration_name,
         dryrun = False,
+        skip_in_position = False,
+        use_planner = False,
 ):
     print("Loading instrument configuration: " + str(configuration_name))
 
     if dryrun == True: return
 
-    yield from move_motors(configuration_name)
+    yield from move_motors(configuration_name, skip_in_position=skip_in_position, use_planner=use_planner)
 
     if "NEXAFS" in configuration_name:
         mdToUpdate = {
@@ -75,9 +122,16 @@ def load_configuration(
         bl.md.update(mdToUpdate)
 
 
-def move_motors(configuration_name):
-    ## configuration is a string that is a key in the default_configurations dictionary
-    configuration_setpoints = GLOBAL_CONFIGURATION_DICT[configuration_name]
+def move_motors(configuration_name, skip_in_position=False, use_planner=False):
+    ## configuration is a string that is a name in rsoxs_configuration_registry or GLOBAL_CONFIGURATION_DICT
+    configuration_setpoints = get_configuration_setpoints(configuration_name)
+
+    if use_planner:
+        yield from move_motors_planned(configuration_name, configuration_setpoints)
+        return
+    if skip_in_position:
+        yield from move_motors_not_in_position(configuration_setpoints)
+        return
 
     ## Sort by order
     configuration_setpoints_sorted = sorted(configuration_setpoints, key=lambda x: x["order"])
@@ -93,12 +147,111 @@ def move_motors(configuration_name):
             yield from bps.mv(*move_list)
 
 
+def move_motors_not_in_position(configuration_setpoints, tolerances=configurationTolerances):
+    ## Reads all the motors once, then moves only the ones that are not already at their setpoint.  Order groups with nothing to move are skipped.
+    positions_current = read_positions([setpoint["motor"] for setpoint in configuration_setpoints])
+    moves, skipped = get_configuration_moves(configuration_setpoints, positions_current, tolerances=tolerances)
+    for order, move_list in moves:
+        yield from bps.mv(*[value for motor_position in move_list for value in motor_position])
+    if skipped:
+        print(
+            str(len(skipped)) + " of " + str(len(configuration_setpoints)) + " motors already in position, "
+            + str(len(moves)) + " order groups moved, about " + str(round(estimate_time_saved(configuration_setpoints, moves))) + " s saved"
+        )
+
+
+def move_motors_planned(configuration_name, configuration_setpoints, planner=configuration_planner):
+    ## Moves only the motors that are not in position, each one as soon as the moves it depends on (order, interlocks, "after") are done
+    motors = [setpoint["motor"] for setpoint in configuration_setpoints]
+    plan = planner.plan(
+        bl.md.get("RSoXS_Config"),
+        configuration_name,
+        configuration_setpoints,
+        read_positions(motors),
+        velocities=read_velocities(motors),
+    )
+    groups = []
+    groups_done = set()
+    for move in plan["moves"]:
+        for indexBefore in move["after"]:
+            if indexBefore not in groups_done:
+                yield from bps.wait(groups[indexBefore])
+                groups_done.add(indexBefore)
+        groups.append(str(uuid.uuid4()))
+        yield from bps.abs_set(move["motor"], move["position"], group=groups[-1])
+    for index, group in enumerate(groups):
+        if index not in groups_done:
+            yield from bps.wait(group)
+    if plan["moves"]:
+        print(
+            str(len(plan["moves"])) + " motors moved (" + str(len(plan["skipped"])) + " already in position).  "
+            + "Estimated time " + str(round(plan["time_critical_path"], 1)) + " s along the critical path ("
+            + ", ".join(str(getattr(plan["moves"][index]["motor"], "name", "")) for index in plan["critical_path"])
+            + ") instead of " + str(round(plan["time_in_order"], 1)) + " s moving one order group at a time"
+        )
+
+
+def read_velocities(motors):
+    ## Velocities for the move time estimates.  Motors without a readable velocity are left out.
+    velocities = {}
+    for motor in motors:
+        try:
+            velocities[motor] = float(motor.velocity.get())
+        except Exception:
+            pass
+    return velocities
+
+
+def read_positions(motors):
+    ## Current position of each motor, all read at the same time.  None if it cannot be read, so that the motor is moved anyway.
+    return snapshot_positions(motors)["positions"]
+
+
+def snapshot_configurations(configuration_names=None, print_report=True):
+    """
+    Reads the motors of one or more configurations at the same time and reports which configuration the instrument is closest to.
+
+    Parameters
+    ----------
+    configuration_names : list of str, optional
+        Configurations to compare with.  Defaults to all configurations in rsoxs_configuration_registry.
+    print_report : bool
+        Prints the nearest configurations and the motors that are out of position
+
+    Returns
+    -------
+    dict with the snapshot from snapshot_positions ("positions", "timestamps", "time", "duration"), plus
+        "configurations": comparison with each configuration from compare_to_configurations, nearest first
+        "nearest": name of the nearest configuration
+    """
+    if configuration_names is None:
+        configuration_names = rsoxs_configuration_registry.names()
+    configurations = {name: get_configuration_setpoints(name) for name in configuration_names}
+    snapshot = snapshot_positions([setpoint["motor"] for configuration_setpoints in configurations.values() for setpoint in configuration_setpoints])
+    snapshot["configurations"] = compare_to_configurations(snapshot["positions"], configurations, tolerances=configurationTolerances)
+    snapshot["nearest"] = snapshot["configurations"][0]["name"] if snapshot["configurations"] else None
+
+    if print_report:
+        print("Read " + str(len(snapshot["positions"])) + " motors in " + str(round(snapshot["duration"] * 1000)) + " ms")
+        for report in snapshot["configurations"][:3]:
+            print(
+                str(report["name"]) + ": " + ("in position" if report["in_position"] else
+                str(len(report["motors_out_of_position"])) + " motors out of position, " + str(len(report["motors_unknown"])) + " unknown")
+            )
+            for motor, position_current, position in report["motors_out_of_position"]:
+                print("    " + str(getattr(motor, "name", motor)) + " at " + str(position_current) + ", setpoint " + str(position))
+    return snapshot
+
+
 ## TODO: this is an example of a function I would want available in bsui_local, but wouldn't be available on a personal computer
 def view_positions(configuration_name):
     ## Prints positions of motors in that configuration without moving anything
-    configuration_setpoints = GLOBAL_CONFIGURATION_DICT[configuration_name]
-    for indexMotor, motor in enumerate(configuration_setpoints):
-        print(motor["motor"].read())
+    snapshot = snapshot_configurations([configuration_name], print_report=False)
+    for setpoint in get_configuration_setpoints(configuration_name):
+        print(
+            str(getattr(setpoint["motor"], "name", setpoint["motor"])) + ": " + str(snapshot["positions"][setpoint["motor"]])
+            + " (setpoint " + str(setpoint["position"]) + ")"
+        )
 
 
 
@@ -124,7 +277,7 @@ def create_hybrid_configuration(
     ## Build base configuration where all detectors are retracted
     for configuration_to_combine in configurations_to_combine:
         configurations_dictionary[new_configuration_name].extend(
-            {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 1)}
+            {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 1), **({"after": item["after"]} if "after" in item else {})}
             for item in configurations_dictionary[configuration_to_combine]
             )
     
@@ -462,18 +615,20 @@ default_configurations = {
 
 
 ## Construct configurations that combine the components above.
-## Can't just copy.deepcopy configurations to piece together new configurations because the motor objects might contain references back to themselves, and then we get `RecursionError: maximum recursion depth exceeded` when we try to load `profile_collection`
-## Instead, make a new ditionary
-default_configurations["NoBeam_WAXS"] = [
-    {"motor": item["motor"], "position": item["position"], "order": item["order"]}
-    for item in default_configurations["RSoXSSlits_Retracted"]
-]
+## Combined configurations are put together by the registry the first time they are used (see configuration_registry)
+for configuration_name, configuration_setpoints in default_configurations.items():
+    rsoxs_configuration_registry.define(configuration_name, configuration_setpoints)
+
+rsoxs_configuration_registry.define_hybrid(
+        "NoBeam_WAXS",
+        configurations_to_combine = ["RSoXSSlits_Retracted"],
+        order_offsets = [0],
+)
 ## Not sure if this is necessary.  Had made it to run count scans when I don't have beam to test automated workflow.
 
 ## TODO: maybe have a Detectors_Retracted_Science and Detectors_Retracted_Commissioning version where the latter includes upstream fluorescence screens like FS1, FS6, and FS7?  Unsure how to treat I0 because I do treat it as a detector for commissioning purposes.
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "detectors_retracted",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "detectors_retracted",
         configurations_to_combine = [
                 "WAXS_Retracted",
                 #"SAXS_Retracted", ## No SAXS detector currently
@@ -486,39 +641,26 @@ default_configurations = create_hybrid_configuration(
 
 
 
-default_configurations["RSoXS_Retracted"] = [
-    {"motor": item["motor"], "position": item["position"], "order": item["order"]}
-    for item in default_configurations["detectors_retracted"] ## Protect detectors first
-]
-default_configurations["RSoXS_Retracted"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 1)}
-    for item in default_configurations["SolidSamples_Retracted"] ## Protect samples next
-    )
-default_configurations["RSoXS_Retracted"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 1)}
-    for item in default_configurations["TEMSample_Retracted"]
-    )
-default_configurations["RSoXS_Retracted"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 2)}
-    for item in default_configurations["RSoXSSlits_Retracted"]
-    )
-default_configurations["RSoXS_Retracted"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 2)}
-    for item in default_configurations["FastShutter_Retracted"]
-    )
-default_configurations["RSoXS_Retracted"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 2)}
-    for item in default_configurations["DMRSoXS_Retracted"]
-    )
+rsoxs_configuration_registry.define_hybrid(
+        "RSoXS_Retracted",
+        configurations_to_combine = [
+                "detectors_retracted", ## Protect detectors first
+                "SolidSamples_Retracted", ## Protect samples next
+                "TEMSample_Retracted",
+                "RSoXSSlits_Retracted",
+                "FastShutter_Retracted",
+                "DMRSoXS_Retracted",
+            ],
+        order_offsets = [0, 1, 1, 2, 2, 2],
+)
 
 
 #default_configurations["NEXAFSStation"]
 ## TODO: Do things like putting M4 into place, setting energy to 270 eV, polarization to 0.
 
 
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "RSoXS_Upstream",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "RSoXS_Upstream",
         configurations_to_combine = [
                 "FOESlits_HighFlux",
                 "SlitC_Retracted",
@@ -532,30 +674,20 @@ default_configurations = create_hybrid_configuration(
             ],
 )
 
-default_configurations["RSoXS_Upstream_Liquids"] = [
-    {"motor": item["motor"], "position": item["position"], "order": item["order"]}
-    for item in default_configurations["SlitC_Retracted"]
-]
-default_configurations["RSoXS_Upstream_Liquids"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"])}
-    for item in default_configurations["RSoXSSlits_Centers"]
-    )
-default_configurations["RSoXS_Upstream_Liquids"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"])}
-    for item in default_configurations["RSoXSSlits_ApertureSizes_LiquidSamples"]
-    )
-default_configurations["RSoXS_Upstream_Liquids"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 1)}
-    for item in default_configurations["DMRSoXS_Mesh"]
-    )
-default_configurations["RSoXS_Upstream_Liquids"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 1)}
-    for item in default_configurations["FastShutter"]
-    )
+rsoxs_configuration_registry.define_hybrid(
+        "RSoXS_Upstream_Liquids",
+        configurations_to_combine = [
+                "SlitC_Retracted",
+                "RSoXSSlits_Centers",
+                "RSoXSSlits_ApertureSizes_LiquidSamples",
+                "DMRSoXS_Mesh",
+                "FastShutter",
+            ],
+        order_offsets = [0, 0, 0, 1, 1],
+)
 
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "WAXSNEXAFS",
-        configurations_dictionary = default_configurations, #copy.deepcopy(default_configurations),
+rsoxs_configuration_registry.define_hybrid(
+        "WAXSNEXAFS",
         configurations_to_combine = [
                 "RSoXS_Upstream",
                 "detectors_retracted"
@@ -564,9 +696,8 @@ default_configurations = create_hybrid_configuration(
                 "WAXS_Beamstop",
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "WAXS",
-        configurations_dictionary = default_configurations, #copy.deepcopy(default_configurations),
+rsoxs_configuration_registry.define_hybrid(
+        "WAXS",
         configurations_to_combine = [
                 "RSoXS_Upstream",
                 "detectors_retracted"
@@ -577,9 +708,8 @@ default_configurations = create_hybrid_configuration(
 )
 
 
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "DM7NEXAFS",
-        configurations_dictionary = default_configurations, #copy.deepcopy(default_configurations),
+rsoxs_configuration_registry.define_hybrid(
+        "DM7NEXAFS",
         configurations_to_combine = [
                 "RSoXS_Upstream",
                 "detectors_retracted"
@@ -588,9 +718,8 @@ default_configurations = create_hybrid_configuration(
                 "DM7_Photodiode",
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "DM7_FluorescenceImage",
-        configurations_dictionary = default_configurations, #copy.deepcopy(default_configurations),
+rsoxs_configuration_registry.define_hybrid(
+        "DM7_FluorescenceImage",
         configurations_to_combine = [
                 "RSoXS_Upstream",
                 "detectors_retracted"
@@ -602,9 +731,8 @@ default_configurations = create_hybrid_configuration(
 ## This is just a copy of DM7NEXAFS
 ## It is just a dummy configuration to take dark WAXS camera images 
 ## PyHyperScattering will throw errors if the configuration does not have "WAXS" in it
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "DM7NEXAFS_WAXS",
-        configurations_dictionary = default_configurations, #copy.deepcopy(default_configurations),
+rsoxs_configuration_registry.define_hybrid(
+        "DM7NEXAFS_WAXS",
         configurations_to_combine = [
                 "DM7NEXAFS",
             ],
@@ -614,19 +742,17 @@ default_configurations = create_hybrid_configuration(
 
 
 
-default_configurations["DM7NEXAFS_Liquids"] = [
-    {"motor": item["motor"], "position": item["position"], "order": item["order"]}
-    for item in default_configurations["RSoXS_Upstream_Liquids"]
-]
-default_configurations["DM7NEXAFS_Liquids"].extend(
-    {"motor": item["motor"], "position": item["position"], "order": int(item["order"] + 1)}
-    for item in default_configurations["detectors_retracted"]
-    )
-## Start with all detectors retracted and then bring in the desired detectors
-devices_to_update = {item["motor"]: item for item in default_configurations["DM7_Photodiode"]}
-for item in default_configurations["DM7NEXAFS_Liquids"]:
-    if item["motor"] in devices_to_update:
-        item.update(devices_to_update[item["motor"]])
+rsoxs_configuration_registry.define_hybrid(
+        "DM7NEXAFS_Liquids",
+        configurations_to_combine = [
+                "RSoXS_Upstream_Liquids",
+                "detectors_retracted",
+            ],
+        configurations_to_overwrite = [
+                "DM7_Photodiode", ## Start with all detectors retracted and then bring in the desired detectors
+            ],
+        order_offsets = [0, 1],
+)
 
 
 
@@ -638,9 +764,8 @@ for item in default_configurations["DM7NEXAFS_Liquids"]:
 
 
 
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "RSoXS_Upstream_BroadbandReflectivity",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "RSoXS_Upstream_BroadbandReflectivity",
         configurations_to_combine = [
                 "SlitC_Retracted",
                 "RSoXSSlits_Centers",
@@ -652,9 +777,8 @@ default_configurations = create_hybrid_configuration(
                 
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "DM7NEXAFS_BroadbandReflectivity",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "DM7NEXAFS_BroadbandReflectivity",
         configurations_to_combine = [
                 "RSoXS_Upstream_BroadbandReflectivity",
                 "detectors_retracted"
@@ -663,9 +787,8 @@ default_configurations = create_hybrid_configuration(
                 "DM7_Photodiode",
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "DM7_FluorescenceImage_BroadbandReflectivity",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "DM7_FluorescenceImage_BroadbandReflectivity",
         configurations_to_combine = [
                 "RSoXS_Upstream_BroadbandReflectivity",
                 "detectors_retracted"
@@ -674,9 +797,8 @@ default_configurations = create_hybrid_configuration(
                 "DM7_FS13",
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "WAXS_BroadbandReflectivity",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "WAXS_BroadbandReflectivity",
         configurations_to_combine = [
                 "FOESlits_Attenuated",
                 "SlitC_Retracted",
@@ -690,9 +812,8 @@ default_configurations = create_hybrid_configuration(
                 
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "WAXS_BroadbandReflectivity_withI0Mesh",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "WAXS_BroadbandReflectivity_withI0Mesh",
         configurations_to_combine = [
                 "FOESlits_Attenuated",
                 "SlitC_Retracted",
@@ -706,9 +827,8 @@ default_configurations = create_hybrid_configuration(
                 
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "WAXS_LowFluxNEXAFS",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "WAXS_LowFluxNEXAFS",
         configurations_to_combine = [
                 "FOESlits_Attenuated",
                 "SlitC_Retracted",
@@ -722,9 +842,8 @@ default_configurations = create_hybrid_configuration(
                 
             ],
 )
-default_configurations = create_hybrid_configuration(
-        new_configuration_name = "WAXS_LowFluxNEXAFS_withI0Mesh",
-        configurations_dictionary = default_configurations, 
+rsoxs_configuration_registry.define_hybrid(
+        "WAXS_LowFluxNEXAFS_withI0Mesh",
         configurations_to_combine = [
                 "FOESlits_Attenuated",
                 "SlitC_Retracted",
@@ -746,15 +865,29 @@ default_configurations = create_hybrid_configuration(
 
 
 
-GLOBAL_CONFIGURATION_DICT.update(default_configurations)
+default_configurations = rsoxs_configuration_registry ## Same names as before, including the combined configurations
+
+## Every configuration is written, including the combined ones, so the GUI lists them all.
+## Only ones whose definitions changed since they were written to GLOBAL_CONFIGURATION_DICT are combined and written.
+rsoxs_configuration_registry.publish(GLOBAL_CONFIGURATION_DICT, hashes_dict=GLOBAL_CONFIGURATION_HASHES)
+
+
+def get_configuration_setpoints(configuration_name):
+    ## Setpoints of a configuration.  GLOBAL_CONFIGURATION_DICT is already up to date from the import and add_configuration.
+    if configuration_name in rsoxs_configuration_registry:
+        return rsoxs_configuration_registry.get(configuration_name)
+    return GLOBAL_CONFIGURATION_DICT[configuration_name] ## e.g., added in another session
 
 
 def add_configuration(configuration_name, configuration_setpoints):
-    GLOBAL_CONFIGURATION_DICT.update({configuration_name: configuration_setpoints})
+    rsoxs_configuration_registry.define(configuration_name, configuration_setpoints)
+    rsoxs_configuration_registry.publish(GLOBAL_CONFIGURATION_DICT, hashes_dict=GLOBAL_CONFIGURATION_HASHES) ## Also the combined configurations that use this one
 
 
 def remove_configuration(configuration_name):
+    rsoxs_configuration_registry.remove(configuration_name)
     GLOBAL_CONFIGURATION_DICT.pop(configuration_name, None)
+    GLOBAL_CONFIGURATION_HASHES.pop(configuration_name, None)
 
 
 ## TODO: break up the function so that undulator movements are separated.  We lose PV write access during maintenance/shutdown periods.
@@ -0,0 +1,271 @@
+## Orders the acquisitions queue to reduce time spent changing the instrument between acquisitions.
+## Acquisitions are still run in order of priority.  Within each priority, the order is chosen to avoid going back and forth between
+## instrument configurations, gratings, polarizations, energies, and samples.
+
+from ..plans.energy_grids import get_energy_grid
+
+
+## Estimated time (seconds) for each kind of change between consecutive acquisitions.
+## Rough numbers; they only need to be right relative to each other for the ordering to be useful.
+transitionCosts_Default = {
+    "configuration_instrument": 120,  ## load_configuration moves several motors in sequence
+    "grating": 60,  ## grating_to_250/grating_to_1200 take about a minute
+    "polarization": 15,  ## EPU phase/mode change
+    "energy_per_eV": 0.02,  ## Monochromator and EPU gap travel
+    "energy_jump": 10,  ## Extra settling time when moving to a different absorption edge
+    "energy_jump_eV": 50,  ## Energy change above which energy_jump is added
+    "sample": 5,  ## load_samp
+    "sample_speed": 1.0,  ## mm/s, sample x and y travel, when sample positions are known (position_function)
+    "sample_rotation_speed": 10,  ## deg/s, sample rotation, when sample positions are known
+}
+
+
+def transition_cost(statePrevious, stateNext, costs=transitionCosts_Default):
+    """
+    Default cost model.  Returns the estimated time (seconds) to go from the state at the end of one acquisition to the state at the start of the next.
+
+    States are dictionaries from get_acquisition_states.  Parameters that are None (unknown or not moved) do not add to the cost.
+    A custom cost model can be any function with the same inputs and output, passed to scheduleAcquisitionsQueue as cost_function.
+    """
+    cost = 0
+    for parameter in ["configuration_instrument", "grating", "polarization", "sample_id"]:
+        valuePrevious, valueNext = statePrevious.get(parameter), stateNext.get(parameter)
+        if valuePrevious is not None and valueNext is not None and valuePrevious != valueNext:
+            cost += costs["sample" if parameter == "sample_id" else parameter]
+
+    ## With known sample positions (see get_acquisition_states), moving and rotating the sample also counts, including between angles of the same sample
+    positionPrevious, positionNext = statePrevious.get("sample_position"), stateNext.get("sample_position")
+    if positionPrevious is not None and positionNext is not None:
+        cost += _sample_move_time(positionPrevious, positionNext, costs)
+
+    energyPrevious, energyNext = statePrevious.get("energy"), stateNext.get("energy")
+    if energyPrevious is not None and energyNext is not None:
+        energyChange = abs(energyNext - energyPrevious)
+        cost += costs["energy_per_eV"] * energyChange
+        if energyChange > costs["energy_jump_eV"]:
+            cost += costs["energy_jump"]
+    return cost
+
+
+def get_acquisition_states(acquisition, grating_function=None, position_function=None):
+    """
+    Returns the instrument state at the start and at the end of an acquisition, as used by the cost model.
+
+    grating_function(acquisition) returns the grating an acquisition needs.
+    By default, the grating is taken from an optional "grating" column (e.g., "250" or "1200"), and is otherwise unknown.
+    position_function(acquisition) returns the sample position ({"x", "y", "th"}) at the start and at the end, e.g., from bar_geometry.make_sample_position_function.
+    By default, sample positions are unknown and only changing samples counts.
+    """
+    if grating_function is None:
+        grating_function = lambda acquisition: acquisition.get("grating")
+
+    stateStart = {
+        "configuration_instrument": acquisition.get("configuration_instrument"),
+        "grating": grating_function(acquisition),
+        "sample_id": acquisition.get("sample_id"),
+    }
+    stateEnd = dict(stateStart)
+    if position_function is not None:
+        stateStart["sample_position"], stateEnd["sample_position"] = position_function(acquisition)
+
+    ## The energy and polarization are not moved for NoBeam acquisitions
+    if acquisition.get("configuration_instrument") == "NoBeam":
+        return stateStart, stateEnd
+
+    polarizations = acquisition.get("polarizations")
+    if isinstance(polarizations, (list, tuple)) and len(polarizations) > 0:
+        stateStart["polarization"] = polarizations[0]
+        stateEnd["polarization"] = polarizations[-1]  ## Polarizations are looped over for every angle, so the last one is where it ends
+
+    energyStart, energyEnd = _get_energy_start_end(acquisition)
+    stateStart["energy"], stateEnd["energy"] = energyStart, energyEnd
+    return stateStart, stateEnd
+
+
+def _sample_move_time(positionPrevious, positionNext, costs):
+    ## x, y, and th move together, so the slowest one sets the time
+    times = []
+    for axis, speed in (("x", costs["sample_speed"]), ("y", costs["sample_speed"]), ("th", costs["sample_rotation_speed"])):
+        valuePrevious, valueNext = positionPrevious.get(axis), positionNext.get(axis)
+        if valuePrevious is not None and valueNext is not None:
+            times.append(abs(valueNext - valuePrevious) / speed)
+    return max(times, default=0)
+
+
+def _get_energy_start_end(acquisition):
+    try:
+        points = get_energy_grid(acquisition.get("energy_list_parameters")).points
+    except ValueError:
+        return None, None
+    ## With cycles > 0, each cycle is an ascending and a descending sweep, so the scan ends back at the start
+    if acquisition.get("cycles"):
+        return float(points[0]), float(points[0])
+    return float(points[0]), float(points[-1])
+
+
+def scheduleAcquisitionsQueue(queue, cost_function=None, grating_function=None, state_initial=None, print_report=True, position_function=None):
+    """
+    Reorders a queue that is already sorted by priority so that the estimated transition time is reduced.
+
+    - Acquisitions with a lower priority value are still run first.  Only the order within each priority is changed.
+    - Acquisitions with the same priority and the same group_name are kept together.  The order within a group is also optimized.
+    - The order is found by a nearest-neighbor pass followed by moving single acquisitions (or groups) wherever that lowers the cost.
+
+    Parameters
+    ----------
+    queue : list of dict
+        Acquisitions, sorted by priority
+    cost_function : function, optional
+        cost_function(statePrevious, stateNext) in seconds.  Defaults to transition_cost.
+    grating_function : function, optional
+        Passed to get_acquisition_states
+    state_initial : dict, optional
+        Current instrument state, in the same format as the states from get_acquisition_states
+    print_report : bool
+        Prints the estimated time saved compared to the priority-only order
+    position_function : function, optional
+        Passed to get_acquisition_states
+
+    Returns
+    -------
+    queue : list of dict
+        Reordered acquisitions
+    report : dict
+        Estimated transition time (seconds) of the priority-only order and of the new order
+    """
+    if cost_function is None:
+        cost_function = transition_cost
+    state_initial = state_initial or {}
+
+    ## Group into priority tiers, then into blocks that have to stay together
+    tiers = {}
+    for acquisition in queue:
+        tiers.setdefault(acquisition.get("priority"), []).append(acquisition)
+
+    queue_scheduled = []
+    state = state_initial
+    for priority, acquisitions in tiers.items():
+        blocks = _get_blocks(acquisitions, grating_function, position_function)
+        for block in blocks:
+            _order_within_block(block, {}, cost_function)  ## First guess, so that blocks can be compared by where they start and end
+        for indexBlock in _order_blocks(blocks, state, cost_function):
+            _order_within_block(blocks[indexBlock], state, cost_function)  ## Now that the state before the block is known
+            queue_scheduled.extend(blocks[indexBlock]["acquisitions"])
+            state = blocks[indexBlock]["state_end"]
+
+    report = {
+        "cost_naive": get_queue_transition_cost(queue, cost_function, grating_function, state_initial, position_function),
+        "cost_scheduled": get_queue_transition_cost(queue_scheduled, cost_function, grating_function, state_initial, position_function),
+    }
+    report["time_saved"] = report["cost_naive"] - report["cost_scheduled"]
+    if print_report:
+        print(
+            "Estimated time changing the instrument between acquisitions: "
+            + str(round(report["cost_naive"] / 60, 1)) + " min in priority order, "
+            + str(round(report["cost_scheduled"] / 60, 1)) + " min in scheduled order ("
+            + str(round(report["time_saved"] / 60, 1)) + " min saved)"
+        )
+    return queue_scheduled, report
+
+
+def get_queue_transition_cost(queue, cost_function=None, grating_function=None, state_initial=None, position_function=None):
+    """
+    Returns the estimated total transition time (seconds) for running the queue in the given order.
+    """
+    if cost_function is None:
+        cost_function = transition_cost
+    cost = 0
+    state = state_initial or {}
+    for acquisition in queue:
+        stateStart, stateEnd = get_acquisition_states(acquisition, grating_function, position_function)
+        cost += cost_function(state, stateStart)
+        state = stateEnd
+    return cost
+
+
+def _get_blocks(acquisitions, grating_function, position_function=None):
+    blocks = []
+    indexBlocks_ByGroup = {}
+    for acquisition in acquisitions:
+        group_name = acquisition.get("group_name")
+        if group_name not in (None, "") and group_name in indexBlocks_ByGroup:
+            blocks[indexBlocks_ByGroup[group_name]]["acquisitions"].append(acquisition)
+            continue
+        if group_name not in (None, ""):
+            indexBlocks_ByGroup[group_name] = len(blocks)
+        blocks.append({"acquisitions": [acquisition]})
+
+    for block in blocks:
+        block["states"] = [get_acquisition_states(acquisition, grating_function, position_function) for acquisition in block["acquisitions"]]
+        block["state_start"] = block["states"][0][0]
+        block["state_end"] = block["states"][-1][1]
+    return blocks
+
+
+def _order_within_block(block, state_initial, cost_function):
+    items = [{"state_start": stateStart, "state_end": stateEnd} for stateStart, stateEnd in block["states"]]
+    order = _order_blocks(items, state_initial, cost_function)
+    block["acquisitions"] = [block["acquisitions"][index] for index in order]
+    block["states"] = [block["states"][index] for index in order]
+    block["state_start"] = block["states"][0][0]
+    block["state_end"] = block["states"][-1][1]
+
+
+def _order_blocks(blocks, state_initial, cost_function, passes_maximum=20):
+    numberBlocks = len(blocks)
+    if numberBlocks <= 1:
+        return list(range(numberBlocks))
+
+    ## Cost of going from the end of one block to the start of another.  Row/column numberBlocks is the initial state.
+    costs = [
+        [cost_function(blockPrevious["state_end"], blockNext["state_start"]) for blockNext in blocks]
+        for blockPrevious in blocks
+    ]
+    costs.append([cost_function(state_initial, blockNext["state_start"]) for blockNext in blocks])
+    start = numberBlocks
+
+    ## Nearest neighbor, ties go to the block that was first in the original order
+    order = []
+    remaining = list(range(numberBlocks))
+    current = start
+    while remaining:
+        indexNext = min(remaining, key=lambda index: (costs[current][index], index))
+        order.append(indexNext)
+        remaining.remove(indexNext)
+        current = indexNext
+
+    ## Move single blocks to a better position until nothing improves.  Costs are not symmetric, so only moves (not reversals) are used.
+    def edge(indexPrevious, indexNext):
+        return 0 if indexNext is None else costs[indexPrevious][indexNext]
+
+    for _ in range(passes_maximum):
+        improved = False
+        for position in range(len(order)):
+            block = order[position]
+            previous = order[position - 1] if position > 0 else start
+            following = order[position + 1] if position + 1 < len(order) else None
+            saving_removal = edge(previous, block) + edge(block, following) - edge(previous, following)
+            rest = order[:position] + order[position + 1 :]
+            best_gain, best_position = 1e-9, None
+            for positionNew in range(len(rest) + 1):
+                if positionNew == position:
+                    continue
+                previousNew = rest[positionNew - 1] if positionNew > 0 else start
+                followingNew = rest[positionNew] if positionNew < len(rest) else None
+                cost_insertion = edge(previousNew, block) + edge(block, followingNew) - edge(previousNew, followingNew)
+                if saving_removal - cost_insertion > best_gain:
+                    best_gain, best_position = saving_removal - cost_insertion, positionNew
+            if best_position is not None:
+                rest.insert(best_position, block)
+                order = rest
+                improved = True
+        if not improved:
+            break
+
+    ## Never return something worse than the order the blocks came in
+    def path_cost(orderPath):
+        return sum(edge(previous, following) for previous, following in zip([start] + orderPath[:-1], orderPath))
+
+    if path_cost(list(range(numberBlocks))) <= path_cost(order):
+        return list(range(numberBlocks))
+    return order
@@ -0,0 +1,89 @@
+## Decides which setup steps before a scan (loading the configuration, moving the sample, rotating, setting polarization and energy) can move at the same time.
+## Steps that move devices that conflict run one after the other, in the order they were given.  All other steps overlap.
+## run_acquisitions.run_setup_steps runs the schedule.  Does not import any hardware, so it can be tested without the beamline.
+
+from .acquisition_time_estimates import timeEstimateOverheads_Default
+from .queue_scheduler import get_acquisition_states, transitionCosts_Default
+
+
+## Pairs of devices that must not move at the same time.  A device always conflicts with itself.
+setupConflicts_Default = [
+    ("configuration", "sample"),  ## Configurations move detectors close to the sample and can include the sample stage motors
+    ("polarization", "energy"),  ## Both move the EPU, and the gap depends on the polarization
+]
+
+## Estimated time (seconds) of each kind of setup step, used to report the time saved by overlapping them
+setupDurations_Default = {
+    "configuration": transitionCosts_Default["configuration_instrument"],
+    "sample": transitionCosts_Default["sample"],
+    "rotation": timeEstimateOverheads_Default["rotation"],
+    "polarization": transitionCosts_Default["polarization"],
+    "energy": transitionCosts_Default["energy_jump"],
+}
+
+
+def steps_conflict(stepA, stepB, conflicts=setupConflicts_Default):
+    if stepA["devices"] & stepB["devices"]:
+        return True
+    for deviceA, deviceB in conflicts:
+        if (deviceA in stepA["devices"] and deviceB in stepB["devices"]) or (deviceB in stepA["devices"] and deviceA in stepB["devices"]):
+            return True
+    return False
+
+
+def schedule_setup_steps(steps, conflicts=setupConflicts_Default, durations=setupDurations_Default):
+    """
+    Schedules setup steps so that each step only waits for earlier steps that it conflicts with.
+
+    Parameters
+    ----------
+    steps : list of dict
+        {"name": ..., "devices": set of device names, "duration": seconds (optional), "deferrable": bool (optional)}, in the order they would run one after the other.
+        Without a "duration", the estimate in durations for the step name is used.
+        Steps with "deferrable" False are run to the end before the next step is started, so they are started after other steps that can start at the same time.
+    conflicts : list of (str, str)
+    durations : dict
+
+    Returns
+    -------
+    dict with
+        "steps": the steps, each with "after" (indices in this list of steps that have to finish first), "start", and "duration",
+                 sorted by the estimated start time
+        "time_sequential": estimated time (seconds) running the steps one after the other
+        "time_overlapped": estimated time (seconds) with the overlaps
+    """
+    steps = [dict(step, duration=step.get("duration", durations.get(step["name"], 0))) for step in steps]
+    finish = []
+    dependencies = []
+    for index, step in enumerate(steps):
+        dependencies.append([indexBefore for indexBefore in range(index) if steps_conflict(steps[indexBefore], step, conflicts)])
+        step["start"] = max([finish[indexBefore] for indexBefore in dependencies[index]], default=0)
+        finish.append(step["start"] + step["duration"])
+
+    ## Steps that are not deferrable hold up the steps after them, so they go after the other steps that start at the same time
+    order_start = sorted(range(len(steps)), key=lambda index: (steps[index]["start"], not steps[index].get("deferrable", True), index))
+    index_New = {indexOld: indexNew for indexNew, indexOld in enumerate(order_start)}
+    steps_scheduled = []
+    for indexOld in order_start:
+        step = steps[indexOld]
+        step["after"] = sorted(index_New[indexBefore] for indexBefore in dependencies[indexOld])
+        steps_scheduled.append(step)
+
+    ## Time in the order the steps are run, where a step that is not deferrable is finished before the next one is started
+    time_issued = 0
+    finish_scheduled = []
+    for step in steps_scheduled:
+        step["start"] = max([time_issued] + [finish_scheduled[indexBefore] for indexBefore in step["after"]])
+        finish_scheduled.append(step["start"] + step["duration"])
+        time_issued = step["start"] if step.get("deferrable", True) else finish_scheduled[-1]
+    return {
+        "steps": steps_scheduled,
+        "time_sequential": sum(step["duration"] for step in steps),
+        "time_overlapped": max(finish_scheduled, default=0),
+    }
+
+
+def get_energy_start(acquisition):
+    ## Energy the scan starts at, or None if the acquisition does not move the energy
+    stateStart, stateEnd = get_acquisition_states(acquisition)
+    return stateStart.get("energy")
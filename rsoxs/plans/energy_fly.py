@@ -0,0 +1,257 @@
+## Continuous energy (fly) NEXAFS.  The mono and EPU ramp together through the energy range while the point detectors are read continuously,
+## then the readings are averaged onto the same energy grid that a step scan would have measured.
+## Trajectories, EPU lookup tables, and rebinning are here and do not import any hardware.  rsoxs.nexafs_fly runs them on the beamline,
+## and SimulatedMonoEPU stands in for the mono and EPU so that a whole fly scan can be tested without the beamline.
+
+import numpy as np
+
+from .energy_grids import get_energy_grid
+
+
+flyNEXAFS_Parameters_Default = {
+    "speed_minimum": 0.01,  ## eV/s
+    "speed_maximum": 2,  ## eV/s.  Faster than this, the EPU gap falls behind the mono.
+    "lookup_table_spacing": 1,  ## eV between EPU lookup table points
+    "lookup_table_margin": 5,  ## eV beyond each end of the scan, so that the spline is not extrapolated at the ends
+    "scan_fixed": 15,  ## s per sweep to program the lookup table, get to the start, and open the run
+}
+
+
+def get_fly_speed(energy_grid, exposure_time, speed=None, parameters=flyNEXAFS_Parameters_Default):
+    """
+    Returns the speed (eV/s) for the region of the energy grid with the smallest step.
+    Without a speed, the speed is chosen so that each point of that region gets exposure_time seconds of readings, same as a step scan.
+    Speeds outside the allowed range are limited to it.
+    """
+    energy_grid = get_energy_grid(energy_grid)
+    if speed is None:
+        speed = energy_grid.step_minimum / exposure_time
+    return min(max(speed, parameters["speed_minimum"]), parameters["speed_maximum"])
+
+
+def get_fly_segments(energy_grid, speed, descending=False, parameters=flyNEXAFS_Parameters_Default):
+    """
+    Splits a fly scan over an energy grid into segments at constant speed, one for each region of the grid.
+
+    speed is used for the region with the smallest step.  Regions with larger steps go proportionally faster (up to speed_maximum),
+    so that every point of the grid gets about the same time.
+
+    Returns
+    -------
+    list of (start, stop, speed), in the order they are run.  Flattened, this is the argument list of nbs-bl's fly_scan after the motor.
+    """
+    energy_grid = get_energy_grid(energy_grid)
+    if not energy_grid.regions:
+        raise ValueError("Fly scans need a range of energies, not a single energy: " + str(energy_grid.parameters))
+    segments = []
+    for region in energy_grid.regions:
+        speed_region = min(speed * region["step"] / energy_grid.step_minimum, parameters["speed_maximum"])
+        segments.append((region["start"], region["stop"], speed_region))
+    if descending:
+        segments = [(stop, start, speed_segment) for start, stop, speed_segment in segments[::-1]]
+    return segments
+
+
+def estimate_fly_time(energy_grid, speed, parameters=flyNEXAFS_Parameters_Default):
+    ## Time (seconds) for one sweep
+    segments = get_fly_segments(energy_grid, speed, parameters=parameters)
+    return parameters["scan_fixed"] + sum(abs(stop - start) / speed_segment for start, stop, speed_segment in segments)
+
+
+def make_epu_lookup_table(energy_grid, gap_function, parameters=flyNEXAFS_Parameters_Default):
+    """
+    Makes the energy and gap arrays for the EPU fly lookup table (FlyLUT-Energy-SP and FlyLUT-Gap-SP), from which the EPU calculates its spline.
+
+    Parameters
+    ----------
+    energy_grid : EnergyGrid, or anything that get_energy_grid accepts
+    gap_function : callable
+        Gap for an energy at the polarization of the scan, e.g., lambda energy: en.gap(energy, polarization, False)
+    parameters : dict
+
+    Returns
+    -------
+    dict with "energy" and "gap", numpy arrays in ascending energy
+    """
+    energy_grid = get_energy_grid(energy_grid)
+    energy_minimum = min(energy_grid.points[0], energy_grid.points[-1]) - parameters["lookup_table_margin"]
+    energy_maximum = max(energy_grid.points[0], energy_grid.points[-1]) + parameters["lookup_table_margin"]
+    spacing = parameters["lookup_table_spacing"]
+    energies = np.arange(energy_minimum, energy_maximum + spacing / 2, spacing)
+    energies = np.unique(np.concatenate((energies, [region["start"] for region in energy_grid.regions], [energy_maximum])))
+    gaps = np.array([gap_function(energy) for energy in energies], dtype=float)
+    if not np.all(np.isfinite(gaps)):
+        raise ValueError("EPU gap is not defined for all energies from " + str(energy_minimum) + " to " + str(energy_maximum) + " eV")
+    return {"energy": energies, "gap": gaps}
+
+
+def rebin_fly_readings(readings, energy_name, energy_points, time_offsets=None):
+    """
+    Averages detector readings from a fly scan onto energy points.
+
+    The energy of each detector reading is interpolated from the energy readback at the reading's timestamp.
+    Each energy point gets the readings from halfway to the point below to halfway to the point above.
+
+    Parameters
+    ----------
+    readings : dict
+        {name: (timestamps, values)} for the energy readback and each detector, in any order, as they were streamed
+    energy_name : str
+        Key in readings for the energy readback
+    energy_points : list or numpy.ndarray
+        Energies to average onto, e.g., energy_grid.points, or energy_grid.points_reversed for a descending sweep
+    time_offsets : dict, optional
+        {name: seconds} added to the timestamps of a detector, for detectors whose timestamps lag the signal
+
+    Returns
+    -------
+    dict with
+        "energy": energy_points as a numpy array
+        name: average of each detector for each energy point, NaN for points without readings
+        "number_readings": {name: number of readings averaged for each energy point}
+    """
+    time_offsets = time_offsets or {}
+    energy_points = np.asarray(energy_points, dtype=float)
+    times_energy, energies = (np.asarray(values, dtype=float) for values in readings[energy_name])
+    order_time = np.argsort(times_energy)
+    times_energy, energies = times_energy[order_time], energies[order_time]
+
+    ## Bin edges halfway between sorted points, and half a step beyond the first and last points
+    order_points = np.argsort(energy_points)
+    points_sorted = energy_points[order_points]
+    if len(points_sorted) > 1:
+        midpoints = (points_sorted[1:] + points_sorted[:-1]) / 2
+        edges = np.concatenate(([2 * points_sorted[0] - midpoints[0]], midpoints, [2 * points_sorted[-1] - midpoints[-1]]))
+    else:
+        edges = np.array([points_sorted[0] - 0.5, points_sorted[0] + 0.5])
+
+    rebinned = {"energy": energy_points, "number_readings": {}}
+    for name, (times, values) in readings.items():
+        if name == energy_name:
+            continue
+        times = np.asarray(times, dtype=float) + time_offsets.get(name, 0.0)
+        values = np.asarray(values, dtype=float)
+        ## Readings from before or after the energy readback cannot be given an energy
+        inside = (times >= times_energy[0]) & (times <= times_energy[-1]) & np.isfinite(values)
+        energies_readings = np.interp(times[inside], times_energy, energies)
+        bins = np.searchsorted(edges, energies_readings, side="right") - 1
+        in_bins = (bins >= 0) & (bins < len(points_sorted))
+        counts = np.bincount(bins[in_bins], minlength=len(points_sorted))
+        sums = np.bincount(bins[in_bins], weights=values[inside][in_bins], minlength=len(points_sorted))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        ## Back to the order of energy_points
+        rebinned[name] = np.empty(len(points_sorted))
+        rebinned[name][order_points] = averages
+        rebinned["number_readings"][name] = np.empty(len(points_sorted), dtype=int)
+        rebinned["number_readings"][name][order_points] = counts
+    return rebinned
+
+
+def _spectrum_default(energy):
+    ## Carbon K-edge-like test spectrum: a step at 290 eV with a sharp peak at 285.1 eV
+    energy = np.asarray(energy, dtype=float)
+    return 1 + 0.5 * (1 + np.tanh((energy - 290) / 1.0)) + 2 * np.exp(-(((energy - 285.1) / 0.4) ** 2))
+
+
+def _gap_default(energy):
+    ## Rough linear version of the EPU gap (um) at linear horizontal polarization in the carbon and oxygen range
+    return 14000 + 150 * (np.asarray(energy, dtype=float) - 100)
+
+
+class SimulatedMonoEPU:
+    """
+    Stand-in for the mono, EPU, and point detectors during an energy fly scan, for testing fly scans without the beamline.
+
+    The mono follows the requested segments at up to mono_speed_maximum.  The EPU gap is set from the programmed lookup table and moves at up to
+    gap_speed_maximum, so it falls behind the mono at high speeds.  The flux drops when the gap is away from the ideal gap for the energy.
+    Each detector is read every detector_periods[name] seconds with its own timestamps, like monitored signals.
+
+    Parameters
+    ----------
+    spectrum : callable, optional
+        Absorption (TEY signal per incident flux) as a function of energy
+    gap_function : callable, optional
+        Ideal gap (um) for an energy
+    mono_speed_maximum : float
+        eV/s
+    gap_speed_maximum : float
+        um/s
+    gap_width : float
+        Gap error (um) at which the flux drops to 1/e
+    detector_periods : dict, optional
+        {name: seconds}, for "energy", "Sample_TEY_int", "izero_mesh", and "beamstop_waxs"
+    noise : float
+        Relative noise of the detector readings
+    seed : int
+    """
+
+    def __init__(
+        self,
+        spectrum=_spectrum_default,
+        gap_function=_gap_default,
+        mono_speed_maximum=10,
+        gap_speed_maximum=500,
+        gap_width=300,
+        detector_periods=None,
+        noise=0,
+        seed=0,
+    ):
+        self.spectrum = spectrum
+        self.gap_function = gap_function
+        self.mono_speed_maximum = mono_speed_maximum
+        self.gap_speed_maximum = gap_speed_maximum
+        self.gap_width = gap_width
+        self.detector_periods = detector_periods or {"energy": 0.1, "Sample_TEY_int": 0.05, "izero_mesh": 0.05, "beamstop_waxs": 0.1}
+        self.noise = noise
+        self.random = np.random.default_rng(seed)
+        self.lookup_table = None
+        self.time = 0.0
+
+    def program_lookup_table(self, lookup_table):
+        self.lookup_table = {"energy": np.asarray(lookup_table["energy"], dtype=float), "gap": np.asarray(lookup_table["gap"], dtype=float)}
+
+    def fly(self, segments, time_step=0.01):
+        """
+        Runs segments [(start, stop, speed), ...] and returns the readings, {name: (timestamps, values)}, same as rebin_fly_readings takes.
+        """
+        if self.lookup_table is None:
+            raise RuntimeError("Program the EPU lookup table before flying")
+
+        ## Mono trajectory, segment by segment
+        times = [np.array([self.time])]
+        energies = [np.array([segments[0][0]])]
+        for start, stop, speed in segments:
+            speed = min(speed, self.mono_speed_maximum)
+            duration = abs(stop - start) / speed
+            times_segment = np.arange(time_step, duration + time_step / 2, time_step)
+            times.append(times[-1][-1] + times_segment)
+            energies.append(start + np.sign(stop - start) * np.minimum(speed * times_segment, abs(stop - start)))
+        times = np.concatenate(times)
+        energies = np.concatenate(energies)
+
+        ## EPU gap follows the lookup table, limited by its speed
+        gaps_target = np.interp(energies, self.lookup_table["energy"], self.lookup_table["gap"])
+        gaps = np.empty(len(gaps_target))
+        gaps[0] = gaps_target[0]
+        step_gap = self.gap_speed_maximum * time_step
+        for index in range(1, len(gaps)):
+            gaps[index] = gaps[index - 1] + np.clip(gaps_target[index] - gaps[index - 1], -step_gap, step_gap)
+        flux = np.exp(-(((gaps - self.gap_function(energies)) / self.gap_width) ** 2))
+
+        signals = {
+            "energy": energies,
+            "Sample_TEY_int": flux * self.spectrum(energies),
+            "izero_mesh": flux,
+            "beamstop_waxs": flux * np.exp(-0.5 * self.spectrum(energies)),
+        }
+        readings = {}
+        for name, period in self.detector_periods.items():
+            ## Each detector starts at a random phase of its period
+            times_readings = np.arange(times[0] + self.random.uniform(0, period), times[-1], period)
+            values = np.interp(times_readings, times, signals[name])
+            if self.noise and name != "energy":
+                values = values * (1 + self.noise * self.random.standard_normal(len(values)))
+            readings[name] = (times_readings, values)
+        self.time = times[-1]
+        return readings
@@ -0,0 +1,164 @@
+## Energy points for the gscan-style parameters in energy_list_parameters, (start, step, stop, step, stop, ...).
+## Points are worked out once per set of parameters and reused by the scans, the time estimates, and the queue scheduler,
+## instead of being expanded again inside each scan.  Each grid is also checked for ranges that are not divisible by their step size.
+
+import functools
+
+import numpy as np
+
+from .default_energy_parameters import energy_list_parameters
+
+
+## Ranges whose length is within this fraction of a step of a whole number of steps are considered divisible
+energyGrid_DivisibilityTolerance = 1e-6
+
+
+class EnergyGrid:
+    """
+    Energy points for one set of gscan parameters.  Use get_energy_grid instead of making these directly, so that grids are reused.
+
+    Attributes
+    ----------
+    parameters : tuple of float
+    points : numpy.ndarray
+        Energies in scan order, the same points as nbs-bl's _make_gscan_points.  Read-only.
+    points_reversed : numpy.ndarray
+        The same energies in reverse order, used for the descending sweep of each cycle
+    reversible : bool
+        True if the reversed parameters, parameters[::-1], give exactly points_reversed
+    number_points : int
+    step_minimum, step_maximum : float
+        Smallest and largest step sizes between regions.  0 for a single energy.
+    regions : list of dict
+        {"start", "stop", "step", "number_points"} for each region.  number_points does not count the start, which belongs to the previous region.
+    edge : dict or None
+        Region with the smallest step (usually the absorption edge)
+    warnings : list of str
+        Problems that do not stop the scan, e.g., a range that is not divisible by its step size
+    """
+
+    __slots__ = ("parameters", "points", "points_reversed", "reversible", "number_points", "step_minimum", "step_maximum", "regions", "edge", "warnings")
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.regions, self.warnings = _get_regions(parameters)
+        points = _make_gscan_points(parameters)
+        points.flags.writeable = False
+        self.points = points
+        self.points_reversed = points[::-1]
+        self.number_points = len(points)
+        steps = [region["step"] for region in self.regions]
+        self.step_minimum = min(steps, default=0)
+        self.step_maximum = max(steps, default=0)
+        self.edge = min(self.regions, key=lambda region: region["step"]) if self.regions else None
+
+        ## The points of the reversed parameters should be the same energies in reverse, otherwise the descending sweeps of cycles do not match
+        self.reversible = len(parameters) == 1 or _points_match(_make_gscan_points(parameters[::-1]), self.points_reversed)
+        if not self.reversible:
+            self.warnings.append("Reversing the parameters gives different energies, so points_reversed is used for descending sweeps")
+
+    def __repr__(self):
+        return (
+            "EnergyGrid(" + str(self.parameters) + ", " + str(self.number_points) + " points"
+            + (", edge " + str(self.edge["start"]) + "-" + str(self.edge["stop"]) + " eV in " + str(self.edge["step"]) + " eV steps" if self.edge else "")
+            + ")"
+        )
+
+
+def get_energy_grid(energy_parameters):
+    """
+    Returns the EnergyGrid for a name in energy_list_parameters, a single energy, or a tuple or list of gscan parameters.
+    An EnergyGrid is returned as it is.
+    Raises ValueError if the parameters cannot be scanned (unknown name, missing stop or step, or a step of 0).
+    """
+    if isinstance(energy_parameters, EnergyGrid):
+        return energy_parameters
+    if isinstance(energy_parameters, str):
+        if energy_parameters not in energy_grids:
+            raise ValueError("Unknown energy plan: " + str(energy_parameters))
+        return energy_grids[energy_parameters]
+    if isinstance(energy_parameters, (int, float, np.number)) and not isinstance(energy_parameters, bool):
+        energy_parameters = (energy_parameters,)
+    if not isinstance(energy_parameters, (list, tuple, np.ndarray)) or len(energy_parameters) == 0:
+        raise ValueError("Energy parameters must be a name, a number, or (start, step, stop, step, stop, ...): " + str(energy_parameters))
+    try:
+        parameters = tuple(float(value) for value in energy_parameters)
+    except (TypeError, ValueError):
+        raise ValueError("Energy parameters must be numbers: " + str(energy_parameters))
+    return _compile_energy_grid(parameters)
+
+
+def print_energy_grid_warnings(energy_parameters_list=None):
+    """
+    Prints the warnings for energy plans, each one once.  Returns the warnings by energy plan (its name, or str of inline parameters).
+
+    Parameters
+    ----------
+    energy_parameters_list : list, optional
+        Anything get_energy_grid accepts, e.g., the energy_list_parameters of every acquisition in a queue.  All named energy plans by default.
+        Parameters that cannot be scanned are left out, since sanitizing the spreadsheet reports those.
+    """
+    warnings = {}
+    for energy_parameters in energy_grids if energy_parameters_list is None else energy_parameters_list:
+        label = energy_parameters if isinstance(energy_parameters, str) else str(energy_parameters)
+        if label in warnings:
+            continue
+        try:
+            energy_grid = get_energy_grid(energy_parameters)
+        except ValueError:
+            continue
+        warnings[label] = energy_grid.warnings
+        for warning in energy_grid.warnings:
+            print("Energy plan " + label + ": " + warning)
+    return {label: warnings_grid for label, warnings_grid in warnings.items() if warnings_grid}
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_energy_grid(parameters):
+    if (len(parameters) - 1) % 2 != 0:
+        raise ValueError("Energy parameters need a stop for every step size.  Expected format: (start, step, stop, step, stop, ...)")
+    if any(step == 0 for step in parameters[1::2]):
+        raise ValueError("Energy step size cannot be 0: " + str(parameters))
+    return EnergyGrid(parameters)
+
+
+def _make_gscan_points(parameters):
+    ## Same as nbs_bl.plans.scan_base._make_gscan_points, which cannot be imported without the beamline setup
+    if len(parameters) == 1:
+        return np.array([parameters[0]])
+    points = []
+    for index in range(1, len(parameters) - 1, 2):
+        start, step, stop = parameters[index - 1], abs(parameters[index]), parameters[index + 1]
+        step = step if stop > start else -step
+        if not points or points[-1] != start:
+            points.append(start)
+        point_next = start + step
+        while (step > 0 and point_next < stop - step / 2.0) or (step < 0 and point_next > stop - step / 2.0):
+            points.append(point_next)
+            point_next += step
+        points.append(stop)
+    return np.array(points)
+
+
+def _get_regions(parameters):
+    regions = []
+    warnings = []
+    for index in range(1, len(parameters) - 1, 2):
+        start, step, stop = parameters[index - 1], abs(parameters[index]), parameters[index + 1]
+        points_region = _make_gscan_points((start, step, stop))
+        number_steps = abs(stop - start) / step
+        if abs(number_steps - round(number_steps)) > energyGrid_DivisibilityTolerance:
+            warnings.append(
+                "Range " + str(start) + " to " + str(stop) + " eV is not divisible by the step size " + str(step)
+                + " eV, so the last step is " + str(round(abs(points_region[-1] - points_region[-2]), 6)) + " eV"
+            )
+        regions.append({"start": start, "stop": stop, "step": step, "number_points": len(points_region) - 1})
+    return regions, warnings
+
+
+def _points_match(pointsA, pointsB):
+    return len(pointsA) == len(pointsB) and np.allclose(pointsA, pointsB, rtol=0, atol=1e-9)
+
+
+## Compiled once when this module is imported
+energy_grids = {name: _compile_energy_grid(tuple(float(value) for value in parameters)) for name, parameters in energy_list_parameters.items()}
@@ -0,0 +1,223 @@
+## Building EPU lookup tables (gap at the peak of the undulator harmonic as a function of energy) one energy at a time.
+## Each measured peak is appended to a file as soon as it is found, and a smooth model of gap against energy is kept for each EPU mode and phase.
+## The model predicts where the peak is at the next energy and how sure it is, so the gap search can cover a much narrower range than a fixed window.
+## Used by common_procedures.buildeputable.  Does not import any hardware.
+
+import csv
+import os
+
+import numpy as np
+
+
+epuTable_Parameters_Default = {
+    "gap_minimum": 14000,  ## um
+    "gap_maximum": 100000,  ## um
+    "fit_points": 8,  ## Measured points nearest in energy that the local fit uses
+    "fit_degree": 2,
+    "sigmas": 4,  ## Half width of the search window in units of the prediction uncertainty
+    "window_half_width_minimum": 300,  ## um, so that the whole peak is still swept when the prediction is very good
+    "extrapolation_uncertainty": 0.25,  ## Fraction of the predicted gap change from the nearest measured point that is added to the uncertainty, until the model has been checked
+    "extrapolation_uncertainty_minimum": 0.02,
+    "errors_checked": 5,  ## Once the model has predicted this many measured points, the extrapolation uncertainty comes from how far off they were
+    "window_below_default": 500,  ## um per widfract below the starting gap, the window used before there is a model (same as before)
+    "window_above_default": 2500,  ## um per widfract above the starting gap
+    "edge_margin": 0.05,  ## Fraction of the window.  A peak found this close to the edge of a predicted window may be outside it, so the gap is swept again over the default window.
+}
+
+epuTable_Columns = ["Energies", "EPUGaps", "PeakCurrent", "EPUGapsBS", "PeakCurrentBS", "Mode", "Phase"]
+
+
+class EPUGapModel:
+    """
+    Running model of the EPU gap at the harmonic peak against energy, for one EPU mode and phase.
+
+    Predictions use a polynomial fit (fit_degree) to the measured points nearest in energy (fit_points), so the model follows curvature over wide energy ranges.
+    The uncertainty combines the scatter of the fit with a share of the gap change the prediction is extrapolated from the nearest measured point.
+    That share starts at extrapolation_uncertainty and is then taken from how far off the predictions of the last errors_checked points were.
+    """
+
+    def __init__(self, parameters=epuTable_Parameters_Default):
+        self.parameters = parameters
+        self.energies = []
+        self.gaps = []
+        self.errors_relative = []  ## Prediction error of each point added, as a fraction of the predicted gap change
+
+    def add(self, energy, gap):
+        gap_predicted, _ = self.predict(energy)
+        if gap_predicted is not None:
+            gap_nearest = self.gaps[int(np.argmin(np.abs(np.asarray(self.energies) - energy)))]
+            self.errors_relative.append(abs(gap - gap_predicted) / max(abs(gap_predicted - gap_nearest), 1e-9))
+        self.energies.append(float(energy))
+        self.gaps.append(float(gap))
+
+    def __len__(self):
+        return len(self.energies)
+
+    def predict(self, energy):
+        """
+        Returns (gap, uncertainty) in um, or (None, None) if there are fewer than 2 measured points.
+        """
+        if len(self.energies) < 2:
+            return None, None
+        energies = np.asarray(self.energies)
+        gaps = np.asarray(self.gaps)
+        nearest = np.argsort(np.abs(energies - energy), kind="stable")[: self.parameters["fit_points"]]
+        energies, gaps = energies[nearest], gaps[nearest]
+        degree = min(self.parameters["fit_degree"], len(np.unique(energies)) - 1)
+
+        ## Fit in scaled energy so that the fit is well conditioned for energies in the thousands of eV
+        center = energies.mean()
+        scale = max(np.ptp(energies), 1e-9)
+        matrix = np.vander((energies - center) / scale, degree + 1)
+        coefficients, *_ = np.linalg.lstsq(matrix, gaps, rcond=None)
+        vector = np.vander([(energy - center) / scale], degree + 1)[0]
+        gap = float(vector @ coefficients)
+
+        degrees_of_freedom = len(gaps) - (degree + 1)
+        variance = 0.0
+        if degrees_of_freedom > 0:
+            variance_residual = np.sum((gaps - matrix @ coefficients) ** 2) / degrees_of_freedom
+            variance = variance_residual * (1 + vector @ np.linalg.pinv(matrix.T @ matrix) @ vector)
+        extrapolation = self._extrapolation_uncertainty() * abs(gap - gaps[0])
+        return gap, float(np.sqrt(variance + extrapolation**2))
+
+    def _extrapolation_uncertainty(self):
+        number_checked = self.parameters["errors_checked"]
+        if len(self.errors_relative) < number_checked:
+            return self.parameters["extrapolation_uncertainty"]
+        return max(max(self.errors_relative[-number_checked:]), self.parameters["extrapolation_uncertainty_minimum"])
+
+
+class EPUTableBuilder:
+    """
+    Collects EPU gap peaks into a file and a model per EPU mode and phase, and makes lookup tables from them.
+
+    Every point is appended to path as one line, so a table that is being built can be read at any time, and building it again with the same path resumes it.
+
+    A file written by the old buildeputable (without Mode and Phase) is moved to the same name with "_legacy" added.  With mode and phase,
+    its points are copied into a new file at path as measured in that mode and phase, and otherwise a new file is started.
+
+    Parameters
+    ----------
+    path : str
+        CSV file with columns epuTable_Columns.  Points already in the file are loaded.
+    parameters : dict
+    mode, phase : optional
+        EPU mode and phase of the points in a file written by the old buildeputable
+    """
+
+    def __init__(self, path, parameters=epuTable_Parameters_Default, mode=None, phase=None):
+        self.path = path
+        self.parameters = parameters
+        self.models = {}
+        self.rows = []
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, newline="") as file:
+                reader = csv.DictReader(file)
+                rows = list(reader)
+            if "Mode" in (reader.fieldnames or []) and "Phase" in reader.fieldnames:
+                for row in rows:
+                    self._add_row({column: row.get(column) for column in epuTable_Columns})
+            else:
+                self._migrate_legacy(rows, mode, phase)
+
+    def model(self, mode, phase):
+        return self.models.setdefault((str(mode), float(phase)), EPUGapModel(self.parameters))
+
+    def append(self, energy, gap, mode, phase, height=None, gap_beamstop=None, height_beamstop=None):
+        """
+        Adds a measured peak to the model for mode and phase and appends it to the file.
+        """
+        row = dict(zip(epuTable_Columns, [energy, gap, height, gap_beamstop, height_beamstop, mode, phase]))
+        write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=epuTable_Columns)
+            if write_header:
+                writer.writeheader()
+            writer.writerow(row)
+        self._add_row(row)
+
+    def search_window(self, energy, mode, phase, gap_start, widfract=1):
+        """
+        Returns (gap_low, gap_high) to search for the peak at energy.
+
+        With a model for mode and phase, the window is the predicted gap plus or minus sigmas times the prediction uncertainty (at least window_half_width_minimum).
+        Before that, the window is the same as buildeputable always used: from 500 * widfract below to 2500 * widfract above gap_start.
+        """
+        parameters = self.parameters
+        gap, uncertainty = self.model(mode, phase).predict(energy)
+        if gap is None:
+            return self.default_window(gap_start, widfract)
+        half_width = max(parameters["sigmas"] * uncertainty, parameters["window_half_width_minimum"])
+        return self._clip_window(gap - half_width, gap + half_width)
+
+    def default_window(self, gap_start, widfract=1):
+        ## From 500 * widfract below to 2500 * widfract above gap_start, within the gap limits
+        return self._clip_window(
+            gap_start - self.parameters["window_below_default"] * widfract, gap_start + self.parameters["window_above_default"] * widfract
+        )
+
+    def peak_at_edge(self, gap_peak, gap_low, gap_high, energy, mode, phase):
+        """
+        Returns True if the window for energy was predicted from the model and gap_peak is within edge_margin of one of its ends,
+        so the peak may be outside the window and the gap should be swept again over default_window before the peak is appended.
+        Ends at the gap limits do not count, since the peak cannot be beyond them.
+        """
+        if self.model(mode, phase).predict(energy)[0] is None:
+            return False
+        gap_low, gap_high = sorted((gap_low, gap_high))
+        margin = self.parameters["edge_margin"] * (gap_high - gap_low)
+        at_low = gap_peak <= gap_low + margin and gap_low > self.parameters["gap_minimum"]
+        at_high = gap_peak >= gap_high - margin and gap_high < self.parameters["gap_maximum"]
+        return bool(at_low or at_high)
+
+    def lookup_table(self, mode, phase, energies=None):
+        """
+        Returns {"energy": ..., "gap": ...} for mode and phase, sorted by energy, ready to load.
+        Without energies, the measured energies are used.  Gaps come from the model, so single noisy peaks are smoothed out.
+        """
+        model = self.model(mode, phase)
+        if len(model) < 2:
+            raise ValueError("Need at least 2 measured points for mode " + str(mode) + " and phase " + str(phase))
+        energies = np.unique(model.energies if energies is None else np.asarray(energies, dtype=float))
+        gaps = np.array([model.predict(energy)[0] for energy in energies])
+        return {"energy": energies, "gap": np.clip(gaps, self.parameters["gap_minimum"], self.parameters["gap_maximum"])}
+
+    def save_lookup_table(self, path, mode, phase, energies=None):
+        table = self.lookup_table(mode, phase, energies)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Energies", "EPUGaps"])
+            writer.writerows(zip(table["energy"], table["gap"]))
+        return table
+
+    def _clip_window(self, gap_low, gap_high):
+        parameters = self.parameters
+        gap_low = min(max(gap_low, parameters["gap_minimum"]), parameters["gap_maximum"] - 2 * parameters["window_half_width_minimum"])
+        gap_high = min(max(gap_high, gap_low + 2 * parameters["window_half_width_minimum"]), parameters["gap_maximum"])
+        return gap_low, gap_high
+
+    def _migrate_legacy(self, rows, mode, phase):
+        root, extension = os.path.splitext(self.path)
+        path_legacy = root + "_legacy" + extension
+        os.replace(self.path, path_legacy)
+        if mode is None or phase is None:
+            print("Moved " + self.path + " (written without EPU mode and phase) to " + path_legacy + " and started a new table.")
+            return
+        for row in rows:
+            if not row.get("Energies") or not row.get("EPUGaps"):
+                continue
+            self.append(
+                float(row["Energies"]),
+                float(row["EPUGaps"]),
+                mode,
+                phase,
+                height=row.get("PeakCurrent"),
+                gap_beamstop=row.get("EPUGapsBS"),
+                height_beamstop=row.get("PeakCurrentBS"),
+            )
+        print("Copied " + str(len(self.rows)) + " points from " + path_legacy + " as mode " + str(mode) + ", phase " + str(phase) + ".")
+
+    def _add_row(self, row):
+        self.rows.append(row)
+        self.model(row["Mode"], row["Phase"]).add(float(row["Energies"]), float(row["EPUGaps"]))
@@ -1,8 +1,12 @@
 ## TODO: would like to change the name of this file to scans.py, but when I change the name and propagate everywhere, I still run into an error ModuleNotFoundError: No module named "rsoxs.plans.rsoxs"
 
+import numpy as np
 import bluesky.plan_stubs as bps
+import bluesky.preprocessors as bpp
+from bluesky.plan_stubs import trigger_and_read
 from bluesky.preprocessors import finalize_wrapper
 from functools import partial
+from ophyd import Signal
 
 from nbs_bl.beamline import GLOBAL_BEAMLINE as bl
 from nbs_bl.hw import (
@@ -11,6 +15,9 @@ from nbs_bl.hw import (
     shutter_open_time,
     sam_X,
     sam_Y,
+    Sample_TEY_int,
+    izero_mesh,
+    beamstop_waxs,
     #waxs_det,
 )
 
@@ -28,8 +35,12 @@ from nbs_bl.help import (
     add_to_plan_time_dict,
 )
 from nbs_bl.plans.scans import nbs_energy_scan
+from nbs_bl.plans.plan_stubs import call_obj
+from rsoxs.HW.energy import set_epu_lookup_table
 
 from .per_steps import take_exposure_corrected_reading, one_nd_sticky_exp_step
+from .energy_grids import get_energy_grid
+from .energy_fly import get_fly_speed, get_fly_segments, make_epu_lookup_table, rebin_fly_readings
 
 try:
     import tomllib
@@ -145,6 +156,121 @@ def nexafs(*args, **kwargs):
 add_to_plan_time_dict(nexafs, estimator="gscan_estimate", overhead=0.2)
 
 
+## Energy fly NEXAFS.  Example use:
+## RE(nexafs_fly("carbon_NEXAFS", exposure_time=1)) ## Rebinned onto the same points as nexafs(*energy_list_parameters["carbon_NEXAFS"])
+## RE(nexafs_fly((280, 0.1, 300), speed=0.05, descending=True))
+@add_to_plan_list
+def nexafs_fly(
+    energy_parameters,
+    speed=None,
+    exposure_time=1,
+    descending=False,
+    detectors=None,
+    period=0.05,
+    time_offsets=None,
+    group_name=None,
+    md=None,
+):
+    """
+    NEXAFS while the mono and EPU ramp continuously through the energy range, instead of stopping at each energy.
+
+    The EPU lookup table is programmed for the current polarization, the energy flies through the regions of the energy grid, and the
+    point detectors are read every period seconds.  Afterwards, the readings are averaged onto the energy grid and saved in the "rebinned" stream,
+    so the result can be compared point by point with a step scan of the same energy parameters.
+
+    Parameters
+    ----------
+    energy_parameters : str, float, or tuple
+        Name in energy_list_parameters or (start, step, stop, step, stop, ...), same as the energy_list_parameters of an acquisition
+    speed : float, optional
+        eV/s in the region with the smallest step.  By default, each point of that region gets exposure_time seconds of readings.
+    exposure_time : float
+        Used to choose the speed if speed is not given
+    descending : bool
+        Fly from the last energy to the first, e.g., for the second half of a cycle
+    detectors : list, optional
+        Point detectors to read.  Default is Sample_TEY_int, izero_mesh, and beamstop_waxs.
+    period : float
+        Time (seconds) between detector readings
+    time_offsets : dict, optional
+        {detector name: seconds} added to detector timestamps before they are matched to energies
+    group_name : str, optional
+    md : dict, optional
+
+    Returns
+    -------
+    dict from energy_fly.rebin_fly_readings
+    """
+    detectors = detectors if detectors else [Sample_TEY_int, izero_mesh, beamstop_waxs]  ## Cannot have device in function definition for gui
+    energy_grid = get_energy_grid(energy_parameters)
+    speed = get_fly_speed(energy_grid, exposure_time, speed)
+    segments = get_fly_segments(energy_grid, speed, descending=descending)
+    energy_points = energy_grid.points_reversed if descending else energy_grid.points
+    print("Flying energy from " + str(segments[0][0]) + " to " + str(segments[-1][1]) + " eV at " + str(speed) + " eV/s in the smallest steps")
+
+    polarization = en.polarization.position
+    yield from set_epu_lookup_table(make_epu_lookup_table(energy_grid, lambda energy: en.gap(energy, polarization, en.scanlock.get())))
+
+    _md = {
+        "plan_name": "nexafs_fly",
+        "scantype": "nexafs",
+        "energy_list_parameters": list(energy_grid.parameters),
+        "fly_speed": speed,
+        "fly_segments": [list(segment) for segment in segments],
+        "descending": descending,
+        "group_name": group_name,
+    }
+    _md.update(md or {})
+    try:
+        energy_name = en.hints["fields"][0]
+    except (AttributeError, KeyError, IndexError):
+        energy_name = en.name
+    readers = [en] + list(detectors)
+    for detector in detectors:
+        if hasattr(detector, "set_exposure"):
+            yield from call_obj(detector, "set_exposure", period)
+
+    yield from bps.mv(en, segments[0][0])
+    yield from call_obj(en, "preflight", *[value for segment in segments for value in segment])
+
+    readings = {}
+
+    @bpp.stage_decorator(readers)
+    @bpp.run_decorator(md=_md)
+    def inner_fly():
+        status = yield from call_obj(en, "fly")
+        while not status.done:
+            reading = yield from trigger_and_read(readers)
+            for key, value in reading.items():
+                times, values = readings.setdefault(key, ([], []))
+                times.append(value["timestamp"])
+                values.append(value["value"])
+        yield from call_obj(en, "land")
+
+        rebinned = rebin_fly_readings(
+            {key: values for key, values in readings.items() if key == energy_name or np.ndim(values[1][0]) == 0},
+            energy_name,
+            energy_points,
+            time_offsets=time_offsets,
+        )
+        yield from _save_rebinned(rebinned)
+        return rebinned
+
+    return (yield from inner_fly())
+
+
+def _save_rebinned(rebinned):
+    ## One event per energy point in a "rebinned" stream of the open run
+    signals = {name: Signal(name=name, value=0.0) for name in rebinned if name != "number_readings"}
+    for index in range(len(rebinned["energy"])):
+        yield from bps.mv(*[value for name, signal in signals.items() for value in (signal, float(rebinned[name][index]))])
+        yield from bps.create("rebinned")
+        for signal in signals.values():
+            yield from bps.read(signal)
+        yield from bps.save()
+
+
+
 def _rsoxs_factory(energy_grid, element, edge, key):
     @_wrap_rsoxs(element, edge)
     @wrap_metadata({"plan_name": key})
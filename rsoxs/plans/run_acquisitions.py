@@ -2,6 +2,8 @@
 import numpy as np
 import copy
 import datetime
+import time
+import uuid
 
 from rsoxs.configuration_setup.configurations_instrument import load_configuration
 from rsoxs.Functions.alignment import (
@@ -11,9 +13,10 @@ from rsoxs.Functions.alignment import (
     )
 from rsoxs.HW.energy import set_polarization
 from nbs_bl.plans.scans import nbs_count, nbs_list_scan, nbs_energy_scan
-from rsoxs.plans.rsoxs import spiral_scan
+from rsoxs.plans.rsoxs import spiral_scan, nexafs_fly
 from .default_energy_parameters import energy_list_parameters
-from ..redis_config import rsoxs_config
+from .energy_grids import get_energy_grid, print_energy_grid_warnings
+from ..redis_config import rsoxs_config, rsoxs_bar_cache
 from nbs_bl.beamline import GLOBAL_BEAMLINE as bl
 from nbs_bl.hw import (
     en,
@@ -36,9 +39,15 @@ from ..configuration_setup.configuration_load_save_sanitize import (
     gatherAcquisitionsFromConfiguration, 
     sanitizeAcquisition, 
     sortAcquisitionsQueue,
-    updateConfigurationWithAcquisition,
 )
-from ..configuration_setup.configuration_load_save import sync_rsoxs_config_to_nbs_manipulator
+from ..configuration_setup.configuration_records import gather_acquisition_records, validate_acquisition
+from ..configuration_setup.acquisition_time_estimates import estimate_queue_time, print_queue_time_estimate, format_duration
+from ..configuration_setup.setup_overlap import schedule_setup_steps, get_energy_start
+from ..alignment.bar_geometry import make_sample_position_function
+from ..configuration_setup.configuration_load_save import (
+    sync_rsoxs_config_to_nbs_manipulator,
+    update_acquisition_in_rsoxs_config,
+)
 
 import bluesky.plan_stubs as bps
 from nbs_bl.beamline import GLOBAL_BEAMLINE as bl
@@ -49,7 +58,7 @@ from nbs_bl.samples import add_current_position_as_sample
 def run_acquisitions_queue(
         configuration = copy.deepcopy(rsoxs_config.get("bar", {})),
         dryrun = True,
-        sort_by = ["priority"], ## TODO: Not sure yet how to give it a list of groups in a particular order.  Maybe a list within a list.
+        sort_by = ["priority"], ## ["priority", "transition_cost"] also orders acquisitions within each priority to reduce time spent changing the instrument.  TODO: Not sure yet how to give it a list of groups in a particular order.  Maybe a list within a list.
         ):
     ## Run a series of single acquisitions
 
@@ -57,23 +66,66 @@ def run_acquisitions_queue(
     ## TODO: Understand why 
     configuration = copy.deepcopy(rsoxs_config["bar"])
 
-    acquisitions = gatherAcquisitionsFromConfiguration(configuration)
-    ## TODO: Can only sort by "priority" at the moment, not by anything else
-    queue = sortAcquisitionsQueue(acquisitions, sortBy=sort_by) 
+    ## Acquisition records share values with configuration instead of copying them, and are validated once here instead of in every run_acquisitions_single
+    acquisitions = gather_acquisition_records(configuration)
+    ## Sorting by "transition_cost" prints the estimated time saved compared to sorting by priority only
+    ## Rotated positions of every sample and angle in the queue are worked out once, for the scheduler, the estimate, and rotate_now
+    position_function = make_sample_position_function(configuration, queue=acquisitions)
+    queue = sortAcquisitionsQueue(acquisitions, sortBy=sort_by, position_function=position_function) 
+    queue = [validate_acquisition(acquisition) for acquisition in queue]
     
+    estimate = estimate_queue_time(queue, position_function=position_function)
+    print_queue_time_estimate(estimate)
+    ## e.g., ranges not divisible by their step size, so they are seen before the queue starts, including in a dry run
+    print_energy_grid_warnings([acquisition["energy_list_parameters"] for acquisition in queue])
     print("Starting queue")
 
     for indexAcquisition, acquisition in enumerate(queue):
         print("\n\n")
+        if dryrun == True: print("Estimated time: " + format_duration(estimate["acquisitions"][indexAcquisition]))
         yield from run_acquisitions_single(acquisition=acquisition, dryrun=dryrun)
 
 
     print("\n\nFinished queue")
-
-    ## TODO: get time estimates for individual acquisitions and the full queue.  Import datetime and can print timestamps for when things actually completed.
-
-
-
+    rsoxs_bar_cache.print_stats()
+
+
+
+
+
+def run_setup_steps(setup_steps):
+    """
+    Runs the setup steps before a scan, overlapping the steps that can move at the same time (see setup_overlap.schedule_setup_steps).
+
+    Each step is a dictionary with "name", "devices", and either
+        "move": (device, position), a single move that is started without waiting.  run_setup_steps waits for it when a conflicting step is next or at the end.
+        "plan": a function that returns a plan, which is run as it is, including its own waits (e.g., load_samp, set_polarization).
+    Only single moves are deferred, because a plan can depend on its own moves finishing in order.
+    """
+    schedule = schedule_setup_steps([dict(step, deferrable="move" in step) for step in setup_steps])
+    groups = []
+    groups_done = set()
+    time_start = time.time()
+    for step in schedule["steps"]:
+        for indexBefore in step["after"]:
+            if indexBefore not in groups_done:
+                yield from bps.wait(groups[indexBefore])
+                groups_done.add(indexBefore)
+        groups.append(str(uuid.uuid4()))
+        if "move" in step:
+            device, position = step["move"]
+            yield from bps.abs_set(device, position, group=groups[-1])
+        else:
+            yield from step["plan"]()
+    for index, group in enumerate(groups):
+        if index not in groups_done:
+            yield from bps.wait(group)
+
+    if len(schedule["steps"]) > 1:
+        print(
+            "Setup (" + ", ".join(step["name"] for step in schedule["steps"]) + ") took " + str(round(time.time() - time_start, 1)) + " s.  "
+            + "Overlapping moves saved about " + str(round(schedule["time_sequential"] - schedule["time_overlapped"])) + " s"
+        )
 
 
 ## TODO: This function can benefit from refactoring.
@@ -91,24 +143,36 @@ def run_acquisitions_single(
     
     ## The acquisition is sanitized again in case it were not run from a spreadsheet
     ## But for now, still requires that a full configuration be set up for the sample
-    acquisition = sanitizeAcquisition(acquisition) ## This would be run before if a spreadsheet were loaded, but now it will ensure the acquisition is sanitized in case the acquisition is run in the terminal
+    acquisition = validate_acquisition(acquisition) ## Skipped if the acquisition was already validated (e.g., by run_acquisitions_queue), but ensures the acquisition is sanitized in case the acquisition is run in the terminal
     
+    ## Setup steps (configuration, sample, rotation, polarization, energy) are run by run_setup_steps, which overlaps the steps that do not conflict
+    setup_steps = []
     parameter = "configuration_instrument"
     if acquisition[parameter] is not None:
-        yield from load_configuration(
-            configuration_name = acquisition[parameter],
-            dryrun = dryrun,
-            )  
+        setup_steps.append({
+            "name": "configuration",
+            "devices": {"configuration"},
+            "plan": lambda: load_configuration(
+                configuration_name = acquisition["configuration_instrument"],
+                dryrun = dryrun,
+                skip_in_position = True, ## Consecutive acquisitions usually use the same configuration
+                use_planner = True,
+                ), ## The planner waits for interlocked moves itself
+        })
 
     ## TODO: set up diodes to high or low gain
     ## But there are issues at the moment with setup_diode_i400() and most people don't use this, so leave it for now
 
     parameter = "sample_id"
     if acquisition[parameter] is not None:
-        yield from load_samp(
-            sample_id_or_index = acquisition[parameter], 
-            dryrun = dryrun,
-            ) 
+        setup_steps.append({
+            "name": "sample",
+            "devices": {"sample"},
+            "plan": lambda: load_samp(
+                sample_id_or_index = acquisition["sample_id"], 
+                dryrun = dryrun,
+                ),
+        })
         
 
     ## TODO: set temperature if needed, but this is lowest priority
@@ -120,10 +184,14 @@ def run_acquisitions_single(
         ## Rotation is either not needed or handled differently.
         if sampleAngle != "Do not rotate":
             ## TODO: Requires spots to be picked from image, so I have to comment when I don't have beam
-            yield from rotate_now(
-                theta = sampleAngle,
-                dryrun = dryrun,
-                ) ## TODO: What is the difference between rotate_sample and rotate_now?
+            setup_steps.append({
+                "name": "rotation",
+                "devices": {"sample"},
+                "plan": lambda sampleAngle=sampleAngle: rotate_now(
+                    theta = sampleAngle,
+                    dryrun = dryrun,
+                    ), ## TODO: What is the difference between rotate_sample and rotate_now?
+            })
         
         for indexPolarization, polarization in enumerate(acquisition["polarizations"]):
             print("Setting polarization: " + str(polarization))
@@ -131,33 +199,39 @@ def run_acquisitions_single(
                 ## If a timeScan or spiral is being run when I don't have beam (during shutdown or when another station is using beam), I don't want to make any changes to the energy or polarization.
                 ## TODO: Actually, make this even smarter.  If RSoXS station does not have control or if cannot write EPU Epics PV, then do this
                 if acquisition["configuration_instrument"] == "NoBeam": print("Not moving motors.")
-                else: yield from set_polarization(polarization)
+                else: 
+                    setup_steps.append({
+                        "name": "polarization",
+                        "devices": {"polarization"},
+                        "plan": lambda polarization=polarization: set_polarization(polarization),
+                    })
+                    ## Time and spiral scans stay at one energy.  Energy scans start at the first energy, so the mono and EPU can get there while other motors move.
+                    energy = get_energy_start(acquisition)
+                    if energy is not None:
+                        print("Setting energy: " + str(energy))
+                        setup_steps.append({
+                            "name": "energy",
+                            "devices": {"energy"},
+                            "move": (en, energy),
+                        })
+            yield from run_setup_steps(setup_steps)
+            setup_steps = []
             
             print("Running scan: " + str(acquisition["scan_type"]))
             if dryrun == False or updateAcquireStatusDuringDryRun == True:
                 timeStamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                acquisition["acquire_status"] = "Started " + str(timeStamp)
-                rsoxs_config["bar"] = updateConfigurationWithAcquisition(rsoxs_config["bar"], acquisition)
+                acquisition = acquisition.replace(acquire_status="Started " + str(timeStamp))
+                update_acquisition_in_rsoxs_config(acquisition.to_dict())
             if dryrun == False:
                 if "time" in acquisition["scan_type"]:
                     if acquisition["scan_type"]=="time": use_2D_detector = False
                     if acquisition["scan_type"]=="time2D": use_2D_detector = True
-                    energy = acquisition["energy_list_parameters"]
-                    print("Setting energy: " + str(energy))
-                    if dryrun == False: 
-                        if acquisition["configuration_instrument"] == "NoBeam": print("Not moving motors.")
-                        else: yield from bps.mv(en, energy)
                     yield from nbs_count(num=acquisition["exposures_per_energy"], 
                                          use_2d_detector=use_2D_detector, 
                                          dwell=acquisition["exposure_time"],
                                          )
                 
                 if acquisition["scan_type"] == "spiral":
-                    energy = acquisition["energy_list_parameters"]
-                    print("Setting energy: " + str(energy))
-                    if dryrun == False: 
-                        if acquisition["configuration_instrument"] == "NoBeam": print("Not moving motors.")
-                        else: yield from bps.mv(en, energy)
                     ## TODO: could I just run waxs_spiral_mode() over here and then after spiral_scan finishes, run waxs_normal_mode()?  Eliot may have mentioned something about not being able to do this inside the Run Engine or within spreadsheet, but maybe get this clarified during data security?
                     yield from spiral_scan(
                         stepsize=acquisition["spiral_dimensions"][0], 
@@ -171,13 +245,12 @@ def run_acquisitions_single(
                     print("Energy parameters: " + str(acquisition["energy_list_parameters"]))
                     if acquisition["scan_type"]=="nexafs": use_2D_detector = False
                     if acquisition["scan_type"]=="rsoxs": use_2D_detector = True
-                    energy_parameters = acquisition["energy_list_parameters"]
-                    if isinstance(energy_parameters, str): energy_parameters = energy_list_parameters[energy_parameters]
+                    energy_grid = get_energy_grid(acquisition["energy_list_parameters"]) ## Parameters are checked once per set of parameters instead of inside every scan
                     
                     ## If cycles = 0, then just run one sweep in ascending energy
                     if acquisition["cycles"] == 0: 
                         yield from nbs_energy_scan(
-                                *energy_parameters,
+                                *energy_grid.parameters,
                                 use_2d_detector=use_2D_detector, 
                                 dwell=acquisition["exposure_time"],
                                 n_exposures=acquisition["exposures_per_energy"], 
@@ -188,26 +261,54 @@ def run_acquisitions_single(
                     else: 
                         for cycle in np.arange(0, acquisition["cycles"], 1):
                             yield from nbs_energy_scan(
-                                *energy_parameters,
-                                use_2d_detector=use_2D_detector, 
-                                dwell=acquisition["exposure_time"],
-                                n_exposures=acquisition["exposures_per_energy"], 
-                                group_name=acquisition["group_name"],
-                                )
-                            yield from nbs_energy_scan(
-                                *energy_parameters[::-1], ## Reverse the energy list parameters to produce reversed energy list
+                                *energy_grid.parameters,
                                 use_2d_detector=use_2D_detector, 
                                 dwell=acquisition["exposure_time"],
                                 n_exposures=acquisition["exposures_per_energy"], 
                                 group_name=acquisition["group_name"],
                                 )
+                            if energy_grid.reversible:
+                                yield from nbs_energy_scan(
+                                    *energy_grid.parameters[::-1], ## Reverse the energy list parameters to produce reversed energy list
+                                    use_2d_detector=use_2D_detector, 
+                                    dwell=acquisition["exposure_time"],
+                                    n_exposures=acquisition["exposures_per_energy"], 
+                                    group_name=acquisition["group_name"],
+                                    )
+                            else:
+                                ## Reversed parameters would give different energies (a range not divisible by its step), so the ascending energies are scanned in reverse
+                                yield from nbs_list_scan(
+                                    bl.energy,
+                                    list(energy_grid.points_reversed),
+                                    use_2d_detector=use_2D_detector, 
+                                    dwell=acquisition["exposure_time"],
+                                    n_exposures=acquisition["exposures_per_energy"], 
+                                    group_name=acquisition["group_name"],
+                                    md={"energy_list_parameters": list(energy_grid.parameters[::-1])},
+                                    )
                     
                     ## TODO: maybe default to cycles = 1?  It would be good practice to have forward and reverse scan to assess reproducibility
+                
+                if acquisition["scan_type"] == "nexafs_fly":
+                    print("Energy parameters: " + str(acquisition["energy_list_parameters"]))
+                    energy_grid = get_energy_grid(acquisition["energy_list_parameters"])
+                    ## Same sweeps as the step scans: one ascending sweep if cycles = 0, otherwise pairs of ascending and descending sweeps
+                    for descending in ([False] if acquisition["cycles"] == 0 else [False, True] * int(acquisition["cycles"])):
+                        yield from nexafs_fly(
+                            energy_grid,
+                            exposure_time=acquisition["exposure_time"] * acquisition["exposures_per_energy"],
+                            descending=descending,
+                            group_name=acquisition["group_name"],
+                            )
             
             if dryrun == False or updateAcquireStatusDuringDryRun == True:
                 timeStamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                acquisition["acquire_status"] = "Finished " + str(timeStamp) ## TODO: Add timestamp
-                rsoxs_config["bar"] = updateConfigurationWithAcquisition(rsoxs_config["bar"], acquisition)
+                acquisition = acquisition.replace(acquire_status="Finished " + str(timeStamp)) ## TODO: Add timestamp
+                update_acquisition_in_rsoxs_config(acquisition.to_dict())
+
+    ## With no sample_angles or polarizations, the loops above do not run the setup, but the configuration and sample are still loaded, as before
+    if setup_steps:
+        yield from run_setup_steps(setup_steps)
 
     sync_rsoxs_config_to_nbs_manipulator()
 
@@ -304,9 +304,10 @@ class BestImageSelector(QWidget):
 
     def save_configuration(self):
         directory = os.path.dirname(self.configuration_file)
-        print(f"Saving configuration to {directory}/SpiralSpotsPicked.xlsx")
-        save_configuration_spreadsheet_local(
-            self.configuration, file_label="SpiralSpotsPicked", file_path=directory
+        ## The file name is timestamped, and the saved path (or the error) is printed when the background save finishes
+        print(f"Saving configuration to {directory} in the background")
+        return save_configuration_spreadsheet_local(
+            self.configuration, file_label="SpiralSpotsPicked", file_path=directory, background=True
         )
 
     def _next_run(self):
@@ -0,0 +1,210 @@
+## Process-local, read-through cache of rsoxs_config["bar"].
+## Lookups such as get_sample_id_and_index and list_samples read the bar from Redis on every call.
+## The cache keeps one snapshot of the bar in memory and only reads it again after the bar was written, either by this process or by another one (GUI, queueserver worker).
+##
+## Writes by this process are reported synchronously by the rsoxs_config objects (see write_listeners).
+## Writes by other processes are picked up through Redis keyspace notifications on the bar's key (or on the version key in the granular layout).
+
+import contextlib
+import copy
+import threading
+
+from redis_json_dict import RedisJSONDict
+
+
+class BarCache:
+    """
+    Snapshot of rsoxs_config["bar"] that is served from memory until the bar changes.
+
+    The snapshot is shared between callers and must be treated as read-only.
+    Anything that changes the bar should go through rsoxs_config, which invalidates the snapshot.
+
+    Parameters
+    ----------
+    rsoxs_config : mapping
+        rsoxs_config object that the bar is read from
+    redis_client : redis.Redis
+        Client used to subscribe to keyspace notifications
+    watch_key : str
+        Redis key that changes whenever the bar changes
+    version_key : str, optional
+        Redis key holding a counter that is incremented with every write.
+        Only used if keyspace notifications cannot be enabled, in which case the counter is checked on every read.
+    """
+
+    def __init__(self, rsoxs_config, redis_client, watch_key, version_key=None):
+        self._rsoxs_config = rsoxs_config
+        self._redis_client = redis_client
+        self.watch_key = watch_key
+        self.version_key = version_key
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_redis_version = None
+        self._pending_own_notifications = 0
+        self._pubsub_thread = None
+        self.notifications_enabled = None  ## None until the first read tries to subscribe
+        self.version = 0  ## Incremented every time the snapshot is invalidated
+        self.hits = 0
+        self.misses = 0
+        self.local_invalidations = 0
+        self.remote_invalidations = 0
+
+    def get(self):
+        """
+        Returns the bar, read from Redis only if it changed since the last read.
+        """
+        self._start_listening()
+        redis_version = self._read_redis_version()
+        with self._lock:
+            if self._snapshot is not None and (
+                self.notifications_enabled or (redis_version is not None and redis_version == self._snapshot_redis_version)
+            ):
+                self.hits += 1
+                return self._snapshot
+            self.misses += 1
+            version = self.version
+
+        snapshot = copy.deepcopy(self._rsoxs_config.get("bar", []))
+
+        with self._lock:
+            if version == self.version:  ## Otherwise the bar was written while it was being read
+                self._snapshot = snapshot
+                self._snapshot_redis_version = redis_version
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._invalidate()
+
+    def stats(self):
+        reads = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / reads if reads else 0,
+            "local_invalidations": self.local_invalidations,
+            "remote_invalidations": self.remote_invalidations,
+            "version": self.version,
+            "notifications_enabled": self.notifications_enabled,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            "Bar cache: "
+            + str(stats["hits"]) + " hits, "
+            + str(stats["misses"]) + " misses (Redis reads of the bar), "
+            + str(stats["local_invalidations"]) + " writes from this process, "
+            + str(stats["remote_invalidations"]) + " writes from other processes"
+        )
+
+    def reset_stats(self):
+        self.hits = self.misses = self.local_invalidations = self.remote_invalidations = 0
+
+    ## Called by rsoxs_config objects around their own writes
+    def writing(self, keys):
+        if self.watch_key in keys and self.notifications_enabled:
+            with self._lock:
+                self._pending_own_notifications += 1  ## This write's keyspace notification should not count as a remote write
+
+    def written(self, keys):
+        if self.watch_key in keys:
+            with self._lock:
+                self._invalidate()
+                self.local_invalidations += 1
+
+    def write_failed(self, keys):
+        if self.watch_key in keys and self.notifications_enabled:
+            with self._lock:
+                self._pending_own_notifications = max(0, self._pending_own_notifications - 1)
+        self.invalidate()
+
+    def _invalidate(self):
+        self._snapshot = None
+        self.version += 1
+
+    def _on_notification(self, message):
+        with self._lock:
+            if self._pending_own_notifications > 0:
+                self._pending_own_notifications -= 1
+                return
+            self._invalidate()
+            self.remote_invalidations += 1
+
+    def _read_redis_version(self):
+        if self.notifications_enabled or self.version_key is None:
+            return None
+        return int(self._redis_client.get(self.version_key) or 0)
+
+    def _start_listening(self):
+        if self.notifications_enabled is not None:
+            return
+        try:
+            ## Add keyspace events for string (set, incr) and generic (del) commands without removing flags other clients rely on
+            flags = self._redis_client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+            if isinstance(flags, bytes):
+                flags = flags.decode()
+            missing = "".join(flag for flag in "K$g" if flag not in flags and not (flag in "$g" and "A" in flags))
+            if missing:
+                self._redis_client.config_set("notify-keyspace-events", flags + missing)
+            database = self._redis_client.connection_pool.connection_kwargs.get("db", 0)
+            pubsub = self._redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{"__keyspace@" + str(database) + "__:" + self.watch_key: self._on_notification})
+            self._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            self.notifications_enabled = True
+        except Exception as error:
+            self.notifications_enabled = False
+            if self.version_key is None:
+                print("Bar cache disabled, unable to enable Redis keyspace notifications: " + str(error))
+            else:
+                print("Redis keyspace notifications unavailable (" + str(error) + ").  Bar cache will check " + str(self.version_key) + " on every read.")
+
+    def stop(self):
+        if self._pubsub_thread is not None:
+            self._pubsub_thread.stop()
+            self._pubsub_thread = None
+        self.notifications_enabled = None
+        self.invalidate()
+
+
+@contextlib.contextmanager
+def notify_write(listeners, keys):
+    """
+    Tells listeners (e.g., a BarCache) that keys are about to be written and then that they were written.
+    """
+    for listener in listeners:
+        listener.writing(keys)
+    try:
+        yield
+    except Exception:
+        for listener in listeners:
+            listener.write_failed(keys)
+        raise
+    for listener in listeners:
+        listener.written(keys)
+
+
+class RedisJSONDictWithListeners(RedisJSONDict):
+    """
+    RedisJSONDict that reports its writes to write_listeners, including writes made by mutating nested values.
+    """
+
+    def __init__(self, redis_client, prefix):
+        super().__init__(redis_client, prefix)
+        self.write_listeners = []
+
+    def __setitem__(self, key, value):
+        with notify_write(self.write_listeners, [f"{self._prefix}{key}"]):
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        with notify_write(self.write_listeners, [f"{self._prefix}{key}"]):
+            super().__delitem__(key)
+
+    def update(self, d):
+        with notify_write(self.write_listeners, [f"{self._prefix}{key}" for key in d]):
+            super().update(d)
+
+    def clear(self):
+        with notify_write(self.write_listeners, [f"{self._prefix}{key}" for key in self]):
+            super().clear()
@@ -1,8 +1,25 @@
 import redis  ## In-memory (RAM) databases that persists on disk even if Bluesky is restarted
-from redis_json_dict import RedisJSONDict
 from nbs_bl.beamline import GLOBAL_BEAMLINE as bl
 from nbs_bl.redisUtils import open_redis_client_from_settings
 
+from .redis_bar_cache import BarCache, RedisJSONDictWithListeners
+from .redis_granular_bar import GranularBar, GranularRSoXSConfig, default_granular_prefix
+
 redis_config_settings = bl.settings.get("redis").get("config", {})
 rsoxsredis = open_redis_client_from_settings(redis_config_settings)
-rsoxs_config = RedisJSONDict(rsoxsredis, prefix=redis_config_settings.get("prefix", "rsoxs-"))
\ No newline at end of file
+rsoxs_config = RedisJSONDictWithListeners(rsoxsredis, prefix=redis_config_settings.get("prefix", "rsoxs-"))
+
+## Optional layout that stores one key per sample and one hash field per acquisition instead of the whole bar as one JSON value.
+## Enable with bar_layout = "granular" in the redis config settings after running redis_granular_bar.migrate_bar_to_granular once.
+if redis_config_settings.get("bar_layout", "json") == "granular":
+    rsoxs_config = GranularRSoXSConfig(
+        rsoxs_config,
+        GranularBar(rsoxsredis, prefix=redis_config_settings.get("granular_prefix", default_granular_prefix)),
+    )
+    rsoxs_bar_cache = BarCache(
+        rsoxs_config, rsoxsredis, watch_key=rsoxs_config.bar.version_key, version_key=rsoxs_config.bar.version_key
+    )
+    rsoxs_config.bar.write_listeners.append(rsoxs_bar_cache)
+else:
+    rsoxs_bar_cache = BarCache(rsoxs_config, rsoxsredis, watch_key=redis_config_settings.get("prefix", "rsoxs-") + "bar")
+    rsoxs_config.write_listeners.append(rsoxs_bar_cache)
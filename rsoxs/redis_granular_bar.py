@@ -0,0 +1,441 @@
+## Optional Redis layout for rsoxs_config["bar"] with one key per sample and one hash field per acquisition.
+## In the default layout, the whole bar is one JSON value under the "bar" key of a RedisJSONDict, so every change serializes and sends the full sample list.
+## In this layout, changing one sample or one acquisition only writes that sample or acquisition.
+##
+## Keys (with the default prefix "rsoxs_bar:"):
+## rsoxs_bar:order                      list of sample tokens in bar order
+## rsoxs_bar:sample:<token>             JSON of the sample without its acquisitions
+## rsoxs_bar:acquisitions:<token>       hash of acquisition token -> JSON of the acquisition
+## rsoxs_bar:acquisition_order:<token>  list of acquisition tokens in order
+## rsoxs_bar:version                    counter incremented with every write
+##
+## Tokens are storage identifiers only, so renaming a sample_id or uid_local does not move any keys.
+## The prefix must not start with the RedisJSONDict prefix (e.g., "rsoxs-"), or these keys would show up as rsoxs_config entries.
+
+import collections.abc
+import copy
+import uuid
+
+import orjson
+from redis_json_dict import RedisJSONDict
+from redis_json_dict.redis_json_dict import ObservableMapping, ObservableSequence, observe
+
+from .redis_bar_cache import notify_write
+
+
+default_granular_prefix = "rsoxs_bar:"
+
+
+class GranularBar(collections.abc.MutableSequence):
+    """
+    List-like view of the bar stored in the granular layout.
+
+    Indexing returns a GranularSample, which only reads from Redis when it is used and only writes the parts that change.
+    Copying (copy.copy, copy.deepcopy) returns a plain list of plain dictionaries, same as a RedisJSONDict value.
+
+    bytes_read and bytes_written count the JSON sent to and from Redis so that traffic per update can be checked.
+    write_listeners (e.g., a BarCache) are told about every write through the version key.
+    """
+
+    def __init__(self, redis_client, prefix=default_granular_prefix):
+        self._redis_client = redis_client
+        self._prefix = prefix
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.write_listeners = []
+
+    ## Keys
+    @property
+    def order_key(self):
+        return self._prefix + "order"
+
+    @property
+    def version_key(self):
+        return self._prefix + "version"
+
+    def sample_key(self, token):
+        return self._prefix + "sample:" + token
+
+    def acquisitions_key(self, token):
+        return self._prefix + "acquisitions:" + token
+
+    def acquisition_order_key(self, token):
+        return self._prefix + "acquisition_order:" + token
+
+    @property
+    def version(self):
+        return int(self._redis_client.get(self.version_key) or 0)
+
+    ## Sequence interface
+    def __len__(self):
+        return self._redis_client.llen(self.order_key)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+        token = self._redis_client.lindex(self.order_key, self._normalize_index(index))
+        if token is None:
+            raise IndexError("bar index out of range")
+        return GranularSample(self, token.decode())
+
+    def __setitem__(self, index, sample):
+        token = self._redis_client.lindex(self.order_key, self._normalize_index(index))
+        if token is None:
+            raise IndexError("bar index out of range")
+        pipe = self._redis_client.pipeline()
+        self._write_sample(pipe, token.decode(), sample, replace_acquisitions=True)
+        self._execute(pipe)
+
+    def __delitem__(self, index):
+        token = self._redis_client.lindex(self.order_key, self._normalize_index(index))
+        if token is None:
+            raise IndexError("bar index out of range")
+        token = token.decode()
+        pipe = self._redis_client.pipeline()
+        pipe.lrem(self.order_key, 1, token)
+        self._delete_sample(pipe, token)
+        self._execute(pipe)
+
+    def insert(self, index, sample):
+        token = uuid.uuid4().hex
+        length = len(self)
+        index = max(0, min(length, index + length if index < 0 else index))
+        pipe = self._redis_client.pipeline()
+        self._write_sample(pipe, token, sample, replace_acquisitions=True)
+        if index == length:
+            pipe.rpush(self.order_key, token)
+        else:
+            pivot = self._redis_client.lindex(self.order_key, index)
+            pipe.linsert(self.order_key, "BEFORE", pivot, token)
+        self._execute(pipe)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def __eq__(self, other):
+        return self.to_list() == other
+
+    def __copy__(self):
+        return self.to_list()
+
+    def __deepcopy__(self, memo):
+        return self.to_list()
+
+    def _normalize_index(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0:
+            raise IndexError("bar index out of range")
+        return index
+
+    ## Bulk operations
+    def to_list(self):
+        """
+        Returns the whole bar as a plain list of sample dictionaries, using one batched read.
+        """
+        tokens = [token.decode() for token in self._redis_client.lrange(self.order_key, 0, -1)]
+        pipe = self._redis_client.pipeline(transaction=False)
+        for token in tokens:
+            pipe.get(self.sample_key(token))
+            pipe.lrange(self.acquisition_order_key(token), 0, -1)
+            pipe.hgetall(self.acquisitions_key(token))
+        results = pipe.execute()
+        configuration = []
+        for indexSample, token in enumerate(tokens):
+            sample_json, acquisition_order, acquisitions = results[3 * indexSample : 3 * indexSample + 3]
+            if sample_json is None:
+                continue  ## Deleted by another process between the two reads
+            sample = self._loads(sample_json)
+            sample["acquisitions"] = [
+                self._loads(acquisitions[acquisition_token])
+                for acquisition_token in acquisition_order
+                if acquisition_token in acquisitions
+            ]
+            configuration.append(sample)
+        return configuration
+
+    def replace(self, configuration):
+        """
+        Replaces the whole bar in one transaction.  Used for rsoxs_config["bar"] = configuration.
+        """
+        configuration = copy.deepcopy(list(configuration))  ## Copy first in case configuration is a view of this bar
+        old_tokens = [token.decode() for token in self._redis_client.lrange(self.order_key, 0, -1)]
+        pipe = self._redis_client.pipeline()
+        pipe.delete(self.order_key)
+        for token in old_tokens:
+            self._delete_sample(pipe, token)
+        new_tokens = []
+        for sample in configuration:
+            token = uuid.uuid4().hex
+            new_tokens.append(token)
+            self._write_sample(pipe, token, sample, replace_acquisitions=True)
+        if new_tokens:
+            pipe.rpush(self.order_key, *new_tokens)
+        self._execute(pipe)
+
+    def clear(self):
+        self.replace([])
+
+    ## Writes.  All of them go through a pipeline that also increments the version counter.
+    def _execute(self, pipe):
+        pipe.incr(self.version_key)
+        with notify_write(self.write_listeners, [self.version_key]):
+            pipe.execute()
+
+    def _write_sample(self, pipe, token, sample, replace_acquisitions=False):
+        fields = {key: value for key, value in sample.items() if key != "acquisitions"}
+        pipe.set(self.sample_key(token), self._dumps(fields))
+        if replace_acquisitions:
+            pipe.delete(self.acquisitions_key(token), self.acquisition_order_key(token))
+            acquisition_tokens = []
+            for acquisition in sample.get("acquisitions", []):
+                acquisition_token = uuid.uuid4().hex
+                acquisition_tokens.append(acquisition_token)
+                pipe.hset(self.acquisitions_key(token), acquisition_token, self._dumps(acquisition))
+            if acquisition_tokens:
+                pipe.rpush(self.acquisition_order_key(token), *acquisition_tokens)
+
+    def _delete_sample(self, pipe, token):
+        pipe.delete(self.sample_key(token), self.acquisitions_key(token), self.acquisition_order_key(token))
+
+    def _dumps(self, value):
+        json = orjson.dumps(value, default=_json_encoder_default, option=orjson.OPT_SERIALIZE_NUMPY)
+        self.bytes_written += len(json)
+        return json
+
+    def _loads(self, json):
+        self.bytes_read += len(json)
+        return orjson.loads(json)
+
+
+class GranularSample(collections.abc.MutableMapping):
+    """
+    Dictionary-like view of one sample.  Fields are read on first use.
+    Changing a field (including nested values such as bar_loc or location) rewrites only this sample's JSON.
+    """
+
+    def __init__(self, bar, token):
+        self._bar = bar
+        self._token = token
+        self._fields = None
+
+    def _load(self):
+        if self._fields is None:
+            json = self._bar._redis_client.get(self._bar.sample_key(self._token))
+            if json is None:
+                raise KeyError("Sample was removed from the bar")
+            self._fields = observe(self._bar._loads(json), self._sync)
+        return self._fields
+
+    def _sync(self):
+        pipe = self._bar._redis_client.pipeline()
+        pipe.set(self._bar.sample_key(self._token), self._bar._dumps(self._fields))
+        self._bar._execute(pipe)
+
+    def __getitem__(self, key):
+        if key == "acquisitions":
+            return GranularAcquisitions(self._bar, self._token)
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        if key == "acquisitions":
+            sample = dict(self._load(), acquisitions=value)
+            pipe = self._bar._redis_client.pipeline()
+            self._bar._write_sample(pipe, self._token, sample, replace_acquisitions=True)
+            self._bar._execute(pipe)
+            return
+        self._load()._mapping[key] = observe(value, self._sync)
+        self._sync()
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __iter__(self):
+        yield from self._load()
+        yield "acquisitions"
+
+    def __len__(self):
+        return len(self._load()) + 1
+
+    def to_dict(self):
+        sample = copy.deepcopy(self._load())
+        sample["acquisitions"] = self["acquisitions"].to_list()
+        return sample
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __eq__(self, other):
+        return self.to_dict() == other
+
+    def __copy__(self):
+        return self.to_dict()
+
+    def __deepcopy__(self, memo):
+        return self.to_dict()
+
+
+class GranularAcquisitions(collections.abc.MutableSequence):
+    """
+    List-like view of one sample's acquisitions.
+    Replacing or changing one acquisition writes only that acquisition.
+    """
+
+    def __init__(self, bar, token):
+        self._bar = bar
+        self._token = token
+        self._tokens = None
+
+    def _load_tokens(self):
+        if self._tokens is None:
+            self._tokens = [
+                token.decode()
+                for token in self._bar._redis_client.lrange(self._bar.acquisition_order_key(self._token), 0, -1)
+            ]
+        return self._tokens
+
+    def _write(self, acquisition_token, acquisition, pipe=None):
+        execute = pipe is None
+        if execute:
+            pipe = self._bar._redis_client.pipeline()
+        pipe.hset(self._bar.acquisitions_key(self._token), acquisition_token, self._bar._dumps(acquisition))
+        if execute:
+            self._bar._execute(pipe)
+
+    def __len__(self):
+        return len(self._load_tokens())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+        acquisition_token = self._load_tokens()[index]
+        json = self._bar._redis_client.hget(self._bar.acquisitions_key(self._token), acquisition_token)
+        if json is None:
+            raise IndexError("Acquisition was removed from the sample")
+        acquisition = None
+
+        def sync():
+            self._write(acquisition_token, acquisition)
+
+        acquisition = observe(self._bar._loads(json), sync)
+        return acquisition
+
+    def __setitem__(self, index, acquisition):
+        self._write(self._load_tokens()[index], acquisition)
+
+    def __delitem__(self, index):
+        acquisition_token = self._load_tokens().pop(index)
+        pipe = self._bar._redis_client.pipeline()
+        pipe.lrem(self._bar.acquisition_order_key(self._token), 1, acquisition_token)
+        pipe.hdel(self._bar.acquisitions_key(self._token), acquisition_token)
+        self._bar._execute(pipe)
+
+    def insert(self, index, acquisition):
+        tokens = self._load_tokens()
+        index = max(0, min(len(tokens), index + len(tokens) if index < 0 else index))
+        acquisition_token = uuid.uuid4().hex
+        pipe = self._bar._redis_client.pipeline()
+        self._write(acquisition_token, acquisition, pipe=pipe)
+        if index == len(tokens):
+            pipe.rpush(self._bar.acquisition_order_key(self._token), acquisition_token)
+        else:
+            pipe.linsert(self._bar.acquisition_order_key(self._token), "BEFORE", tokens[index], acquisition_token)
+        self._bar._execute(pipe)
+        tokens.insert(index, acquisition_token)
+
+    def to_list(self):
+        tokens = self._load_tokens()
+        if not tokens:
+            return []
+        jsons = self._bar._redis_client.hmget(self._bar.acquisitions_key(self._token), tokens)
+        return [self._bar._loads(json) for json in jsons if json is not None]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def __eq__(self, other):
+        return self.to_list() == other
+
+    def __copy__(self):
+        return self.to_list()
+
+    def __deepcopy__(self, memo):
+        return self.to_list()
+
+
+class GranularRSoXSConfig(collections.abc.MutableMapping):
+    """
+    Drop-in replacement for the rsoxs_config RedisJSONDict that stores "bar" in the granular layout.
+    All other keys stay in the RedisJSONDict.
+    """
+
+    def __init__(self, json_config, bar):
+        self.json_config = json_config
+        self.bar = bar
+
+    def __getitem__(self, key):
+        if key == "bar":
+            return self.bar
+        return self.json_config[key]
+
+    def __setitem__(self, key, value):
+        if key == "bar":
+            self.bar.replace(value)
+        else:
+            self.json_config[key] = value
+
+    def __delitem__(self, key):
+        if key == "bar":
+            self.bar.clear()
+        else:
+            del self.json_config[key]
+
+    def __iter__(self):
+        yield "bar"
+        yield from (key for key in self.json_config if key != "bar")
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def migrate_bar_to_granular(redis_client, json_prefix="rsoxs-", granular_prefix=default_granular_prefix, delete_json=False):
+    """
+    Copies rsoxs_config["bar"] from the RedisJSONDict layout (one JSON value under json_prefix + "bar") to the granular layout.
+
+    The JSON value is kept unless delete_json is True, so that switching back to the default layout is possible.
+    Returns the GranularBar.
+    """
+    json_config = RedisJSONDict(redis_client, prefix=json_prefix)
+    bar = GranularBar(redis_client, prefix=granular_prefix)
+    bar.replace(copy.deepcopy(json_config.get("bar", [])))
+    if delete_json:
+        del json_config["bar"]
+    print("Migrated " + str(len(bar)) + " samples to the granular layout with prefix " + str(granular_prefix))
+    return bar
+
+
+def migrate_bar_to_json(redis_client, json_prefix="rsoxs-", granular_prefix=default_granular_prefix):
+    """
+    Copies the bar from the granular layout back to the RedisJSONDict layout.
+    """
+    json_config = RedisJSONDict(redis_client, prefix=json_prefix)
+    json_config["bar"] = GranularBar(redis_client, prefix=granular_prefix).to_list()
+
+
+def _json_encoder_default(content):
+    if isinstance(content, ObservableMapping):
+        return content._mapping
+    if isinstance(content, ObservableSequence):
+        return content._sequence
+    if isinstance(content, (GranularSample, GranularAcquisitions)):
+        return copy.deepcopy(content)
+    raise TypeError
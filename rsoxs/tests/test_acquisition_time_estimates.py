@@ -0,0 +1,56 @@
+import time
+
+from rsoxs.configuration_setup.acquisition_time_estimates import (
+    count_energy_points,
+    estimate_acquisition_time,
+    estimate_queue_time,
+    timeEstimateOverheads_Default,
+)
+from rsoxs.plans.default_energy_parameters import energy_list_parameters
+
+
+def test_count_energy_points():
+    ## 250 to 282 in 1.28 eV steps, 282 to 297 in 0.3 eV steps, 297 to 350 in 1.325 eV steps
+    assert count_energy_points("carbon_NEXAFS") == 1 + 25 + 50 + 40
+    assert count_energy_points(energy_list_parameters["carbon_NEXAFS"][::-1]) == 116
+    assert count_energy_points((270, 1, 272.6)) == 4  ## 270, 271, 272, 272.6
+    assert count_energy_points((270, 1, 272.4)) == 3  ## 270, 271, 272.4; no extra point within half a step of the stop
+    assert count_energy_points(285) == 1
+
+
+def test_estimate_acquisition_time():
+    overheads = dict(timeEstimateOverheads_Default, rotation=0, polarization=0)
+    acquisition = {
+        "scan_type": "nexafs",
+        "energy_list_parameters": (270, 1, 280),
+        "exposure_time": 2,
+        "exposures_per_energy": 1,
+        "cycles": 1,
+        "polarizations": [0, 90],
+        "sample_angles": [20],
+    }
+    time_sweep = overheads["scan_fixed"] + 11 * (2 + overheads["point_nexafs"])
+    assert estimate_acquisition_time(acquisition, overheads=overheads) == 2 * 2 * time_sweep
+
+
+def test_estimate_queue_time_is_fast():
+    queue = [
+        {
+            "sample_id": "sample" + str(index % 50),
+            "configuration_instrument": ["WAXSNEXAFS", "WAXS"][index % 2],
+            "scan_type": ["nexafs", "rsoxs", "spiral", "time"][index % 4],
+            "energy_list_parameters": ["carbon_NEXAFS", "oxygen_NEXAFS", 285, 270][index % 4],
+            "polarizations": [0, 90],
+            "sample_angles": [0, 20],
+            "spiral_dimensions": [0.3, 1.8, 1.8],
+            "exposure_time": 1,
+            "exposures_per_energy": 1,
+            "cycles": 0,
+        }
+        for index in range(5000)
+    ]
+    start = time.perf_counter()
+    estimate = estimate_queue_time(queue)
+    assert time.perf_counter() - start < 1
+    assert len(estimate["acquisitions"]) == 5000
+    assert abs(estimate["total"] - sum(estimate["acquisitions"])) < 1e-6
@@ -0,0 +1,139 @@
+import copy
+
+import numpy as np
+
+from rsoxs.alignment.bar_geometry import (
+    BarGeometryCache,
+    apply_position,
+    make_sample_position_function,
+    rotate_positions,
+    rotatedx,
+)
+from rsoxs.configuration_setup.queue_scheduler import get_acquisition_states, transition_cost
+
+
+def _sanatize_angle_reference(samp, force=False):
+    ## alignment_local.sanatize_angle before it used bar_geometry.rotation_angles
+    goodnumber = type(samp["angle"]) == int or type(samp["angle"]) == float
+    if force and -155 < samp["angle"] < 195:
+        samp["bar_loc"]["th"] = samp["angle"]
+        return
+    if samp["grazing"]:
+        if samp["front"]:
+            if goodnumber:
+                samp["bar_loc"]["th"] = float(90 - np.mod(samp["angle"] + 3600, 180))
+            else:
+                samp["bar_loc"]["th"] = 70
+                samp["angle"] = 70
+        else:
+            if goodnumber:
+                angle = float(np.mod(435 - np.mod(-samp["angle"] + 3600, 180), 360) - 165)
+                if angle < -155:
+                    angle = float(np.mod(435 - np.mod(samp["angle"] + 3600, 180), 360) - 165)
+                samp["bar_loc"]["th"] = angle
+            else:
+                samp["bar_loc"]["th"] = 110
+                samp["angle"] = 110
+    else:
+        if samp["front"]:
+            if goodnumber:
+                samp["bar_loc"]["th"] = float(np.mod(345 - np.mod(90 + samp["angle"] + 3600, 180) + 90, 360) - 165)
+                if samp["bar_loc"]["x0"] > 6 and np.abs(samp["angle"]) > 30:
+                    samp["bar_loc"]["th"] = float(np.mod(345 - np.mod(90 - samp["angle"] + 3600, 180) + 90, 360) - 165)
+                if samp["bar_loc"]["th"] >= 195:
+                    samp["bar_loc"]["th"] = 180
+                if samp["bar_loc"]["th"] <= -155:
+                    samp["bar_loc"]["th"] = -150
+            else:
+                samp["bar_loc"]["th"] = 0
+                samp["angle"] = 0
+        else:
+            if goodnumber:
+                samp["bar_loc"]["th"] = float(np.mod(90 + samp["angle"] + 3600, 180) - 90)
+                if samp["bar_loc"]["x0"] < -5 and np.abs(samp["angle"]) > 30:
+                    samp["bar_loc"]["th"] = float(np.mod(90 - samp["angle"] + 3600, 180) - 90.0)
+            else:
+                samp["bar_loc"]["th"] = 0
+                samp["angle"] = 0
+    if samp["bar_loc"]["th"] >= 195:
+        samp["bar_loc"]["th"] = 195.0
+    if samp["bar_loc"]["th"] <= -155:
+        samp["bar_loc"]["th"] = -155.0
+
+
+def _make_bar(number_samples=60, seed=0):
+    random = np.random.default_rng(seed)
+    return [
+        {
+            "sample_id": "sample" + str(index),
+            "sample_name": "sample" + str(index),
+            "grazing": bool(index % 4 < 2),
+            "front": bool(index % 2),
+            "angle": 0,
+            "location": [{"motor": motor, "position": 0.0, "order": 0} for motor in ("x", "y", "z", "th")],
+            "bar_loc": {"x0": float(random.uniform(-10, 10)), "y0": float(random.uniform(-190, 0)), "xoff": 1.88, "zoff": float(random.uniform(-1, 1))},
+        }
+        for index in range(number_samples)
+    ]
+
+
+def test_positions_match_rotating_one_sample_at_a_time():
+    bar = _make_bar()
+    angles = [-170.0, -90.0, -45.0, 0.0, 20.0, 45.0, 90.0, 135.0, 200.0, "normal"]
+    samples = [sample for sample in bar for _ in angles]
+    angles_all = [angle for _ in bar for angle in angles]
+    for force in (False, True):
+        positions = rotate_positions(samples, angles_all, force=force)
+        for sample, angle, position in zip(samples, angles_all, positions):
+            if force and isinstance(angle, str):
+                continue  ## The old function compared strings with numbers
+            reference = copy.deepcopy(sample)
+            reference["angle"] = angle
+            _sanatize_angle_reference(reference, force=force)
+            assert position["th"] == reference["bar_loc"]["th"]
+            assert position["angle"] == reference["angle"]
+            bar_loc = reference["bar_loc"]
+            assert np.isclose(position["x"], rotatedx(bar_loc["x0"], bar_loc["th"], bar_loc["zoff"], xoff=bar_loc["xoff"]))
+            assert position["y"] == bar_loc["y0"]
+
+
+def test_cache_hits_and_invalidation():
+    bar = _make_bar(10)
+    cache = BarGeometryCache()
+    positions = cache.get_bar_positions(bar, [0, 45])
+    assert cache.misses == 20 and cache.hits == 0
+    assert cache.get_bar_positions(bar, [0, 45]) == positions
+    assert cache.hits == 20
+
+    ## A changed sample is calculated again, the rest still come from the cache
+    bar[0]["bar_loc"]["zoff"] += 0.5
+    cache.get_bar_positions(bar, [0, 45])
+    assert cache.misses == 22
+
+    cache.invalidate()
+    cache.get_bar_positions(bar, [0])
+    assert cache.misses == 32
+
+    sample = copy.deepcopy(bar[1])
+    apply_position(sample, cache.get_position(sample, 45))
+    assert sample["location"][3]["position"] == sample["bar_loc"]["th"]
+    sample_uncorrected = dict(bar[2], bar_loc={"spot": "1"})
+    assert cache.get_positions([sample_uncorrected], [0]) == [None]
+
+
+def test_position_function_adds_sample_moves_to_costs():
+    bar = _make_bar(4)
+    queue = [
+        {"sample_id": "sample1", "sample_angles": [0, 45]},
+        {"sample_id": "sample1", "sample_angles": [0]},
+        {"sample_id": "sample3", "sample_angles": ["Do not rotate"]},
+    ]
+    cache = BarGeometryCache()
+    position_function = make_sample_position_function(bar, cache=cache, queue=queue)
+    assert cache.misses == 3
+    states = [get_acquisition_states(acquisition, position_function=position_function) for acquisition in queue]
+    assert cache.misses == 3
+    ## Same sample, but rotating back from 45 degrees
+    assert transition_cost(states[0][1], states[1][0]) > 0
+    assert transition_cost(states[0][0], states[0][0]) == 0
+    assert states[2][0]["sample_position"] == {"x": 0.0, "y": 0.0, "th": 0.0}
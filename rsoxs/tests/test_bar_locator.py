@@ -0,0 +1,64 @@
+import numpy as np
+
+from rsoxs.alignment.bar_locator import image_location, label_components, locate_samples
+from rsoxs.alignment.bar_stitching import barImage_Extent_Default
+
+## Synthetic bar image with the default extent: 235 mm x 29 mm at 10 pixels per mm
+shape = (290, 2350)
+
+
+def _pixel(x, y):
+    left, right, bottom, top = barImage_Extent_Default
+    return int(round((top - x) * 10)), int(round((y - left) * 10))
+
+
+def _make_bar(missing=(), shift=(0.0, 0.0)):
+    random = np.random.default_rng(2)
+    image = 100 + 3 * random.standard_normal(shape)
+    samples, truth = [], {}
+    for number in range(1, 13):
+        for row, letter in enumerate("AB"):
+            name = str(number) + letter
+            x, y = 5 - 10 * row + shift[0], -180 + 15 * number + shift[1]
+            samples.append({"sample_id": name, "sample_name": name, "bar_loc": {"spot": name}, "front": True})
+            truth[name] = (x, y)
+            if name in missing:
+                continue
+            row_center, column_center = _pixel(x, y)
+            image[row_center - 25 : row_center + 25, column_center - 30 : column_center + 30] = 180 if number % 2 else 40
+    return np.clip(image, 0, 255).astype(np.uint8), samples, truth
+
+
+def test_label_components():
+    mask = np.zeros((6, 8), dtype=bool)
+    mask[1:3, 1:3] = True
+    mask[1:5, 5] = True
+    mask[4, 4:6] = True
+    components = sorted(label_components(mask), key=lambda component: component["column"])
+    assert [component["area"] for component in components] == [4, 5]
+    assert components[1]["rows"] == (1, 4) and components[1]["columns"] == (4, 5)
+
+
+def test_locate_from_spots():
+    image, samples, truth = _make_bar(missing=["7B"])
+    proposals = locate_samples(image, samples)
+    for proposal in proposals:
+        if proposal["sample_id"] == "7B":
+            assert proposal["location"] is None and proposal["confidence"] == 0
+            continue
+        assert proposal["confidence"] > 0.7
+        assert np.hypot(proposal["ximg"] - truth[proposal["sample_id"]][0], proposal["yimg"] - truth[proposal["sample_id"]][1]) < 0.2
+        assert proposal["bounds"]["y"][0] < proposal["yimg"] < proposal["bounds"]["y"][1]
+    assert proposals[0]["location"] == image_location(proposals[0]["ximg"], proposals[0]["yimg"])
+
+
+def test_locate_from_earlier_image():
+    ## Positions from an earlier image of the bar, which has been put back 2 mm further along
+    image, samples, truth = _make_bar(shift=(0.5, 2.0))
+    for sample in samples:
+        sample["bar_loc"].update(ximg=truth[sample["sample_id"]][0] - 0.5, yimg=truth[sample["sample_id"]][1] - 2.0)
+    samples.insert(0, {"sample_id": "AF1_front", "sample_name": "AF1_front", "bar_loc": {"spot": "0A"}})
+    proposals = locate_samples(image, samples)
+    assert proposals[0]["confidence"] == 0
+    assert all(proposal["confidence"] > 0.7 for proposal in proposals[1:])
+    assert all(abs(proposal["yimg"] - truth[proposal["sample_id"]][1]) < 0.2 for proposal in proposals[1:])
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from rsoxs.alignment.bar_stitching import (
+    _stitch_concatenate,
+    barStitch_Parameters_Default,
+    build_pyramid,
+    load_bar_images,
+    pyramid_level,
+    save_bar_images,
+    stitch_tiles,
+)
+
+## Small pictures, 30 pixels per step of 25 mm
+parameters = dict(barStitch_Parameters_Default, pixels_per_mm=30 / 25, pyramid_minimum=4, display_width=16)
+
+
+def _make_tiles(number_tiles=5, shape=(20, 40, 3)):
+    random = np.random.default_rng(1)
+    return [random.integers(0, 256, shape, dtype=np.uint8) for _ in range(number_tiles)]
+
+
+@pytest.mark.parametrize("y_off", [-2, 0, 3])
+def test_same_as_concatenate(y_off):
+    tiles = _make_tiles()
+    image = stitch_tiles(tiles, None, 25, y_off, parameters=parameters)
+    assert np.array_equal(image, _stitch_concatenate(tiles, 25, y_off, parameters))
+    ## Positions in the reverse order give the same bar image
+    image_reversed = stitch_tiles(tiles[::-1], 100 - 25 * np.arange(5), 25, -y_off, parameters=parameters)
+    assert image_reversed.shape == image.shape
+
+
+def test_blend():
+    tiles = [np.full((20, 40), value, dtype=np.uint8) for value in (100, 200)]
+    image = stitch_tiles(tiles, None, 25, 0, blend=True, parameters=parameters)
+    assert image.shape == (20, 70)
+    ## Only one picture at the ends, a smooth change across the 10 columns of overlap
+    assert np.all(image[:, :30] == 200) and np.all(image[:, 40:] == 100)
+    assert np.all(np.diff(image[0, 29:41].astype(int)) <= 0)
+    assert 100 < image[0, 35] < 200
+
+
+def test_pyramid():
+    image = np.arange(17 * 34, dtype=float).reshape(17, 34)
+    pyramid = build_pyramid(image, parameters)
+    assert [level.shape for level in pyramid] == [(17, 34), (8, 17), (4, 8)]
+    assert pyramid[1][0, 0] == image[:2, :2].mean()
+    assert pyramid_level(pyramid, 1.0, parameters) == 1
+    assert pyramid_level(pyramid, 0.5, parameters) == 0
+
+
+def test_save_and_load(tmp_path):
+    pytest.importorskip("h5py")
+    tiles = _make_tiles()
+    positions = 25 * np.arange(5)
+    pyramid = save_bar_images(tmp_path / "bar.h5", tiles, positions, 25, -2, parameters=parameters)
+    loaded = load_bar_images(tmp_path / "bar.h5", tiles=True)
+    assert np.array_equal(loaded["tiles"], tiles)
+    assert all(np.array_equal(level, level_loaded) for level, level_loaded in zip(pyramid, loaded["pyramid"]))
+    assert loaded["y_off"] == -2
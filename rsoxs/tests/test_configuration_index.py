@@ -0,0 +1,54 @@
+import copy
+import random
+
+from rsoxs.configuration_setup.configuration_index import ConfigurationIndex, _make_benchmark_configuration
+
+
+def _make_configuration(number_of_samples=40):
+    configuration = _make_benchmark_configuration(number_of_samples, 2)
+    for indexSample, sample in enumerate(configuration):
+        sample.update(sample_name="name" + str(indexSample % 7), project_name="project" + str(indexSample % 3), proposal_id=300000 + indexSample % 2)
+    return configuration
+
+
+def test_lookups_by_field():
+    configuration = _make_configuration()
+    index = ConfigurationIndex(configuration)
+    assert index.sample_index(configuration, "sample12") == 12
+    assert index.sample_positions(configuration, "sample_name", "name3") == [3, 10, 17, 24, 31, 38]
+    assert index.sample_ids(configuration, "spot", "5") == ["sample5"]
+    assert len(index.sample_positions(configuration, "proposal_id", 300001)) == 20
+    assert index.sample_positions(configuration, "project_name", "missing") == []
+
+    ## Changed in place: the stale position is noticed and the index is updated
+    configuration[3]["sample_name"] = "renamed"
+    assert index.sample_positions(configuration, "sample_name", "name3") == [10, 17, 24, 31, 38]
+    assert index.sample_ids(configuration, "sample_name", "renamed") == ["sample3"]
+    assert index.rebuilds == 1 and index.updates == 1
+
+
+def test_incremental_updates_match_rebuilds():
+    configuration = _make_configuration()
+    index = ConfigurationIndex(configuration)
+    random.seed(0)
+    for step in range(200):
+        configuration = copy.deepcopy(configuration)
+        change = random.choice(["rename", "spot", "append", "pop", "insert", "duplicate", "acquisition"])
+        indexSample = random.randrange(len(configuration))
+        if change == "rename":
+            configuration[indexSample]["sample_name"] = "name" + str(random.randrange(10))
+        elif change == "spot":
+            configuration[indexSample]["bar_loc"]["spot"] = str(random.randrange(50))
+        elif change == "append":
+            configuration.append(dict(copy.deepcopy(configuration[indexSample]), sample_id="new" + str(step)))
+        elif change == "pop" and len(configuration) > 5:
+            configuration.pop(indexSample)
+        elif change == "insert":
+            configuration.insert(indexSample, dict(copy.deepcopy(configuration[indexSample]), sample_id="inserted" + str(step)))
+        elif change == "duplicate":
+            configuration[indexSample]["sample_id"] = configuration[0]["sample_id"]
+        elif change == "acquisition":
+            configuration[indexSample]["acquisitions"].append(dict(configuration[indexSample]["acquisitions"][0], uid_local="uid" + str(step)))
+        index.update(configuration)
+        assert index.check(configuration) == []
+    assert index.updates > index.rebuilds
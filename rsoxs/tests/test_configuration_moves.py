@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from rsoxs.configuration_setup.configuration_moves import (
+    ConfigurationPlanner,
+    compare_to_configurations,
+    estimate_time_saved,
+    get_configuration_moves,
+    plan_configuration_transition,
+    snapshot_positions,
+)
+
+
+def test_only_motors_out_of_position_are_moved():
+    configuration_setpoints = [
+        {"motor": "slits1", "position": 10, "order": 0},
+        {"motor": "izero_y", "position": 144, "order": 0},
+        {"motor": "Det_W", "position": -94, "order": 1},
+        {"motor": "BeamStopW", "position": 3, "order": 1},
+        {"motor": "en", "position": 150, "order": 2},
+    ]
+    positions_current = {"slits1": 10.004, "izero_y": 2, "Det_W": -94, "BeamStopW": 3.005, "en": 150.03}
+
+    moves, skipped = get_configuration_moves(configuration_setpoints, positions_current, tolerances={"en": 0.05})
+    assert moves == [(0, [("izero_y", 144)])]
+    assert [motor for order, motor, position in skipped] == ["slits1", "Det_W", "BeamStopW", "en"]
+    assert estimate_time_saved(configuration_setpoints, moves) > 0
+
+    ## Motors that could not be read are always moved
+    moves, skipped = get_configuration_moves(configuration_setpoints, dict(positions_current, en=None))
+    assert moves == [(0, [("izero_y", 144)]), (2, [("en", 150)])]
+
+
+class Motor:
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+
+
+def test_planner_runs_unrelated_moves_in_parallel():
+    hexapod = object()
+    mir_x, mir_y = Motor("mir_x", hexapod), Motor("mir_y", hexapod)
+    detector, beamstop, slit = Motor("Det_W"), Motor("BeamStopW"), Motor("slitsc")
+    configuration_setpoints = [
+        {"motor": mir_x, "position": 1, "order": 0},
+        {"motor": mir_y, "position": 1, "order": 1},
+        {"motor": detector, "position": -94, "order": 1},
+        {"motor": beamstop, "position": 3, "order": 2},
+        {"motor": slit, "position": -3, "order": 3},
+    ]
+    positions_current = {mir_x: 0, mir_y: 0, detector: 2, beamstop: 20, slit: -3}
+    interlocks = [{"first": detector, "then": beamstop, "when": lambda targets: targets[detector] < -50}]
+    velocities = {mir_x: 10, mir_y: 10, detector: 96, beamstop: 17}
+
+    plan = plan_configuration_transition(configuration_setpoints, positions_current, interlocks=interlocks, velocities=velocities, independent=[hexapod])
+    moves = {move["motor"].name: move for move in plan["moves"]}
+    assert "slitsc" not in moves
+    assert moves["mir_x"]["start"] == moves["Det_W"]["start"] == 0  ## Independent devices do not wait for other devices' order
+    assert moves["mir_y"]["start"] == moves["mir_x"]["duration"]
+    assert moves["BeamStopW"]["start"] == moves["Det_W"]["duration"]
+    assert [plan["moves"][index]["motor"].name for index in plan["critical_path"]] == ["Det_W", "BeamStopW"]
+    assert plan["time_critical_path"] < plan["time_in_order"]
+
+    planner = ConfigurationPlanner(interlocks=interlocks, independent=[hexapod])
+    planner.plan("WAXS", "WAXSNEXAFS", configuration_setpoints, positions_current, velocities)
+    assert planner.plan("WAXS", "WAXSNEXAFS", configuration_setpoints, positions_current, velocities) is not None
+    assert planner.stats()["hits"] == 1
+
+    interlocks.append({"first": beamstop, "then": detector})
+    with pytest.raises(ValueError):
+        plan_configuration_transition(configuration_setpoints, positions_current, interlocks=interlocks)
+
+
+def test_upstream_slits_wait_for_beamstop_when_camera_is_in_position():
+    ## WAXS_LowFluxNEXAFS to WAXS, where Det_W is already in the beam and the FOE slits open up
+    slits_foe = object()
+    detector, beamstop = Motor("Det_W"), Motor("BeamStopW")
+    foe_hsize, shutter = Motor("slits_foe_hsize", slits_foe), Motor("shutter_y")
+    configuration_setpoints = [
+        {"motor": beamstop, "position": 67.4, "order": 0},
+        {"motor": detector, "position": 2, "order": 1},
+        {"motor": foe_hsize, "position": 8, "order": 2},
+        {"motor": shutter, "position": 2.2, "order": 2},
+    ]
+    positions_current = {beamstop: 3, detector: 2, foe_hsize: -0.28, shutter: 2.2}
+
+    plan = plan_configuration_transition(configuration_setpoints, positions_current, velocities={beamstop: 17, foe_hsize: 1})
+    moves = {move["motor"].name: move for move in plan["moves"]}
+    assert list(moves) == ["BeamStopW", "slits_foe_hsize"]
+    assert moves["slits_foe_hsize"]["start"] == moves["BeamStopW"]["duration"]
+    assert plan["time_critical_path"] == plan["time_in_order"]
+
+    ## Only devices declared independent skip the order of other devices
+    plan = plan_configuration_transition(configuration_setpoints, positions_current, independent=[slits_foe])
+    assert [move["start"] for move in plan["moves"]] == [0, 0]
+
+
+class SlowMotor(Motor):
+    def __init__(self, name, position):
+        super().__init__(name)
+        self.position_current = position
+
+    def read(self):
+        time.sleep(0.05)  ## e.g., a Channel Access get
+        return {self.name: {"value": self.position_current, "timestamp": time.time()}}
+
+
+def test_snapshot_reads_concurrently_and_finds_nearest_configuration():
+    motors = [SlowMotor("motor" + str(index), 0) for index in range(16)]
+    snapshot = snapshot_positions(motors + motors[:4])
+    assert len(snapshot["positions"]) == 16
+    assert snapshot["duration"] < 16 * 0.05 / 2
+    assert all(timestamp >= snapshot["time"] for timestamp in snapshot["timestamps"].values())
+
+    configurations = {
+        "retracted": [{"motor": motor, "position": 10, "order": 0} for motor in motors[:8]],
+        "in_beam": [{"motor": motor, "position": 0, "order": 0} for motor in motors[:8]],
+        "partly": [{"motor": motor, "position": 0.5 if index == 0 else 0, "order": 0} for index, motor in enumerate(motors[:8])],
+    }
+    reports = compare_to_configurations(snapshot["positions"], configurations)
+    assert [report["name"] for report in reports] == ["in_beam", "partly", "retracted"]
+    assert reports[0]["in_position"] and reports[0]["distance"] == 0
+    assert reports[1]["motors_out_of_position"] == [(motors[0], 0, 0.5)]
@@ -0,0 +1,46 @@
+import copy
+
+from rsoxs.configuration_setup.configuration_index import _make_benchmark_configuration
+from rsoxs.configuration_setup.configuration_load_save_sanitize import gatherAcquisitionsFromConfiguration
+from rsoxs.configuration_setup.configuration_records import (
+    Acquisition,
+    Sample,
+    gather_acquisition_records,
+    validate_acquisition,
+)
+
+
+def test_to_dict_is_lossless():
+    configuration = _make_benchmark_configuration(3, 2)
+    configuration[0]["user_parameter"] = {"a": 1}  ## Not a Sample field
+    del configuration[1]["bar_loc"]  ## Missing fields stay missing
+    for sample in configuration:
+        record = Sample.from_dict(sample)
+        assert record.to_dict() == sample
+        assert record == sample
+    assert "bar_loc" not in Sample.from_dict(configuration[1])
+
+
+def test_location_attributes_and_replace():
+    sample = Sample.from_dict(_make_benchmark_configuration(1, 1)[0])
+    location = sample.location.replace(x=1.5, th=90)
+    sample_moved = sample.replace(location=location)
+    assert (sample_moved.x, sample_moved.y, sample_moved.th) == (1.5, 0.0, 90)
+    assert sample.x == 0.0  ## Original is unchanged
+    assert sample_moved.acquisitions is sample.acquisitions  ## Unchanged values are shared
+    assert [entry["motor"] for entry in sample_moved["location"]] == ["x", "y", "z", "th"]
+
+
+def test_validated_state_and_copies():
+    configuration = _make_benchmark_configuration(2, 2)
+    records = gather_acquisition_records(configuration)
+    assert [record.to_dict() for record in records] == gatherAcquisitionsFromConfiguration(configuration)
+
+    acquisition = validate_acquisition(records[0])
+    assert acquisition.validated and validate_acquisition(acquisition) is acquisition
+    assert copy.deepcopy(acquisition) is acquisition
+
+    started = acquisition.replace(acquire_status="Started")
+    assert started.validated and started["acquire_status"] == "Started" and acquisition["acquire_status"] == "Not begun"
+    assert not acquisition.replace(exposure_time=2).validated
+    assert isinstance(Acquisition.from_dict(started.to_dict()), Acquisition)
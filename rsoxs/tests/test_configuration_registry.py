@@ -0,0 +1,52 @@
+from rsoxs.configuration_setup.configuration_registry import ConfigurationRegistry
+
+
+def test_all_configurations_are_published_and_only_changes_are_written():
+    registry = ConfigurationRegistry(names_always_allowed=["NoBeam"])
+    registry.define("WAXS_Retracted", [{"motor": "BeamStopW", "position": 3, "order": 0}, {"motor": "Det_W", "position": -94, "order": 0}])
+    registry.define("WAXS_Beamstop", [{"motor": "BeamStopW", "position": 67.4, "order": 0}])
+    registry.define("DMRSoXS_Mesh", [{"motor": "izero_y", "position": -31, "order": 0}])
+    registry.define_hybrid("WAXSNEXAFS", ["DMRSoXS_Mesh", "WAXS_Retracted"], ["WAXS_Beamstop"])
+    assert registry.names_allowed == ["NoBeam", "WAXS_Retracted", "WAXS_Beamstop", "DMRSoXS_Mesh", "WAXSNEXAFS"]
+
+    ## A copy of WAXSNEXAFS left from an earlier session with other setpoints is replaced
+    status_dict = {"WAXSNEXAFS": [{"motor": "izero_y", "position": -20, "order": 1}]}
+    assert registry.publish(status_dict) == ["WAXS_Retracted", "WAXS_Beamstop", "DMRSoXS_Mesh", "WAXSNEXAFS"]
+    assert registry.get("WAXSNEXAFS") == [
+        {"motor": "izero_y", "position": -31, "order": 1},
+        {"motor": "BeamStopW", "position": 67.4, "order": 0},
+        {"motor": "Det_W", "position": -94, "order": 1},
+    ]
+    assert status_dict["WAXSNEXAFS"] == registry.get("WAXSNEXAFS")
+    assert registry.publish(status_dict) == []
+    assert registry.publish(dict(status_dict)) == []  ## e.g., a new process that finds the same configurations already stored
+
+    ## Changing a component changes the hybrids combined from it
+    registry.define("DMRSoXS_Mesh", [{"motor": "izero_y", "position": -30, "order": 0}])
+    assert registry.get("WAXSNEXAFS")[0]["position"] == -30
+    assert registry.publish(status_dict) == ["DMRSoXS_Mesh", "WAXSNEXAFS"]
+
+    registry.get("WAXSNEXAFS")[0]["position"] = 0  ## Returned lists are copies
+    assert status_dict["WAXSNEXAFS"] == registry.get("WAXSNEXAFS")
+
+
+def test_publishing_with_definition_hashes_does_not_combine_hybrids():
+    def make_registry():
+        registry = ConfigurationRegistry()
+        registry.define("WAXS_Retracted", [{"motor": "BeamStopW", "position": 3, "order": 0}, {"motor": "Det_W", "position": -94, "order": 0}])
+        registry.define("WAXS_Beamstop", [{"motor": "BeamStopW", "position": 67.4, "order": 0}])
+        registry.define_hybrid("WAXSNEXAFS", ["WAXS_Retracted"], ["WAXS_Beamstop"])
+        return registry
+
+    status_dict, hashes_dict = {}, {}
+    assert make_registry().publish(status_dict, hashes_dict=hashes_dict) == ["WAXS_Retracted", "WAXS_Beamstop", "WAXSNEXAFS"]
+
+    ## A new process finds the same definitions already stored, so nothing is combined or written
+    registry = make_registry()
+    assert registry.publish(status_dict, hashes_dict=hashes_dict) == []
+    assert "WAXSNEXAFS" not in registry._materialized
+    assert registry.get("WAXSNEXAFS") == status_dict["WAXSNEXAFS"]
+
+    registry.define("WAXS_Beamstop", [{"motor": "BeamStopW", "position": 20, "order": 0}])
+    assert registry.publish(status_dict, hashes_dict=hashes_dict) == ["WAXS_Beamstop", "WAXSNEXAFS"]
+    assert status_dict["WAXSNEXAFS"][0]["position"] == 20
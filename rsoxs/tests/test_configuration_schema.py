@@ -0,0 +1,135 @@
+import copy
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rsoxs.configuration_setup.configuration_load_save_sanitize import (
+    load_configuration_spreadsheet_local,
+    save_configuration_spreadsheet_local,
+    sanitizeAcquisitions,
+    sanitizeSamples,
+    sanitizeSpreadsheet,
+    updateConfigurationWithAcquisition,
+)
+from rsoxs.configuration_setup.configuration_cache import spreadsheet_cache_key
+from rsoxs.configuration_setup.configuration_schema import sanitize_configuration_columnar
+
+
+def make_sheets(number_samples=20, acquisitions_per_sample=3):
+    samples = pd.DataFrame(
+        {
+            "bar_name": "bar",
+            "sample_id": [f"sample{index}" for index in range(number_samples)],
+            "sample_name": [f"name{index}" for index in range(number_samples)],
+            "project_name": "project",
+            "institution": "NIST",
+            "proposal_id": 312345,
+            "bar_spot": [f"{index}A" for index in range(number_samples)],
+            "front": True,
+            "grazing": [index % 2 == 0 for index in range(number_samples)],
+            "angle": [0, 45, 90, -30] * (number_samples // 4),
+            "height": 0.25,
+            "sample_priority": 1,
+            "location": ["[{'motor': 'x', 'position': 1.5, 'order': 0}]"] + [np.nan] * (number_samples - 1),
+            "bar_loc": np.nan,
+            "acq_history": np.nan,
+            "Unnamed: 20": np.nan,
+        }
+    )
+    rows = []
+    for index in range(number_samples):
+        for count in range(acquisitions_per_sample):
+            rows.append(
+                {
+                    "sample_id": f"sample{index}",
+                    "configuration_instrument": "WAXSNEXAFS",
+                    "scan_type": ["nexafs", "time", "spiral"][count],
+                    "energy_list_parameters": ["carbon_NEXAFS", 270, 285][count],
+                    "polarizations": ["[0, 90]", 0, "[-1]"][count],
+                    "exposure_time": 1,
+                    "exposures_per_energy": 1.0,
+                    "cycles": 0,
+                    "sample_angles": ["Do not rotate", "[0, 20]", 0][count],
+                    "priority": count,
+                    "uid_local": f"uid{index}-{count}",
+                }
+            )
+    return samples, pd.DataFrame(rows)
+
+
+def sanitize_row_by_row(samplesDF, acquisitionsDF):
+    configuration = sanitizeSamples(sanitizeSpreadsheet(samplesDF.copy()).to_dict(orient="records"))
+    acquisitions = sanitizeSpreadsheet(acquisitionsDF.copy()).to_dict(orient="records")
+    for acquisition in sanitizeAcquisitions(acquisitions, configuration):
+        configuration = updateConfigurationWithAcquisition(configuration, acquisition)
+    return configuration
+
+
+def test_columnar_matches_row_by_row():
+    samplesDF, acquisitionsDF = make_sheets()
+    expected = sanitize_row_by_row(samplesDF, acquisitionsDF)
+    configuration, errors = sanitize_configuration_columnar(samplesDF, acquisitionsDF)
+    assert len(errors) == 0
+    assert configuration == expected
+
+
+def test_error_report_collects_every_bad_row():
+    samplesDF, acquisitionsDF = make_sheets()
+    samplesDF.loc[3, "height"] = -1
+    acquisitionsDF.loc[2, "exposure_time"] = 20
+    acquisitionsDF.loc[5, "configuration_instrument"] = "NotAConfiguration"
+    acquisitionsDF.loc[7, "sample_id"] = "missing_sample"
+    configuration, errors = sanitize_configuration_columnar(samplesDF, copy.deepcopy(acquisitionsDF))
+    assert list(zip(errors["sheet"], errors["row"], errors["column"])) == [
+        ("Acquisitions", 2, "exposure_time"),
+        ("Acquisitions", 5, "configuration_instrument"),
+        ("Acquisitions", 7, "sample_id"),
+        ("Samples", 3, "height"),
+    ]
+
+
+def test_spreadsheet_cache_returns_same_configuration(tmp_path):
+    samplesDF, acquisitionsDF = make_sheets()
+    acquisitionsDF.loc[0, "uid_local"] = np.nan  ## Generated while sanitizing, so cached as a uuid.UUID
+    acquisitionsDF.loc[3, "energy_list_parameters"] = "(270, 1, 290)"  ## Sanitized to tuples, which JSON does not have
+    file_path = tmp_path / "bar.xlsx"
+    with pd.ExcelWriter(file_path) as writer:
+        samplesDF.to_excel(writer, index=False, sheet_name="Samples")
+        acquisitionsDF.to_excel(writer, index=False, sheet_name="Acquisitions")
+    cache_directory = tmp_path / "cache"
+
+    configuration = load_configuration_spreadsheet_local(file_path, cache_directory=cache_directory)
+    assert len(list(cache_directory.iterdir())) == 1
+    configuration_cached = load_configuration_spreadsheet_local(file_path, cache_directory=cache_directory)
+    ## Generated uid_local values are new every time, same as without the cache
+    uid_cached = configuration_cached[0]["acquisitions"][0]["uid_local"]
+    assert isinstance(uid_cached, uuid.UUID) and uid_cached != configuration[0]["acquisitions"][0]["uid_local"]
+    configuration_cached[0]["acquisitions"][0]["uid_local"] = configuration[0]["acquisitions"][0]["uid_local"]
+    assert configuration_cached == configuration
+
+    configuration_uncached = load_configuration_spreadsheet_local(file_path, use_cache=False)
+    configuration_uncached[0]["acquisitions"][0]["uid_local"] = configuration[0]["acquisitions"][0]["uid_local"]
+    assert configuration_uncached == configuration
+
+    ## Another set of allowed configurations could change what the spreadsheet is sanitized to
+    assert spreadsheet_cache_key(b"bar", ["WAXS", "NoBeam"]) == spreadsheet_cache_key(b"bar", ["NoBeam", "WAXS"])
+    assert spreadsheet_cache_key(b"bar", ["WAXS", "NoBeam"]) != spreadsheet_cache_key(b"bar", ["WAXS"])
+
+
+@pytest.mark.parametrize("file_format", ["xlsx", "csv", "parquet", "jsonl"])
+def test_saved_configuration_loads_back(tmp_path, file_format):
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+    samplesDF, acquisitionsDF = make_sheets()
+    configuration, errors = sanitize_configuration_columnar(samplesDF, acquisitionsDF)
+    configuration_xlsx = load_configuration_spreadsheet_local(
+        save_configuration_spreadsheet_local(configuration, tmp_path, file_label="xlsx")[0], use_cache=False
+    )
+
+    future = save_configuration_spreadsheet_local(configuration_xlsx, tmp_path, file_format=file_format, background=True)
+    paths = future.result()
+    configuration_loaded = load_configuration_spreadsheet_local(paths[-1], use_cache=False)
+    assert configuration_loaded == configuration_xlsx
+    assert not any(path.name.startswith(".") for path in tmp_path.iterdir())  ## No temporary files left behind
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from rsoxs.configuration_setup.acquisition_time_estimates import estimate_acquisition_time, timeEstimateOverheads_Default
+from rsoxs.plans.energy_fly import (
+    flyNEXAFS_Parameters_Default,
+    SimulatedMonoEPU,
+    get_fly_segments,
+    get_fly_speed,
+    make_epu_lookup_table,
+    rebin_fly_readings,
+    _gap_default,
+    _spectrum_default,
+)
+from rsoxs.plans.energy_grids import get_energy_grid
+
+
+def test_fly_segments():
+    energy_grid = get_energy_grid((270, 1, 282, 0.2, 290))
+    speed = get_fly_speed(energy_grid, exposure_time=1)
+    assert speed == pytest.approx(0.2)
+    assert get_fly_segments(energy_grid, speed) == [(270, 282, pytest.approx(1)), (282, 290, pytest.approx(0.2))]
+    assert get_fly_segments(energy_grid, speed, descending=True) == [(290, 282, pytest.approx(0.2)), (282, 270, pytest.approx(1))]
+    with pytest.raises(ValueError):
+        get_fly_segments(285, speed)
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_simulated_fly_scan_matches_spectrum(descending):
+    energy_grid = get_energy_grid((275, 1, 282, 0.2, 292, 1, 300))
+    simulation = SimulatedMonoEPU(noise=0.002)
+    simulation.program_lookup_table(make_epu_lookup_table(energy_grid, _gap_default))
+    readings = simulation.fly(get_fly_segments(energy_grid, get_fly_speed(energy_grid, exposure_time=0.5), descending=descending))
+
+    energy_points = energy_grid.points_reversed if descending else energy_grid.points
+    rebinned = rebin_fly_readings(readings, "energy", energy_points)
+    assert np.array_equal(rebinned["energy"], energy_points)
+    assert rebinned["number_readings"]["izero_mesh"].min() >= 3  ## The first and last points only get half of their range
+    normalized = rebinned["Sample_TEY_int"] / rebinned["izero_mesh"]
+    assert np.allclose(normalized, _spectrum_default(energy_points), rtol=0.05)
+
+
+def test_gap_lag_reduces_flux():
+    energy_grid = get_energy_grid((270, 1, 300))
+    simulation = SimulatedMonoEPU(gap_speed_maximum=50)  ## Much slower than the 150 um/eV * 2 eV/s needed
+    simulation.program_lookup_table(make_epu_lookup_table(energy_grid, _gap_default))
+    rebinned = rebin_fly_readings(simulation.fly(get_fly_segments(energy_grid, 2)), "energy", energy_grid.points)
+    assert np.nanmin(rebinned["izero_mesh"]) < 0.1
+
+
+def test_estimate_fly_acquisition():
+    overheads = dict(timeEstimateOverheads_Default, rotation=0, polarization=0)
+    acquisition = {"scan_type": "nexafs_fly", "energy_list_parameters": (270, 1, 280), "exposure_time": 1, "exposures_per_energy": 1, "cycles": 1}
+    time_sweep = flyNEXAFS_Parameters_Default["scan_fixed"] + 10 / 1
+    assert estimate_acquisition_time(acquisition, overheads=overheads) == pytest.approx(2 * time_sweep)
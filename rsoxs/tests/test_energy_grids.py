@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from rsoxs.plans.energy_grids import get_energy_grid, print_energy_grid_warnings
+
+
+def test_energy_grid_points():
+    grid = get_energy_grid("carbon_NEXAFS")
+    assert grid.number_points == len(grid.points) == 116
+    assert grid.points[0] == 250 and grid.points[-1] == 350
+    assert np.array_equal(grid.points_reversed, grid.points[::-1])
+    assert get_energy_grid(270).number_points == 1
+    assert get_energy_grid((270, 1, 272)) is get_energy_grid([270.0, 1.0, 272.0])  ## Compiled once
+
+
+def test_energy_grid_warnings_and_errors():
+    assert not get_energy_grid("carbon_NEXAFS").warnings
+    assert get_energy_grid((270, 0.3, 271)).warnings
+    assert get_energy_grid("carbon_NEXAFS").reversible and not get_energy_grid((270, 0.3, 271)).reversible
+    with pytest.raises(ValueError):
+        get_energy_grid((270, 0, 280))
+    with pytest.raises(ValueError):
+        get_energy_grid((270, 1))
+    with pytest.raises(ValueError):
+        get_energy_grid("not_an_energy_plan")
+
+    ## Each energy plan in a queue is reported once, and plans that cannot be scanned are left to the sanitizer
+    warnings = print_energy_grid_warnings(["carbon_NEXAFS", (270, 0.3, 271), (270, 0.3, 271), 285, (270, 0, 280)])
+    assert list(warnings) == ["(270, 0.3, 271)"]
@@ -0,0 +1,63 @@
+import numpy as np
+
+from rsoxs.plans.epu_lookup_tables import EPUTableBuilder
+
+
+def _gap_peak(energy):
+    ## Smooth, curved gap against energy, roughly like the third harmonic at linear horizontal polarization
+    x = energy / 3
+    return 14000 + 150 * (x - 80) - 0.08 * (x - 80) ** 2
+
+
+def test_search_windows_narrow_and_contain_peak(tmp_path):
+    path = tmp_path / "EPUdata_test.csv"
+    table = EPUTableBuilder(str(path))
+    random = np.random.default_rng(0)
+    gap_start = 14000
+    widths = []
+    for energy in np.arange(300, 2200, 50):
+        gap_low, gap_high = table.search_window(energy, "L", 0, gap_start, widfract=3)
+        assert gap_low <= _gap_peak(energy) <= gap_high
+        widths.append(gap_high - gap_low)
+        gap_start = _gap_peak(energy) + random.normal(0, 20)
+        table.append(energy, gap_start, "L", 0)
+
+    assert widths[0] == 2500 * 3  ## Default window, cut off at the minimum gap
+    assert np.mean(widths[5:]) < 3000  ## Fixed windows would have been 9000 um wide
+
+    ## Appended line by line, and a new builder on the same file picks up where this one stopped
+    assert len(path.read_text().splitlines()) == 1 + len(widths)
+    resumed = EPUTableBuilder(str(path))
+    assert resumed.search_window(2200, "L", 0, 14000, 3) == table.search_window(2200, "L", 0, 14000, 3)
+    assert len(resumed.model("C", 15000)) == 0
+
+    lookup_table = table.save_lookup_table(str(tmp_path / "EPUdata_test_LUT.csv"), "L", 0)
+    assert np.all(np.diff(lookup_table["energy"]) > 0)
+    assert np.allclose(lookup_table["gap"], _gap_peak(lookup_table["energy"]), atol=100)
+
+
+def test_legacy_file_is_migrated(tmp_path):
+    ## Written by the old buildeputable with DataFrame.to_csv: an unnamed index column and no Mode or Phase
+    path = tmp_path / "EPUdata_2023Nov_test.csv"
+    path.write_text(",Energies,EPUGaps,PeakCurrent,EPUGapsBS,PeakCurrentBS\n0,250.0,15000.0,1.5,15010.0,0.2\n1,260.0,15400.0,1.6,15405.0,0.3\n")
+    table = EPUTableBuilder(str(path), mode="L", phase=0)
+    assert table.model("L", 0).energies == [250.0, 260.0]
+    assert (tmp_path / "EPUdata_2023Nov_test_legacy.csv").exists()
+    table.append(270, 15800, "L", 0)
+    assert EPUTableBuilder(str(path)).model("L", 0).gaps == [15000.0, 15400.0, 15800.0]
+
+    ## Without a mode and phase, a new table is started
+    path.write_text(",Energies,EPUGaps,PeakCurrent,EPUGapsBS,PeakCurrentBS\n0,250.0,15000.0,1.5,15010.0,0.2\n")
+    table = EPUTableBuilder(str(path))
+    assert table.models == {} and not path.exists()
+
+
+def test_peak_at_edge_of_predicted_window(tmp_path):
+    table = EPUTableBuilder(str(tmp_path / "EPUdata_test.csv"))
+    assert not table.peak_at_edge(15000, 15000, 20000, 300, "L", 0)  ## Default window, nothing predicted yet
+    table.append(250, 15000, "L", 0)
+    table.append(260, 15400, "L", 0)
+    gap_low, gap_high = table.search_window(270, "L", 0, 15400)
+    assert not table.peak_at_edge((gap_low + gap_high) / 2, gap_low, gap_high, 270, "L", 0)
+    assert table.peak_at_edge(gap_high, gap_low, gap_high, 270, "L", 0)
+    assert table.default_window(15400) == (14900, 17900)
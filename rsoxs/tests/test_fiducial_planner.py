@@ -0,0 +1,53 @@
+from rsoxs.alignment.fiducial_planner import (
+    FiducialStore,
+    cold_scan,
+    compare_fiducial_plans,
+    fiducial_Names,
+    fiducialPlanner_Parameters_Default,
+    fiducial_list,
+    peak_at_edge,
+    plan_fiducial_scans,
+)
+
+
+def _stored_positions(offset=0.05):
+    return {name: index + offset for index, name in enumerate(fiducial_Names)}
+
+
+def test_plan_covers_every_fiducial_with_y_first():
+    scans = plan_fiducial_scans(position={"x": 0, "y": 0, "th": 0})
+    assert sorted(scan["name"] for scan in scans) == sorted(fiducial_Names)
+    assert [scan["name"] for scan in scans][::5] == ["af2y", "af1y"]
+    assert not any(scan["warm"] for scan in scans)
+    assert all(round(scan["stop"] - scan["start"], 9) in (2, 3.5) for scan in scans)
+
+
+def test_store_warm_starts_narrower_windows():
+    config = {}
+    store = FiducialStore(config)
+    assert store.latest() is None
+    store.add(list(_stored_positions().values()), {"af1y": 0.2}, now=1000)
+    record = store.latest(now=2000)
+    assert fiducial_list(record) == list(_stored_positions().values())
+    assert store.latest(now=1000 + fiducialPlanner_Parameters_Default["age_maximum"] + 1) is None
+
+    scans = {scan["name"]: scan for scan in plan_fiducial_scans(stored=record)}
+    assert all(scan["warm"] for scan in scans.values())
+    assert scans["af2x0"]["center"] == record["positions"]["af2x0"]
+    assert scans["af2x0"]["stop"] - scans["af2x0"]["start"] == 2 * fiducialPlanner_Parameters_Default["prior_width_x"]
+    ## Wider than prior_width_y for an uncertain stored result, but never wider than the full range
+    assert scans["af1y"]["stop"] - scans["af1y"]["start"] == 2
+
+    assert peak_at_edge(scans["af2x0"], scans["af2x0"]["stop"])
+    assert not peak_at_edge(scans["af2x0"], scans["af2x0"]["center"])
+    assert cold_scan(scans["af2x0"])["center"] == -1
+
+    record_new = store.add(_stored_positions(0.1), now=3000)
+    assert abs(store.differences(record_new)["af2y"] - 0.05) < 1e-9
+    assert len(config["fiducials"]) == 2
+
+
+def test_warm_start_is_faster():
+    times = compare_fiducial_plans()
+    assert times["warm"] < 0.8 * times["old"]
+    assert times["cold"] <= times["old"]
@@ -0,0 +1,44 @@
+import numpy as np
+
+from rsoxs.Functions.monitor_streams import (
+    _align_monitor_streams_pandas,
+    _make_benchmark_streams,
+    align_monitor_streams,
+    find_monitor_maxima,
+    maximum_windows,
+)
+
+
+def test_align_matches_dataframe_alignment():
+    streams = _make_benchmark_streams(2000)
+    ## Duplicate timestamps are averaged
+    times, values = streams["SAXS Beamstop"]
+    streams["SAXS Beamstop"] = (np.concatenate((times, times[:10])), np.concatenate((values, values[:10] + 1)))
+    df = _align_monitor_streams_pandas(streams)
+    aligned = align_monitor_streams(streams)
+    np.testing.assert_allclose(aligned["time"], df.index.values)
+    for name in streams:
+        np.testing.assert_allclose(aligned[name], df[name].values)
+
+
+def test_maxima_match_dataframe_maxima():
+    streams = _make_benchmark_streams(5000)
+    motor_name = "RSoXS Sample Up-Down"
+    signal_names = ["RSoXS Au Mesh Current", "SAXS Beamstop"]
+    df = _align_monitor_streams_pandas(streams)
+    maxima = find_monitor_maxima(streams, motor_name, signal_names)
+    for name in signal_names:
+        index = df[name].idxmax()
+        assert maxima[name]["time"] == index
+        assert np.isclose(maxima[name][motor_name], df[motor_name][index])
+        assert np.isclose(maxima[name][name], df[name][index])
+        assert abs(maxima[name][motor_name] - 0.3) < 0.05
+
+
+def test_windows_only_around_maxima():
+    streams = _make_benchmark_streams(5000)
+    motor_name = "RSoXS Sample Up-Down"
+    windows = maximum_windows(streams, ["RSoXS Au Mesh Current"], half_width=0.1)
+    aligned = align_monitor_streams(streams, reference=motor_name, windows=windows)
+    assert np.all((aligned["time"] >= windows[0][0]) & (aligned["time"] <= windows[0][1]))
+    assert 0 < len(aligned["time"]) < len(streams[motor_name][0])
@@ -0,0 +1,30 @@
+import copy
+
+from rsoxs.configuration_setup.configuration_index import _make_benchmark_configuration
+from rsoxs.configuration_setup.configuration_load_save_sanitize import (
+    get_sample_changes_nbs_format_from_rsoxs_config,
+    get_sample_dictionary_nbs_format_from_rsoxs_config,
+)
+
+
+def test_only_changed_samples_are_converted():
+    configuration = _make_benchmark_configuration(6, 2)
+    samples_changed, sample_ids_removed, fingerprints = get_sample_changes_nbs_format_from_rsoxs_config(configuration, {})
+    assert samples_changed == get_sample_dictionary_nbs_format_from_rsoxs_config(copy.deepcopy(configuration))
+    assert sample_ids_removed == []
+
+    configuration_new = copy.deepcopy(configuration)
+    configuration_new[1]["acquisitions"][0]["acquire_status"] = "Finished"
+    configuration_new[2]["location"] = []  ## No longer has positions, so it leaves the manipulator
+    del configuration_new[3]
+    configuration_new.append(dict(copy.deepcopy(configuration[0]), sample_id="new_sample"))
+
+    samples_changed, sample_ids_removed, fingerprints = get_sample_changes_nbs_format_from_rsoxs_config(
+        configuration_new, fingerprints
+    )
+    assert sorted(samples_changed) == ["new_sample", "sample1"]
+    assert sorted(sample_ids_removed) == ["sample2", "sample3"]
+    assert sorted(fingerprints) == ["new_sample", "sample0", "sample1", "sample4", "sample5"]
+    assert configuration_new[1]["sample_id"] == "sample1"  ## Input is not modified
+
+    assert get_sample_changes_nbs_format_from_rsoxs_config(configuration_new, fingerprints)[:2] == ({}, [])
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from rsoxs.alignment.peak_fitting import fit_peak
+
+
+@pytest.mark.parametrize("method", ["centroid", "quadratic", "gaussian", "lorentzian"])
+def test_fits_are_more_precise_than_maximum(method):
+    random = np.random.default_rng(1)
+    positions = np.linspace(-1, 1, 81)
+    peak = 5 + 100 * np.exp(-0.5 * ((positions - 0.123) / 0.1) ** 2)
+    errors_fit, errors_maximum, uncertainties = [], [], []
+    for _ in range(50):
+        values = peak + random.normal(0, 3, len(positions))
+        fit = fit_peak(positions, values, method=method)
+        assert fit["method"] == method
+        errors_fit.append(fit["position"] - 0.123)
+        uncertainties.append(fit["uncertainty"])
+        errors_maximum.append(fit["position_maximum"] - 0.123)
+    assert np.std(errors_fit) < 0.5 * np.std(errors_maximum)
+    assert 0.5 < np.mean(uncertainties) / np.sqrt(np.mean(np.square(errors_fit))) < 2
+
+
+def test_fit_of_dip_and_fallback():
+    positions = np.linspace(0, 10, 101)
+    fit = fit_peak(positions, 10 - 8 / (1 + ((positions - 4.2) / 0.5) ** 2), method="lorentzian", invert=True)
+    assert fit["position"] == pytest.approx(4.2, abs=0.01)
+    assert fit["height"] == pytest.approx(-8, rel=0.05)
+    assert fit["width"] == pytest.approx(1.0, rel=0.05)
+
+    ## A rising edge has no peak to fit, so the largest reading is used
+    fit = fit_peak(positions, positions, method="gaussian")
+    assert fit["method"] == "maximum" and fit["position"] == 10
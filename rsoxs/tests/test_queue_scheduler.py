@@ -0,0 +1,53 @@
+import itertools
+
+from rsoxs.configuration_setup.queue_scheduler import get_queue_transition_cost, scheduleAcquisitionsQueue
+
+
+def make_queue():
+    queue = []
+    for index, (configuration, polarization, energy) in enumerate(
+        itertools.product(["WAXSNEXAFS", "WAXS"], [0, 90], ["carbon_NEXAFS", "oxygen_NEXAFS"])
+    ):
+        queue.append(
+            {
+                "sample_id": "sample" + str(index % 3),
+                "configuration_instrument": configuration,
+                "polarizations": [polarization],
+                "energy_list_parameters": energy,
+                "cycles": 0,
+                "priority": 1 if index < 6 else 2,
+                "group_name": "group" if index in (1, 3) else None,
+                "uid_local": index,
+            }
+        )
+    ## Interleave so that the priority-only order keeps switching configuration, polarization, and edge
+    return sorted(queue, key=lambda acquisition: (acquisition["priority"], acquisition["uid_local"] % 2, acquisition["uid_local"]))
+
+
+def test_scheduled_queue_is_cheaper_and_respects_constraints():
+    queue = make_queue()
+    queue_scheduled, report = scheduleAcquisitionsQueue(queue, print_report=False)
+
+    assert sorted(acquisition["uid_local"] for acquisition in queue_scheduled) == list(range(8))
+    assert [acquisition["priority"] for acquisition in queue_scheduled] == sorted(acquisition["priority"] for acquisition in queue)
+    uids = [acquisition["uid_local"] for acquisition in queue_scheduled]
+    assert abs(uids.index(1) - uids.index(3)) == 1  ## group_name stays together
+
+    assert report["cost_scheduled"] == get_queue_transition_cost(queue_scheduled)
+    assert report["time_saved"] > 0
+
+
+def test_custom_cost_function():
+    queue = make_queue()
+    queue_scheduled, report = scheduleAcquisitionsQueue(queue, cost_function=lambda previous, following: 0, print_report=False)
+    assert queue_scheduled == queue
+    assert report["time_saved"] == 0
+
+
+def test_default_group_name_is_reordered():
+    ## Every acquisition gets group_name "Group" by default, which should not stop the queue from being reordered
+    queue = make_queue()
+    for acquisition in queue:
+        acquisition["group_name"] = "Group"
+    queue_scheduled, report = scheduleAcquisitionsQueue(queue, print_report=False)
+    assert report["time_saved"] > 0
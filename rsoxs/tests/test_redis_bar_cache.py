@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from rsoxs.redis_bar_cache import BarCache, RedisJSONDictWithListeners
+from rsoxs.redis_granular_bar import GranularBar, GranularRSoXSConfig
+
+
+class FakeRedisWithConfig(fakeredis.FakeRedis):
+    ## fakeredis publishes keyspace notifications but does not implement CONFIG GET/SET
+    def config_get(self, pattern="*"):
+        return {"notify-keyspace-events": ""}
+
+    def config_set(self, name, value):
+        return True
+
+
+def wait_for(condition, timeout=5):
+    start = time.monotonic()
+    while not condition() and time.monotonic() - start < timeout:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_notifications_invalidate_local_and_remote_writes():
+    server = fakeredis.FakeServer()
+    rsoxs_config = RedisJSONDictWithListeners(FakeRedisWithConfig(server=server), prefix="rsoxs-")
+    rsoxs_config["bar"] = [{"sample_id": "a"}]
+    cache = BarCache(rsoxs_config, rsoxs_config._redis_client, watch_key="rsoxs-bar")
+    rsoxs_config.write_listeners.append(cache)
+
+    try:
+        assert cache.get() is cache.get()
+        assert (cache.hits, cache.misses, cache.notifications_enabled) == (1, 1, True)
+
+        rsoxs_config["bar"][0]["sample_id"] = "b"  ## Nested write through this process
+        assert cache.get() == [{"sample_id": "b"}]
+        assert cache.local_invalidations == 1
+
+        other_process = RedisJSONDictWithListeners(fakeredis.FakeRedis(server=server), prefix="rsoxs-")
+        other_process["bar"] = [{"sample_id": "remote"}]
+        assert wait_for(lambda: cache.remote_invalidations == 1)
+        assert cache.get() == [{"sample_id": "remote"}]
+    finally:
+        cache.stop()
+
+
+def test_version_key_fallback_for_granular_layout():
+    redis_client = fakeredis.FakeRedis()
+    rsoxs_config = GranularRSoXSConfig(RedisJSONDictWithListeners(redis_client, prefix="rsoxs-"), GranularBar(redis_client))
+    rsoxs_config["bar"] = [{"sample_id": "a", "acquisitions": []}]
+    cache = BarCache(rsoxs_config, redis_client, watch_key=rsoxs_config.bar.version_key, version_key=rsoxs_config.bar.version_key)
+    rsoxs_config.bar.write_listeners.append(cache)
+
+    assert cache.get() is cache.get()
+    assert cache.notifications_enabled is False
+
+    rsoxs_config["bar"][0]["sample_id"] = "b"
+    assert cache.get()[0]["sample_id"] == "b"
+    assert cache.local_invalidations == 1
+
+    GranularBar(redis_client)[0] = {"sample_id": "remote", "acquisitions": []}
+    assert cache.get()[0]["sample_id"] == "remote"
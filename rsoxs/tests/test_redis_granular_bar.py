@@ -0,0 +1,66 @@
+import copy
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from redis_json_dict import RedisJSONDict
+
+from rsoxs.configuration_setup.configuration_index import ConfigurationIndex, _make_benchmark_configuration
+from rsoxs.configuration_setup.configuration_load_save_sanitize import updateConfigurationWithAcquisition
+from rsoxs.redis_granular_bar import GranularBar, GranularRSoXSConfig, migrate_bar_to_granular
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+def test_round_trip_and_list_operations(redis_client):
+    configuration = _make_benchmark_configuration(5, 3)
+    bar = GranularBar(redis_client)
+    bar.replace(configuration)
+    assert copy.deepcopy(bar) == configuration
+
+    new_sample = dict(copy.deepcopy(configuration[0]), sample_id="new_sample")
+    bar.insert(1, new_sample)
+    bar.append(dict(new_sample, sample_id="last_sample"))
+    del bar[0]
+    assert [sample["sample_id"] for sample in bar] == ["new_sample", "sample1", "sample2", "sample3", "sample4", "last_sample"]
+
+    bar[2]["bar_loc"]["x0"] = 1.5
+    bar[2]["acquisitions"][1]["acquire_status"] = "Finished"
+    sample = copy.deepcopy(bar[2])
+    assert sample["bar_loc"] == {"spot": "2", "x0": 1.5}
+    assert [acquisition["acquire_status"] for acquisition in sample["acquisitions"]] == ["Not begun", "Finished", "Not begun"]
+
+
+def test_status_update_traffic_does_not_grow_with_bar(redis_client):
+    written = []
+    for number_of_samples in (10, 300):
+        bar = GranularBar(redis_client, prefix=f"bar{number_of_samples}:")
+        bar.replace(_make_benchmark_configuration(number_of_samples, 5))
+        index = ConfigurationIndex(bar.to_list())
+        acquisition = dict(bar[number_of_samples // 2]["acquisitions"][2], acquire_status="Started")
+        bar.bytes_read = bar.bytes_written = 0
+        updateConfigurationWithAcquisition(bar, acquisition, index=index, in_place=True)
+        written.append((bar.bytes_read, bar.bytes_written))
+        assert bar[number_of_samples // 2]["acquisitions"][2]["acquire_status"] == "Started"
+    ## Only the sample_id lengths differ ("sample5" vs "sample150"), not the amount of the bar that is sent
+    assert written[1][0] <= 1.1 * written[0][0] and written[1][1] <= 1.1 * written[0][1]
+
+
+def test_migration_from_json_layout(redis_client):
+    configuration = _make_benchmark_configuration(4, 2)
+    json_config = RedisJSONDict(redis_client, prefix="rsoxs-")
+    json_config["bar"] = configuration
+    json_config["other"] = {"a": 1}
+
+    bar = migrate_bar_to_granular(redis_client)
+    rsoxs_config = GranularRSoXSConfig(json_config, bar)
+    assert copy.deepcopy(rsoxs_config["bar"]) == configuration
+    assert sorted(rsoxs_config) == ["bar", "other"]
+
+    rsoxs_config["bar"] = configuration[:2]
+    assert len(rsoxs_config["bar"]) == 2
+    assert bar.version > 0
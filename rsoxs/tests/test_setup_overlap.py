@@ -0,0 +1,40 @@
+from rsoxs.configuration_setup.setup_overlap import get_energy_start, schedule_setup_steps
+
+
+def test_independent_setup_steps_overlap():
+    steps = [
+        {"name": "configuration", "devices": {"configuration"}, "deferrable": False},
+        {"name": "sample", "devices": {"sample"}},
+        {"name": "rotation", "devices": {"sample"}},
+        {"name": "polarization", "devices": {"polarization"}},
+        {"name": "energy", "devices": {"energy"}},
+    ]
+    schedule = schedule_setup_steps(steps)
+    names = [step["name"] for step in schedule["steps"]]
+    assert names == ["polarization", "configuration", "energy", "sample", "rotation"]
+
+    after = {step["name"]: [schedule["steps"][index]["name"] for index in step["after"]] for step in schedule["steps"]}
+    assert after == {"polarization": [], "configuration": [], "energy": ["polarization"], "sample": ["configuration"], "rotation": ["configuration", "sample"]}
+    assert schedule["time_overlapped"] == 120 + 5 + 20
+    assert schedule["time_sequential"] == 120 + 5 + 20 + 15 + 10
+
+
+def test_only_single_moves_overlap():
+    ## As run_acquisitions_single makes them: only the energy is a single move that can be started without waiting
+    steps = [
+        {"name": "configuration", "devices": {"configuration"}, "deferrable": False},
+        {"name": "sample", "devices": {"sample"}, "deferrable": False},
+        {"name": "polarization", "devices": {"polarization"}, "deferrable": False},
+        {"name": "energy", "devices": {"energy"}, "deferrable": True},
+    ]
+    schedule = schedule_setup_steps(steps)
+    assert [step["name"] for step in schedule["steps"]] == ["configuration", "polarization", "energy", "sample"]
+    ## The energy moves while the sample moves, everything else is one after the other
+    assert schedule["time_overlapped"] == 120 + 15 + 10
+    assert schedule["time_sequential"] == 120 + 15 + 10 + 5
+
+
+def test_energy_start():
+    assert get_energy_start({"configuration_instrument": "WAXSNEXAFS", "energy_list_parameters": "carbon_NEXAFS"}) == 250
+    assert get_energy_start({"configuration_instrument": "WAXS", "energy_list_parameters": 270}) == 270
+    assert get_energy_start({"configuration_instrument": "NoBeam", "energy_list_parameters": 270}) is None